@@ -4,7 +4,7 @@ import asyncio
 import time
 import json
 import uuid
-from dotenv import load_dotenv
+from dotenv import load_dotenv, find_dotenv
 
 # CRITICAL: Load environment variables BEFORE importing config or other modules
 # This ensures that config.py reads the correct values from .env
@@ -30,6 +30,8 @@ from livekit.agents import ModelSettings
 from livekit.plugins import deepgram, openai, silero, elevenlabs, google
 from livekit.plugins.elevenlabs.tts import TTS, VoiceSettings
 from livekit.agents.llm import FallbackAdapter
+from livekit.agents.llm.fallback_adapter import DEFAULT_FALLBACK_API_CONNECT_OPTIONS
+from livekit.agents.types import NOT_GIVEN
 from typing import AsyncIterable
 #from livekit.plugins.turn_detector.multilingual import MultilingualModel
 from livekit.plugins import inworld
@@ -37,14 +39,16 @@ from livekit.plugins import inworld
 # Import RAG modules
 from rag_hq import query_rag, ensure_rag_initialized, enrich_with_rag as rag_enrich_with_rag
 import rag_hq.initialization  # Import to access internal state flags
-from rag_qa.query import query_qa_rag, ensure_qa_initialized, init_qa_rag
+from rag_hq.config import VECTOR_DB_PATH
+from rag_qa.query import query_qa_rag_results, ensure_qa_initialized, init_qa_rag
 
 # Import RAG configuration
 from config import (
     RAG_ENABLED, RAG_MODE, RAG_DEBUG_MODE, RAG_DEBUG_PRINT_FULL,
-    RAG_NUM_RESULTS, RAG_CONTEXT_BUDGET_TOKENS, RAG_ROLLING_BUDGET,
+    RAG_NUM_RESULTS, RAG_CONTEXT_BUDGET_TOKENS, RAG_ROLLING_BUDGET, RAG_PRE_LLM_BUDGET_MS,
     DOCUMENT_SERVER_ENABLED, DOCUMENT_SERVER_BASE_URL,
-    RAG_QUERY_LOG_ENABLED, RAG_QUERY_LOG_FILE
+    RAG_QUERY_LOG_ENABLED, RAG_QUERY_LOG_FILE,
+    LLM_REDUNDANCY_MODE
 )
 
 # Import RAG query logger
@@ -59,6 +63,15 @@ from custom_components.firebase_user_manager import get_firebase_manager, Fireba
 # Import Memory Manager
 from custom_components.memory_manager import get_memory_manager
 
+# Import chat streaming (delta-encoded responses for the frontend chat)
+from custom_components.chat_stream import ChatStreamPublisher
+
+# Import hedged LLM streaming (races the next model when the first is slow)
+from custom_components.hedged_llm import HedgedLLMStream
+
+# Import runtime watcher (hot-reloads .env and the RAG index off the turn path)
+from custom_components.runtime_watcher import RuntimeWatcher
+
 # Import Opener Manager for fast initial greetings
 from custom_components.opener_manager import get_opener_manager
 
@@ -83,15 +96,10 @@ rag_query_logger = None
 
 def check_rag_enabled_hot():
     """
-    Check environment variable RAG_ENABLED setting with hot-reloading.
-    Reading from env vars is fast and allows runtime switching without file I/O.
+    RAG_ENABLED setting with hot-reloading.
+    The .env file is re-read in the background by runtime_watcher; this only reads its latest snapshot.
     """
-    # Reload environment variable from .env file to allow hot-switching via file edit
-    from dotenv import load_dotenv
-    load_dotenv(override=True)
-    
-    is_enabled = os.getenv("RAG_ENABLED", "false").lower() == "true"
-    return is_enabled
+    return runtime_watcher.snapshot.rag_enabled
 
 # Custom FallbackAdapter met betere logging en preflight check
 class SafeFallbackAdapter(FallbackAdapter):
@@ -100,36 +108,45 @@ class SafeFallbackAdapter(FallbackAdapter):
         super().__init__(models, attempt_timeout=15.0)
         self.current_index = 0
 
+    @property
+    def models(self):
+        return self._llm_instances
+
     @property
     def current_model(self):
         return self.models[self.current_index].model
 
-    async def stream(self, chat_ctx, **kwargs):
-        """Attempt chat on each model until one succeeds"""
-        num_models = len(self.models)
-        for attempt in range(num_models):
-            model = self.models[self.current_index]
-            try:
-                if self.current_index == 1:
-                    logger.warning(f"⚠️ FALLBACK NOTICE: Using 2nd choice LLM: {model.model}")
-                else:
-                    logger.info(f"Trying LLM [{self.current_index}]: {model.model}")
+    def chat(
+        self,
+        *,
+        chat_ctx,
+        tools=None,
+        conn_options=DEFAULT_FALLBACK_API_CONNECT_OPTIONS,
+        parallel_tool_calls=NOT_GIVEN,
+        tool_choice=NOT_GIVEN,
+        extra_kwargs=NOT_GIVEN,
+    ):
+        """Stream from the models; with LLM_REDUNDANCY_MODE a slow first token starts the next model in parallel"""
+        if not LLM_REDUNDANCY_MODE or len(self.models) < 2:
+            return super().chat(
+                chat_ctx=chat_ctx, tools=tools, conn_options=conn_options,
+                parallel_tool_calls=parallel_tool_calls, tool_choice=tool_choice, extra_kwargs=extra_kwargs
+            )
+        return HedgedLLMStream(
+            llm=self,
+            conn_options=conn_options,
+            chat_ctx=chat_ctx,
+            tools=tools or [],
+            parallel_tool_calls=parallel_tool_calls,
+            tool_choice=tool_choice,
+            extra_kwargs=extra_kwargs,
+        )
 
-                # Using stream or chat call depending on API
-                async for chunk in model.stream(chat_ctx, **kwargs):
-                    yield chunk  # stream out
-                logger.info(f"✓ LLM [{self.current_index}] succeeded: {model.model}")
-                return  # success, exit
-            except Exception as e:
-                logger.error(
-                    f"✗ LLM [{self.current_index}] failed: {model.model}\nError: {e}",
-                    exc_info=True
-                )
-                # switch to next LLM
-                self.current_index = (self.current_index + 1) % num_models
-        # all LLMs failed
-        logger.critical("‼️ All LLMs failed, no model available")
-        raise RuntimeError("All LLMs unavailable")
+    async def stream(self, chat_ctx, **kwargs):
+        """Attempt chat on each model until one succeeds (see chat())"""
+        async with self.chat(chat_ctx=chat_ctx, **kwargs) as stream:
+            async for chunk in stream:
+                yield chunk
 
     async def preflight_check(self):
         """Ping all models before starting sessions"""
@@ -179,7 +196,8 @@ async def automatic_rag_enrichment_wrapper(agent, chat_ctx: ChatContext):
     """Wrapper to call the automatic_rag_enrichment function with all required parameters"""
     logger.info("🔍 RAG_ENRICHMENT_WRAPPER - Starting RAG enrichment")
     try:
-        await automatic_rag_enrichment(
+        # Stage timings of this turn (budget, stats, retrieval, total) for inspection/metrics
+        agent.pre_llm_timings = await automatic_rag_enrichment(
             agent, chat_ctx,
             # RAG state
             rag_enabled=rag_enabled,
@@ -187,7 +205,7 @@ async def automatic_rag_enrichment_wrapper(agent, chat_ctx: ChatContext):
             qa_rag_initialized=qa_rag_initialized,
             rag_initialized=rag_initialized,
             # Query functions
-            query_qa_rag_func=query_qa_rag,
+            query_qa_rag_func=query_qa_rag_results,
             query_rag_func=query_rag,
             # Config values
             rag_num_results=RAG_NUM_RESULTS,
@@ -201,7 +219,9 @@ async def automatic_rag_enrichment_wrapper(agent, chat_ctx: ChatContext):
             estimate_tokens_func=estimate_tokens,
             rag_query_logger=rag_query_logger,
             llm_module=llm,  # Pass llm module for ChatMessage creation
-            logger=logger
+            logger=logger,
+            # Retrieval not done within this budget is dropped
+            rag_pre_llm_budget_ms=RAG_PRE_LLM_BUDGET_MS
         )
         logger.info("✅ RAG_ENRICHMENT_WRAPPER - Completed successfully")
     except RuntimeError as e:
@@ -272,6 +292,7 @@ class MyAgent(Agent):
         self.user_id = user_id
         self.room_name = room_name
         self.log_dir = os.getcwd()
+        self.pre_llm_timings = {}  # Stage timings (ms) of the last turn's RAG enrichment
         
         # Firebase manager for storing messages
         self._firebase_manager = None
@@ -381,34 +402,15 @@ class MyAgent(Agent):
                     logger.warning(f"Failed to store user message: {e}")
 
         if rag_enabled:
-            # Check for database updates on disk (Hot-Reload Index)
-            try:
-                from rag_hq.state import state
-                from rag_hq.config import VECTOR_DB_PATH
-                # Use absolute path to ensure we're looking at the right file
-                abs_vdb_path = os.path.abspath(VECTOR_DB_PATH)
-                if os.path.exists(abs_vdb_path):
-                    disk_mtime = int(os.stat(abs_vdb_path).st_mtime)
-                    if disk_mtime > state.last_db_modified_time:
-                        logger.info(f"🔄 RAG database update detected: {disk_mtime} > {state.last_db_modified_time}")
-                        await perform_rag_initialization()
-                else:
-                    logger.warning(f"⚠️ RAG hot-reload: File not found at {abs_vdb_path}")
-            except Exception as e:
-                logger.error(f"⚠️ Error checking for RAG database updates: {e}")
-
-            # If RAG is enabled but systems aren't initialized, try initializing now
-            if not rag_initialized and not qa_rag_initialized:
-                logger.info("🔄 RAG toggled ON mid-session - Initializing...")
-                await perform_rag_initialization()
-
+            # Database updates on disk (and RAG toggled ON mid-session) are loaded by
+            # runtime_watcher in the background; until then the current index is used
             if rag_initialized or qa_rag_initialized:
                 logger.info("🔍 LLM_NODE - Starting RAG enrichment")
                 # Enrich chat context with RAG
                 await automatic_rag_enrichment_wrapper(self, chat_ctx)
                 logger.info("✅ LLM_NODE - RAG enrichment complete")
             else:
-                logger.warning("⚠️ RAG enrichment skipped: Systems failed to initialize")
+                logger.warning("⚠️ RAG enrichment skipped: Systems not initialized (loading in the background)")
         else:
             logger.info("⏭️ LLM_NODE - RAG enrichment disabled, skipping")
         
@@ -416,49 +418,36 @@ class MyAgent(Agent):
         if model_settings:
             model_settings.timeout = 11.0
             
-        # Capture the full response to send it as a chat message
+        # Capture the full response; the chat receives it as a stream of deltas sent
+        # by a background task, so forwarding tokens never waits on the network
         full_response = ""
-        msg_id = str(uuid.uuid4())
-        last_publish_time = 0
+        chat_stream = ChatStreamPublisher(self.room) if self.room else None
         
-        # Call the default LLM node with enriched context
-        async for chunk in Agent.default.llm_node(self, chat_ctx, tools, model_settings):
-            # Collect text content for chat response
-            content = None
-            if isinstance(chunk, str):
-                content = chunk
-            elif hasattr(chunk, 'choices') and chunk.choices:
-                delta = chunk.choices[0].delta
-                if hasattr(delta, 'content'):
-                    content = delta.content
-            elif hasattr(chunk, 'delta') and chunk.delta:
-                if hasattr(chunk.delta, 'content'):
-                    content = chunk.delta.content
-            
-            if content:
-                full_response += content
+        try:
+            # Call the default LLM node with enriched context
+            async for chunk in Agent.default.llm_node(self, chat_ctx, tools, model_settings):
+                # Collect text content for chat response
+                content = None
+                if isinstance(chunk, str):
+                    content = chunk
+                elif hasattr(chunk, 'choices') and chunk.choices:
+                    delta = chunk.choices[0].delta
+                    if hasattr(delta, 'content'):
+                        content = delta.content
+                elif hasattr(chunk, 'delta') and chunk.delta:
+                    if hasattr(chunk.delta, 'content'):
+                        content = chunk.delta.content
                 
-                # Stream to chat every 100ms to avoid overwhelming the network
-                current_time = time.time()
-                if current_time - last_publish_time > 0.1:
-                    try:
-                        if self.room:
-                            timestamp = int(current_time * 1000)
-                            msg_payload = json.dumps({
-                                "id": msg_id,
-                                "message": full_response,
-                                "timestamp": timestamp
-                            })
-                            await self.room.local_participant.publish_data(
-                                payload=msg_payload,
-                                topic="lk-chat-topic",
-                                reliable=True
-                            )
-                            last_publish_time = current_time
-                    except Exception:
-                        pass # Ignore intermittent stream errors
-            
-            yield chunk
+                if content:
+                    full_response += content
+                    if chat_stream is not None:
+                        chat_stream.push(content)
+                
+                yield chunk
+        finally:
+            # Remaining delta and the completion frame go out in the background (also when interrupted)
+            if chat_stream is not None:
+                chat_stream.close()
             
         logger.info(f"🤖 Agent response: '{full_response}'")
         
@@ -476,32 +465,10 @@ class MyAgent(Agent):
             except Exception as e:
                 logger.warning(f"Failed to store agent response: {e}")
         
-        # Final publish to ensure the complete message is received
-        if full_response:
-            try:
-                # Use local participant to publish chat message
-                if self.room:
-                    # Frontend sends on 'lk-chat-topic' with JSON, so we respond in kind
-                    timestamp = int(time.time() * 1000)
-                    msg_payload = json.dumps({
-                        "id": msg_id,
-                        "message": full_response,
-                        "timestamp": timestamp
-                    })
-                    
-                    # Publish to the topic observed in debug logs ('lk-chat-topic')
-                    await self.room.local_participant.publish_data(
-                        payload=msg_payload,
-                        topic="lk-chat-topic",
-                        reliable=True
-                    )
-                    logger.info(f"💬 Published final response to chat")
-                else:
-                    logger.warning("⚠️ Cannot publish chat: Room not available")
-            except Exception as e:
-                logger.error(f"❌ Error publishing chat message: {e}")
-        else:
+        if not full_response:
             logger.warning("⚠️ No response generated to publish")
+        elif chat_stream is None:
+            logger.warning("⚠️ Cannot publish chat: Room not available")
             
         # Trigger Active Memory Formation (Asynchronous & Non-blocking)
         try:
@@ -666,6 +633,20 @@ def prewarm(proc: JobProcess):
     logger.info(f"RAG MODE configured: {RAG_MODE}")
     logger.info("=" * 60)
 
+    # Make sure the shared mmap store is exported once, up front. The first idle
+    # process to get here writes it; the others wait on its lock and each job then
+    # attaches zero-copy in perform_rag_initialization() instead of unpickling.
+    if RAG_MODE in ["chunk", "both"]:
+        try:
+            from rag_hq.config import SHARED_STORE_ENABLED
+            if SHARED_STORE_ENABLED:
+                from rag_hq.shared_store import ensure_shared_store
+                manifest = ensure_shared_store()
+                if manifest:
+                    logger.info(f"✓ Shared RAG store ready (generation {manifest['generation']}, {manifest['num_items']:,} items)")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not prepare shared RAG store (jobs will load database files): {e}")
+
 # Assign prewarm as the setup function for the AgentServer
 server.setup_fnc = prewarm
 
@@ -730,6 +711,14 @@ async def perform_rag_initialization():
         
         return rag_initialized, qa_rag_initialized
 
+# Per-process watcher for .env and the RAG index on disk (started in entrypoint)
+runtime_watcher = RuntimeWatcher(
+    reload_index=perform_rag_initialization,
+    is_ready=lambda: rag_initialized or qa_rag_initialized,
+    env_path=find_dotenv(),
+    index_path=VECTOR_DB_PATH,
+)
+
 @server.rtc_session(agent_name=AGENT_NAME)
 async def entrypoint(ctx: JobContext):
     """Main entrypoint for each job - Initialize RAG in THIS child process"""
@@ -745,6 +734,7 @@ async def entrypoint(ctx: JobContext):
     # The RAG_ENABLED switch in .env now only controls if it is used during chat enrichment.
     # This allows hot-switching ON instantly without waiting for init mid-session.
     await perform_rag_initialization()
+    runtime_watcher.start()
     
     # Initialize RAG query logger
     log_dir = os.getcwd()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Vector Index Backend Benchmark
+Compares recall@k and query latency of the annoy / exact / int8 backends
+behind EnhancedAnnoyIndex (see VECTOR_INDEX_BACKEND in rag_hq/config.py).
+
+Uses the vectors of the real database when it exists, synthetic clustered
+vectors otherwise. Ground truth is an exact fp32 scan.
+
+Run from the repository root:
+    python benchmark_tools/benchmark_vector_backends.py
+    python benchmark_tools/benchmark_vector_backends.py --synthetic 50000 --queries 300 --k 6
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_hq.config import VECTOR_DB_PATH, VECTOR_DIM, ANNOY_N_TREES
+from rag_hq.vector_index import EnhancedAnnoyIndex, INDEX_BACKENDS
+
+# Colors for output
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    CYAN = '\033[96m'
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+def load_vectors(synthetic_size):
+    """Vectors of the real database, or synthetic clustered vectors."""
+    if not synthetic_size and os.path.exists(VECTOR_DB_PATH):
+        index = EnhancedAnnoyIndex.load(VECTOR_DB_PATH)
+        vectors = np.asarray(index.get_vectors(), dtype=np.float32)
+        print(f"{Colors.CYAN}Loaded {len(vectors):,} vectors from {VECTOR_DB_PATH} ({index.backend_name}){Colors.END}")
+        return vectors
+
+    n = synthetic_size or 20000
+    rng = np.random.default_rng(42)
+    # Clustered data behaves more like real embeddings than uniform noise
+    centers = rng.normal(size=(max(n // 200, 1), VECTOR_DIM)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.normal(size=(n, VECTOR_DIM)).astype(np.float32)
+    print(f"{Colors.CYAN}Generated {n:,} synthetic clustered vectors (dim {VECTOR_DIM}){Colors.END}")
+    return vectors
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+def make_queries(vectors, num_queries):
+    """Perturbed copies of stored vectors, like paraphrased questions."""
+    rng = np.random.default_rng(7)
+    picks = vectors[rng.integers(0, len(vectors), num_queries)]
+    return normalize(picks + 0.05 * rng.normal(size=picks.shape).astype(np.float32))
+
+def benchmark_backend(name, vectors, queries, truth, k):
+    """Build one backend and measure build time, latency and recall@k."""
+    index = EnhancedAnnoyIndex(VECTOR_DIM, backend=name)
+
+    start = time.perf_counter()
+    index.add_items([str(i) for i in range(len(vectors))], vectors)
+    index.build(ANNOY_N_TREES)
+    build_s = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids, _ = index.index.search(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(ids) & set(expected.tolist()))
+
+    latencies.sort()
+    return {
+        "build_s": build_s,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "recall": hits / (len(queries) * k),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare vector index backends')
+    parser.add_argument('--synthetic', type=int, default=0, help='Use N synthetic vectors instead of the database')
+    parser.add_argument('--queries', type=int, default=200, help='Number of queries')
+    parser.add_argument('--k', type=int, default=6, help='Results per query (query.py uses K_RESULTS * 2)')
+    args = parser.parse_args()
+
+    vectors = normalize(load_vectors(args.synthetic))
+    queries = make_queries(vectors, args.queries)
+
+    # Ground truth: exact fp32 scan
+    scores = queries @ vectors.T
+    truth = np.argsort(-scores, axis=1)[:, :args.k]
+
+    print(f"\n{Colors.BOLD}{'Backend':<10}{'Build (s)':>12}{'p50 (ms)':>12}{'p95 (ms)':>12}{'Recall@' + str(args.k):>12}{Colors.END}")
+    print("─" * 58)
+    for name in INDEX_BACKENDS:
+        result = benchmark_backend(name, vectors, queries, truth, args.k)
+        color = Colors.GREEN if result["recall"] >= 0.99 else Colors.YELLOW if result["recall"] >= 0.9 else Colors.RED
+        print(f"{name:<10}{result['build_s']:>12.2f}{result['p50_ms']:>12.3f}{result['p95_ms']:>12.3f}"
+              f"{color}{result['recall']:>12.3f}{Colors.END}")
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,16 @@
 Diagnostic script to find and report corrupted chunks in RAG database.
 Searches for non-Latin characters (Chinese, emoji, etc.) that can crash TTS.
 """
+import os
+import sys
 import pickle
 import json
 import re
 from pathlib import Path
 from collections import defaultdict
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 
 def has_non_latin_chars(text: str) -> tuple[bool, list]:
     """
@@ -204,18 +208,23 @@ def scan_qa_database():
     print("SCANNING Q&A RAG DATABASE")
     print("=" * 80)
     
+    from rag_qa.qa_store import QAStore, qa_store_exists
+    
     qa_file = Path("qa_vector_db/qa_embeddings.pkl")
     
-    if not qa_file.exists():
+    if not qa_store_exists() and not qa_file.exists():
         print("❌ Q&A database not found at:", qa_file)
         return
     
-    print(f"✓ Found Q&A database: {qa_file}")
+    print(f"✓ Found Q&A database: {'qa_vector_db/qa_manifest.json' if qa_store_exists() else qa_file}")
     print()
     
     try:
-        with open(qa_file, 'rb') as f:
-            qa_pairs = pickle.load(f)
+        if qa_store_exists():
+            qa_pairs = QAStore.open().records
+        else:
+            with open(qa_file, 'rb') as f:
+                qa_pairs = pickle.load(f)
         
         print(f"Total Q&A pairs: {len(qa_pairs):,}")
         print()
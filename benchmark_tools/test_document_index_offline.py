@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import os
+import sys
+import random
+import tempfile
+import unittest
+
+
+class DocumentIndexOfflineTests(unittest.TestCase):
+    def setUp(self):
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        from rag_hq import document_index
+        self.di = document_index
+
+        # Store document texts in a temp dir instead of the vector database folder
+        self._tmp = tempfile.TemporaryDirectory()
+        self._texts_dir = document_index.DOCUMENT_TEXTS_DIR
+        document_index.DOCUMENT_TEXTS_DIR = self._tmp.name
+        document_index._open_indexes.clear()
+
+    def tearDown(self):
+        self.di.DOCUMENT_TEXTS_DIR = self._texts_dir
+        self.di._open_indexes.clear()
+        self._tmp.cleanup()
+
+    def _stored_index(self, filename, text):
+        with open(self.di.document_text_path(filename), "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        self.di.save_document_index(filename, text)
+        return self.di.get_document_index(filename)
+
+    def test_slices_match_the_text(self):
+        sentence = "Één zin met accenten. Nog één!\n"
+        for length in (0, 1, self.di.CHECKPOINT_CHARS - 1, self.di.CHECKPOINT_CHARS,
+                       self.di.CHECKPOINT_CHARS + 1, 2 * self.di.CHECKPOINT_CHARS, 3000):
+            text = (sentence * (length // len(sentence) + 1))[:length]
+            index = self._stored_index(f"doc_{length}.txt", text)
+            self.assertEqual(len(index), length)
+            for start, end in ((0, length), (max(0, length - 10), length), (length // 2, length), (3, 40)):
+                self.assertEqual(index.slice(start, end), text[start:end], (length, start, end))
+
+    def test_exact_checkpoint_multiple_slices_to_the_end(self):
+        text = "a" * (2 * self.di.CHECKPOINT_CHARS)
+        index = self._stored_index("exact.txt", text)
+        self.assertEqual(index.slice(2000, len(text)), text[2000:])
+
+    def test_expansion_bounds_snap_to_sentences(self):
+        text = "First sentence here. Second one is the chunk. Third follows it.\nFourth."
+        index = self._stored_index("bounds.txt", text)
+        start = text.index("one is")
+        end = start + len("one is the")
+        expanded_start, expanded_end = index.expansion_bounds(start, end, 15)
+        self.assertEqual(index.slice(expanded_start, expanded_end), "Second one is the chunk.")
+
+    def test_expansion_bounds_match_the_rfind_scan(self):
+        def scan(text, char_start, char_end, expansion_chars):
+            # The rfind/find expansion the index replaces
+            expanded_start = max(0, char_start - expansion_chars)
+            expanded_end = min(len(text), char_end + expansion_chars)
+            if expanded_start > 0:
+                for punct in ['. ', '? ', '! ', '\n\n', '\n']:
+                    pos = text.rfind(punct, expanded_start, char_start)
+                    if pos != -1:
+                        expanded_start = pos + len(punct)
+                        break
+            if expanded_end < len(text):
+                for punct in ['. ', '? ', '! ', '\n\n', '\n']:
+                    pos = text.find(punct, char_end, expanded_end)
+                    if pos != -1:
+                        expanded_end = pos + len(punct.rstrip())
+                        break
+            return expanded_start, expanded_end
+
+        rng = random.Random(7)
+        for n in range(200):
+            text = "".join(rng.choice("ab .?!\n") for _ in range(rng.randint(1, 120)))
+            index = self._stored_index(f"scan_{n}.txt", text)
+            for _ in range(20):
+                char_start = rng.randint(0, len(text))
+                char_end = rng.randint(char_start, len(text))
+                expansion_chars = rng.randint(0, 40)
+                self.assertEqual(index.expansion_bounds(char_start, char_end, expansion_chars),
+                                 scan(text, char_start, char_end, expansion_chars), (text, char_start, char_end))
+
+
+if __name__ == "__main__":
+    unittest.main()
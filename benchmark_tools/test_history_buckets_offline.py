@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+import base64
+import json
+import os
+import secrets
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def _b64url(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).decode("utf-8")
+
+
+def _dt_from_ms(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000.0, tz=timezone.utc).replace(tzinfo=None)
+
+
+# ==========================================
+# Local Firestore stand-in (subcollections, transforms, batches, ordered pages)
+# ==========================================
+
+class _ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class _Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+_DELETE_FIELD = object()
+
+
+class _Query:
+    DESCENDING = "DESCENDING"
+    ASCENDING = "ASCENDING"
+
+
+def _apply(doc: Dict[str, Any], data: Dict[str, Any]) -> None:
+    for key, value in data.items():
+        parts = key.split(".")
+        cur = doc
+        for p in parts[:-1]:
+            if not isinstance(cur.get(p), dict):
+                cur[p] = {}
+            cur = cur[p]
+        field = parts[-1]
+        if value is _DELETE_FIELD:
+            cur.pop(field, None)
+        elif isinstance(value, _ArrayUnion):
+            existing = list(cur.get(field) or [])
+            existing.extend(v for v in value.values if v not in existing)
+            cur[field] = existing
+        elif isinstance(value, _Increment):
+            cur[field] = (cur.get(field) or 0) + value.value
+        else:
+            cur[field] = value
+
+
+class _FakeSnapshot:
+    def __init__(self, ref: "_FakeDocRef", data: Optional[Dict[str, Any]]):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = data is not None
+        self._data = data or {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._data)
+
+
+class _FakeDocRef:
+    def __init__(self, db: "_FakeDB", path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def get(self) -> _FakeSnapshot:
+        self._db.reads.append(self.path)
+        return _FakeSnapshot(self, self._db.docs.get(self.path))
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        if not merge or self.path not in self._db.docs:
+            self._db.docs[self.path] = {}
+        _apply(self._db.docs[self.path], data)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        if self.path not in self._db.docs:
+            raise RuntimeError("document does not exist")
+        _apply(self._db.docs[self.path], data)
+
+    def delete(self) -> None:
+        self._db.docs.pop(self.path, None)
+
+    def collection(self, name: str) -> "_FakeCollection":
+        return _FakeCollection(self._db, f"{self.path}/{name}")
+
+
+class _FakeQueryRef:
+    def __init__(self, collection: "_FakeCollection", field: str, descending: bool,
+                 cursor: Any = None, count: Optional[int] = None):
+        self._collection = collection
+        self._field = field
+        self._descending = descending
+        self._cursor = cursor
+        self._count = count
+
+    def start_after(self, cursor: Any) -> "_FakeQueryRef":
+        return _FakeQueryRef(self._collection, self._field, self._descending, cursor, self._count)
+
+    def limit(self, count: int) -> "_FakeQueryRef":
+        return _FakeQueryRef(self._collection, self._field, self._descending, self._cursor, count)
+
+    def stream(self):
+        docs = [s for s in self._collection._snapshots() if self._field in s._data]
+        docs.sort(key=lambda s: s._data[self._field], reverse=self._descending)
+        if self._cursor is not None:
+            after = self._cursor[self._field] if isinstance(self._cursor, dict) else self._cursor._data[self._field]
+            docs = [s for s in docs if (s._data[self._field] < after if self._descending else s._data[self._field] > after)]
+        if self._count is not None:
+            docs = docs[:self._count]
+        self._collection._db.reads.extend(s.reference.path for s in docs)
+        return iter(docs)
+
+
+class _FakeCollection:
+    def __init__(self, db: "_FakeDB", path: str):
+        self._db = db
+        self._path = path
+
+    def document(self, doc_id: str) -> _FakeDocRef:
+        return _FakeDocRef(self._db, f"{self._path}/{doc_id}")
+
+    def _snapshots(self) -> List[_FakeSnapshot]:
+        prefix = self._path + "/"
+        return [
+            _FakeSnapshot(_FakeDocRef(self._db, path), data)
+            for path, data in self._db.docs.items()
+            if path.startswith(prefix) and "/" not in path[len(prefix):]
+        ]
+
+    def order_by(self, field: str, direction: str = _Query.ASCENDING) -> _FakeQueryRef:
+        return _FakeQueryRef(self, field, direction == _Query.DESCENDING)
+
+    def stream(self):
+        snapshots = self._snapshots()
+        self._db.reads.extend(s.reference.path for s in snapshots)
+        return iter(snapshots)
+
+
+class _FakeBatch:
+    def __init__(self, db: "_FakeDB"):
+        self._db = db
+        self._ops = []
+
+    def set(self, ref: _FakeDocRef, data: Dict[str, Any], merge: bool = False) -> None:
+        self._ops.append(lambda: ref.set(data, merge=merge))
+
+    def delete(self, ref: _FakeDocRef) -> None:
+        self._ops.append(ref.delete)
+
+    def commit(self) -> None:
+        for op in self._ops:
+            op()
+        self._db.commits += 1
+
+
+class _FakeDB:
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.reads: List[str] = []
+        self.commits = 0
+
+    def collection(self, name: str) -> _FakeCollection:
+        return _FakeCollection(self, name)
+
+    def batch(self) -> _FakeBatch:
+        return _FakeBatch(self)
+
+
+class HistoryBucketsOfflineTests(unittest.IsolatedAsyncioTestCase):
+    user_id = "test_user_buckets"
+    agent_name = "juno"
+
+    def setUp(self):
+        try:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: F401
+        except Exception:
+            self.skipTest("cryptography not available")
+
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        from custom_components import firebase_user_manager as fum
+        self.fum = fum
+
+        # Patch Firestore transforms in the imported module so the manager works offline
+        fum.firestore.ArrayUnion = _ArrayUnion  # type: ignore[attr-defined]
+        fum.firestore.Increment = _Increment  # type: ignore[attr-defined]
+        fum.firestore.DELETE_FIELD = _DELETE_FIELD  # type: ignore[attr-defined]
+        fum.firestore.Query = _Query  # type: ignore[attr-defined]
+
+        self._tmp = tempfile.TemporaryDirectory()
+        keyring_path = os.path.join(self._tmp.name, "history-kek-keyring.json")
+        with open(keyring_path, "w", encoding="utf-8") as f:
+            json.dump({"active_version": 1, "keys": {"1": _b64url(secrets.token_bytes(32))}}, f)
+        os.environ["HISTORY_KEK_KEYRING_PATH"] = keyring_path
+
+        # Build an instance without running firebase initialization
+        mgr = object.__new__(fum.FirebaseUserManager)
+        mgr._db = _FakeDB()
+        mgr._keks = {}
+        mgr._dek_cache = {}
+        mgr._kek_keyring_cache = None
+        mgr._kek_keyring_mtime = None
+        mgr.db.collection("users").document(self.user_id).set({"email": "test@example.com"})
+        self.mgr = mgr
+        self.conv_path = f"conversations/{self.user_id}_{self.agent_name}"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _texts(self, chat_ctx: Any) -> List[str]:
+        msgs = getattr(chat_ctx, "messages", None) or getattr(chat_ctx, "items", [])
+        out = []
+        for m in msgs:
+            if getattr(m, "role", None) == "system":
+                continue
+            content = getattr(m, "content", "")
+            if isinstance(content, list):
+                out.append("".join(str(getattr(i, "text", i)) for i in content))
+            else:
+                out.append(str(content))
+        return out
+
+    async def _store_at(self, timestamp_ms: int, text: str, role: str = "user") -> None:
+        """store_message with the clock set to timestamp_ms"""
+        fum = self.fum
+        original = fum._utcnow_naive
+        fum._utcnow_naive = lambda: _dt_from_ms(timestamp_ms)
+        try:
+            await self.mgr.store_message(self.user_id, text, role, self.agent_name)
+        finally:
+            fum._utcnow_naive = original
+
+    async def _legacy_message(self, timestamp_ms: int, text: str, role: str = "user") -> Dict[str, Any]:
+        dek, kek_version, dek_id = await self.mgr._get_or_create_user_history_dek_for_day(self.user_id, timestamp_ms)
+        content_enc, nonce = self.mgr._encrypt_content(
+            dek=dek, user_id=self.user_id, agent_name=self.agent_name,
+            role=role, timestamp_ms=timestamp_ms, plaintext=text,
+        )
+        return {
+            "user_id": self.user_id, "agent_name": self.agent_name, "role": role,
+            "timestamp": _dt_from_ms(timestamp_ms), "timestamp_ms": timestamp_ms,
+            "content_enc": content_enc, "nonce": nonce, "enc_v": 1,
+            "key_version": kek_version, "history_dek_id": dek_id, "history_kek_version": kek_version,
+        }
+
+    async def test_store_is_a_blind_append_into_day_buckets(self):
+        t0 = 1769953899810
+        await self._store_at(t0, "day 1 a")
+        await self._store_at(t0 + 1000, "day 1 b", role="assistant")
+
+        db = self.mgr.db
+        conv_reads = [p for p in db.reads if p.startswith("conversations/")]
+        self.assertEqual(conv_reads, [])  # no read of the conversation on write
+        self.assertEqual(db.commits, 2)  # one batched write per message
+
+        await self._store_at(t0 + DAY_MS, "day 2")
+        head = db.docs[self.conv_path]
+        day1, day2 = self.mgr._utc_day_id(t0), self.mgr._utc_day_id(t0 + DAY_MS)
+        self.assertEqual(head["head_bucket"], day2)
+        self.assertEqual(head["message_count"], 3)
+        self.assertNotIn("messages", head)
+        self.assertEqual(len(db.docs[f"{self.conv_path}/history_buckets/{day1}"]["messages"]), 2)
+        self.assertEqual(len(db.docs[f"{self.conv_path}/history_buckets/{day2}"]["messages"]), 1)
+
+        chat_ctx = await self.mgr.load_chat_history(self.user_id, self.agent_name, max_messages=50)
+        self.assertEqual(self._texts(chat_ctx), ["day 1 a", "day 1 b", "day 2"])
+
+    async def test_load_reads_only_the_newest_buckets(self):
+        t0 = 1769953899810
+        days = 30
+        for d in range(days):
+            for i in range(3):
+                await self._store_at(t0 + d * DAY_MS + i * 1000, f"d{d} m{i}")
+
+        db = self.mgr.db
+        db.reads.clear()
+        chat_ctx = await self.mgr.load_chat_history(self.user_id, self.agent_name, max_messages=10)
+        self.assertEqual(self._texts(chat_ctx), [f"d{d} m{i}" for d in range(26, 30) for i in range(3)][-10:])
+
+        bucket_reads = [p for p in db.reads if "/history_buckets/" in p]
+        # One page of the newest buckets, not all 30 days
+        self.assertLessEqual(len(bucket_reads), self.fum.HISTORY_LOAD_PAGE_BUCKETS)
+
+        # Paging continues past the first page when more messages are needed
+        chat_ctx = await self.mgr.load_chat_history(self.user_id, self.agent_name, max_messages=40)
+        self.assertEqual(len(self._texts(chat_ctx)), 40)
+        self.assertEqual(self._texts(chat_ctx)[-1], "d29 m2")
+
+    async def test_stale_head_bucket_does_not_hide_newer_buckets(self):
+        t0 = 1769953899810
+        for d in range(3):
+            await self._store_at(t0 + d * DAY_MS, f"d{d}")
+        # A late commit from the first day moved the blindly written pointer backward
+        await self._store_at(t0 + 2000, "d0 late")
+        self.assertEqual(self.mgr.db.docs[self.conv_path]["head_bucket"], self.mgr._utc_day_id(t0))
+
+        chat_ctx = await self.mgr.load_chat_history(self.user_id, self.agent_name, max_messages=50)
+        self.assertEqual(self._texts(chat_ctx), ["d0", "d0 late", "d1", "d2"])
+
+    async def test_legacy_document_is_migrated_on_load(self):
+        t0 = 1769953899810
+        legacy = [
+            await self._legacy_message(t0, "old 1"),
+            await self._legacy_message(t0 + 1000, "old 2", role="assistant"),
+            await self._legacy_message(t0 + 3 * DAY_MS, "old 3"),
+        ]
+        db = self.mgr.db
+        db.collection("conversations").document(f"{self.user_id}_{self.agent_name}").set({
+            "messages": legacy,
+            "created_at": _dt_from_ms(t0),
+            "updated_at": _dt_from_ms(t0 + 3 * DAY_MS),
+            "user_id": self.user_id,
+            "agent_name": self.agent_name,
+        })
+
+        # Written after the deploy, before the first load: goes to a bucket next to the legacy array
+        await self._store_at(t0 + 4 * DAY_MS, "new 1")
+
+        chat_ctx = await self.mgr.load_chat_history(self.user_id, self.agent_name, max_messages=50)
+        self.assertEqual(self._texts(chat_ctx), ["old 1", "old 2", "old 3", "new 1"])
+
+        head = db.docs[self.conv_path]
+        self.assertNotIn("messages", head)
+        self.assertEqual(head["history_layout"], self.fum.HISTORY_LAYOUT)
+        self.assertEqual(head["message_count"], 4)
+        self.assertEqual(head["head_bucket"], self.mgr._utc_day_id(t0 + 4 * DAY_MS))
+        self.assertEqual(len(db.docs[f"{self.conv_path}/history_buckets/{self.mgr._utc_day_id(t0)}"]["messages"]), 2)
+
+        # Migration is a no-op once done
+        self.assertEqual(await self.mgr.migrate_history_to_buckets(self.user_id, self.agent_name), 0)
+        chat_ctx = await self.mgr.load_chat_history(self.user_id, self.agent_name, max_messages=50)
+        self.assertEqual(self._texts(chat_ctx), ["old 1", "old 2", "old 3", "new 1"])
+
+    async def test_interrupted_migration_does_not_duplicate(self):
+        t0 = 1769953899810
+        legacy = [await self._legacy_message(t0 + d * DAY_MS, f"old {d}") for d in range(3)]
+        head_ref = self.mgr.db.collection("conversations").document(f"{self.user_id}_{self.agent_name}")
+        head_ref.set({"messages": legacy, "user_id": self.user_id, "agent_name": self.agent_name})
+
+        # Bucket batch committed, head update lost: the legacy array is still there
+        original = self.fum.HISTORY_MIGRATION_BATCH_WRITES
+        self.fum.HISTORY_MIGRATION_BATCH_WRITES = 2
+        try:
+            batch_commit = _FakeBatch.commit
+            calls = {"n": 0}
+
+            def failing_commit(batch):
+                calls["n"] += 1
+                if calls["n"] == 2:
+                    raise RuntimeError("connection lost")
+                batch_commit(batch)
+
+            _FakeBatch.commit = failing_commit
+            try:
+                with self.assertRaises(RuntimeError):
+                    await self.mgr.migrate_history_to_buckets(self.user_id, self.agent_name)
+            finally:
+                _FakeBatch.commit = batch_commit
+
+            self.assertIn("messages", self.mgr.db.docs[self.conv_path])
+            self.assertEqual(await self.mgr.migrate_history_to_buckets(self.user_id, self.agent_name), 3)
+        finally:
+            self.fum.HISTORY_MIGRATION_BATCH_WRITES = original
+
+        chat_ctx = await self.mgr.load_chat_history(self.user_id, self.agent_name, max_messages=50)
+        self.assertEqual(self._texts(chat_ctx), ["old 0", "old 1", "old 2"])
+        self.assertEqual(self.mgr.db.docs[self.conv_path]["message_count"], 3)
+
+    async def test_clear_history_removes_buckets(self):
+        t0 = 1769953899810
+        for d in range(3):
+            await self._store_at(t0 + d * DAY_MS, f"d{d}")
+        self.assertTrue(await self.mgr.clear_history(self.user_id, self.agent_name))
+        self.assertEqual([p for p in self.mgr.db.docs if p.startswith("conversations/")], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+
+DIM = 16
+
+
+def _vector(text: str) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+    v = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+class IngestionRollbackOfflineTests(unittest.IsolatedAsyncioTestCase):
+    filename = "report.txt"
+
+    def setUp(self):
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+        from rag_hq import ingestion_pipeline as ip
+        from rag_hq import database
+        from rag_hq.state import state
+        from rag_hq.chunk_store import ChunkStore
+        from rag_hq.segments import SegmentedIndex
+        from rag_hq.bm25_index import BM25Index
+        self.ip = ip
+        self.state = state
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, self.filename)
+        self.index = SegmentedIndex(DIM)
+        self.store = ChunkStore(os.path.join(self._tmp.name, "chunk_store"))
+        self.bm25 = BM25Index()
+        self.summary_fails = False
+
+        # Offline stand-ins for extraction, the embedding server, the tokenizer, the LLM and disk writes
+        async def noop(*args, **kwargs):
+            return None
+
+        def prepare_document(file_path, filename, nlp=None):
+            with open(file_path, encoding="utf-8") as f:
+                text = f.read()
+            lines = [line for line in text.split("\n") if line]
+            return text, [(line, {"filename": filename, "chunk_index": i}) for i, line in enumerate(lines)]
+
+        async def embed_and_deduplicate_chunks(chunks, threshold):
+            return chunks, [_vector(text) for text, _ in chunks]
+
+        async def create_embeddings(text):
+            return _vector(text)
+
+        async def generate_document_summary(filename, text):
+            if self.summary_fails:
+                raise RuntimeError("summary LLM call failed")
+            state.document_summaries[filename] = {"summary": text.split("\n")[0], "keywords": []}
+
+        patches = {
+            (ip, "INGESTION_PROCESS_WORKERS"): 0,
+            (ip, "prepare_document"): prepare_document,
+            (ip, "embed_and_deduplicate_chunks"): embed_and_deduplicate_chunks,
+            (ip, "create_embeddings"): create_embeddings,
+            (ip, "count_tokens"): lambda text: len(text.split()),
+            (ip, "generate_document_summary"): generate_document_summary,
+            (ip, "save_document_text"): noop,
+            (ip, "save_embeddings_cache"): noop,
+            (ip, "save_document_summaries"): noop,
+            (ip, "update_ingestion_rapport"): noop,
+            (database, "save_processed_files"): noop,
+        }
+        self._originals = {key: getattr(*key) for key in patches}
+        for (module, name), value in patches.items():
+            setattr(module, name, value)
+
+        self._state_attrs = (dict(state.processed_files), dict(state.document_summaries))
+        state.processed_files.clear()
+        state.document_summaries.clear()
+
+    def tearDown(self):
+        for (module, name), value in self._originals.items():
+            setattr(module, name, value)
+        self.state.processed_files.clear()
+        self.state.processed_files.update(self._state_attrs[0])
+        self.state.document_summaries.clear()
+        self.state.document_summaries.update(self._state_attrs[1])
+        self._tmp.cleanup()
+
+    async def _ingest(self, text):
+        """One build_vector_database-style run over the document; returns the documents indexed."""
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(text)
+        previous_chunks = {
+            name: ids for name, ids in self.store.chunk_ids_by_filename().items() if name == self.filename
+        }
+
+        def on_file_done(filename, obsolete):
+            for chunk_id in obsolete:
+                self.store.pop(chunk_id, None)
+                self.bm25.remove_document(chunk_id)
+            self.index.remove_uuids(obsolete)
+
+        rapport = {"total_files": 1, "files": {}}
+        pipeline = self.ip.IngestionPipeline(self.index, self.store, rapport, self.bm25, on_file_done, previous_chunks)
+        return await pipeline.run([(self.path, self.filename)])
+
+    async def _searchable(self):
+        """Chunk texts of the document as search sees them: live vectors, records and BM25 entries."""
+        live = {r.userdata for r in await self.index.query_async(_vector("x"), 100, None)}
+        self.assertEqual(live, set(self.store.keys()))
+        self.assertEqual(set(self.bm25.doc_ids), set(self.store.keys()))
+        return sorted(
+            (record["metadata"].get("chunk_index"), record["text"])
+            for record in self.store.values() if record["metadata"].get("filename") == self.filename
+        )
+
+    async def test_failed_summary_keeps_only_the_indexed_version(self):
+        v1 = "alpha\nbravo\ncharlie\n"
+        self.assertEqual(await self._ingest(v1), 1)
+        indexed = await self._searchable()
+        self.assertEqual([text for i, text in indexed if i != -1], ["alpha", "bravo", "charlie"])
+
+        # Modified: new first line (kept chunks move), one changed chunk, summary fails after indexing
+        self.summary_fails = True
+        self.assertEqual(await self._ingest("zulu\nalpha\nbravo two\ncharlie\n"), 0)
+        self.assertEqual(await self._searchable(), indexed)
+        self.assertEqual(self.state.document_summaries[self.filename]["summary"], "alpha")
+
+        # The next successful run replaces it
+        self.summary_fails = False
+        self.assertEqual(await self._ingest("zulu\nalpha\nbravo two\ncharlie\n"), 1)
+        self.assertEqual(
+            await self._searchable(),
+            [(-1, f"Document: {self.filename}\n\nSummary: zulu"),
+             (0, "zulu"), (1, "alpha"), (2, "bravo two"), (3, "charlie")],
+        )
+
+    async def test_failed_first_ingestion_leaves_nothing(self):
+        self.summary_fails = True
+        self.assertEqual(await self._ingest("alpha\nbravo\n"), 0)
+        self.assertEqual(await self._searchable(), [])
+        self.assertNotIn(self.filename, self.state.document_summaries)
+
+
+if __name__ == "__main__":
+    unittest.main()
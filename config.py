@@ -8,8 +8,11 @@ import os
 
 
 
-LLM_REDUNDANCY_MODE = True
-LLM_REDUNDANCY_GRACE_TIME = 350
+LLM_REDUNDANCY_MODE = True  # Hedge LLM requests: start the next model if the first is slow to its first token
+LLM_REDUNDANCY_GRACE_TIME = 350  # Minimum wait (ms) for the first token before hedging
+LLM_REDUNDANCY_MAX_GRACE_TIME = 3000  # Maximum wait (ms), however slow the model usually is
+LLM_REDUNDANCY_PERCENTILE = 0.9  # Grace time = this percentile of the model's recent time-to-first-token
+LLM_REDUNDANCY_MIN_SAMPLES = 5  # First-token samples needed before the percentile is used
 PRINT_FULL_LLM_MESSAGE = True
 
 # Controls whether the AI should continue conversations or introduce new topics 
@@ -45,6 +48,7 @@ RAG_NUM_RESULTS = 5  # Number of RAG documents to retrieve
 RAG_CONTEXT_BUDGET_TOKENS = 6000  # Maximum tokens reserved for RAG context
 RAG_ROLLING_BUDGET = True  # Remove oldest RAG messages when budget exceeded
 RAG_RELEVANCE_THRESHOLD = 0.2  # Minimum similarity score for document retrieval (0.0-1.0, lower = more results)
+RAG_PRE_LLM_BUDGET_MS = 600  # Hard latency budget for the pre-LLM stage; RAG results arriving later are dropped
 
 # RAG Query Logging - FORCE ENABLED for comprehensive debugging
 RAG_QUERY_LOG_ENABLED = True  # Enable detailed RAG query logging to file - FORCE ENABLED
@@ -91,6 +95,17 @@ MEMORY_MAX_ITEMS = 100  # Maximum number of memories to store per user
 MEMORY_MODEL = "llama-3.3-70b-versatile"  # High quality model for extraction
 MEMORY_PII_PROTECTION = True  # Enable strict PII filtering
 
+# ===========================
+# Chat Streaming Configuration
+# ===========================
+CHAT_STREAM_TOPIC = "lk.chat"  # LiveKit text stream topic the frontend chat (useChat) assembles
+CHAT_STREAM_FLUSH_INTERVAL = 0.1  # Seconds; tokens arriving within this window are sent as one delta
+
+# ===========================
+# Runtime Watcher Configuration
+# ===========================
+RUNTIME_WATCH_INTERVAL = 2.0  # Seconds between background checks of .env and the RAG index on disk
+
 # LLM Debug Settings
 PRINT_FULL_LLM_MESSAGE = False  # Set to True to enable detailed LLM message logging
 PRINT_LLM_TIMING = False  # Set to True to enable LLM timing metrics
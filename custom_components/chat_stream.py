@@ -0,0 +1,134 @@
+"""
+Streaming of agent responses to the frontend chat.
+
+llm_node used to publish the whole accumulated response on 'lk-chat-topic'
+every 100 ms (and once more at the end), awaiting each publish inside the
+token loop: bytes on the wire grew quadratically with the answer length and a
+slow publish delayed the next token.
+
+A response is now sent as one LiveKit text stream on CHAT_STREAM_TOPIC, the
+stream id being the chat message id:
+
+    header   stream id, topic                      (sent with the first delta)
+    chunks   sequence-numbered deltas (chunk_index) only the text added since the last send
+    trailer  length + sha256 of the complete text  (closes the message)
+
+The frontend chat (useChat) appends the chunks of a stream to one message. The
+token loop only calls push(), which buffers the text; a sender task writes
+the buffer at most every CHAT_STREAM_FLUSH_INTERVAL (tokens arriving in
+between are coalesced into one delta), so the loop never waits on the network.
+If the stream cannot be opened or written, the complete response is published
+once on the legacy 'lk-chat-topic' when the stream is closed.
+"""
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+
+from config import CHAT_STREAM_TOPIC, CHAT_STREAM_FLUSH_INTERVAL
+
+logger = logging.getLogger("chat_stream")
+
+LEGACY_CHAT_TOPIC = "lk-chat-topic"
+
+
+class ChatStreamPublisher:
+    """Sends one agent response as a stream of deltas from a background task."""
+
+    def __init__(self, room, msg_id=None, topic=CHAT_STREAM_TOPIC, flush_interval=CHAT_STREAM_FLUSH_INTERVAL):
+        self.room = room
+        self.msg_id = msg_id or str(uuid.uuid4())
+        self.topic = topic
+        self.flush_interval = flush_interval
+        self.frames = 0  # Deltas sent
+        self.sent_chars = 0
+        self.failed = False
+        self._parts = []  # Everything pushed (for the legacy fallback)
+        self._pending = []  # Pushed but not yet sent
+        self._checksum = hashlib.sha256()
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._last_send = 0.0
+        self._task = asyncio.create_task(self._run())
+
+    def push(self, text):
+        """Queue response text for sending (never blocks)."""
+        if not text or self._closed:
+            return
+        self._parts.append(text)
+        self._pending.append(text)
+        self._wakeup.set()
+
+    def close(self):
+        """Send what is left and close the stream; returns the sender task (awaiting it is optional)."""
+        if not self._closed:
+            self._closed = True
+            self._wakeup.set()
+        return self._task
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    async def _run(self):
+        writer = None
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+
+                # Coalesce tokens until the flush interval since the last send has passed
+                wait = self._last_send + self.flush_interval - time.monotonic()
+                if wait > 0 and not self._closed:
+                    await asyncio.sleep(wait)
+
+                delta = "".join(self._pending)
+                self._pending.clear()
+                if delta and not self.failed:
+                    try:
+                        if writer is None:
+                            writer = await self.room.local_participant.stream_text(
+                                topic=self.topic, stream_id=self.msg_id
+                            )
+                        await writer.write(delta)
+                        self._checksum.update(delta.encode("utf-8"))
+                        self.frames += 1
+                        self.sent_chars += len(delta)
+                        self._last_send = time.monotonic()
+                    except Exception as e:
+                        self.failed = True
+                        logger.warning(f"⚠️ Chat stream failed, final response goes out as one message: {e}")
+
+                if self._closed and not self._pending:
+                    break
+        finally:
+            await self._finish(writer)
+
+    async def _finish(self, writer):
+        """Close the stream with its completion trailer, or fall back to one legacy message."""
+        if writer is not None:
+            try:
+                await writer.aclose(attributes={
+                    "length": str(self.sent_chars),
+                    "sha256": self._checksum.hexdigest(),
+                })
+                if not self.failed:
+                    logger.debug(f"💬 Streamed response {self.msg_id}: {self.sent_chars} chars in {self.frames} deltas")
+                    return
+            except Exception as e:
+                self.failed = True
+                logger.warning(f"⚠️ Could not close chat stream: {e}")
+
+        text = self.text
+        if not text or not self.failed:
+            return
+        try:
+            await self.room.local_participant.publish_data(
+                payload=json.dumps({"id": self.msg_id, "message": text, "timestamp": int(time.time() * 1000)}),
+                topic=LEGACY_CHAT_TOPIC,
+                reliable=True
+            )
+        except Exception as e:
+            logger.error(f"❌ Error publishing chat message: {e}")
@@ -39,6 +39,12 @@ HISTORY_KEK_ACTIVE_VERSION_ENV = "HISTORY_KEK_ACTIVE_VERSION"
 # Per-day DEK rotation
 HISTORY_DEK_ROTATION_DAYS_ENABLED = True  # new DEK per UTC day
 
+# Bucketed history layout (see "Chat History Management")
+HISTORY_LAYOUT = "daily_buckets_v1"
+HISTORY_BUCKETS_COLLECTION = "history_buckets"  # conversations/{user}_{agent}/history_buckets/{YYYYMMDD}
+HISTORY_LOAD_PAGE_BUCKETS = 7  # Older buckets fetched per query page when loading history
+HISTORY_MIGRATION_BATCH_WRITES = 400  # Bucket writes per batch when migrating (Firestore limit: 500)
+
 
 def _utcnow_naive() -> datetime:
     """
@@ -870,7 +876,101 @@ class FirebaseUserManager:
     # ==========================================
     # Chat History Management
     # ==========================================
-    
+    #
+    # Messages are stored in one document per UTC day (the same day id as the per-day DEK):
+    #
+    #   conversations/{user}_{agent}                          head: head_bucket, message_count, history_layout
+    #   conversations/{user}_{agent}/history_buckets/{day}    day, messages: [...]
+    #
+    # - store_message is one blind batched write: ArrayUnion into the day's bucket plus the
+    #   head pointer (no read, and no document grows beyond one day of messages)
+    # - load_chat_history reads the head, then buckets newest first (HISTORY_LOAD_PAGE_BUCKETS
+    #   per query) only until max_messages are collected. head_bucket is not used as a cursor:
+    #   it is written blindly, so a late commit from the previous day can move it backward
+    # - conversations from before the bucketed layout keep all messages in the head's
+    #   'messages' array; they are migrated into buckets on first load (or with
+    #   migrate_history_to_buckets)
+
+    def _history_timestamp_ms(self, msg: Mapping[str, Any]) -> int:
+        """Message time in ms (timestamp_ms, or derived from timestamp for early records)."""
+        ts_ms = msg.get("timestamp_ms")
+        if ts_ms is not None:
+            return int(ts_ms)
+        ts = msg.get("timestamp")
+        return int(ts.timestamp() * 1000) if isinstance(ts, datetime) else 0
+
+    def _history_buckets(self, head_ref: Any) -> Any:
+        return head_ref.collection(HISTORY_BUCKETS_COLLECTION)
+
+    async def _migrate_legacy_history(self, head_ref: Any, head_data: Dict[str, Any]) -> int:
+        """
+        Move the head's legacy 'messages' array into day buckets.
+
+        Bucket writes use ArrayUnion, so re-running after a partial failure does not duplicate
+        messages; the last batch removes the legacy array and updates the head atomically.
+        Returns the number of migrated messages.
+        """
+        legacy = head_data.get("messages") or []
+        if not legacy:
+            return 0
+
+        by_day: Dict[str, List[Dict[str, Any]]] = {}
+        for msg in legacy:
+            by_day.setdefault(self._utc_day_id(self._history_timestamp_ms(msg)), []).append(msg)
+        days = sorted(by_day)
+
+        buckets = self._history_buckets(head_ref)
+        writes = [
+            (buckets.document(day), {"day": day, "messages": firestore.ArrayUnion(by_day[day])})
+            for day in days
+        ]
+        head_update = {
+            "messages": firestore.DELETE_FIELD,
+            "history_layout": HISTORY_LAYOUT,
+            "head_bucket": max(days[-1], head_data.get("head_bucket") or ""),
+            "message_count": firestore.Increment(len(legacy)),
+            "migrated_at": _utcnow_naive(),
+        }
+
+        for start in range(0, len(writes), HISTORY_MIGRATION_BATCH_WRITES):
+            batch = self.db.batch()
+            for bucket_ref, data in writes[start:start + HISTORY_MIGRATION_BATCH_WRITES]:
+                batch.set(bucket_ref, data, merge=True)
+            if start + HISTORY_MIGRATION_BATCH_WRITES >= len(writes):
+                batch.set(head_ref, head_update, merge=True)
+            await asyncio.to_thread(batch.commit)
+
+        logger.info(f"Migrated {len(legacy)} history messages into {len(days)} day buckets ({head_ref.id})")
+        return len(legacy)
+
+    async def migrate_history_to_buckets(self, user_id: str, agent_name: str = "juno") -> int:
+        """Migrate one conversation from the single-document layout; returns the migrated message count."""
+        head_ref = self.db.collection('conversations').document(f"{user_id}_{agent_name}")
+        doc = await asyncio.to_thread(head_ref.get)
+        if not doc.exists:
+            return 0
+        return await self._migrate_legacy_history(head_ref, doc.to_dict() or {})
+
+    async def _load_bucket_messages(self, head_ref: Any, max_messages: int) -> List[Dict[str, Any]]:
+        """Messages of the newest buckets, reading only until max_messages are collected."""
+        buckets = self._history_buckets(head_ref)
+        messages: List[Dict[str, Any]] = []
+
+        # Buckets newest first, one page at a time
+        cursor: Any = None
+        while len(messages) < max_messages:
+            query = buckets.order_by("day", direction=firestore.Query.DESCENDING)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            page = await asyncio.to_thread(lambda: list(query.limit(HISTORY_LOAD_PAGE_BUCKETS).stream()))
+            for doc in page:
+                messages.extend((doc.to_dict() or {}).get("messages", []))
+            if len(page) < HISTORY_LOAD_PAGE_BUCKETS:
+                break
+            cursor = page[-1]
+
+        return messages
+
     async def store_message(self, user_id: str, content: str, role: str, agent_name: str = "juno"):
         """Store a chat message in Firebase"""
         timestamp = _utcnow_naive()
@@ -878,7 +978,7 @@ class FirebaseUserManager:
         
         try:
             conversation_id = f"{user_id}_{agent_name}"
-            doc_ref = self.db.collection('conversations').document(conversation_id)
+            head_ref = self.db.collection('conversations').document(conversation_id)
 
             # Encrypt content (Firestore is treated as untrusted)
             if HISTORY_DEK_ROTATION_DAYS_ENABLED:
@@ -914,26 +1014,31 @@ class FirebaseUserManager:
                 "history_kek_version": kek_version,
             }
             
-            doc = await asyncio.to_thread(doc_ref.get)
-            if doc.exists:
-                await asyncio.to_thread(
-                    doc_ref.update,
-                    {
-                        'messages': firestore.ArrayUnion([new_message]),
-                        'updated_at': timestamp
-                    }
-                )
-            else:
-                await asyncio.to_thread(
-                    doc_ref.set,
-                    {
-                        'messages': [new_message],
-                        'created_at': timestamp,
-                        'updated_at': timestamp,
-                        'user_id': user_id,
-                        'agent_name': agent_name
-                    }
-                )
+            # Blind append: the day's bucket and the head pointer in one batched write
+            day = self._utc_day_id(timestamp_ms)
+            batch = self.db.batch()
+            batch.set(
+                self._history_buckets(head_ref).document(day),
+                {
+                    'day': day,
+                    'messages': firestore.ArrayUnion([new_message]),
+                    'updated_at': timestamp
+                },
+                merge=True
+            )
+            batch.set(
+                head_ref,
+                {
+                    'user_id': user_id,
+                    'agent_name': agent_name,
+                    'updated_at': timestamp,
+                    'head_bucket': day,
+                    'message_count': firestore.Increment(1),
+                    'history_layout': HISTORY_LAYOUT
+                },
+                merge=True
+            )
+            await asyncio.to_thread(batch.commit)
 
             logger.debug(f"Stored encrypted message for {user_id}: role={role}, bytes={len(content.encode('utf-8'))}")
             
@@ -958,34 +1063,49 @@ class FirebaseUserManager:
         
         try:
             conversation_id = f"{user_id}_{agent_name}"
-            doc_ref = self.db.collection('conversations').document(conversation_id)
-            doc = await asyncio.to_thread(doc_ref.get)
+            head_ref = self.db.collection('conversations').document(conversation_id)
+            doc = await asyncio.to_thread(head_ref.get)
             
             if not doc.exists:
                 logger.info(f"No history found for user {user_id}, starting fresh")
                 print(f"Firebase history: total=0, loaded=0, limit={max_messages}", flush=True)
                 return chat_ctx
             
-            data = doc.to_dict()
-            messages = data.get('messages', [])
+            data = doc.to_dict() or {}
+            legacy_messages = data.get('messages') or []
+            bucketed = data.get('history_layout') == HISTORY_LAYOUT
+            if legacy_messages:
+                try:
+                    await self._migrate_legacy_history(head_ref, data)
+                    data = (await asyncio.to_thread(head_ref.get)).to_dict() or {}
+                    legacy_messages = data.get('messages') or []
+                    bucketed = True
+                except Exception as e:
+                    # Keep serving the legacy array; migration is retried on the next load
+                    logger.warning(f"History migration to buckets failed for user {user_id}: {e}")
+            
+            messages = list(legacy_messages)
+            if bucketed:
+                messages.extend(await self._load_bucket_messages(head_ref, max_messages))
+            total_messages = max((data.get('message_count') or 0) + len(legacy_messages), len(messages))
             
             if not messages:
                 print(f"Firebase history: total=0, loaded=0, limit={max_messages}", flush=True)
                 return chat_ctx
             
             # Sort by timestamp and limit
-            sorted_messages = sorted(messages, key=lambda x: x['timestamp'])
+            sorted_messages = sorted(messages, key=self._history_timestamp_ms)
             limited_messages = sorted_messages[-max_messages:] if len(sorted_messages) > max_messages else sorted_messages
             
             # Add context about returning user
             self._chat_ctx_add(
                 chat_ctx,
                 role="system",
-                content=f"Notice: User is returning. Found {len(messages)} total messages, loading last {len(limited_messages)} from previous conversations (max {max_messages}):",
+                content=f"Notice: User is returning. Found {total_messages} total messages, loading last {len(limited_messages)} from previous conversations (max {max_messages}):",
             )
             
-            logger.info(f"Firebase history: total={len(messages)}, loaded={len(limited_messages)}, limit={max_messages}")
-            print(f"Firebase history: total={len(messages)}, loaded={len(limited_messages)}, limit={max_messages}", flush=True)
+            logger.info(f"Firebase history: total={total_messages}, loaded={len(limited_messages)}, limit={max_messages}")
+            print(f"Firebase history: total={total_messages}, loaded={len(limited_messages)}, limit={max_messages}", flush=True)
             
             loaded_summary = []
             # Group messages by relative date
@@ -1005,11 +1125,8 @@ class FirebaseUserManager:
                 text = msg.get("content")
                 if msg.get("content_enc") and msg.get("nonce"):
                     try:
-                        ts_ms = msg.get("timestamp_ms")
-                        if ts_ms is None:
-                            # Best-effort fallback for early records.
-                            ts = msg.get("timestamp")
-                            ts_ms = int(ts.timestamp() * 1000) if isinstance(ts, datetime) else 0
+                        # Best-effort fallback to 'timestamp' for early records.
+                        ts_ms = self._history_timestamp_ms(msg)
 
                         dek_id = msg.get("history_dek_id")
                         dek = None
@@ -1134,8 +1251,15 @@ class FirebaseUserManager:
         """Clear chat history for a user"""
         try:
             conversation_id = f"{user_id}_{agent_name}"
-            doc_ref = self.db.collection('conversations').document(conversation_id)
-            doc_ref.delete()
+            head_ref = self.db.collection('conversations').document(conversation_id)
+            # Buckets are a subcollection: deleting the head does not delete them
+            bucket_docs = await asyncio.to_thread(lambda: list(self._history_buckets(head_ref).stream()))
+            for start in range(0, len(bucket_docs), HISTORY_MIGRATION_BATCH_WRITES):
+                batch = self.db.batch()
+                for bucket_doc in bucket_docs[start:start + HISTORY_MIGRATION_BATCH_WRITES]:
+                    batch.delete(bucket_doc.reference)
+                await asyncio.to_thread(batch.commit)
+            await asyncio.to_thread(head_ref.delete)
             logger.info(f"Cleared history for user {user_id}")
             return True
         except Exception as e:
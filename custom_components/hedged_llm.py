@@ -0,0 +1,209 @@
+"""
+Hedged LLM streaming (LLM_REDUNDANCY_MODE).
+
+The fallback adapter tries its models one after the other, so a model that is
+slow to answer costs the full attempt timeout before the next one is tried.
+HedgedLLMStream starts the first available model and, if it has not produced
+its first token within the grace time, starts the next model alongside it:
+
+    primary   |----- grace -----|......first token?  -> commit, cancel the hedge
+    hedge                       |......first token?  -> commit, cancel the primary
+
+The stream commits to whichever model streams first and cancels the other. A
+model that fails before its first token is marked unavailable (recovered in the
+background, as in FallbackAdapter) and the next one starts immediately; after a
+committed model has sent chunks, its errors are raised.
+
+Grace times adapt per model: every first token is recorded in a decaying
+histogram of time-to-first-token (TTFT), and the grace time is its
+LLM_REDUNDANCY_PERCENTILE, bounded by LLM_REDUNDANCY_GRACE_TIME and
+LLM_REDUNDANCY_MAX_GRACE_TIME. A model cancelled after losing the race has no
+first token; the time it had been waiting is recorded instead (its TTFT is at
+least that), so the losses of a slow model raise its grace time too. A fast
+model is hedged early, a model that is usually slow is not hedged on every
+request.
+"""
+import time
+import bisect
+import asyncio
+import logging
+import weakref
+
+from livekit.agents import APIConnectionError
+from livekit.agents.llm.fallback_adapter import FallbackLLMStream, AvailabilityChangedEvent
+
+from config import (
+    LLM_REDUNDANCY_GRACE_TIME, LLM_REDUNDANCY_MAX_GRACE_TIME,
+    LLM_REDUNDANCY_PERCENTILE, LLM_REDUNDANCY_MIN_SAMPLES
+)
+
+logger = logging.getLogger("hedged_llm")
+
+# Histogram bucket upper bounds (ms): 25 ms to ~30 s, 25% apart
+TTFT_BUCKETS_MS = [25 * 1.25 ** i for i in range(33)]
+TTFT_DECAY = 0.97  # Weight kept by older samples per new sample (adapts to drift)
+
+
+class TTFTHistogram:
+    """Decaying histogram of one model's time-to-first-token."""
+
+    def __init__(self):
+        self.counts = [0.0] * (len(TTFT_BUCKETS_MS) + 1)
+        self.samples = 0
+
+    def record(self, ttft_ms):
+        self.counts = [count * TTFT_DECAY for count in self.counts]
+        self.counts[bisect.bisect_left(TTFT_BUCKETS_MS, ttft_ms)] += 1.0
+        self.samples += 1
+
+    def percentile(self, q):
+        """Upper bound (ms) of the bucket holding the q-th quantile, or None without samples."""
+        total = sum(self.counts)
+        if total == 0:
+            return None
+        cumulative = 0.0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= q * total:
+                return TTFT_BUCKETS_MS[min(i, len(TTFT_BUCKETS_MS) - 1)]
+        return TTFT_BUCKETS_MS[-1]
+
+
+_histograms = weakref.WeakKeyDictionary()  # LLM instance -> TTFTHistogram
+
+
+def ttft_histogram(llm):
+    if llm not in _histograms:
+        _histograms[llm] = TTFTHistogram()
+    return _histograms[llm]
+
+
+def grace_time_ms(llm):
+    """How long to wait for this model's first token before hedging."""
+    histogram = ttft_histogram(llm)
+    if histogram.samples < LLM_REDUNDANCY_MIN_SAMPLES:
+        return LLM_REDUNDANCY_GRACE_TIME
+    return min(LLM_REDUNDANCY_MAX_GRACE_TIME,
+               max(LLM_REDUNDANCY_GRACE_TIME, histogram.percentile(LLM_REDUNDANCY_PERCENTILE)))
+
+
+_END = object()
+
+
+class _Attempt:
+    """One model's stream, pumped into a queue by a task (first item: chunk, end or error)."""
+
+    def __init__(self, stream, llm):
+        self.llm = llm
+        self.started = time.perf_counter()
+        self.ttft_ms = None
+        self.error = None
+        self.queue = asyncio.Queue()
+        self.ready = asyncio.Event()  # The first item is queued
+        self.task = asyncio.create_task(self._pump(stream))
+
+    async def _pump(self, stream):
+        try:
+            async for chunk in stream._try_generate(llm=self.llm, check_recovery=False):
+                if self.ttft_ms is None:
+                    self.ttft_ms = (time.perf_counter() - self.started) * 1000
+                    ttft_histogram(self.llm).record(self.ttft_ms)
+                self.queue.put_nowait(chunk)
+                self.ready.set()
+            self.queue.put_nowait(_END)
+        except Exception as e:  # Already logged by _try_generate
+            self.error = e
+            self.queue.put_nowait(e)
+        self.ready.set()
+
+    def record_censored(self):
+        """Record the time waited so far as a lower bound of the TTFT (the attempt is being cancelled)."""
+        if self.ttft_ms is None and self.error is None:
+            ttft_histogram(self.llm).record((time.perf_counter() - self.started) * 1000)
+
+    def failed_early(self):
+        """Whether the attempt failed before streaming anything."""
+        return self.ttft_ms is None and self.error is not None
+
+
+class HedgedLLMStream(FallbackLLMStream):
+    """FallbackLLMStream that races the next model when the current one is slow to its first token."""
+
+    def _start(self, llm):
+        logger.info(f"Trying LLM: {llm.label} (hedge after {grace_time_ms(llm):.0f} ms without a first token)")
+        return _Attempt(self, llm)
+
+    def _mark_failed(self, llm):
+        adapter = self._fallback_adapter
+        status = adapter._status[adapter._llm_instances.index(llm)]
+        if status.available:
+            status.available = False
+            adapter.emit("llm_availability_changed", AvailabilityChangedEvent(llm=llm, available=False))
+        self._try_recovery(llm)
+
+    async def _run(self) -> None:
+        adapter = self._fallback_adapter
+        start_time = time.time()
+        candidates = [llm for llm, status in zip(adapter._llm_instances, adapter._status) if status.available]
+        if not candidates:
+            logger.error("All LLMs are unavailable, retrying..")
+            candidates = list(adapter._llm_instances)
+
+        running = []
+        winner = None
+        try:
+            while winner is None:
+                if not running:
+                    if not candidates:
+                        raise APIConnectionError(
+                            f"all LLMs failed ({[llm.label for llm in adapter._llm_instances]}) "
+                            f"after {time.time() - start_time} seconds"
+                        )
+                    running.append(self._start(candidates.pop(0)))
+
+                # With a model left to hedge with, wait for the first token only for the grace time
+                timeout = None
+                if candidates and len(running) == 1:
+                    elapsed_ms = (time.perf_counter() - running[0].started) * 1000
+                    timeout = max(0.0, grace_time_ms(running[0].llm) - elapsed_ms) / 1000
+                waiters = [asyncio.create_task(attempt.ready.wait()) for attempt in running]
+                try:
+                    done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+
+                if not done:
+                    hedge = candidates.pop(0)
+                    logger.warning(f"⏱️ No first token from {running[0].llm.label} after "
+                                   f"{grace_time_ms(running[0].llm):.0f} ms, hedging with {hedge.label}")
+                    running.append(self._start(hedge))
+                    continue
+
+                for attempt in [attempt for attempt in running if attempt.ready.is_set()]:
+                    if attempt.failed_early():
+                        running.remove(attempt)
+                        self._mark_failed(attempt.llm)
+                    elif winner is None:
+                        winner = attempt
+
+            # Commit to the first model that streams, cancel the others
+            for attempt in running:
+                if attempt is not winner:
+                    attempt.record_censored()
+                    attempt.task.cancel()
+                    logger.info(f"🏁 {winner.llm.label} streamed first "
+                                f"({winner.ttft_ms or 0:.0f} ms), cancelled {attempt.llm.label}")
+
+            while True:
+                item = await winner.queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    self._mark_failed(winner.llm)
+                    raise item
+                self._event_ch.send_nowait(item)
+        finally:
+            for attempt in running:
+                if not attempt.task.done():
+                    attempt.task.cancel()
@@ -23,7 +23,9 @@ from .message_helpers import (
 
 from .chat_management import (
     print_chat_history_stats,
-    manage_rag_context_budget
+    manage_rag_context_budget,
+    message_text,
+    message_tokens
 )
 
 from .query_handlers import (
@@ -53,6 +55,8 @@ __all__ = [
     # Chat management
     'print_chat_history_stats',
     'manage_rag_context_budget',
+    'message_text',
+    'message_tokens',
     # Query handlers
     'query_qa_rag_only',
     'query_chunk_rag_only',
@@ -1,9 +1,49 @@
 """
 RAG Chat Management Functions
 Handles chat history statistics and RAG context budget management
+
+Token estimates are cached on each message (_token_estimate: text, tokens), so
+a turn only estimates the messages added or changed since the previous one.
 """
 
 
+def message_text(msg):
+    """Text of a chat message - handles different content types"""
+    msg_text = ""
+    if hasattr(msg, 'content'):
+        content = msg.content
+        # Handle content as list or string
+        if isinstance(content, list):
+            # Extract text from list of content items
+            msg_text = " ".join(str(item.get('text', '') if isinstance(item, dict) else item) for item in content)
+        elif isinstance(content, str):
+            msg_text = content
+        else:
+            msg_text = str(content) if content else ""
+    elif hasattr(msg, 'text'):
+        msg_text = msg.text if isinstance(msg.text, str) else str(msg.text)
+    
+    # Ensure msg_text is a string
+    if not isinstance(msg_text, str):
+        msg_text = str(msg_text) if msg_text else ""
+    return msg_text
+
+
+def message_tokens(msg, estimate_tokens_func, msg_text=None):
+    """Estimated tokens of a chat message, cached on the message while its text is unchanged"""
+    if msg_text is None:
+        msg_text = message_text(msg)
+    cached = getattr(msg, '_token_estimate', None)
+    if cached is not None and cached[0] == msg_text:
+        return cached[1]
+    msg_tokens = estimate_tokens_func(msg_text)
+    try:
+        msg._token_estimate = (msg_text, msg_tokens)
+    except Exception:
+        pass
+    return msg_tokens
+
+
 def print_chat_history_stats(chat_ctx, estimate_tokens_func, label=""):
     """Print detailed statistics about chat history size and token usage."""
     # Get messages list - handle both regular ChatContext and read-only variants
@@ -29,27 +69,9 @@ def print_chat_history_stats(chat_ctx, estimate_tokens_func, label=""):
     for msg in messages:
         role = getattr(msg, 'role', 'unknown')
         
-        # Get message text - handle different content types
-        msg_text = ""
-        if hasattr(msg, 'content'):
-            content = msg.content
-            # Handle content as list or string
-            if isinstance(content, list):
-                # Extract text from list of content items
-                msg_text = " ".join(str(item.get('text', '') if isinstance(item, dict) else item) for item in content)
-            elif isinstance(content, str):
-                msg_text = content
-            else:
-                msg_text = str(content) if content else ""
-        elif hasattr(msg, 'text'):
-            msg_text = msg.text if isinstance(msg.text, str) else str(msg.text)
-        
-        # Ensure msg_text is a string
-        if not isinstance(msg_text, str):
-            msg_text = str(msg_text) if msg_text else ""
-        
+        msg_text = message_text(msg)
         msg_chars = len(msg_text)
-        msg_tokens = estimate_tokens_func(msg_text)
+        msg_tokens = message_tokens(msg, estimate_tokens_func, msg_text)
         
         total_chars += msg_chars
         total_tokens += msg_tokens
@@ -117,24 +139,7 @@ def manage_rag_context_budget(chat_ctx, rag_rolling_budget, rag_context_budget_t
     for msg in messages:
         is_rag = getattr(msg, '_is_rag_context', False)
         if is_rag:
-            # Get message text - handle different content types
-            msg_text = ""
-            if hasattr(msg, 'content'):
-                content = msg.content
-                if isinstance(content, list):
-                    msg_text = " ".join(str(item.get('text', '') if isinstance(item, dict) else item) for item in content)
-                elif isinstance(content, str):
-                    msg_text = content
-                else:
-                    msg_text = str(content) if content else ""
-            elif hasattr(msg, 'text'):
-                msg_text = msg.text if isinstance(msg.text, str) else str(msg.text)
-            
-            # Ensure msg_text is a string
-            if not isinstance(msg_text, str):
-                msg_text = str(msg_text) if msg_text else ""
-            
-            msg_tokens = estimate_tokens_func(msg_text)
+            msg_tokens = message_tokens(msg, estimate_tokens_func)
             rag_messages.append((msg, msg_tokens, getattr(msg, '_rag_timestamp', 0)))
             rag_token_count += msg_tokens
     
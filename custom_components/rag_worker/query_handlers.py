@@ -15,6 +15,24 @@ from .logging_helpers import (
 from .message_helpers import insert_rag_message
 
 
+def parse_qa_results(results):
+    """
+    Q&A results as a dict, or None when nothing relevant was found.
+    
+    Accepts the structured result of query_qa_rag_results() as-is and
+    decodes the JSON string returned by query_qa_rag().
+    """
+    if not results:
+        return None
+    if isinstance(results, str):
+        if "No relevant" in results:
+            return None
+        return json.loads(results)
+    if results.get("message") or results.get("error"):
+        return None
+    return results
+
+
 async def query_qa_rag_only(
     agent, chat_ctx, last_user_message, user_id, conversation_id,
     qa_rag_initialized, query_qa_rag_func, rag_num_results,
@@ -40,9 +58,9 @@ async def query_qa_rag_only(
         
         search_time = (time.perf_counter() - start_time) * 1000
         
-        if results and "No relevant" not in results:
-            try:
-                parsed_results = json.loads(results)
+        try:
+            parsed_results = parse_qa_results(results)
+            if parsed_results:
                 qa_pairs = parsed_results.get("retrieved_qa", [])
                 timing_info = parsed_results.get("timing", {})
                 
@@ -86,8 +104,8 @@ async def query_qa_rag_only(
                     
                     print_chat_history_stats_func(chat_ctx, label="[AFTER Q&A RAG]")
                     
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing Q&A RAG results: {e}")
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing Q&A RAG results: {e}")
                 
     except asyncio.TimeoutError:
         logger.warning("⚠️  Q&A RAG query timed out (>500ms)")
@@ -299,8 +317,8 @@ async def query_both_rags(
                 timeout=0.5
             )
             
-            if qa_results and "No relevant" not in qa_results:
-                parsed_qa = json.loads(qa_results)
+            parsed_qa = parse_qa_results(qa_results)
+            if parsed_qa:
                 qa_pairs = parsed_qa.get("retrieved_qa", [])
                 
                 if qa_pairs:
@@ -1,7 +1,23 @@
 """
 RAG Orchestrator
 Main entry point for automatic RAG enrichment
+
+The pre-LLM stages run concurrently instead of one after the other:
+
+    retrieval   |--- query in flight ----------------|insert|
+    budget      |--|                                        (trims before the insert)
+    stats          |-|
+                |<-------- rag_pre_llm_budget_ms --------->|  later: cancelled, dropped
+
+Retrieval is started first; budget trimming and history stats run while its
+query is in flight (they are synchronous, so trimming always finishes before
+the new context is inserted). Retrieval that has not finished within the
+latency budget is cancelled and the turn goes to the LLM without it. Each
+stage's duration is returned (and logged) as the turn's timing breakdown.
 """
+import asyncio
+import time
+
 from .chat_management import manage_rag_context_budget, print_chat_history_stats
 from .query_handlers import query_qa_rag_only, query_chunk_rag_only, query_both_rags
 
@@ -43,30 +59,86 @@ async def automatic_rag_enrichment(
     rag_debug_mode, rag_debug_print_full,
     document_server_enabled, document_server_base_url,
     # Helper functions
-    estimate_tokens_func, rag_query_logger, llm_module, logger
+    estimate_tokens_func, rag_query_logger, llm_module, logger,
+    # Latency budget
+    rag_pre_llm_budget_ms=None
 ):
-    """Automatically enrich every user query with RAG context - supports multiple modes"""
+    """Automatically enrich every user query with RAG context - supports multiple modes
     
-    # First, manage RAG context budget (remove oldest if over limit)
-    manage_rag_context_budget(
-        chat_ctx, rag_rolling_budget, rag_context_budget_tokens,
-        rag_debug_mode, estimate_tokens_func, logger
-    )
+    Returns:
+        Stage timings of this turn in ms (budget, stats, retrieval, total; dropped if retrieval was late)
+    """
+    start_time = time.perf_counter()
+    timings = {}
     
-    # Print chat history stats at the start of every request
-    print_chat_history_stats(chat_ctx, estimate_tokens_func, label="[BEFORE RAG]")
+    def run_stage(name, func, *args, **kwargs):
+        stage_start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[name] = (time.perf_counter() - stage_start) * 1000
     
+    retrieval = None
     if not rag_enabled:
         logger.debug("RAG mechanism is disabled. Skipping automatic enrichment.")
-        return
-
-    # Get the full last user message
-    last_user_message = get_last_user_message(chat_ctx)
+    else:
+        # Get the full last user message
+        last_user_message = get_last_user_message(chat_ctx)
+        if not last_user_message or len(last_user_message.strip()) < 3:
+            logger.debug("No meaningful user message found, skipping automatic RAG enrichment")
+        else:
+            retrieval_start = time.perf_counter()
+            retrieval = asyncio.create_task(_retrieve(
+                agent, chat_ctx, last_user_message,
+                rag_mode, qa_rag_initialized, rag_initialized,
+                query_qa_rag_func, query_rag_func,
+                rag_num_results, rag_context_budget_tokens,
+                rag_debug_mode, rag_debug_print_full,
+                document_server_enabled, document_server_base_url,
+                estimate_tokens_func, rag_query_logger, llm_module, logger
+            ))
+            await asyncio.sleep(0)  # Let retrieval send its query before the local stages run
+    
+    # Manage RAG context budget (remove oldest if over limit) and print chat history stats
+    run_stage("budget", manage_rag_context_budget,
+              chat_ctx, rag_rolling_budget, rag_context_budget_tokens,
+              rag_debug_mode, estimate_tokens_func, logger)
+    run_stage("stats", print_chat_history_stats, chat_ctx, estimate_tokens_func, label="[BEFORE RAG]")
     
-    if not last_user_message or len(last_user_message.strip()) < 3:
-        logger.debug("No meaningful user message found, skipping automatic RAG enrichment")
-        return
+    if retrieval is not None:
+        timeout = None
+        if rag_pre_llm_budget_ms is not None:
+            timeout = max(0.0, rag_pre_llm_budget_ms / 1000 - (time.perf_counter() - start_time))
+        try:
+            done, _ = await asyncio.wait({retrieval}, timeout=timeout)
+        except asyncio.CancelledError:  # Turn interrupted
+            retrieval.cancel()
+            raise
+        timings["retrieval"] = (time.perf_counter() - retrieval_start) * 1000
+        if not done:
+            retrieval.cancel()
+            timings["dropped"] = True
+            logger.warning(f"⏱️  RAG retrieval exceeded the {rag_pre_llm_budget_ms} ms pre-LLM budget, answering without it")
+        elif retrieval.exception() is not None:
+            logger.error(f"❌ RAG retrieval failed: {retrieval.exception()}")
+    
+    timings["total"] = (time.perf_counter() - start_time) * 1000
+    logger.info("⏱️  Pre-LLM stages: " + " | ".join(
+        f"{name} {value:.1f} ms" for name, value in timings.items() if name != "dropped"
+    ) + (" (retrieval dropped)" if timings.get("dropped") else ""))
+    return timings
+
 
+async def _retrieve(
+    agent, chat_ctx, last_user_message,
+    rag_mode, qa_rag_initialized, rag_initialized,
+    query_qa_rag_func, query_rag_func,
+    rag_num_results, rag_context_budget_tokens,
+    rag_debug_mode, rag_debug_print_full,
+    document_server_enabled, document_server_base_url,
+    estimate_tokens_func, rag_query_logger, llm_module, logger
+):
+    """Query the RAG system(s) for the last user message and insert the context (retrieval stage)"""
     # Get user_id and conversation_id for logging
     user_id = getattr(agent, 'user_id', 'unknown')
     conversation_id = getattr(agent, 'room_name', None)
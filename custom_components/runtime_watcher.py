@@ -0,0 +1,143 @@
+"""
+Background watcher for hot-reloaded settings and the RAG index.
+
+llm_node used to re-parse .env (load_dotenv) and stat the vector database on
+every turn, and ran a full RAG (re)initialization inline when the database on
+disk was newer, while the user waited for an answer. One RuntimeWatcher task
+per process now does this every RUNTIME_WATCH_INTERVAL seconds:
+
+- .env is re-read only when its mtime changes (load_dotenv(override=True), so
+  os.getenv readers see the new values as before)
+- when RAG is enabled and the vector database is newer than the loaded one
+  (or nothing is loaded), the reload callback runs in the watcher task; the
+  loader swaps the new index into rag_hq.state in one step, so turns keep
+  using the previous index until the new one is ready
+- the result is published as a new immutable RuntimeSnapshot
+
+The turn path only reads `watcher.snapshot`.
+"""
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from config import RUNTIME_WATCH_INTERVAL
+
+logger = logging.getLogger("runtime_watcher")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime if path else None
+    except OSError:
+        return None
+
+
+def _rag_enabled_from_env():
+    return os.getenv("RAG_ENABLED", "false").lower() == "true"
+
+
+@dataclass(frozen=True)
+class RuntimeSnapshot:
+    """Settings and index state as of the watcher's last check."""
+    rag_enabled: bool
+    env_mtime: Optional[float] = None
+    index_mtime: Optional[int] = None  # Vector database file on disk (None: missing)
+    index_generation: int = 0  # Reloads completed by the watcher
+
+
+class RuntimeWatcher:
+    """Polls .env and the vector database from a background task and publishes snapshots."""
+
+    def __init__(self, reload_index, is_ready, env_path, index_path, interval=RUNTIME_WATCH_INTERVAL):
+        """
+        Args:
+            reload_index: Async callable that (re)loads the RAG index
+            is_ready: Callable returning whether a RAG index is loaded
+            env_path: The .env file (empty: no hot-reloading of settings)
+            index_path: The vector database file
+            interval: Seconds between checks
+        """
+        self.reload_index = reload_index
+        self.is_ready = is_ready
+        self.env_path = env_path
+        self.index_path = os.path.abspath(index_path)
+        self.interval = interval
+        index_mtime = _mtime(self.index_path)
+        self.snapshot = RuntimeSnapshot(
+            rag_enabled=_rag_enabled_from_env(),
+            env_mtime=_mtime(env_path),
+            index_mtime=int(index_mtime) if index_mtime is not None else None,
+        )
+        self._failed_mtime = None  # Index mtime of the last failed reload (not retried until it changes)
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"👀 Watching {self.env_path or '(no .env)'} and {self.index_path} every {self.interval}s")
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"⚠️ Runtime watcher check failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _read_files(self, previous):
+        """(env mtime, rag_enabled, index mtime); re-reads .env only if it changed (blocking)."""
+        env_mtime = _mtime(self.env_path)
+        rag_enabled = previous.rag_enabled
+        if env_mtime is not None and env_mtime != previous.env_mtime:
+            load_dotenv(self.env_path, override=True)
+            rag_enabled = _rag_enabled_from_env()
+        index_mtime = _mtime(self.index_path)
+        return env_mtime, rag_enabled, int(index_mtime) if index_mtime is not None else None
+
+    async def check(self):
+        """Check the files once, reload the index if needed and publish a new snapshot."""
+        from rag_hq.state import state
+
+        previous = self.snapshot
+        env_mtime, rag_enabled, index_mtime = await asyncio.get_running_loop().run_in_executor(
+            None, self._read_files, previous
+        )
+        if rag_enabled != previous.rag_enabled:
+            logger.info(f"🔁 RAG_ENABLED changed in .env: {previous.rag_enabled} → {rag_enabled}")
+
+        generation = previous.index_generation
+        if rag_enabled and index_mtime is None and previous.index_mtime is not None:
+            logger.warning(f"⚠️ RAG hot-reload: File not found at {self.index_path}")
+        elif rag_enabled and index_mtime is not None and index_mtime != self._failed_mtime:
+            stale = index_mtime > state.last_db_modified_time
+            if stale or not self.is_ready():
+                if stale:
+                    logger.info(f"🔄 RAG database update detected: {index_mtime} > {state.last_db_modified_time}")
+                else:
+                    logger.info("🔄 RAG enabled without a loaded index - initializing in the background")
+                await self.reload_index()
+                if self.is_ready() and index_mtime <= state.last_db_modified_time:
+                    generation += 1
+                    self._failed_mtime = None
+                    logger.info(f"✓ RAG index generation {generation} in use")
+                else:
+                    self._failed_mtime = index_mtime
+                    logger.warning("⚠️ RAG index reload did not complete, retrying when the database changes")
+
+        snapshot = RuntimeSnapshot(rag_enabled, env_mtime, index_mtime, generation)
+        if snapshot != previous:
+            self.snapshot = snapshot
@@ -129,7 +129,7 @@ async def generate_qa_for_document(document_path: str, dev_mode: bool = True) ->
     
     all_qa_pairs = []
     
-    for chunk in chunks:
+    async def generate_chunk(chunk):
         chunk_title = get_chunk_title(title, chunk)
         
         print(f"\n🤖 Generating Q&A pairs for chunk {chunk['chunk_num']}/{chunk['total_chunks']}...")
@@ -144,11 +144,15 @@ async def generate_qa_for_document(document_path: str, dev_mode: bool = True) ->
                 force_language=force_lang
             )
         
-        qa_result, retry_meta = await retry_with_backoff(
+        return await retry_with_backoff(
             generate_with_retry,
             operation_name=f"Q&A generation for {chunk_title}"
         )
-        
+    
+    # All chunks are generated concurrently; the LLM pool bounds concurrency and rate
+    chunk_results = await asyncio.gather(*(generate_chunk(chunk) for chunk in chunks))
+    
+    for chunk, (qa_result, retry_meta) in zip(chunks, chunk_results):
         if qa_result is None:
             result['error'] = f"Failed to generate Q&As for chunk {chunk['chunk_num']}: {retry_meta.get('error', 'Unknown')}"
             print(f"✗ {result['error']}")
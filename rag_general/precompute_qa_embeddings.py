@@ -2,112 +2,193 @@
 """
 Pre-compute embeddings for all Q&A pairs and save to disk.
 Run this ONCE after ingesting documents, then the worker loads instantly.
+
+Questions are embedded with concurrent multi-input requests and written as a
+Q&A store (rag_qa/qa_store.py): a normalized float16 matrix plus compact
+records that workers memory-map. Q&A files whose content hash is unchanged
+since the previous run keep their rows, so re-running after adding documents
+only embeds the new or changed files.
 """
+import sys
 import json
-import pickle
+import asyncio
+import hashlib
 from pathlib import Path
-import requests
+
+import aiohttp
+import numpy as np
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from rag_qa.qa_store import QA_STORE_DIR, QAStore, qa_store_exists, normalize_rows, write_qa_store
+
 QA_JSON_DIR = Path("qa_vector_db/dev_outputs")
-EMBEDDINGS_OUTPUT = Path("qa_vector_db/qa_embeddings.pkl")
 EMBEDDING_SERVER_URL = "http://localhost:7777/embedding"
+EMBED_BATCH_SIZE = 16  # Questions per request
+EMBED_CONCURRENCY = 4  # Requests in flight
+
 
+def _parse_embedding(embedding):
+    # Handle nested list format from llama server
+    if isinstance(embedding, list) and len(embedding) > 0 and isinstance(embedding[0], list):
+        return embedding[0]
+    return embedding
 
-def get_embedding(text: str):
+
+async def get_embedding(session, text: str):
     """Get embedding vector for text"""
     try:
-        response = requests.post(
-            EMBEDDING_SERVER_URL,
-            json={"content": text},
-            timeout=5.0
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            # Handle nested list format from llama server
-            if isinstance(result, list) and len(result) > 0:
-                if isinstance(result[0], dict) and 'embedding' in result[0]:
-                    embedding = result[0]['embedding']
-                    if isinstance(embedding, list) and len(embedding) > 0:
-                        return embedding[0]
-            return result
-        else:
-            print(f"Embedding server error: {response.status_code}")
-            return None
+        async with session.post(EMBEDDING_SERVER_URL, json={"content": text}) as response:
+            if response.status == 200:
+                result = await response.json()
+                if isinstance(result, list) and len(result) > 0:
+                    if isinstance(result[0], dict) and 'embedding' in result[0]:
+                        return _parse_embedding(result[0]['embedding'])
+                return result
+            else:
+                print(f"Embedding server error: {response.status}")
+                return None
     except Exception as e:
         print(f"Error getting embedding: {e}")
         return None
 
 
+async def get_embeddings_batch(session, texts):
+    """Embed several texts in one request; falls back to one request per text."""
+    try:
+        async with session.post(EMBEDDING_SERVER_URL, json={"content": texts}) as response:
+            if response.status == 200:
+                result = await response.json()
+                if isinstance(result, list) and len(result) == len(texts):
+                    vectors = [None] * len(texts)
+                    for position, item in enumerate(result):
+                        if isinstance(item, dict) and 0 <= item.get('index', position) < len(texts):
+                            vectors[item.get('index', position)] = _parse_embedding(item.get('embedding'))
+                    return vectors
+    except Exception as e:
+        print(f"Batch embedding failed, retrying per question: {e}")
+    return [await get_embedding(session, text) for text in texts]
+
+
+async def embed_questions(questions):
+    """Embed all questions concurrently. Returns one vector (or None) per question."""
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    batches = [questions[i:i + EMBED_BATCH_SIZE] for i in range(0, len(questions), EMBED_BATCH_SIZE)]
+    results = [None] * len(batches)
+    
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        with tqdm(total=len(questions), desc="Computing embeddings") as progress:
+            async def run(batch_idx, batch):
+                async with semaphore:
+                    results[batch_idx] = await get_embeddings_batch(session, batch)
+                progress.update(len(batch))
+            
+            await asyncio.gather(*(run(i, batch) for i, batch in enumerate(batches)))
+    
+    return [vector for batch in results for vector in batch]
+
+
+def load_qa_file(json_file):
+    """Q&A records of one dev-output file (without embeddings)."""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    
+    document_title = data.get('document_title', json_file.stem)
+    
+    records = []
+    for qa in data.get('qa_pairs', []):
+        question = qa.get('question', '')
+        answer = qa.get('answer', '')
+        context = qa.get('context', answer)
+        page_hint = qa.get('page_hint', None)
+        
+        if question and answer:
+            records.append({
+                'question': question,
+                'answer': answer,
+                'context': context,
+                'source': document_title,
+                'page': page_hint
+            })
+    return records
+
+
 def main():
     print("=" * 80)
     print("PRE-COMPUTING Q&A EMBEDDINGS")
     print("=" * 80)
     
-    qa_files = list(QA_JSON_DIR.glob("*.json"))
+    qa_files = sorted(QA_JSON_DIR.glob("*.json"))
     print(f"\nFound {len(qa_files)} Q&A files")
     
-    all_qa_pairs = []
+    # Previous store: rows of unchanged files are reused
+    previous = None
+    if qa_store_exists():
+        try:
+            previous = QAStore.open()
+        except Exception as e:
+            print(f"⚠️  Ignoring previous Q&A store: {e}")
+    previous_files = previous.manifest.get('files', {}) if previous else {}
     
     # Load all Q&A pairs
     print("\nStep 1: Loading Q&A pairs...")
+    parts = []  # (file name, hash, records, vectors or None)
+    questions = []
+    reused = 0
     for json_file in qa_files:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        document_title = data.get('document_title', json_file.stem)
+        file_hash = hashlib.sha256(json_file.read_bytes()).hexdigest()
+        old = previous_files.get(json_file.name)
+        if old is not None and old['hash'] == file_hash:
+            rows = range(old['start'], old['start'] + old['count'])
+            parts.append((json_file.name, file_hash, [previous.records[i] for i in rows],
+                          np.asarray(previous.matrix[old['start']:old['start'] + old['count']])))
+            reused += old['count']
+            continue
         
-        for qa in data.get('qa_pairs', []):
-            question = qa.get('question', '')
-            answer = qa.get('answer', '')
-            context = qa.get('context', answer)
-            page_hint = qa.get('page_hint', None)
-            
-            if question and answer:
-                all_qa_pairs.append({
-                    'question': question,
-                    'answer': answer,
-                    'context': context,
-                    'source': document_title,
-                    'page': page_hint,
-                    'embedding': None  # Will compute
-                })
+        records = load_qa_file(json_file)
+        parts.append((json_file.name, file_hash, records, None))
+        questions.extend(record['question'] for record in records)
     
-    print(f"✓ Loaded {len(all_qa_pairs)} Q&A pairs")
+    print(f"✓ {reused} Q&A pairs unchanged, {len(questions)} to embed")
     
     # Compute embeddings
-    print("\nStep 2: Computing embeddings (this will take a while)...")
-    print(f"Estimated time: ~{len(all_qa_pairs) * 0.7 / 60:.1f} minutes")
+    print("\nStep 2: Computing embeddings...")
+    embeddings = asyncio.run(embed_questions(questions)) if questions else []
     
+    # Assemble the store in file order; failed embeddings are dropped
+    all_records = []
+    all_vectors = []
+    files = {}
     failed_count = 0
+    new_embeddings = iter(embeddings)
+    for name, file_hash, records, vectors in parts:
+        start = len(all_records)
+        if vectors is None:
+            kept = [(record, embedding) for record, embedding in zip(records, new_embeddings) if embedding]
+            if len(kept) < len(records):
+                # Re-embedded on the next run
+                failed_count += len(records) - len(kept)
+                file_hash = None
+            records = [record for record, _ in kept]
+            vectors = normalize_rows([embedding for _, embedding in kept]) if kept else None
+        all_records.extend(records)
+        if vectors is not None and len(vectors):
+            all_vectors.append(vectors)
+        files[name] = {'hash': file_hash, 'start': start, 'count': len(records)}
     
-    for i, qa in enumerate(tqdm(all_qa_pairs, desc="Computing embeddings")):
-        embedding = get_embedding(qa['question'])
-        
-        if embedding:
-            qa['embedding'] = embedding
-        else:
-            failed_count += 1
-            print(f"\n✗ Failed to get embedding for Q&A {i+1}")
-    
-    # Remove failed embeddings
-    all_qa_pairs = [qa for qa in all_qa_pairs if qa['embedding'] is not None]
-    
-    print(f"\n✓ Computed {len(all_qa_pairs)} embeddings")
+    print(f"\n✓ Computed {len(embeddings) - failed_count} embeddings")
     if failed_count > 0:
-        print(f"✗ Failed: {failed_count}")
+        print(f"✗ Failed: {failed_count} (their files are embedded again on the next run)")
     
     # Save to disk
-    print("\nStep 3: Saving embeddings to disk...")
-    EMBEDDINGS_OUTPUT.parent.mkdir(exist_ok=True)
-    
-    with open(EMBEDDINGS_OUTPUT, 'wb') as f:
-        pickle.dump(all_qa_pairs, f)
+    print("\nStep 3: Saving Q&A store to disk...")
+    matrix = np.concatenate(all_vectors) if all_vectors else np.zeros((0, 0), dtype=np.float16)
+    write_qa_store(all_records, matrix, files)
     
-    file_size_mb = EMBEDDINGS_OUTPUT.stat().st_size / 1024 / 1024
-    print(f"✓ Saved to {EMBEDDINGS_OUTPUT}")
-    print(f"  File size: {file_size_mb:.2f} MB")
+    file_size_mb = sum(p.stat().st_size for p in QA_STORE_DIR.glob("qa_*") if p.suffix in ('.npy', '.bin', '.json')) / 1024 / 1024
+    print(f"✓ Saved {len(all_records)} Q&A pairs to {QA_STORE_DIR}")
+    print(f"  Matrix: {matrix.shape}, total size: {file_size_mb:.2f} MB")
     
     print("\n" + "=" * 80)
     print("✅ DONE! Worker will now load instantly.")
@@ -116,4 +197,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -32,7 +32,7 @@ logger = logging.getLogger("rebuild-script")
 
 # Import RAG module
 from rag_hq import build_vector_database, initialize_rag, cleanup_rag
-from rag_hq.config import VECTOR_DB_FOLDER, FILE_HISTORY_PATH, VECTOR_DB_PATH, METADATA_PATH
+from rag_hq.config import VECTOR_DB_FOLDER, FILE_HISTORY_PATH, VECTOR_DB_PATH, METADATA_PATH, LEGACY_METADATA_PATH
 from rag_hq.database_operations import BM25_INDEX_PATH
 
 
@@ -40,7 +40,11 @@ def delete_file_if_exists(filepath, description):
     """Delete a file if it exists and log the action."""
     if os.path.exists(filepath):
         try:
-            os.remove(filepath)
+            if os.path.isdir(filepath):
+                import shutil
+                shutil.rmtree(filepath)
+            else:
+                os.remove(filepath)
             logger.info(f"✓ Deleted {description}: {filepath}")
             return True
         except Exception as e:
@@ -78,11 +82,13 @@ async def rebuild_database(fresh_start=False, clear_all=False):
         files_to_delete = [
             (VECTOR_DB_PATH, "Vector database"),
             (VECTOR_DB_PATH + ".map", "Vector database map"),
-            (METADATA_PATH, "Chunks metadata"),
+            (METADATA_PATH, "Chunks metadata (chunk store)"),
+            (LEGACY_METADATA_PATH, "Chunks metadata (legacy pickle)"),
             (BM25_INDEX_PATH, "BM25 index"),
             (FILE_HISTORY_PATH, "File history"),
             (os.path.join(VECTOR_DB_FOLDER, "embeddings_cache.npy.npy"), "Embeddings cache"),
             (os.path.join(VECTOR_DB_FOLDER, "embeddings_cache.npy"), "Embeddings cache (alt)"),
+            (os.path.join(VECTOR_DB_FOLDER, "embeddings_cache"), "Embeddings cache (mapped)"),
             (os.path.join(VECTOR_DB_FOLDER, "document_summaries.pkl"), "Document summaries"),
             (os.path.join(VECTOR_DB_FOLDER, ".ingestionrapport.json"), "Ingestion report"),
         ]
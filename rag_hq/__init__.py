@@ -43,6 +43,8 @@ from .database_operations import (
 
 from .state import state, preload_all_documents
 
+from .metadata_index import ChunkFilter
+
 from .health_check import (
     run_health_check,
     quick_check,
@@ -56,6 +58,7 @@ __all__ = [
     'ensure_rag_initialized',
     'enrich_with_rag',
     'query_rag',
+    'ChunkFilter',
     'build_vector_database',
     'load_vector_database',
     'run_health_check',
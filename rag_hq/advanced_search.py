@@ -1,23 +1,69 @@
 """
 Advanced search capabilities with query understanding and multi-hop reasoning.
 This is the Tier 2 search system for complex queries.
+
+Latency: the query analysis and rewrite LLM calls run speculatively while the
+original query is retrieved; the rewrites are then embedded in one batched
+request, searched in one pass over the index and fused with reciprocal-rank
+fusion (RRF).
 """
 import time
 import json
+import asyncio
 import logging
 import numpy as np
 from typing import List, Dict, Any, Optional
-from groq import Groq
 
-from .config import GROQ_API_KEY, K_RESULTS, VECTOR_DIM
+from .config import GROQ_API_KEY, K_RESULTS, VECTOR_DIM, ADVANCED_SEARCH_RRF_K, ENABLE_METADATA_FILTERING
 from .state import state
-from .embeddings import create_embeddings
-from .token_counter import count_tokens
-from .query import expand_chunk_context
+from .llm_client import get_llm_pool
+from .token_counter import chunk_token_count
+from .metadata_index import ChunkFilter
+from .query import expand_chunk_context, embed_query, embed_queries, collapse_duplicates
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
 
+async def _groq_completion(prompt: str, temperature: float, max_tokens: int) -> str:
+    """Run a Groq chat completion on the shared async LLM pool so retrieval can proceed meanwhile.
+
+    No retries: these calls are speculative and the callers fall back to the original query.
+    """
+    return await get_llm_pool(GROQ_API_KEY).chat(
+        [{"role": "user", "content": prompt}],
+        model="llama-3.1-8b-instant",
+        max_retries=0,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+
+
+def reciprocal_rank_fusion(rankings, rrf_k: int = ADVANCED_SEARCH_RRF_K) -> List[tuple]:
+    """
+    Fuse ranked result lists with reciprocal-rank fusion.
+    
+    Args:
+        rankings: Lists of query results (best first), one per query variation
+        rrf_k: RRF damping constant (60 in the original paper)
+        
+    Returns:
+        List of (uuid, fused score, best cosine similarity), best first
+    """
+    fused = {}
+    best_similarity = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking):
+            uuid = result.userdata
+            fused[uuid] = fused.get(uuid, 0.0) + 1.0 / (rrf_k + rank + 1)
+            best_similarity[uuid] = max(best_similarity.get(uuid, -1.0), result.cosine_similarity)
+    
+    return sorted(
+        ((uuid, score, best_similarity[uuid]) for uuid, score in fused.items()),
+        key=lambda item: (item[1], item[2]),
+        reverse=True
+    )
+
+
 async def analyze_query(query: str) -> Dict[str, Any]:
     """
     Analyze query to extract intent, entities, and determine if multi-hop needed.
@@ -42,23 +88,14 @@ Return JSON with:
 }}"""
 
     try:
-        client = Groq(api_key=GROQ_API_KEY)
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1,
-            max_tokens=300,
-        )
-        
-        if completion.choices:
-            response_text = completion.choices[0].message.content.strip()
-            try:
-                analysis = json.loads(response_text)
-                logger.info(f"Query analysis: intent={analysis.get('intent')}, complex={analysis.get('is_complex')}")
-                return analysis
-            except json.JSONDecodeError:
-                logger.warning("Failed to parse query analysis JSON")
-                return {"intent": "factual", "entities": [], "is_complex": False, "sub_questions": [], "keywords": []}
+        response_text = (await _groq_completion(prompt, temperature=0.1, max_tokens=300)).strip()
+        try:
+            analysis = json.loads(response_text)
+            logger.info(f"Query analysis: intent={analysis.get('intent')}, complex={analysis.get('is_complex')}")
+            return analysis
+        except json.JSONDecodeError:
+            logger.warning("Failed to parse query analysis JSON")
+            return {"intent": "factual", "entities": [], "is_complex": False, "sub_questions": [], "keywords": []}
     except Exception as e:
         logger.error(f"Query analysis failed: {e}")
     
@@ -83,23 +120,14 @@ Query: "{query}"
 Return JSON array of strings: ["variation1", "variation2", "variation3"]"""
 
     try:
-        client = Groq(api_key=GROQ_API_KEY)
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=200,
-        )
-        
-        if completion.choices:
-            response_text = completion.choices[0].message.content.strip()
-            try:
-                variations = json.loads(response_text)
-                if isinstance(variations, list):
-                    logger.info(f"Generated {len(variations)} query variations")
-                    return variations
-            except json.JSONDecodeError:
-                pass
+        response_text = (await _groq_completion(prompt, temperature=0.3, max_tokens=200)).strip()
+        try:
+            variations = json.loads(response_text)
+            if isinstance(variations, list):
+                logger.info(f"Generated {len(variations)} query variations")
+                return variations
+        except json.JSONDecodeError:
+            pass
     except Exception as e:
         logger.error(f"Query rewriting failed: {e}")
     
@@ -139,80 +167,85 @@ async def advanced_search(
             "search_time_ms": 0
         }
     
-    # Step 1: Analyze query
-    logger.info(f"Advanced search for: {query}")
-    analysis = await analyze_query(query)
-    
-    # Step 2: Query rewriting/expansion
-    queries = [query]
-    if rewrite_query:
-        variations = await rewrite_query_for_retrieval(query)
-        queries.extend(variations[:2])  # Add top 2 variations
-        logger.info(f"Using {len(queries)} query variations")
-    
-    # Step 3: Multi-query retrieval
-    all_results = {}
-    
     # Check if annoy_index is initialized
     if state.annoy_index is None:
         logger.error("advanced_search failed: Annoy index is not initialized (database not loaded)")
         return []
     
-    for q in queries:
-        # Create embeddings
-        embedding = await create_embeddings(q, is_query=True)
+    # Step 1+2: Analyze and rewrite the query speculatively, in parallel with retrieval below
+    logger.info(f"Advanced search for: {query}")
+    analysis_task = asyncio.create_task(analyze_query(query))
+    rewrite_task = asyncio.create_task(rewrite_query_for_retrieval(query)) if rewrite_query else None
+    
+    # Document types restrict the index search itself: only matching chunks are scored
+    chunk_filter = ChunkFilter(doc_types=doc_types) if doc_types and ENABLE_METADATA_FILTERING else None
+    search_options = {'chunk_filter': chunk_filter, 'chunks_metadata': state.chunks_metadata}
+    
+    # Step 3: Multi-query retrieval (original query first, rewrites in one batch)
+    rankings = []
+    try:
+        embedding = await embed_query(query)
+        if np.any(embedding):
+            rankings.append(await state.annoy_index.query_async(embedding, n=k * 2, executor=state.executor, **search_options))
         
-        if not np.any(embedding):
-            continue
+        variations = []
+        if rewrite_task is not None:
+            variations = [
+                v for v in await rewrite_task
+                if isinstance(v, str) and v.strip() and v.strip() != query.strip()
+            ][:2]  # Add top 2 variations
+            logger.info(f"Using {len(variations) + 1} query variations")
         
-        # Search
-        results = await state.annoy_index.query_async(embedding, n=k * 2, executor=state.executor)
+        if variations:
+            vectors = [e for e in await embed_queries(variations) if np.any(e)]
+            if vectors:
+                rankings.extend(await state.annoy_index.query_batch_async(vectors, n=k * 2, executor=state.executor, **search_options))
         
-        # Collect results
-        for result in results:
-            uuid = result.userdata
-            if uuid not in all_results or result.cosine_similarity > all_results[uuid]['score']:
-                chunk_data = state.chunks_metadata.get(uuid)
-                if chunk_data:
-                    all_results[uuid] = {
-                        'score': result.cosine_similarity,
-                        'chunk': chunk_data
-                    }
+        analysis = await analysis_task
+    finally:
+        for task in (analysis_task, rewrite_task):
+            if task is not None and not task.done():
+                task.cancel()
     
-    # Step 4: Filter by doc_types if specified
+    # Step 4: Reciprocal-rank fusion, keeping chunks that exist and match doc_types
+    fused_results = []
+    for uuid, fused_score, similarity in reciprocal_rank_fusion(rankings):
+        chunk_data = state.chunks_metadata.get(uuid)
+        if not chunk_data:
+            continue
+        if doc_types and chunk_filter is None:
+            # Metadata filtering disabled: extension-based filtering of the results
+            filename = chunk_data.get('metadata', {}).get('filename', '')
+            if not any(filename.endswith(f".{dt}") for dt in doc_types):
+                continue
+        fused_results.append((uuid, {'score': similarity, 'fusion_score': fused_score, 'chunk': chunk_data}))
+    fused_results = [
+        (uuid, data) for uuid, data, _ in
+        collapse_duplicates([(uuid, data['chunk'], data['score']) for uuid, data in fused_results])
+    ]
     if doc_types:
-        filtered_results = {}
-        for uuid, data in all_results.items():
-            metadata = data['chunk'].get('metadata', {})
-            filename = metadata.get('filename', '')
-            # Simple extension-based filtering
-            if any(filename.endswith(f".{dt}") for dt in doc_types):
-                filtered_results[uuid] = data
-        all_results = filtered_results
-        logger.info(f"Filtered to {len(all_results)} results matching doc types: {doc_types}")
+        logger.info(f"Found {len(fused_results)} results matching doc types: {doc_types}")
     
-    # Step 5: Sort by score and take top-k
-    sorted_results = sorted(
-        all_results.items(),
-        key=lambda x: x[1]['score'],
-        reverse=True
-    )[:k]
+    # Step 5: Take top-k (already ordered by fused rank)
+    sorted_results = fused_results[:k]
     
     # Step 6: Format results with expanded context
+    # Expand context for all results concurrently
+    expanded_texts = await asyncio.gather(*(
+        expand_chunk_context(data['chunk']['text'], data['chunk']['metadata']) for _, data in sorted_results
+    ))
+    
     formatted_results = []
-    for uuid, data in sorted_results:
-        chunk = data['chunk']
-        metadata = chunk['metadata']
-        
-        # Expand context
-        expanded_text = await expand_chunk_context(chunk['text'], metadata)
+    for (uuid, data), expanded_text in zip(sorted_results, expanded_texts):
+        metadata = data['chunk']['metadata']
         
         formatted_results.append({
             "text": expanded_text,
             "filename": metadata.get('filename', 'unknown'),
             "chunk_index": metadata.get('chunk_index', 0),
             "similarity": data['score'],
-            "tokens": count_tokens(expanded_text)
+            "fusion_score": data['fusion_score'],
+            "tokens": chunk_token_count(expanded_text, metadata, data['chunk']['text'])
         })
     
     search_time_ms = (time.time() - start_time) * 1000
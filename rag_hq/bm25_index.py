@@ -1,89 +1,226 @@
 """
 BM25 keyword-based search for hybrid retrieval.
+
+The index is an inverted index: each term maps to a posting list of
+(document id, term frequency). Queries only touch the posting lists of their
+own terms, with IDF and document-length norms precomputed once per change.
 """
+import copy
 import logging
 import math
 import re
+from array import array
 from typing import List, Tuple, Dict
 from collections import Counter
 
+import numpy as np
+
 logger = logging.getLogger("rag-assistant-enhanced")
 
+_TOKEN_PATTERN = re.compile(r'\b\w+\b')
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokenize text into terms."""
+    # Lowercase and split on non-alphanumeric
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def bm25_top_k(term_ids, term_offsets, postings_docs, postings_tf, idf, doc_norms, k1, n):
+    """
+    Score the documents in the posting lists of `term_ids` and return the top n.
+    
+    Shared by the in-memory BM25Index and the memory-mapped shared store, so both
+    rank identically. Repeated query terms count once per occurrence.
+    
+    Returns:
+        List of (doc_id, score) tuples sorted by score descending
+    """
+    if not term_ids or n <= 0:
+        return []
+    
+    docs_parts = []
+    score_parts = []
+    for term_id in term_ids:
+        start, end = term_offsets[term_id], term_offsets[term_id + 1]
+        docs = postings_docs[start:end]
+        tf = postings_tf[start:end]
+        docs_parts.append(docs)
+        score_parts.append(idf[term_id] * (tf * (k1 + 1)) / (tf + doc_norms[docs]))
+    
+    docs = np.concatenate(docs_parts)
+    if len(docs) == 0:
+        return []
+    candidates, inverse = np.unique(docs, return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+    
+    # Partial selection of the top n, then order just those (ties: lowest doc id first)
+    positive = np.flatnonzero(scores > 0)
+    if len(positive) > n:
+        positive = positive[np.argpartition(-scores[positive], n - 1)[:n]]
+    positive = positive[np.lexsort((candidates[positive], -scores[positive]))]
+    return [(int(candidates[i]), float(scores[i])) for i in positive]
+
 
 class BM25Index:
     """
-    Simple BM25 implementation for keyword-based search.
+    Inverted-index BM25 implementation for keyword-based search.
     Uses standard BM25 parameters: k1=1.5, b=0.75
     """
     
     def __init__(self, k1: float = 1.5, b: float = 0.75):
         self.k1 = k1
         self.b = b
-        self.documents = {}  # uuid -> document text
-        self.doc_lengths = {}  # uuid -> document length
+        self.doc_uuids = []  # doc id -> uuid
+        self.doc_ids = {}  # uuid -> doc id
+        self.doc_lengths = array('I')  # doc id -> document length
+        self.total_length = 0
         self.avg_doc_length = 0
-        self.term_frequencies = {}  # uuid -> {term: frequency}
-        self.doc_frequencies = {}  # term -> number of docs containing term
+        self.postings = {}  # term -> (array of doc ids, array of term frequencies)
+        self.deleted_docs = set()  # doc ids removed since the last compact()
         self.num_docs = 0
-        
+        self._frozen = None
+    
     def tokenize(self, text: str) -> List[str]:
         """Tokenize text into terms."""
-        # Lowercase and split on non-alphanumeric
-        text = text.lower()
-        tokens = re.findall(r'\b\w+\b', text)
-        return tokens
+        return tokenize(text)
     
     def add_document(self, uuid: str, text: str):
         """Add a document to the index."""
+        if uuid in self.doc_ids:
+            logger.warning(f"BM25: document {uuid} already indexed, skipping")
+            return
+        
         tokens = self.tokenize(text)
+        self._index_document(uuid, len(tokens), Counter(tokens))
+    
+    def _index_document(self, uuid: str, length: int, term_freqs: Dict[str, int]):
+        """Append a document's term frequencies to the posting lists."""
+        doc_id = len(self.doc_uuids)
         
-        self.documents[uuid] = text
-        self.doc_lengths[uuid] = len(tokens)
-        self.term_frequencies[uuid] = Counter(tokens)
+        self.doc_uuids.append(uuid)
+        self.doc_ids[uuid] = doc_id
+        self.doc_lengths.append(length)
         
-        # Update document frequencies
-        unique_terms = set(tokens)
-        for term in unique_terms:
-            self.doc_frequencies[term] = self.doc_frequencies.get(term, 0) + 1
+        for term, tf in term_freqs.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array('I'), array('I'))
+            posting[0].append(doc_id)
+            posting[1].append(tf)
         
         self.num_docs += 1
         
-        # Update average document length
-        self.avg_doc_length = sum(self.doc_lengths.values()) / self.num_docs
+        # Running total keeps the average O(1) per insert
+        self.total_length += length
+        self.avg_doc_length = self.total_length / self.num_docs
+        self._frozen = None
     
-    def compute_idf(self, term: str) -> float:
-        """Compute inverse document frequency for a term."""
-        df = self.doc_frequencies.get(term, 0)
-        if df == 0:
-            return 0.0
+    def remove_document(self, uuid: str):
+        """Remove a document; its postings are skipped until compact() drops them."""
+        doc_id = self.doc_ids.pop(uuid, None)
+        if doc_id is None:
+            return
+        
+        self.deleted_docs.add(doc_id)
+        self.num_docs -= 1
+        self.total_length -= self.doc_lengths[doc_id]
+        self.avg_doc_length = self.total_length / self.num_docs if self.num_docs else 0
+        self._frozen = None
+    
+    def copy(self) -> 'BM25Index':
+        """Independent copy (for building an update next to the live index)."""
+        return copy.deepcopy(self)
+    
+    def compact(self) -> 'BM25Index':
+        """Return a copy without removed documents, with doc ids renumbered densely."""
+        compacted = BM25Index(self.k1, self.b)
+        new_ids = np.full(len(self.doc_uuids), -1, dtype=np.int64)
+        for doc_id, uuid in enumerate(self.doc_uuids):
+            if doc_id in self.deleted_docs:
+                continue
+            new_ids[doc_id] = len(compacted.doc_uuids)
+            compacted.doc_ids[uuid] = len(compacted.doc_uuids)
+            compacted.doc_uuids.append(uuid)
+            compacted.doc_lengths.append(self.doc_lengths[doc_id])
+        
+        for term, (docs, tfs) in self.postings.items():
+            ids = new_ids[np.frombuffer(docs, dtype=np.uint32)]
+            keep = ids >= 0
+            if keep.any():
+                compacted.postings[term] = (
+                    array('I', ids[keep].astype(np.uint32).tobytes()),
+                    array('I', np.frombuffer(tfs, dtype=np.uint32)[keep].tobytes()),
+                )
         
+        compacted.num_docs = len(compacted.doc_uuids)
+        compacted.total_length = sum(compacted.doc_lengths)
+        compacted.avg_doc_length = compacted.total_length / compacted.num_docs if compacted.num_docs else 0
+        return compacted
+    
+    def freeze(self) -> Dict:
+        """
+        Compact the posting lists into flat (CSR) arrays with precomputed IDF
+        and document-length norms. Cached until the next add/remove.
+        
+        Returns:
+            Dict with 'terms' (sorted), 'term_ids', 'term_offsets', 'postings_docs',
+            'postings_tf', 'idf' and 'doc_norms' (postings of live documents only)
+        """
+        if self._frozen is not None:
+            return self._frozen
+        
+        terms = sorted(self.postings)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(self.postings[t][0]) for t in terms])
+        
+        postings_docs = np.empty(int(term_offsets[-1]), dtype=np.int32)
+        postings_tf = np.empty(int(term_offsets[-1]), dtype=np.float32)
+        for i, term in enumerate(terms):
+            docs, tfs = self.postings[term]
+            postings_docs[term_offsets[i]:term_offsets[i + 1]] = docs
+            postings_tf[term_offsets[i]:term_offsets[i + 1]] = tfs
+        
+        if self.deleted_docs:
+            # Drop postings of removed documents and shift the offsets to match
+            live = np.ones(len(self.doc_uuids), dtype=bool)
+            live[list(self.deleted_docs)] = False
+            keep = live[postings_docs]
+            kept_before = np.concatenate([[0], np.cumsum(keep)])
+            term_offsets = kept_before[term_offsets].astype(np.int64)
+            postings_docs = postings_docs[keep]
+            postings_tf = postings_tf[keep]
+        
+        df = np.diff(term_offsets).astype(np.float64)
         # Standard BM25 IDF formula
-        idf = math.log((self.num_docs - df + 0.5) / (df + 0.5) + 1.0)
-        return idf
+        idf = np.log((self.num_docs - df + 0.5) / (df + 0.5) + 1.0)
+        
+        doc_lengths = np.asarray(self.doc_lengths, dtype=np.float64)
+        avg_doc_length = self.avg_doc_length or 1.0
+        doc_norms = self.k1 * (1 - self.b + self.b * (doc_lengths / avg_doc_length))
+        
+        self._frozen = {
+            'terms': terms,
+            'term_ids': {term: i for i, term in enumerate(terms)},
+            'term_offsets': term_offsets,
+            'postings_docs': postings_docs,
+            'postings_tf': postings_tf,
+            'idf': idf,
+            'doc_norms': doc_norms,
+        }
+        return self._frozen
     
-    def compute_score(self, query_terms: List[str], uuid: str) -> float:
-        """Compute BM25 score for a document given query terms."""
-        if uuid not in self.documents:
+    def compute_idf(self, term: str) -> float:
+        """Compute inverse document frequency for a term."""
+        posting = self.postings.get(term)
+        if posting is None:
             return 0.0
         
-        score = 0.0
-        doc_length = self.doc_lengths[uuid]
-        term_freqs = self.term_frequencies[uuid]
-        
-        for term in query_terms:
-            if term not in term_freqs:
-                continue
-            
-            idf = self.compute_idf(term)
-            tf = term_freqs[term]
-            
-            # BM25 formula
-            numerator = tf * (self.k1 + 1)
-            denominator = tf + self.k1 * (1 - self.b + self.b * (doc_length / self.avg_doc_length))
-            
-            score += idf * (numerator / denominator)
-        
-        return score
+        df = len(posting[0])
+        if self.deleted_docs:
+            df -= sum(1 for doc_id in posting[0] if doc_id in self.deleted_docs)
+        # Standard BM25 IDF formula
+        return math.log((self.num_docs - df + 0.5) / (df + 0.5) + 1.0)
     
     def search(self, query: str, n: int = 10) -> List[Tuple[str, float]]:
         """
@@ -94,20 +231,17 @@ class BM25Index:
         """
         query_terms = self.tokenize(query)
         
-        if not query_terms:
+        if not query_terms or self.num_docs == 0:
             return []
         
-        # Score all documents
-        scores = []
-        for uuid in self.documents:
-            score = self.compute_score(query_terms, uuid)
-            if score > 0:
-                scores.append((uuid, score))
+        frozen = self.freeze()
+        term_ids = [frozen['term_ids'][t] for t in query_terms if t in frozen['term_ids']]
         
-        # Sort by score descending
-        scores.sort(key=lambda x: x[1], reverse=True)
-        
-        return scores[:n]
+        top = bm25_top_k(
+            term_ids, frozen['term_offsets'], frozen['postings_docs'], frozen['postings_tf'],
+            frozen['idf'], frozen['doc_norms'], self.k1, n
+        )
+        return [(self.doc_uuids[doc_id], score) for doc_id, score in top]
     
     def get_num_docs(self) -> int:
         """Return number of documents in index."""
@@ -115,12 +249,33 @@ class BM25Index:
     
     def clear(self):
         """Clear the index."""
-        self.documents = {}
-        self.doc_lengths = {}
-        self.term_frequencies = {}
-        self.doc_frequencies = {}
-        self.num_docs = 0
+        self.doc_uuids = []
+        self.doc_ids = {}
+        self.doc_lengths = array('I')
+        self.total_length = 0
         self.avg_doc_length = 0
+        self.postings = {}
+        self.deleted_docs = set()
+        self.num_docs = 0
+        self._frozen = None
+    
+    def __getstate__(self):
+        # The frozen arrays are a cache; rebuild them after unpickling
+        state = self.__dict__.copy()
+        state['_frozen'] = None
+        return state
+    
+    def __setstate__(self, state):
+        if 'term_frequencies' in state:
+            # Pickle from the old dict-of-Counters layout: re-index its term frequencies
+            self.__init__(state.get('k1', 1.5), state.get('b', 0.75))
+            doc_lengths = state.get('doc_lengths', {})
+            for uuid, term_freqs in state['term_frequencies'].items():
+                self._index_document(uuid, doc_lengths.get(uuid, sum(term_freqs.values())), term_freqs)
+            logger.info(f"Migrated legacy BM25 index ({self.num_docs} documents) to posting lists")
+            return
+        state.setdefault('deleted_docs', set())
+        self.__dict__.update(state)
 
 
 def merge_hybrid_results(
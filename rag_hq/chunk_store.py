@@ -0,0 +1,446 @@
+"""
+Columnar, memory-mapped store for chunks_metadata.
+
+chunks_metadata used to be one pickle of every chunk record (full text plus
+metadata dict), unpickled in full by every process and rewritten in full on
+every save. ChunkStore keeps the same mapping interface
+(uuid -> {'text', 'metadata', 'embedding_hash'}) on top of:
+
+Layout (METADATA_PATH/, one generation <g> at a time):
+    manifest.json            committed lengths, filenames, deleted rows (written last)
+    records.<g>.bin          fixed-width records (RECORD_DTYPE): uuid, filename id,
+                             chunk_index, char_start, char_end, text/extra offsets
+    text.<g>.bin             utf-8 chunk texts, addressed by (offset, length)
+    extra.<g>.bin            JSON of the remaining fields (keywords, embedding_hash, ...)
+    ids.<g>.<c>.npy          UUIDs sorted for binary-search lookup (commit <c>)
+    rows.<g>.<c>.npy         record row of each sorted UUID (commit <c>)
+
+Records are decoded on access from read-only memory maps, so load time and
+per-process memory do not grow with the corpus. Saves append new records and
+bytes past the committed lengths and then swap the manifest; anything past
+those lengths (an interrupted save) is truncated by the next save. The id
+index is rewritten on every save, so it gets a new name per commit (recorded
+in the manifest) and the previous one is kept for readers still opening it;
+an interrupted save never touches the files a manifest points to. Deletions
+are recorded as row numbers in the manifest until compacted() rewrites the
+live records as a new generation.
+"""
+import os
+import json
+import time
+import pickle
+import logging
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from .config import METADATA_PATH, LEGACY_METADATA_PATH
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+STORE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+RECORD_DTYPE = np.dtype([
+    ('uuid', 'S64'),
+    ('filename_id', '<i4'),
+    ('chunk_index', '<i4'),
+    ('char_start', '<i8'),
+    ('char_end', '<i8'),
+    ('text_offset', '<i8'),
+    ('text_length', '<u4'),
+    ('extra_length', '<u4'),
+    ('extra_offset', '<i8'),
+    ('fields', 'u1'),  # Bitmask of the optional numeric fields that are present
+])
+
+# Numeric metadata fields stored as columns: (column, presence bit)
+_NUMERIC_FIELDS = (('chunk_index', 1), ('char_start', 2), ('char_end', 4))
+_HAS_FILENAME = 8
+
+
+def _map_file(path, length, dtype=np.uint8):
+    """Read-only map of the committed part of a file (empty maps are not allowed)."""
+    if length == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+
+def _append(path, committed_bytes, blob):
+    """Append after the committed length, dropping leftovers of an interrupted save."""
+    with open(path, 'ab') as f:
+        f.truncate(committed_bytes)
+        f.write(blob)
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def chunk_store_exists(directory=METADATA_PATH):
+    """True if a committed chunk store (or a legacy pickle to migrate) exists."""
+    return (os.path.exists(os.path.join(directory, MANIFEST_NAME)) or
+            (directory == METADATA_PATH and os.path.exists(LEGACY_METADATA_PATH)))
+
+
+class ChunkStore(MutableMapping):
+    """chunks_metadata backed by memory-mapped columns; changes are buffered until save()."""
+
+    def __init__(self, directory=METADATA_PATH, manifest=None):
+        self.directory = directory
+        self.manifest = manifest or {
+            'format_version': STORE_FORMAT_VERSION,
+            'generation': time.time_ns(),
+            'num_records': 0,
+            'text_bytes': 0,
+            'extra_bytes': 0,
+            'filenames': [],
+            'deleted_rows': [],
+        }
+        self.generation = self.manifest['generation']
+        self._filenames = list(self.manifest['filenames'])
+        self._filename_ids = {name: i for i, name in enumerate(self._filenames)}
+        self._deleted = set(self.manifest['deleted_rows'])
+        self._pending = {}  # uuid -> record added since the last save
+        self._dirty = manifest is None
+        self._map_files()
+
+    # --- Files ---
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.{self.generation}.bin")
+
+    def _id_index_path(self, name, commit):
+        # Stores written before per-commit id indexes have no commit in the manifest
+        if commit is None:
+            return os.path.join(self.directory, f"{name}.{self.generation}.npy")
+        return os.path.join(self.directory, f"{name}.{self.generation}.{commit}.npy")
+
+    def _map_files(self):
+        num_records = self.manifest['num_records']
+        self.records = _map_file(self._path('records'), num_records, RECORD_DTYPE)
+        self.text = _map_file(self._path('text'), self.manifest['text_bytes'])
+        self.extra = _map_file(self._path('extra'), self.manifest['extra_bytes'])
+        if num_records:
+            commit = self.manifest.get('commit')
+            self.ids_sorted = np.load(self._id_index_path('ids', commit), mmap_mode='r')
+            self.ids_rows = np.load(self._id_index_path('rows', commit), mmap_mode='r')
+        else:
+            self.ids_sorted = np.zeros(0, dtype=RECORD_DTYPE['uuid'])
+            self.ids_rows = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def open(cls, directory=METADATA_PATH):
+        """Attach to the committed store, migrating the legacy pickle if needed (blocking)."""
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            if directory == METADATA_PATH and os.path.exists(LEGACY_METADATA_PATH):
+                return cls.migrate_pickle(LEGACY_METADATA_PATH, directory)
+            raise FileNotFoundError(f"Chunk store not found: {manifest_path}")
+
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported chunk store format {manifest.get('format_version')}")
+        return cls(directory, manifest)
+
+    @classmethod
+    def migrate_pickle(cls, pickle_path, directory=METADATA_PATH):
+        """Convert a metadata.pkl into a chunk store (the pickle is left in place)."""
+        start_time = time.time()
+        with open(pickle_path, 'rb') as f:
+            chunks_metadata = pickle.load(f)
+
+        store = cls(directory)
+        store.update(chunks_metadata)
+        store.save()
+        logger.info(f"✓ Migrated {len(chunks_metadata):,} chunks from {pickle_path} to the chunk store "
+                    f"in {time.time() - start_time:.1f}s")
+        return cls.open(directory)
+
+    # --- Mapping interface ---
+
+    def _row_for_uuid(self, uuid_str):
+        """Committed, non-deleted row of a UUID, or None."""
+        if not isinstance(uuid_str, str) or len(self.ids_sorted) == 0:
+            return None
+        key = uuid_str.encode('utf-8')
+        pos = int(np.searchsorted(self.ids_sorted, key))
+        if pos < len(self.ids_sorted) and self.ids_sorted[pos] == key:
+            row = int(self.ids_rows[pos])
+            # Guards against an id index that does not match the records (e.g. a damaged store)
+            if row < len(self.records) and row not in self._deleted:
+                return row
+        return None
+
+    def _decode(self, row):
+        """Rebuild the chunk record dict of one row; only the touched pages are read."""
+        rec = self.records[row]
+        text_start = int(rec['text_offset'])
+        extra_start = int(rec['extra_offset'])
+        extra = json.loads(self.extra[extra_start:extra_start + int(rec['extra_length'])].tobytes())
+
+        metadata = extra.pop('metadata', {})
+        fields = int(rec['fields'])
+        if fields & _HAS_FILENAME:
+            metadata['filename'] = self._filenames[int(rec['filename_id'])]
+        for name, bit in _NUMERIC_FIELDS:
+            if fields & bit:
+                metadata[name] = int(rec[name])
+
+        record = {'text': self.text[text_start:text_start + int(rec['text_length'])].tobytes().decode('utf-8'),
+                  'metadata': metadata}
+        record.update(extra)
+        return record
+
+    def __getitem__(self, uuid_str):
+        if uuid_str in self._pending:
+            return self._pending[uuid_str]
+        row = self._row_for_uuid(uuid_str)
+        if row is None:
+            raise KeyError(uuid_str)
+        return self._decode(row)
+
+    def __contains__(self, uuid_str):
+        return uuid_str in self._pending or self._row_for_uuid(uuid_str) is not None
+
+    def __setitem__(self, uuid_str, record):
+        row = self._row_for_uuid(uuid_str)
+        if row is not None:
+            self._deleted.add(row)
+        self._pending[uuid_str] = record
+        self._dirty = True
+
+    def __delitem__(self, uuid_str):
+        if self._pending.pop(uuid_str, None) is not None:
+            return
+        row = self._row_for_uuid(uuid_str)
+        if row is None:
+            raise KeyError(uuid_str)
+        self._deleted.add(row)
+        self._dirty = True
+
+    def _live_rows(self):
+        live = np.ones(len(self.records), dtype=bool)
+        if self._deleted:
+            live[list(self._deleted)] = False
+        return np.flatnonzero(live)
+
+    def __iter__(self):
+        for row in self._live_rows():
+            yield self.records[row]['uuid'].decode('utf-8')
+        yield from list(self._pending)
+
+    def __len__(self):
+        return len(self.records) - len(self._deleted) + len(self._pending)
+
+    def items(self):
+        """(uuid, record) pairs, decoding rows in file order."""
+        for row in self._live_rows():
+            yield self.records[row]['uuid'].decode('utf-8'), self._decode(row)
+        yield from list(self._pending.items())
+
+    def values(self):
+        for _, record in self.items():
+            yield record
+
+    # --- Column queries (no record decoding) ---
+
+    def chunk_ids_by_filename(self):
+        """Filename -> list of live chunk UUIDs, read from the fixed-width columns only."""
+        by_filename = {}
+        rows = self._live_rows()
+        records = self.records[rows] if len(rows) else self.records[:0]
+        has_filename = (records['fields'] & _HAS_FILENAME) != 0
+        for uuid_bytes, filename_id in zip(records['uuid'][has_filename], records['filename_id'][has_filename]):
+            by_filename.setdefault(self._filenames[filename_id], []).append(uuid_bytes.decode('utf-8'))
+        for uuid_str, record in self._pending.items():
+            filename = record.get('metadata', {}).get('filename')
+            if filename:
+                by_filename.setdefault(filename, []).append(uuid_str)
+        return by_filename
+
+    def metadata_columns(self, uuid_strs):
+        """Filename ids and chunk indexes of chunk ids, for the metadata filter index.
+
+        Returns:
+            (filename table, filename ids into it (-1: unknown chunk or no filename),
+            chunk indexes (-1 marks summary chunks))
+        """
+        filenames = list(self._filenames)
+        filename_ids = np.full(len(uuid_strs), -1, dtype=np.int32)
+        chunk_indexes = np.zeros(len(uuid_strs), dtype=np.int64)
+
+        if len(self.ids_sorted) and len(uuid_strs):
+            keys = np.array([(u or '').encode('utf-8') for u in uuid_strs], dtype=RECORD_DTYPE['uuid'])
+            pos = np.minimum(np.searchsorted(self.ids_sorted, keys), len(self.ids_sorted) - 1)
+            rows = np.asarray(self.ids_rows[pos])
+            found = (np.asarray(self.ids_sorted[pos]) == keys) & (rows < len(self.records))
+            if self._deleted:
+                found &= ~np.isin(rows, list(self._deleted))
+            records = self.records[rows[found]]
+            fields = records['fields']
+            filename_ids[found] = np.where((fields & _HAS_FILENAME) != 0, records['filename_id'], -1)
+            has_chunk_index = (fields & dict(_NUMERIC_FIELDS)['chunk_index']) != 0
+            chunk_indexes[found] = np.where(has_chunk_index, records['chunk_index'], 0)
+
+        ids = {name: i for i, name in enumerate(filenames)}
+        for i, uuid_str in enumerate(uuid_strs):
+            record = self._pending.get(uuid_str)
+            if record is None:
+                continue
+            metadata = record.get('metadata', {})
+            filename = metadata.get('filename')
+            filename_ids[i] = -1
+            if filename is not None:
+                if filename not in ids:
+                    ids[filename] = len(filenames)
+                    filenames.append(filename)
+                filename_ids[i] = ids[filename]
+            chunk_index = metadata.get('chunk_index')
+            chunk_indexes[i] = chunk_index if isinstance(chunk_index, int) else 0
+        return filenames, filename_ids, chunk_indexes
+
+    def num_documents(self):
+        return len(self.chunk_ids_by_filename())
+
+    def needs_compaction(self, ratio):
+        return len(self._deleted) > ratio * max(len(self.records), 1)
+
+    # --- Writing ---
+
+    def fork(self):
+        """Copy for an ingestion run: committed files are shared, buffered changes copied."""
+        clone = ChunkStore(self.directory, self.manifest)
+        clone._filenames = list(self._filenames)
+        clone._filename_ids = dict(self._filename_ids)
+        clone._deleted = set(self._deleted)
+        clone._pending = dict(self._pending)
+        clone._dirty = self._dirty
+        return clone
+
+    def _encode(self, items, records, text_base, extra_base):
+        """Fill fixed-width records for (uuid, record) items; returns the text and extra blobs."""
+        text_parts = []
+        extra_parts = []
+        text_offset = text_base
+        extra_offset = extra_base
+        for i, (uuid_str, record) in enumerate(items):
+            uuid_bytes = uuid_str.encode('utf-8')
+            if len(uuid_bytes) > RECORD_DTYPE['uuid'].itemsize:
+                raise ValueError(f"Chunk id too long for the chunk store: {uuid_str}")
+
+            metadata = dict(record.get('metadata', {}))
+            extra = {key: value for key, value in record.items() if key not in ('text', 'metadata')}
+            fields = 0
+            filename = metadata.pop('filename', None)
+            if filename is not None:
+                if filename not in self._filename_ids:
+                    self._filename_ids[filename] = len(self._filenames)
+                    self._filenames.append(filename)
+                records[i]['filename_id'] = self._filename_ids[filename]
+                fields |= _HAS_FILENAME
+            for name, bit in _NUMERIC_FIELDS:
+                value = metadata.get(name)
+                if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+                    records[i][name] = metadata.pop(name)
+                    fields |= bit
+            extra['metadata'] = metadata
+
+            text_blob = record.get('text', '').encode('utf-8')
+            extra_blob = json.dumps(extra, ensure_ascii=False, default=str).encode('utf-8')
+            records[i]['uuid'] = uuid_bytes
+            records[i]['fields'] = fields
+            records[i]['text_offset'] = text_offset
+            records[i]['text_length'] = len(text_blob)
+            records[i]['extra_offset'] = extra_offset
+            records[i]['extra_length'] = len(extra_blob)
+            text_parts.append(text_blob)
+            extra_parts.append(extra_blob)
+            text_offset += len(text_blob)
+            extra_offset += len(extra_blob)
+        return b''.join(text_parts), b''.join(extra_parts)
+
+    def _write_id_index(self, uuids, rows, commit):
+        order = np.argsort(uuids, kind='stable')
+        for name, array in (('ids', uuids[order]), ('rows', rows[order])):
+            path = self._id_index_path(name, commit)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+
+    def save(self):
+        """Append buffered records and commit a new manifest (blocking)."""
+        if not self._dirty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = dict(self.manifest)
+
+        items = list(self._pending.items())
+        new_records = np.zeros(len(items), dtype=RECORD_DTYPE)
+        text_blob, extra_blob = self._encode(items, new_records, manifest['text_bytes'], manifest['extra_bytes'])
+
+        _append(self._path('records'), manifest['num_records'] * RECORD_DTYPE.itemsize, new_records.tobytes())
+        _append(self._path('text'), manifest['text_bytes'], text_blob)
+        _append(self._path('extra'), manifest['extra_bytes'], extra_blob)
+
+        # Only live rows are indexed, so a re-added UUID resolves to its newest record.
+        # Written under a new commit name: the committed manifest keeps pointing at its own index
+        previous_commit = manifest.get('commit')
+        commit = (previous_commit or 0) + 1
+        num_records = manifest['num_records'] + len(items)
+        uuids = np.concatenate([np.asarray(self.records['uuid']), new_records['uuid']])
+        live = np.ones(num_records, dtype=bool)
+        if self._deleted:
+            live[list(self._deleted)] = False
+        self._write_id_index(uuids[live], np.flatnonzero(live).astype(np.int64), commit)
+
+        manifest.update({
+            'num_records': num_records,
+            'text_bytes': manifest['text_bytes'] + len(text_blob),
+            'extra_bytes': manifest['extra_bytes'] + len(extra_blob),
+            'filenames': list(self._filenames),
+            'deleted_rows': sorted(self._deleted),
+            'commit': commit,
+            'saved_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        _write_json(os.path.join(self.directory, MANIFEST_NAME), manifest)
+
+        self.manifest = manifest
+        self._pending = {}
+        self._dirty = False
+        self._map_files()
+        self._remove_other_generations()
+        self._remove_old_id_indexes(keep={commit, previous_commit})
+
+    def compacted(self):
+        """New generation holding only the live records; written by its save() (blocking)."""
+        compacted = ChunkStore(self.directory)
+        compacted._pending = dict(self.items())
+        return compacted
+
+    def _remove_old_id_indexes(self, keep):
+        """Delete id indexes of this generation older than the last two commits."""
+        keep_names = {os.path.basename(self._id_index_path(name, commit))
+                      for name in ('ids', 'rows') for commit in keep}
+        for name in os.listdir(self.directory):
+            if (name.startswith((f"ids.{self.generation}.", f"rows.{self.generation}."))
+                    and name.endswith(".npy") and name not in keep_names):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _remove_other_generations(self):
+        # Processes still attached to an old generation keep their open maps
+        suffix = f".{self.generation}."
+        for name in os.listdir(self.directory):
+            if name != MANIFEST_NAME and suffix not in name and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
@@ -17,12 +17,15 @@ import os
 UPLOADS_FOLDER = "./docs"
 VECTOR_DB_FOLDER = "local_vector_db_enhanced"
 VECTOR_DB_PATH = os.path.join(VECTOR_DB_FOLDER, "vdb_data")
-METADATA_PATH = os.path.join(VECTOR_DB_FOLDER, "metadata.pkl")
+METADATA_PATH = os.path.join(VECTOR_DB_FOLDER, "chunk_store")  # Columnar chunk store directory (chunk_store.py)
+LEGACY_METADATA_PATH = os.path.join(VECTOR_DB_FOLDER, "metadata.pkl")  # Migrated to METADATA_PATH on first load
 FILE_HISTORY_PATH = os.path.join(VECTOR_DB_FOLDER, "file_history.pkl")
-EMBEDDINGS_CACHE_PATH = os.path.join(VECTOR_DB_FOLDER, "embeddings_cache.npy")
+EMBEDDINGS_CACHE_PATH = os.path.join(VECTOR_DB_FOLDER, "embeddings_cache.npy")  # Legacy pickled cache, migrated on first load
+EMBEDDINGS_CACHE_DIR = os.path.join(VECTOR_DB_FOLDER, "embeddings_cache")  # Memory-mapped cache (embedding_cache.py)
 DOCUMENT_SUMMARIES_PATH = os.path.join(VECTOR_DB_FOLDER, "document_summaries.pkl")
 DOCUMENT_TEXTS_DIR = os.path.join(VECTOR_DB_FOLDER, "document_texts")
 INGESTION_RAPPORT_PATH = os.path.join(VECTOR_DB_FOLDER, ".ingestionrapport.json")
+SHARED_STORE_DIR = os.path.join(VECTOR_DB_FOLDER, "shared_store")
 
 # ===========================
 # Update Settings
@@ -43,6 +46,25 @@ MAX_EMBEDDING_TOKENS = 128  # Matches chunk size (512 chars / 4 = 128 tokens)
 MAX_EMBEDDING_SIZE_CHARS = 520  # Strict char limit
 SAFE_EMBEDDING_SIZE_CHARS = 512  # Safe size for your embedding model
 
+# ===========================
+# Embedding Batching (multi-input requests)
+# ===========================
+# llama-server runs with --batch-size 512 (tokens across ALL inputs of a request).
+# Batches are packed against this budget; the margin covers tokenizer mismatch
+# between tiktoken (our estimate) and the embedding model's own tokenizer.
+EMBEDDING_BATCH_TOKEN_BUDGET = 448
+EMBEDDING_BATCH_MAX_ITEMS = 16  # Max texts per multi-input request
+EMBEDDING_COALESCING_ENABLED = True  # Merge concurrent ingestion requests into batches
+EMBEDDING_COALESCE_WINDOW_MS = 5  # How long to collect concurrent callers before sending
+
+# ===========================
+# Shared Memory-Mapped Store (job processes)
+# ===========================
+# Job processes attach to a read-only mmap snapshot of the database instead of
+# unpickling metadata/BM25 into their own heap (see shared_store.py).
+SHARED_STORE_ENABLED = True
+SHARED_STORE_KEEP_GENERATIONS = 2  # Old generations kept for processes still attached
+
 # ===========================
 # Context Expansion (Small-to-Large Retrieval)
 # ===========================
@@ -62,6 +84,33 @@ EXTENSIVE_SEARCH_SUMMARY_CHARS = 6000  # Character limit for text to summarize (
 LLAMA_SERVER_URL = "http://localhost:7777/embedding"
 VECTOR_DIM = 768  # Updated to match current database on disk
 
+# ===========================
+# Vector Index Backend
+# ===========================
+# "annoy": approximate Annoy forest (original behaviour)
+# "exact": brute-force scan over a normalized matrix (exact recall)
+# "int8":  int8 scalar-quantized scan + fp32 rescoring of the top candidates
+# Switching backends converts an existing index in memory at load; re-run
+# ingestion to persist it. Compare with benchmark_tools/benchmark_vector_backends.py
+VECTOR_INDEX_BACKEND = "annoy"
+ANNOY_N_TREES = 50
+EXACT_INDEX_DTYPE = "float16"  # Matrix dtype for the exact backend ("float16" or "float32")
+INDEX_SCAN_BLOCK_ROWS = 8192  # Rows upcast to fp32 at a time during a scan
+INT8_RESCORE_FACTOR = 8  # int8 scan keeps n * factor candidates for fp32 rescoring
+
+# ===========================
+# Segmented Index (incremental updates)
+# ===========================
+# New chunks go to a small exact delta segment, deletions become tombstones;
+# the delta is sealed into a base segment once it reaches SEGMENT_DELTA_MAX_ITEMS,
+# and everything is compacted into one base segment when there are more than
+# SEGMENT_MAX_BASE_SEGMENTS base segments or tombstones exceed the ratio
+SEGMENT_DELTA_MAX_ITEMS = 2000
+SEGMENT_MAX_BASE_SEGMENTS = 4
+SEGMENT_TOMBSTONE_RATIO = 0.2
+SEGMENT_QUERY_OVERFETCH = 8  # Extra results fetched per segment to absorb tombstones
+CHUNK_STORE_DELETED_RATIO = 0.2  # Chunk store is rewritten without deleted records past this ratio
+
 # ===========================
 # Memory Optimization
 # ===========================
@@ -75,6 +124,18 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
 if GROQ_API_KEY:
     os.environ["GROQ_API_KEY"] = GROQ_API_KEY
 
+# ===========================
+# LLM Client (ingestion: summaries, Q&A generation)
+# ===========================
+# Async pooled Groq client (see llm_client.py). Request starts are paced by a
+# token bucket whose rate halves on every 429 and recovers on success.
+LLM_MAX_CONCURRENCY = 4  # In-flight LLM requests per process
+LLM_RATE_LIMIT_RPS = 0.5  # Starting (and maximum) request rate: 30 requests/minute
+LLM_RATE_BURST = 4  # Requests that may start back-to-back
+LLM_MIN_RATE_RPS = 0.05  # Floor after repeated 429s (3 requests/minute)
+LLM_MAX_RETRIES = 3
+LLM_REQUEST_TIMEOUT = 120  # seconds
+
 # ===========================
 # Retrieval Configuration (OPTIMIZED)
 # ===========================
@@ -91,11 +152,19 @@ HYBRID_SEARCH_ENABLED = False  # Toggle for hybrid semantic + keyword search
 HYBRID_SEMANTIC_WEIGHT = 0.7  # Weight for semantic similarity
 HYBRID_KEYWORD_WEIGHT = 0.3  # Weight for keyword (BM25) scoring
 
+# ===========================
+# Advanced Search (Tier 2)
+# ===========================
+ADVANCED_SEARCH_RRF_K = 60  # Reciprocal-rank fusion constant for multi-query results
+
 # ===========================
 # Citation & Metadata
 # ===========================
 ENABLE_CITATIONS = True  # Add source citations to responses
 ENABLE_METADATA_FILTERING = True  # Allow filtering by document metadata
+# Filtered searches score only the matching rows of each segment (see metadata_index.py)
+METADATA_FILTER_CACHE_SIZE = 32  # Row subsets of recent filters kept per segment
+FILTER_EXACT_SCAN_MAX_ITEMS = 20000  # Annoy segments: filtered subsets up to this size are scanned exactly
 
 # ===========================
 # Logging Configuration
@@ -107,16 +176,31 @@ VERBOSE_RAG_LOGGING = False  # Enable verbose RAG query logging
 # ===========================
 CACHE_SAVE_THRESHOLD = 50  # Save after this many new entries
 CACHE_SAVE_INTERVAL = 300  # Or this many seconds (5 minutes)
+EMBEDDINGS_CACHE_MAX_ENTRIES = 200000  # ~300 MB of fp16 vectors at 768 dims, least recently used evicted
+EMBEDDINGS_CACHE_EVICT_FRACTION = 0.1  # Extra room freed per eviction so compactions stay rare
 DOCUMENT_TEXT_CACHE_MAX_SIZE = 5  # Keep 5 documents in memory at once
+DOCUMENT_INDEX_CACHE_MAX_SIZE = 256  # Open sentence-boundary indexes (small arrays + a text mmap each)
+
+# ===========================
+# Query Cache (repeat utterances)
+# ===========================
+# Normalized query text -> query embedding / ranked chunk ids (see query_cache.py).
+# Ranked results are dropped whenever the database generation changes.
+QUERY_CACHE_ENABLED = True
+QUERY_CACHE_TTL_SECONDS = 600
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = 2000
+QUERY_RESULT_CACHE_MAX_ENTRIES = 500
 
 # ===========================
-# Processing Settings
+# Ingestion Pipeline
 # ===========================
-BATCH_SIZE_FILES = 2  # Process 2 files at a time
-BATCH_SIZE_CHUNKS = 2  # Process 2 chunks at a time during ingestion
-CHUNK_BATCH_SIZE_NORMAL = 5  # Normal chunk batch size
-INGESTION_DELAY = 0.2  # Delay between batches during ingestion
-NORMAL_DELAY = 0.1  # Normal delay between batches
+# Documents stream through extract+segment -> embed -> index stages connected by
+# bounded queues (see ingestion_pipeline.py); a full queue pauses the stage before it.
+INGESTION_PROCESS_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # Extraction/spaCy processes (0: threads)
+INGESTION_QUEUE_SIZE = 4  # Documents buffered between stages
+INGESTION_EMBED_WORKERS = 2  # Documents being embedded at once
+DEDUP_BLOCK_ROWS = 2048  # Chunk rows per similarity block in near-duplicate detection
+INGESTION_CROSS_DOC_DEDUP = True  # Mark chunks that near-duplicate a chunk of another indexed document (collapsed at retrieval)
 
 # Create necessary directories
 if not os.path.exists(VECTOR_DB_FOLDER):
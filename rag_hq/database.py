@@ -2,7 +2,6 @@
 Vector database building, loading, and saving functionality.
 """
 import os
-import time
 import uuid
 import asyncio
 import hashlib
@@ -15,17 +14,11 @@ import aiofiles.os
 
 from .config import (
     UPLOADS_FOLDER, VECTOR_DB_PATH, METADATA_PATH, FILE_HISTORY_PATH,
-    VECTOR_DB_FOLDER, BATCH_SIZE_FILES, BATCH_SIZE_CHUNKS,
-    CHUNK_BATCH_SIZE_NORMAL, INGESTION_DELAY, NORMAL_DELAY
+    VECTOR_DB_FOLDER
 )
-from .state import state, save_document_text, get_document_text
+from .state import state, get_document_text
 from .vector_index import EnhancedAnnoyIndex, validate_index, copy_index_efficiently
-from .text_processing import extract_text, smart_chunk_text
-from .document_management import (
-    generate_document_summary, save_document_summaries,
-    update_ingestion_rapport
-)
-from .embeddings import create_embeddings, save_embeddings_cache, _embedding_cache_key
+from .embeddings import create_embeddings, _embedding_cache_key
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
@@ -110,35 +103,29 @@ async def save_database():
         logger.info("Saving database to disk...")
         
         # Save to temporary files first
-        temp_db_path = VECTOR_DB_PATH + ".tmp"
-        temp_map_path = temp_db_path + ".map"  # Map file created by save_async
-        temp_metadata_path = METADATA_PATH + ".tmp"
-        
         # Import BM25 path
         from .database_operations import BM25_INDEX_PATH
         temp_bm25_path = BM25_INDEX_PATH + ".tmp"
         
-        # This creates both temp_db_path and temp_db_path.map
-        await state.annoy_index.save_async(temp_db_path, state.executor)
-        async with aiofiles.open(temp_metadata_path, "wb") as f:
-            await f.write(pickle.dumps(state.chunks_metadata))
+        # Chunk store: new records are appended, then its manifest is swapped in
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(state.executor, state.chunks_metadata.save)
         
         # Save BM25 index if it exists
         if state.bm25_index is not None:
             async with aiofiles.open(temp_bm25_path, "wb") as f:
                 await f.write(pickle.dumps(state.bm25_index))
         
-        # Atomically swap ALL files (index, map, metadata, and bm25)
-        await aiofiles.os.replace(temp_db_path, VECTOR_DB_PATH)
-        await aiofiles.os.replace(temp_map_path, VECTOR_DB_PATH + ".map")  # FIX: Rename the map file too!
-        await aiofiles.os.replace(temp_metadata_path, METADATA_PATH)
+        # Segmented index: only new/changed segments are written, each swapped in atomically,
+        # and the segment manifest last. Unchanged base segments are not rewritten.
+        await state.annoy_index.save_async(VECTOR_DB_PATH, state.executor)
         if state.bm25_index is not None:
             await aiofiles.os.replace(temp_bm25_path, BM25_INDEX_PATH)
         
-        logger.info(f"✓ Database saved: {state.annoy_index.index.get_n_items()} vectors, {len(state.chunks_metadata)} chunks")
+        logger.info(f"✓ Database saved: {state.annoy_index.num_live_items()} vectors, {len(state.chunks_metadata)} chunks")
         if state.bm25_index is not None:
             logger.info(f"  BM25 index: {state.bm25_index.get_num_docs()} documents")
-        logger.debug(f"  Saved files: {VECTOR_DB_PATH}, {VECTOR_DB_PATH}.map, {METADATA_PATH}, {BM25_INDEX_PATH}")
+        logger.debug(f"  Saved files: {VECTOR_DB_PATH} (+segments), {METADATA_PATH}, {BM25_INDEX_PATH}")
         return True
     except Exception as e:
         logger.error(f"Error saving database: {e}")
@@ -166,177 +153,38 @@ async def process_chunk(chunk_text, metadata, annoy_index_local, chunks_metadata
         logger.error(f"   Preview: {chunk_text[:150]}...")
         return False
     
-    # Add to Annoy index (thread-safe with lock)
-    async with state.lock:
-        annoy_index_local.add_item(chunk_id, embedding)
-        
-        chunks_metadata_local[chunk_id] = {
-            'text': chunk_text,
-            'metadata': metadata,
-            'embedding_hash': _embedding_cache_key(chunk_text)
-        }
-        
-        # Add to BM25 index if provided
-        if bm25_index_local is not None:
-            bm25_index_local.add_document(chunk_id, chunk_text)
-    
+    await add_embedded_chunks([(chunk_id, chunk_text, metadata, embedding)],
+                              annoy_index_local, chunks_metadata_local, bm25_index_local)
     return True
 
 
-async def process_file(file_path, filename, annoy_index_local, chunks_metadata_local, rapport, bm25_index_local=None):
-    """Process a single file and add it to the index."""
-    try:
-        # Calculate progress numbers
-        file_num = rapport.get('files_processed', 0) + rapport.get('files_failed', 0) + rapport.get('files_skipped', 0) + 1
-        total_files = rapport.get('total_files', '?')
-        
-        # Get file info for tracking
-        file_info = await get_file_info(file_path)
-        if file_info is None:
-            raise Exception("Failed to get file info")
-        
-        # Skip if file was already processed and hasn't changed
-        if filename in state.processed_files:
-            old_info = state.processed_files[filename]
-            if (old_info['size'] == file_info['size'] and 
-                old_info['mtime'] == file_info['mtime'] and
-                old_info['hash'] == file_info['hash']):
-                log_progress(f"[{file_num}/{total_files}] Skipping {filename} (unchanged)", "info")
-                rapport['files'][filename] = {'status': 'skipped', 'reason': 'unchanged'}
-                rapport['files_skipped'] = rapport.get('files_skipped', 0) + 1
-                await update_ingestion_rapport(rapport)
-                return False
-        
-        log_progress(f"[{file_num}/{total_files}] Processing: {filename}", "file")
-        
-        # Extract text from file
-        text = await extract_text(file_path)
-        if not text:
-            raise Exception("No text extracted from file")
-        
-        # Store document text to disk for lazy loading
-        await save_document_text(filename, text)
-        
-        # Register the document in our tracking system
-        state.document_texts[filename] = text
-        
-        # Generate document summary
-        await generate_document_summary(filename, text)
-        
-        # Smart chunking with metadata
-        chunks_with_meta = await smart_chunk_text(text, filename)
-        log_progress(f"[{file_num}/{total_files}] Generated {len(chunks_with_meta)} chunks from {filename}", "chunk")
-        
-        # Update rapport
-        rapport['files'][filename] = {
-            'status': 'processing',
-            'total_chunks': len(chunks_with_meta),
-            'chunks_processed': 0,
-            'start_time': time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        await update_ingestion_rapport(rapport)
-        
-        # Process chunks in smaller batches
-        chunk_batch_size = BATCH_SIZE_CHUNKS if state.is_ingesting else CHUNK_BATCH_SIZE_NORMAL
-        chunks_processed = 0
-        chunks_failed = 0
-        
-        for i in range(0, len(chunks_with_meta), chunk_batch_size):
-            chunk_batch = chunks_with_meta[i:i+chunk_batch_size]
-            chunk_tasks = []
-            
-            for chunk_text, metadata in chunk_batch:
-                chunk_tasks.append(process_chunk(chunk_text, metadata, annoy_index_local, chunks_metadata_local, bm25_index_local))
-            
-            results = await asyncio.gather(*chunk_tasks, return_exceptions=True)
-            
-            # Count successes and failures
-            for result in results:
-                if isinstance(result, Exception):
-                    chunks_failed += 1
-                    logger.error(f"Chunk processing failed: {result}")
-                elif result:
-                    chunks_processed += 1
-            
-            # Update rapport and log progress
-            rapport['files'][filename]['chunks_processed'] = chunks_processed
-            if chunks_failed > 0:
-                rapport['files'][filename]['chunks_failed'] = chunks_failed
-            
-            # Small delay between batches to avoid overwhelming server
-            if i + chunk_batch_size < len(chunks_with_meta):
-                await asyncio.sleep(0.05)  # 50ms delay between batches
-            await update_ingestion_rapport(rapport)
-            
-            # Log chunk progress every batch
-            progress_pct = (chunks_processed / len(chunks_with_meta)) * 100
-            log_progress(f"[{file_num}/{total_files}] {filename}: {chunks_processed}/{len(chunks_with_meta)} chunks ({progress_pct:.0f}%)", "progress")
-            
-            # Delay between batches
-            if i + chunk_batch_size < len(chunks_with_meta):
-                delay = INGESTION_DELAY if state.is_ingesting else NORMAL_DELAY
-                await asyncio.sleep(delay)
-        
-        # Add document summary as a special searchable chunk
-        if filename in state.document_summaries:
-            summary_data = state.document_summaries[filename]
-            # Summary text WITHOUT keywords (keywords will be in metadata)
-            summary_text = f"Document: {filename}\n\n"
-            summary_text += f"Summary: {summary_data.get('summary', '')}"
+async def add_embedded_chunks(items, annoy_index_local, chunks_metadata_local, bm25_index_local=None):
+    """Add already-embedded chunks to the index: items are (chunk_id, chunk_text, metadata, embedding)."""
+    # Add to Annoy index (thread-safe with lock, taken once per batch)
+    async with state.lock:
+        for chunk_id, chunk_text, metadata, embedding in items:
+            annoy_index_local.add_item(chunk_id, embedding)
             
-            # Add keywords as structured metadata tags
-            summary_metadata = {
-                'filename': filename,
-                'chunk_index': -1,  # Special marker for summary chunks
-                'chunk_type': 'summary',
-                'start_sentence': 0,
-                'estimated_tokens': len(summary_text) // 4,
-                'keywords': summary_data.get('keywords', []),  # Add keywords as metadata
-                'extended_keywords': summary_data.get('extended_keywords', [])  # Add extended keywords
+            chunks_metadata_local[chunk_id] = {
+                'text': chunk_text,
+                'metadata': metadata,
+                'embedding_hash': _embedding_cache_key(chunk_text)
             }
             
-            # Add summary chunk to index
-            summary_success = await process_chunk(summary_text, summary_metadata, annoy_index_local, chunks_metadata_local, bm25_index_local)
-            if summary_success:
-                chunks_processed += 1
-                logger.info(f"✓ Added document summary chunk for {filename} (keywords in metadata)")
-        
-        # Mark file as processed only if majority of chunks succeeded
-        if chunks_processed > chunks_failed:
-            state.processed_files[filename] = file_info
-            rapport['files'][filename]['status'] = 'completed'
-            rapport['files'][filename]['end_time'] = time.strftime("%Y-%m-%d %H:%M:%S")
-            rapport['files_processed'] = rapport.get('files_processed', 0) + 1
-            log_progress(f"[{file_num}/{total_files}] ✓ Completed {filename}: {chunks_processed} chunks ({chunks_failed} failed)", "success")
-            
-            # Mark file as processed and save history
-            # NOTE: We DON'T save the full database here anymore to avoid building index multiple times
-            # The index will be built and saved once at the end of all processing
-            logger.info(f"✓ Chunks added to index (will be saved after all files processed)")
-            
-            await save_processed_files()
-            await save_embeddings_cache()
-            await save_document_summaries()
-        else:
-            raise Exception(f"Too many chunk failures: {chunks_failed}/{len(chunks_with_meta)}")
-        
-        await update_ingestion_rapport(rapport)
-        return True
-        
-    except Exception as e:
-        file_num = rapport.get('files_processed', 0) + rapport.get('files_failed', 0) + rapport.get('files_skipped', 0) + 1
-        total_files = rapport.get('total_files', '?')
-        
-        rapport['files'][filename] = {
-            'status': 'failed',
-            'error': str(e),
-            'error_type': type(e).__name__,
-            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        rapport['files_failed'] = rapport.get('files_failed', 0) + 1
-        await update_ingestion_rapport(rapport)
-        log_progress(f"[{file_num}/{total_files}] ✗ Failed to process {filename}: {e}", "error")
-        return False
+            # Add to BM25 index if provided
+            if bm25_index_local is not None:
+                bm25_index_local.add_document(chunk_id, chunk_text)
+
+
+async def process_file(file_path, filename, annoy_index_local, chunks_metadata_local, rapport, bm25_index_local=None):
+    """Process a single file and add it to the index (a one-document ingestion pipeline).
+    
+    Returns True if the document was indexed, False if it was skipped or failed.
+    """
+    from .ingestion_pipeline import IngestionPipeline
+    
+    pipeline = IngestionPipeline(annoy_index_local, chunks_metadata_local, rapport, bm25_index_local)
+    return await pipeline.run([(file_path, filename)]) > 0
 
 
 async def check_for_new_files():
@@ -390,7 +238,7 @@ async def cleanup_temp_files():
     """Clean up any leftover temporary files from previous runs."""
     temp_patterns = [
         VECTOR_DB_PATH + ".tmp*",
-        METADATA_PATH + ".tmp*",
+        os.path.join(METADATA_PATH, "*.tmp"),
     ]
     
     cleaned = 0
@@ -11,19 +11,25 @@ import aiofiles
 import aiofiles.os
 
 from .config import (
-    VECTOR_DB_PATH, METADATA_PATH, UPLOADS_FOLDER, BATCH_SIZE_FILES,
-    LLAMA_SERVER_URL, DOCUMENT_TEXTS_DIR, VECTOR_DIM, VECTOR_DB_FOLDER
+    VECTOR_DB_PATH, METADATA_PATH, UPLOADS_FOLDER,
+    LLAMA_SERVER_URL, DOCUMENT_TEXTS_DIR, VECTOR_DIM, VECTOR_DB_FOLDER,
+    SHARED_STORE_ENABLED, ANNOY_N_TREES, CHUNK_STORE_DELETED_RATIO
 )
 from .state import state
-from .vector_index import EnhancedAnnoyIndex, validate_index, copy_index_efficiently
+from .vector_index import validate_index, copy_index_efficiently
+from .segments import SegmentedIndex
 from .text_processing import initialize_spacy
 from .embeddings import get_http_session, load_embeddings_cache, save_embeddings_cache
+from .query_cache import query_cache
 from .document_management import load_document_summaries, save_document_summaries, update_ingestion_rapport
 from .database import (
     load_processed_files, save_processed_files, check_for_new_files,
-    process_file, cleanup_temp_files, log_progress
+    cleanup_temp_files, log_progress
 )
+from .ingestion_pipeline import IngestionPipeline
 from .bm25_index import BM25Index
+from .chunk_store import ChunkStore, chunk_store_exists
+from .shared_store import SharedStore, ensure_shared_store, write_shared_store
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
@@ -68,11 +74,12 @@ async def build_vector_database():
     
     # Load existing index and data if available
     has_existing_data = False
-    if await aiofiles.os.path.exists(VECTOR_DB_PATH) and await aiofiles.os.path.exists(METADATA_PATH):
+    if await aiofiles.os.path.exists(VECTOR_DB_PATH) and chunk_store_exists():
         try:
-            state.annoy_index = await EnhancedAnnoyIndex.load_async(VECTOR_DB_PATH, state.executor)
-            async with aiofiles.open(METADATA_PATH, "rb") as f:
-                state.chunks_metadata = pickle.loads(await f.read())
+            state.annoy_index = await SegmentedIndex.load_async(VECTOR_DB_PATH, state.executor)
+            state.chunks_metadata = await asyncio.get_running_loop().run_in_executor(state.executor, ChunkStore.open)
+            state.bm25_index = await _load_bm25_for_update(state.chunks_metadata)
+            state.shared_store = None
             logger.info(f"Loaded existing vector database with {len(state.chunks_metadata)} entries")
             has_existing_data = True
         except Exception as e:
@@ -81,8 +88,9 @@ async def build_vector_database():
     
     # If no existing data, create a new index
     if not has_existing_data:
-        state.annoy_index = EnhancedAnnoyIndex(VECTOR_DIM)
-        state.chunks_metadata = {}
+        state.annoy_index = SegmentedIndex(VECTOR_DIM)
+        state.chunks_metadata = ChunkStore()
+        state.bm25_index = BM25Index()
         logger.info("Created new vector database")
     
     # Check for new or modified files first
@@ -131,8 +139,10 @@ async def build_vector_database():
     state.is_ingesting = True
     logger.info("Entering ingestion mode - cleaning up stale vectors and adding new ones")
     
-    # Create a new index for the build process
-    new_annoy_index = EnhancedAnnoyIndex(VECTOR_DIM)
+    # Work on a fork of the live index: base segments are shared, new chunks go to the delta
+    new_annoy_index = state.annoy_index.fork()
+    new_chunks_metadata = state.chunks_metadata.fork()
+    new_bm25_index = state.bm25_index.copy()
     
     # Identify which files still exist on disk
     existing_files = set()
@@ -151,67 +161,37 @@ async def build_vector_database():
         if history_cleaned > 0:
             logger.info(f"🗑️  Removed {history_cleaned} deleted files from processing history")
 
-    # Filter metadata: Keep only chunks whose source files still exist
-    new_chunks_metadata = {}
-    stale_count = 0
-    for chunk_id, chunk_data in state.chunks_metadata.items():
-        source_file = chunk_data.get('metadata', {}).get('filename')
-        if source_file in existing_files:
-            new_chunks_metadata[chunk_id] = chunk_data
-        else:
-            stale_count += 1
-            
-    if stale_count > 0:
-        logger.info(f"🧹 Removing {stale_count} stale chunks from deleted files")
-
-    # Initialize BM25 index
-    new_bm25_index = BM25Index()
+    # Tombstone chunks whose source files no longer exist (no vectors are copied)
+    chunk_ids_by_filename = new_chunks_metadata.chunk_ids_by_filename()
+    stale_chunks = [chunk_id for fname, chunk_ids in chunk_ids_by_filename.items()
+                    if fname not in existing_files for chunk_id in chunk_ids]
+    _remove_chunks(stale_chunks, new_annoy_index, new_chunks_metadata, new_bm25_index)
+    if stale_chunks:
+        logger.info(f"🧹 Tombstoned {len(stale_chunks)} stale chunks from deleted files")
     
-    # Only copy items that are still in our filtered metadata
-    copied = 0
-    if state.annoy_index and state.annoy_index.index.get_n_items() > 0:
-        total_items = state.annoy_index.index.get_n_items()
-        for j in range(total_items):
-            uuid_str = state.annoy_index.uuid_map.get(j)
-            if uuid_str in new_chunks_metadata:
-                vector = state.annoy_index.index.get_item_vector(j)
-                new_annoy_index.add_item(uuid_str, vector)
-                new_bm25_index.add_document(uuid_str, new_chunks_metadata[uuid_str]['text'])
-                copied += 1
-        logger.info(f"✓ Carried forward {copied} active vectors (skipped {total_items - copied} deleted ones)")
+    # Chunks of files about to be re-ingested; their new versions are diffed against them
+    previous_chunks = {fname: chunk_ids for fname, chunk_ids in chunk_ids_by_filename.items()
+                       if fname in new_or_modified}
 
-    # Process files concurrently in batches
-    files_processed = 0
-    batch_size = BATCH_SIZE_FILES
+    # Re-ingested files: drop the previous chunks the new version no longer contains once it is in
+    def on_file_done(filename, obsolete_chunks):
+        if obsolete_chunks:
+            _remove_chunks(obsolete_chunks, new_annoy_index, new_chunks_metadata, new_bm25_index)
+            logger.info(f"🧹 Tombstoned {len(obsolete_chunks)} obsolete chunks of {filename}")
     
     # Calculate how many files were removed
     files_removed_count = 0
     if state.annoy_index:
-        current_db_files = set()
-        for chunk_data in state.chunks_metadata.values():
-            fname = chunk_data.get('metadata', {}).get('filename')
-            if fname:
-                current_db_files.add(fname)
-        
         # Files that are in DB but NOT on disk
-        files_removed_count = len(current_db_files - existing_files)
+        files_removed_count = len(set(chunk_ids_by_filename) - existing_files)
 
     try:
-        for i in range(0, len(new_or_modified), batch_size):
-            batch = new_or_modified[i:i+batch_size]
-            batch_tasks = []
-            
-            for filename in batch:
-                file_path = os.path.join(UPLOADS_FOLDER, filename)
-                # NOTE: process_file now handles saving after each document
-                batch_tasks.append(process_file(file_path, filename, new_annoy_index, new_chunks_metadata, rapport, new_bm25_index))
-            
-            results = await asyncio.gather(*batch_tasks)
-            files_processed += sum(1 for r in results if r)
-            
-            # Log batch completion
-            processed_so_far = rapport.get('files_processed', 0) + rapport.get('files_failed', 0) + rapport.get('files_skipped', 0)
-            log_progress(f"Batch complete: {processed_so_far}/{len(new_or_modified)} files processed", "info")
+        # Files stream through extraction (process pool), embedding and indexing stages
+        pipeline = IngestionPipeline(new_annoy_index, new_chunks_metadata, rapport, new_bm25_index,
+                                     on_file_done, previous_chunks)
+        files_processed = await pipeline.run(
+            (os.path.join(UPLOADS_FOLDER, filename), filename) for filename in new_or_modified
+        )
         
         # Show final summary
         files_succeeded = rapport.get('files_processed', 0)
@@ -223,11 +203,13 @@ async def build_vector_database():
         if files_processed > 0 or files_removed_count > 0:
             logger.info(f"Database update needed: {files_processed} new/modified, {files_removed_count} removed")
             
-            # NOW build the index (only once, after all documents processed)
-            logger.info("Building Annoy index with 50 trees...")
+            # Finish the delta (only once, after all documents processed); a large delta
+            # is sealed into a new base segment, existing segments are untouched
             loop = asyncio.get_running_loop()
-            await loop.run_in_executor(state.executor, new_annoy_index.build, 50)
-            logger.info("✓ Index build complete")
+            await loop.run_in_executor(state.executor, new_annoy_index.build, ANNOY_N_TREES)
+            logger.info(f"✓ Index update complete: {len(new_annoy_index.segments)} base segment(s), "
+                        f"{new_annoy_index.delta.index.get_n_items():,} delta items, "
+                        f"{len(new_annoy_index.tombstones):,} tombstones")
             
             # Swap state and save
             async with state.lock:
@@ -235,9 +217,12 @@ async def build_vector_database():
                 old_metadata = state.chunks_metadata
                 old_bm25 = state.bm25_index
                 
+                old_shared_store = state.shared_store
+                
                 state.annoy_index = new_annoy_index
                 state.chunks_metadata = new_chunks_metadata
                 state.bm25_index = new_bm25_index
+                state.shared_store = None
                 logger.info(f"✓ BM25 index built with {new_bm25_index.get_num_docs()} documents")
                 
                 # Save to disk
@@ -249,8 +234,11 @@ async def build_vector_database():
                     state.annoy_index = old_index
                     state.chunks_metadata = old_metadata
                     state.bm25_index = old_bm25
+                    state.shared_store = old_shared_store
                     raise Exception("Database save failed")
                 
+                query_cache.invalidate()
+                
                 # FORCE UPDATE TIMESTAMP for hot-reload
                 # Even if save_database does it, let's be explicit to ensure OS registers change
                 try:
@@ -261,11 +249,18 @@ async def build_vector_database():
                 
                 logger.info("✓ Database saved to disk")
             
+            # Merge segments / drop tombstones once they pile up (off the event loop)
+            if (state.annoy_index.needs_compaction() or
+                    state.chunks_metadata.needs_compaction(CHUNK_STORE_DELETED_RATIO)):
+                await compact_vector_database()
+            else:
+                await _export_shared_store()
+            
             await save_processed_files()
             await save_embeddings_cache()
             await save_document_summaries()
             
-            num_vectors = state.annoy_index.index.get_n_items()
+            num_vectors = state.annoy_index.num_live_items()
             logger.info(f"✅ Vector database build complete:")
             logger.info(f"   - {num_vectors:,} vectors in index")
             logger.info(f"   - {len(state.chunks_metadata):,} chunks")
@@ -292,6 +287,140 @@ async def build_vector_database():
         state.is_ingesting = False
 
 
+def _remove_chunks(chunk_ids, annoy_index, chunks_metadata, bm25_index):
+    """Delete chunks from the metadata and BM25 index and tombstone their vectors."""
+    for chunk_id in chunk_ids:
+        chunks_metadata.pop(chunk_id, None)
+        bm25_index.remove_document(chunk_id)
+    annoy_index.remove_uuids(chunk_ids)
+
+
+async def _load_bm25_for_update(chunks_metadata):
+    """Load the BM25 pickle to update it in place, or rebuild it from the metadata."""
+    if await aiofiles.os.path.exists(BM25_INDEX_PATH):
+        try:
+            async with aiofiles.open(BM25_INDEX_PATH, "rb") as f:
+                bm25_index = pickle.loads(await f.read())
+            if bm25_index.doc_ids.keys() == chunks_metadata.keys():
+                return bm25_index
+            logger.warning("⚠️  BM25 index out of sync with metadata, rebuilding")
+        except Exception as e:
+            logger.warning(f"⚠️  Could not load BM25 index, rebuilding: {e}")
+    
+    bm25_index = BM25Index()
+    for chunk_id, chunk_data in chunks_metadata.items():
+        bm25_index.add_document(chunk_id, chunk_data['text'])
+    return bm25_index
+
+
+async def _export_shared_store():
+    """Export the mmap generation job processes attach to (written once per update)."""
+    if not SHARED_STORE_ENABLED:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+        source_mtime = int(os.stat(VECTOR_DB_PATH).st_mtime)
+        await loop.run_in_executor(
+            state.executor, write_shared_store,
+            state.annoy_index, state.chunks_metadata, state.bm25_index, source_mtime
+        )
+    except Exception as e:
+        logger.warning(f"⚠️  Could not export shared store (workers will export on attach): {e}")
+
+
+async def compact_vector_database():
+    """Merge all segments into one base segment and drop tombstoned vectors and chunks.
+    
+    The merge runs in the executor on the current data; queries keep using the
+    live index until the compacted one is swapped in.
+    """
+    if state.annoy_index is None or state.bm25_index is None:
+        return False
+    
+    index = state.annoy_index
+    logger.info(f"🗜️  Compacting vector index: {len(index.segments)} base segment(s), "
+                f"{len(index.tombstones):,} tombstones...")
+    loop = asyncio.get_running_loop()
+    compacted_index = await loop.run_in_executor(state.executor, index.compacted, ANNOY_N_TREES)
+    compacted_bm25 = await loop.run_in_executor(state.executor, state.bm25_index.compact)
+    compacted_metadata = await loop.run_in_executor(state.executor, state.chunks_metadata.compacted)
+    
+    async with state.lock:
+        if state.annoy_index is not index:
+            logger.warning("⚠️  Index changed during compaction, keeping the new index")
+            return False
+        
+        old_metadata = state.chunks_metadata
+        old_bm25 = state.bm25_index
+        old_shared_store = state.shared_store
+        state.annoy_index = compacted_index
+        state.chunks_metadata = compacted_metadata
+        state.bm25_index = compacted_bm25
+        state.shared_store = None
+        
+        from .database import save_database
+        if not await save_database():
+            logger.error("Failed to save compacted database, rolling back")
+            state.annoy_index = index
+            state.chunks_metadata = old_metadata
+            state.bm25_index = old_bm25
+            state.shared_store = old_shared_store
+            return False
+        
+        query_cache.invalidate()
+        try:
+            os.utime(VECTOR_DB_PATH, None)
+        except Exception as e:
+            logger.warning(f"Could not touch database file: {e}")
+    
+    await _export_shared_store()
+    logger.info(f"✓ Compaction complete: {compacted_index.get_n_items():,} vectors in one base segment")
+    return True
+
+
+async def _attach_shared_store():
+    """Attach to the shared memory-mapped generation of the database.
+    
+    Returns False if the store is unavailable, so the caller falls back to
+    unpickling the database files.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        manifest = await loop.run_in_executor(state.executor, ensure_shared_store)
+        if manifest is None:
+            return False
+        
+        # Same generation already attached in this process: nothing to do
+        if (state.shared_store is not None and state.annoy_index is not None
+                and state.shared_store.generation == manifest['generation']):
+            logger.info(f"✓ Shared store generation {manifest['generation']} already attached")
+            return True
+        
+        store = await loop.run_in_executor(state.executor, SharedStore.open_current)
+        if store is None:
+            return False
+        annoy_index = await SegmentedIndex.attach_shared(VECTOR_DB_PATH, store, state.executor)
+        
+        async with state.lock:
+            state.annoy_index = annoy_index
+            state.chunks_metadata = store.chunks_metadata
+            state.bm25_index = store.bm25_index
+            state.shared_store = store
+            state.last_db_modified_time = store.manifest['source_mtime']
+        
+        logger.info(f"✓ Attached to shared store generation {store.generation} (zero-copy):")
+        logger.info(f"  - {store.num_chunks:,} chunks ({store.num_items:,} vectors incl. tombstoned)")
+        if store.bm25_index is not None:
+            logger.info(f"  - BM25 postings for {store.bm25_index.get_num_docs():,} documents")
+        else:
+            logger.warning("⚠️  BM25 index not found - hybrid search will be disabled")
+        logger.info(f"📊 Database timestamp recorded: {state.last_db_modified_time}")
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️  Could not attach shared store, loading database files instead: {e}")
+        return False
+
+
 async def load_vector_database(skip_build_if_missing=False):
     """Load the vector database if it exists.
     
@@ -306,33 +435,50 @@ async def load_vector_database(skip_build_if_missing=False):
         logger.info("=" * 60)
         
         db_exists = await aiofiles.os.path.exists(VECTOR_DB_PATH)
-        meta_exists = await aiofiles.os.path.exists(METADATA_PATH)
+        meta_exists = chunk_store_exists()
         
         logger.info(f"Vector DB file exists: {db_exists} ({VECTOR_DB_PATH})")
-        logger.info(f"Metadata file exists: {meta_exists} ({METADATA_PATH})")
+        logger.info(f"Chunk store exists: {meta_exists} ({METADATA_PATH})")
         
         if db_exists and meta_exists:
             logger.info("✓ Found existing database - loading...")
             
+            # Job processes share one mmap generation instead of unpickling their own copy.
+            # The (memory-mapped) embeddings cache is attached afterwards by initialize_rag.
+            if SHARED_STORE_ENABLED and await _attach_shared_store():
+                state.rag_enabled = True
+                logger.info("=" * 60)
+                logger.info("RAG DATABASE READY FOR QUERIES")
+                logger.info("=" * 60)
+                return True
+            
             # Record modification time for hot-reloading (use integer for robust comparison)
             stat = os.stat(VECTOR_DB_PATH)
-            state.last_db_modified_time = int(stat.st_mtime)
-            logger.info(f"📊 Database timestamp recorded: {state.last_db_modified_time}")
+            source_mtime = int(stat.st_mtime)
             
-            state.annoy_index = await EnhancedAnnoyIndex.load_async(VECTOR_DB_PATH, state.executor)
-            async with aiofiles.open(METADATA_PATH, "rb") as f:
-                state.chunks_metadata = pickle.loads(await f.read())
+            annoy_index = await SegmentedIndex.load_async(VECTOR_DB_PATH, state.executor)
+            # Memory-mapped: records are decoded on access, nothing is read up front
+            chunks_metadata = await asyncio.get_running_loop().run_in_executor(state.executor, ChunkStore.open)
             
             # Load BM25 index if it exists
+            bm25_index = None
             if await aiofiles.os.path.exists(BM25_INDEX_PATH):
                 async with aiofiles.open(BM25_INDEX_PATH, "rb") as f:
-                    state.bm25_index = pickle.loads(await f.read())
-                logger.info(f"✓ Loaded BM25 index with {state.bm25_index.get_num_docs()} documents")
+                    bm25_index = pickle.loads(await f.read())
+                logger.info(f"✓ Loaded BM25 index with {bm25_index.get_num_docs()} documents")
             else:
                 logger.warning("⚠️  BM25 index not found - hybrid search will be disabled")
-                state.bm25_index = None
             
-            num_vectors = state.annoy_index.index.get_n_items()
+            # Swap in the loaded generation in one step: queries during a reload keep using the old one
+            async with state.lock:
+                state.annoy_index = annoy_index
+                state.chunks_metadata = chunks_metadata
+                state.bm25_index = bm25_index
+                state.shared_store = None
+                state.last_db_modified_time = source_mtime
+            logger.info(f"📊 Database timestamp recorded: {state.last_db_modified_time}")
+            
+            num_vectors = state.annoy_index.num_live_items()
             num_chunks = len(state.chunks_metadata)
             logger.info(f"✓ Successfully loaded vector database:")
             logger.info(f"  - {num_vectors:,} vectors in index")
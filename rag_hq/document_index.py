@@ -0,0 +1,192 @@
+"""
+Sentence-boundary index for context expansion.
+
+Context expansion used to load the whole document text (through a 5-entry
+LRU) and scan it with rfind/find for punctuation on every retrieved chunk.
+Instead, each stored document text gets a small sidecar written at ingestion:
+
+    DOCUMENT_TEXTS_DIR/<safe name>              document text (UTF-8, unchanged)
+    DOCUMENT_TEXTS_DIR/<safe name>.bounds.npz   delimiter positions (char offsets),
+                                                char -> byte checkpoints, char length
+
+Expansion is then a few bisects over the delimiter positions plus two small
+slices of the memory-mapped text. Documents ingested before the sidecar existed
+(or with an older sidecar format) get it built on first use.
+"""
+import os
+import re
+import mmap
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .config import DOCUMENT_TEXTS_DIR, DOCUMENT_INDEX_CACHE_MAX_SIZE
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+# Delimiters the rfind/find expansion looked for, in its order of preference
+DELIMITERS = ('. ', '? ', '! ', '\n\n', '\n')
+CHECKPOINT_CHARS = 1024  # One char -> byte checkpoint per this many characters
+INDEX_SUFFIX = ".bounds.npz"
+INDEX_FORMAT_VERSION = 2
+
+
+def document_text_path(filename):
+    """Path of the stored text for a document (same naming as save_document_text)."""
+    safe_filename = filename.replace('/', '_').replace('\\', '_')
+    return os.path.join(DOCUMENT_TEXTS_DIR, safe_filename)
+
+
+def build_document_index(text):
+    """Boundary arrays for a document text.
+
+    positions[position_offsets[k]:position_offsets[k + 1]]: sorted offsets of every
+        occurrence of DELIMITERS[k] (overlapping ones included, as str.find sees them)
+    checkpoints[j]: byte offset of character j * CHECKPOINT_CHARS in the UTF-8 text (up to len(text))
+    """
+    per_delimiter = [[m.start() for m in re.finditer(f"(?={re.escape(d)})", text)] for d in DELIMITERS]
+    position_offsets = np.cumsum([0] + [len(positions) for positions in per_delimiter])
+
+    checkpoints = [0]
+    for pos in range(CHECKPOINT_CHARS, len(text) + 1, CHECKPOINT_CHARS):
+        checkpoints.append(checkpoints[-1] + len(text[pos - CHECKPOINT_CHARS:pos].encode('utf-8')))
+    return {
+        'format_version': np.array(INDEX_FORMAT_VERSION, dtype=np.int64),
+        'positions': np.array([p for positions in per_delimiter for p in positions], dtype=np.int64),
+        'position_offsets': position_offsets.astype(np.int64),
+        'checkpoints': np.array(checkpoints, dtype=np.int64),
+        'length': np.array(len(text), dtype=np.int64),
+    }
+
+
+def save_document_index(filename, text):
+    """Write the boundary sidecar for a document text (blocking)."""
+    path = document_text_path(filename) + INDEX_SUFFIX
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **build_document_index(text))
+    os.replace(tmp_path, path)
+    with _cache_lock:
+        _open_indexes.pop(filename, None)
+
+
+class DocumentIndex:
+    """A document text with its sentence boundaries; sliced by character offset."""
+
+    def __init__(self, arrays, text=None, text_path=None):
+        offsets = arrays['position_offsets']
+        positions = arrays['positions']
+        # One sorted list per delimiter, in DELIMITERS order
+        self.positions = [positions[offsets[k]:offsets[k + 1]].tolist() for k in range(len(DELIMITERS))]
+        self.checkpoints = arrays['checkpoints']
+        self.length = int(arrays['length'])
+        self._text = text  # In-memory text (fallback when there is no stored file)
+        self._map = None
+        if text is None:
+            with open(text_path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(build_document_index(text), text=text)
+
+    def __len__(self):
+        return self.length
+
+    def _byte_offset(self, pos):
+        """Byte offset of character `pos`: checkpoint plus at most CHECKPOINT_CHARS decoded chars."""
+        checkpoint = pos // CHECKPOINT_CHARS
+        byte_pos = int(self.checkpoints[checkpoint])
+        remainder = pos - checkpoint * CHECKPOINT_CHARS
+        if remainder:
+            window = self._map[byte_pos:byte_pos + 4 * remainder].decode('utf-8', errors='ignore')
+            byte_pos += len(window[:remainder].encode('utf-8'))
+        return byte_pos
+
+    def slice(self, start, end):
+        """Text between character offsets [start, end)."""
+        start, end = max(0, start), min(self.length, end)
+        if start >= end:
+            return ""
+        if self._text is not None:
+            return self._text[start:end]
+        return self._map[self._byte_offset(start):self._byte_offset(end)].decode('utf-8', errors='ignore')
+
+    def expansion_bounds(self, char_start, char_end, expansion_chars):
+        """Expand [char_start, char_end) by up to expansion_chars, snapped to sentence boundaries.
+
+        Same result as the rfind/find scan: the first delimiter (in DELIMITERS order)
+        found inside the window wins, at its occurrence nearest to the chunk.
+        """
+        expanded_start = max(0, char_start - expansion_chars)
+        expanded_end = min(self.length, char_end + expansion_chars)
+
+        # Last delimiter lying wholly in [expanded_start, char_start)
+        if expanded_start > 0:
+            for delimiter, positions in zip(DELIMITERS, self.positions):
+                i = bisect.bisect_right(positions, char_start - len(delimiter)) - 1
+                if i >= 0 and positions[i] >= expanded_start:
+                    expanded_start = positions[i] + len(delimiter)
+                    break
+
+        # First delimiter lying wholly in [char_end, expanded_end)
+        if expanded_end < self.length:
+            for delimiter, positions in zip(DELIMITERS, self.positions):
+                i = bisect.bisect_left(positions, char_end)
+                if i < len(positions) and positions[i] + len(delimiter) <= expanded_end:
+                    expanded_end = positions[i] + len(delimiter.rstrip())
+                    break
+
+        return expanded_start, expanded_end
+
+
+_open_indexes = OrderedDict()  # filename -> (index mtime, DocumentIndex)
+_cache_lock = threading.Lock()
+
+
+def get_document_index(filename):
+    """Open (or build) the boundary index of a stored document (blocking).
+
+    Returns None if the document text is not on disk.
+    """
+    text_path = document_text_path(filename)
+    index_path = text_path + INDEX_SUFFIX
+    try:
+        text_mtime = os.stat(text_path).st_mtime
+    except OSError:
+        return None
+
+    try:
+        index_mtime = os.stat(index_path).st_mtime
+    except OSError:
+        index_mtime = None
+
+    with _cache_lock:
+        cached = _open_indexes.get(filename)
+        if cached is not None and cached[0] == index_mtime:
+            _open_indexes.move_to_end(filename)
+            return cached[1]
+
+    index = None
+    if index_mtime is not None and index_mtime >= text_mtime:
+        with np.load(index_path) as arrays:
+            if 'format_version' in arrays.files and int(arrays['format_version']) == INDEX_FORMAT_VERSION:
+                index = DocumentIndex(arrays, text_path=text_path)
+
+    if index is None:
+        # Ingested before sidecars existed (text rewritten, older sidecar format): build it once
+        with open(text_path, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+            save_document_index(filename, f.read())
+        index_mtime = os.stat(index_path).st_mtime
+        logger.debug(f"Built sentence-boundary index for {filename}")
+        with np.load(index_path) as arrays:
+            index = DocumentIndex(arrays, text_path=text_path)
+
+    with _cache_lock:
+        _open_indexes[filename] = (index_mtime, index)
+        _open_indexes.move_to_end(filename)
+        while len(_open_indexes) > DOCUMENT_INDEX_CACHE_MAX_SIZE:
+            _open_indexes.popitem(last=False)
+    return index
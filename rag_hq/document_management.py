@@ -5,28 +5,25 @@ import time
 import json
 import pickle
 import logging
-import asyncio
 import aiofiles
 import aiofiles.os
-from groq import Groq
+from groq import RateLimitError, APIConnectionError, InternalServerError
 from typing import Dict, Any
 
-from .config import DOCUMENT_SUMMARIES_PATH, INGESTION_RAPPORT_PATH, GROQ_API_KEY
+from .config import DOCUMENT_SUMMARIES_PATH, INGESTION_RAPPORT_PATH
 from .state import state
+from .llm_client import get_llm_pool
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
 
-async def call_openai_groq_api(input_message: str, retry_count=3, extended=False) -> Dict[str, Any]:
-    """Call Groq API to summarize document and extract keywords with retry logic.
+def _summary_request(input_message: str, retry_count=3, extended=False) -> Dict[str, Any]:
+    """LLMPool.chat() keyword arguments that summarize a document and extract keywords.
     
     Args:
         input_message: Document text to summarize
         retry_count: Number of retries on failure (default: 3)
         extended: If True, generate extended summary (400 tokens, hard limit 410) instead of short (2-3 sentences)
-    
-    Returns:
-        Dict with 'summary' and 'keywords' keys
     """
     if extended:
         prompt = (
@@ -73,78 +70,58 @@ async def call_openai_groq_api(input_message: str, retry_count=3, extended=False
         )
         max_tokens = 400
 
-    client = Groq(api_key=GROQ_API_KEY)
-    
-    summary_type = "extended" if extended else "short"
-    
-    for attempt in range(retry_count + 1):
-        start_time = time.perf_counter()
-        try:
-            completion = client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[{"role": "user", "content": prompt + "\n" + input_message}],
-                temperature=0.3,
-                max_tokens=max_tokens,
-                top_p=1,
-                stream=False,
-                stop=None,
-            )
-            inference_time = (time.perf_counter() - start_time) * 1000
-            logger.info(f"Groq {summary_type} summary generated in {inference_time:.2f} ms")
-
-            if completion.choices:
-                response_text = completion.choices[0].message.content.strip()
-                try:
-                    result = json.loads(response_text)
-                    return result
-                except json.JSONDecodeError:
-                    return {
-                        "summary": response_text,
-                        "keywords": []
-                    }
-            else:
-                return {"summary": "Unable to generate summary", "keywords": []}
-                
-        except Exception as e:
-            error_msg = str(e).lower()
-            
-            # Check for rate limit errors
-            if "rate_limit" in error_msg or "429" in error_msg:
-                if attempt < retry_count:
-                    wait_time = (2 ** attempt) * 2  # Exponential backoff: 2s, 4s, 8s
-                    logger.warning(f"⚠️  Groq rate limit hit, waiting {wait_time}s before retry {attempt+1}/{retry_count}")
-                    await asyncio.sleep(wait_time)
-                    continue
-                else:
-                    logger.error(f"✗ Groq rate limit exceeded after {retry_count} retries")
-                    return {"summary": "Rate limit exceeded", "keywords": []}
-            
-            # Check for other retryable errors
-            elif any(err in error_msg for err in ["timeout", "connection", "temporarily unavailable"]):
-                if attempt < retry_count:
-                    wait_time = (2 ** attempt)  # Exponential backoff: 1s, 2s, 4s
-                    logger.warning(f"⚠️  Groq API error (retryable), waiting {wait_time}s before retry {attempt+1}/{retry_count}: {e}")
-                    await asyncio.sleep(wait_time)
-                    continue
-                else:
-                    logger.error(f"✗ Groq API failed after {retry_count} retries: {e}")
-                    return {"summary": "API error after retries", "keywords": []}
-            else:
-                # Non-retryable error
-                logger.error(f"✗ Groq API error (non-retryable): {e}")
-                return {"summary": "Error generating summary", "keywords": []}
+    return {
+        'messages': [{"role": "user", "content": prompt + "\n" + input_message}],
+        'model': "llama-3.1-8b-instant",
+        'max_retries': retry_count,
+        'temperature': 0.3,
+        'max_tokens': max_tokens,
+        'top_p': 1,
+        'stop': None,
+    }
+
+
+def _summary_result(response, summary_type: str, start_time: float, retry_count=3) -> Dict[str, Any]:
+    """Parse a summary response (completion text, or the exception the request ended with).
     
-    # Shouldn't reach here, but just in case
-    return {"summary": "Summary generation failed", "keywords": []}
+    Returns:
+        Dict with 'summary' and 'keywords' keys
+    """
+    if isinstance(response, RateLimitError):
+        logger.error(f"✗ Groq rate limit exceeded after {retry_count} retries")
+        return {"summary": "Rate limit exceeded", "keywords": []}
+    if isinstance(response, (APIConnectionError, InternalServerError)):
+        logger.error(f"✗ Groq API failed after {retry_count} retries: {response}")
+        return {"summary": "API error after retries", "keywords": []}
+    if isinstance(response, Exception):
+        # Non-retryable error
+        logger.error(f"✗ Groq API error (non-retryable): {response}")
+        return {"summary": "Error generating summary", "keywords": []}
+    
+    inference_time = (time.perf_counter() - start_time) * 1000
+    logger.info(f"Groq {summary_type} summary generated in {inference_time:.2f} ms")
+    
+    response_text = (response or "").strip()
+    if not response_text:
+        return {"summary": "Unable to generate summary", "keywords": []}
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        return {
+            "summary": response_text,
+            "keywords": []
+        }
 
 
-async def generate_document_summary(filename: str, text: str, respect_rate_limit=True) -> Dict[str, Any]:
+async def generate_document_summary(filename: str, text: str) -> Dict[str, Any]:
     """Generate BOTH short and extended summaries for a document if not already exists.
     
+    Both requests run on the shared async LLM pool (llm_client.py), which bounds
+    concurrency and backs off on rate limits, so summaries overlap with embedding work.
+    
     Args:
         filename: Name of the document
         text: Full text of the document
-        respect_rate_limit: If True, adds small delay to avoid rate limits (default: True)
     
     Returns:
         Dict with 'summary', 'extended_summary', and 'keywords' keys
@@ -161,23 +138,23 @@ async def generate_document_summary(filename: str, text: str, respect_rate_limit
     
     logger.info(f"📝 Generating summaries for {filename}...")
     
-    # Generate SHORT summary (2-3 sentences, for quick RAG context)
+    # SHORT summary (2-3 sentences, for quick RAG context) and EXTENDED summary
+    # (max 400 tokens, for document selection in extensive search) run concurrently;
+    # each is parsed as soon as its response arrives
     text_for_short_summary = text[:3000] if len(text) > 3000 else text
     
-    if respect_rate_limit:
-        await asyncio.sleep(0.5)  # 500ms delay
-    
-    short_summary_data = await call_openai_groq_api(text_for_short_summary, extended=False)
-    
-    # Generate EXTENDED summary (max 400 tokens, for document selection in extensive search)
-    # Use more text for extended summary
     from .config import EXTENSIVE_SEARCH_SUMMARY_CHARS
     text_for_extended_summary = text[:EXTENSIVE_SEARCH_SUMMARY_CHARS] if len(text) > EXTENSIVE_SEARCH_SUMMARY_CHARS else text
     
-    if respect_rate_limit:
-        await asyncio.sleep(0.5)  # 500ms delay
-    
-    extended_summary_data = await call_openai_groq_api(text_for_extended_summary, extended=True)
+    requests = [
+        ("short", _summary_request(text_for_short_summary, extended=False)),
+        ("extended", _summary_request(text_for_extended_summary, extended=True)),
+    ]
+    start_time = time.perf_counter()
+    results = {}
+    async for summary_type, response in get_llm_pool().as_completed(requests):
+        results[summary_type] = _summary_result(response, summary_type, start_time)
+    short_summary_data, extended_summary_data = results["short"], results["extended"]
     
     # Combine both summaries into one entry
     summary_data = {
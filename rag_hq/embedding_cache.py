@@ -0,0 +1,280 @@
+"""
+Persistent embeddings cache: content-addressed, memory-mapped, bounded.
+
+The cache used to be a dict of every embedding, pickled through np.save on
+every CACHE_SAVE_THRESHOLD inserts, copied to a backup on every startup and
+never bounded. EmbeddingCache keeps the dict-style interface
+(get / in / [] / len) on top of fixed-width files:
+
+Layout (EMBEDDINGS_CACHE_DIR/, one generation <g> at a time):
+    manifest.json       generation, committed row count, clock hand (written last)
+    keys.<g>.bin        16-byte md5 digests, one per row
+    vectors.<g>.bin     float16 [rows, VECTOR_DIM]
+    refs.<g>.bin        one reference byte per row (clock), shared by all processes
+
+Lookups binary-search the key column and read one vector row from the map, so
+a process only pays for the rows it touches. New entries are buffered and
+appended under an inter-process lock; rows past the committed count (an
+interrupted flush) are truncated by the next flush. When the cache would exceed
+EMBEDDINGS_CACHE_MAX_ENTRIES, a clock sweep evicts the least recently used rows
+and the survivors are written as a new generation before the manifest is
+swapped, so a crash leaves either the old or the new generation intact.
+"""
+import os
+import json
+import time
+import fcntl
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from .config import (
+    VECTOR_DIM, USE_FP16_EMBEDDINGS, EMBEDDINGS_CACHE_DIR, EMBEDDINGS_CACHE_PATH,
+    EMBEDDINGS_CACHE_MAX_ENTRIES, EMBEDDINGS_CACHE_EVICT_FRACTION
+)
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+MANIFEST_NAME = "manifest.json"
+KEY_DTYPE = np.dtype('S16')
+COMPACT_BLOCK_ROWS = 8192
+
+
+def _digest(key):
+    """Raw 16-byte digest of an md5 hex cache key."""
+    return np.array([bytes.fromhex(key)], dtype=KEY_DTYPE)[0]
+
+
+def _clock_victims(refs, hand, count):
+    """Pick `count` rows to evict with a clock sweep starting at `hand`.
+
+    Referenced rows the hand passes get a second chance (their bit is cleared);
+    if fewer than `count` rows are unreferenced, a second lap takes referenced
+    rows in hand order. Returns (victim mask, refs after the sweep, last victim).
+    """
+    n = len(refs)
+    if count <= 0 or n == 0:
+        return np.zeros(n, dtype=bool), refs.copy(), hand
+    order = np.roll(np.arange(n), -hand)
+    referenced = refs[order] != 0
+    unreferenced = order[~referenced]
+
+    new_refs = refs.copy()
+    if len(unreferenced) >= count:
+        victims = unreferenced[:count]
+        passed = order[:int(np.flatnonzero(order == victims[-1])[0]) + 1]
+    else:
+        victims = np.concatenate([unreferenced, order[referenced][:count - len(unreferenced)]])
+        passed = order
+    new_refs[passed] = 0
+
+    mask = np.zeros(n, dtype=bool)
+    mask[victims] = True
+    return mask, new_refs, int(victims[-1]) if len(victims) else hand
+
+
+class EmbeddingCache:
+    """Bounded key -> fp16 vector cache shared by all processes through memory maps."""
+
+    def __init__(self, directory=EMBEDDINGS_CACHE_DIR, capacity=EMBEDDINGS_CACHE_MAX_ENTRIES, dim=VECTOR_DIM):
+        self.directory = directory
+        self.capacity = capacity
+        self.dim = dim
+        self._pending = {}  # hex key -> vector, not yet flushed
+        self._manifest = None
+        self._attach(None)
+
+    @classmethod
+    def open(cls, directory=EMBEDDINGS_CACHE_DIR):
+        """Attach to the committed cache, migrating the legacy .npy dict if needed (blocking)."""
+        os.makedirs(directory, exist_ok=True)
+        cache = cls(directory)
+        manifest = cache._read_manifest()
+        legacy_path = EMBEDDINGS_CACHE_PATH + '.npy'
+        if manifest is None and directory == EMBEDDINGS_CACHE_DIR and os.path.exists(legacy_path):
+            cache._migrate_legacy(legacy_path)
+        else:
+            cache._attach(manifest)
+        return cache
+
+    def _migrate_legacy(self, legacy_path):
+        try:
+            data = np.load(legacy_path, allow_pickle=True).item()
+            keys = list(data.get('keys', []))[-self.capacity:]
+            values = list(data.get('values', []))[-self.capacity:]
+            self._pending.update(zip(keys, values))
+            self.flush()
+            logger.info(f"✓ Migrated {len(keys):,} embeddings from {legacy_path} to the mapped cache")
+        except Exception as e:
+            logger.error(f"Error migrating legacy embeddings cache (starting empty): {e}")
+            self._pending.clear()
+
+    # --- Files ---
+
+    def _path(self, name, generation):
+        return os.path.join(self.directory, f"{name}.{generation}.bin")
+
+    @contextmanager
+    def _lock(self):
+        """Inter-process lock: one writer appends or compacts at a time."""
+        with open(os.path.join(self.directory, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _attach(self, manifest):
+        """Map the committed rows of a manifest (None: empty cache)."""
+        self._manifest = manifest
+        rows = manifest['rows'] if manifest else 0
+        if rows == 0:
+            self.keys = np.zeros(0, dtype=KEY_DTYPE)
+            self.vectors = np.zeros((0, self.dim), dtype=np.float16)
+            self.refs = np.zeros(0, dtype=np.uint8)
+        else:
+            generation = manifest['generation']
+            self.keys = np.memmap(self._path('keys', generation), dtype=KEY_DTYPE, mode='r', shape=(rows,))
+            self.vectors = np.memmap(self._path('vectors', generation), dtype=np.float16, mode='r', shape=(rows, self.dim))
+            # Reference bits are written by every process on hits; races only lose a hint
+            self.refs = np.memmap(self._path('refs', generation), dtype=np.uint8, mode='r+', shape=(rows,))
+        # Sorted view of the small key column for binary search
+        self._order = np.argsort(self.keys, kind='stable')
+        self._sorted_keys = self.keys[self._order]
+
+    # --- Mapping interface ---
+
+    def _row(self, key):
+        if len(self._sorted_keys) == 0:
+            return None
+        probe = _digest(key)
+        pos = int(np.searchsorted(self._sorted_keys, probe))
+        if pos < len(self._sorted_keys) and self._sorted_keys[pos] == probe:
+            return int(self._order[pos])
+        return None
+
+    def get(self, key, default=None):
+        vector = self._pending.get(key)
+        if vector is not None:
+            return vector
+        row = self._row(key)
+        if row is None:
+            return default
+        self.refs[row] = 1
+        vector = np.array(self.vectors[row])
+        return vector if USE_FP16_EMBEDDINGS else vector.astype(np.float32)
+
+    def __getitem__(self, key):
+        vector = self.get(key)
+        if vector is None:
+            raise KeyError(key)
+        return vector
+
+    def __contains__(self, key):
+        return key in self._pending or self._row(key) is not None
+
+    def __setitem__(self, key, vector):
+        self._pending[key] = vector
+
+    def __len__(self):
+        return len(self.keys) + len(self._pending)
+
+    @property
+    def nbytes(self):
+        """Bytes of cached vectors: the mapped rows plus unflushed entries."""
+        return self.vectors.nbytes + sum(np.asarray(v).nbytes for v in self._pending.values())
+
+    # --- Writing ---
+
+    def flush(self):
+        """Append buffered entries, evicting with the clock when over capacity (blocking).
+
+        Without buffered entries this only re-attaches if another process committed.
+        Returns the number of rows appended.
+        """
+        if not self._pending:
+            manifest = self._read_manifest()
+            if manifest != self._manifest and manifest is not None:
+                self._attach(manifest)
+            return 0
+
+        with self._lock():
+            manifest = self._read_manifest()
+            if manifest != self._manifest:
+                self._attach(manifest)
+            if manifest is None:
+                manifest = {'generation': time.time_ns(), 'rows': 0, 'hand': 0}
+
+            new_items = [(k, v) for k, v in self._pending.items() if self._row(k) is None][-self.capacity:]
+            if manifest['rows'] + len(new_items) > self.capacity:
+                keep = max(0, int(self.capacity * (1 - EMBEDDINGS_CACHE_EVICT_FRACTION)) - len(new_items))
+                manifest = self._compact(manifest, keep)
+
+            if new_items:
+                keys = np.array([bytes.fromhex(k) for k, _ in new_items], dtype=KEY_DTYPE)
+                vectors = np.stack([np.asarray(v, dtype=np.float16) for _, v in new_items])
+                self._append(manifest, keys, vectors, np.ones(len(new_items), dtype=np.uint8))
+                manifest = dict(manifest, rows=manifest['rows'] + len(new_items))
+                self._write_manifest(manifest)
+                self._attach(manifest)
+
+        self._pending.clear()
+        return len(new_items)
+
+    def _append(self, manifest, keys, vectors, refs):
+        rows = manifest['rows']
+        generation = manifest['generation']
+        for name, blob, row_bytes in (('keys', keys, KEY_DTYPE.itemsize),
+                                      ('vectors', vectors, self.dim * 2),
+                                      ('refs', refs, 1)):
+            with open(self._path(name, generation), 'ab') as f:
+                f.truncate(rows * row_bytes)  # Drop rows of an interrupted flush
+                f.write(blob.tobytes())
+
+    def _compact(self, manifest, keep):
+        """Evict down to `keep` rows and write the survivors as a new generation."""
+        rows = manifest['rows']
+        victims, refs, last_victim = _clock_victims(np.asarray(self.refs), manifest.get('hand', 0) % max(rows, 1), rows - keep)
+        survivors = np.flatnonzero(~victims)
+
+        new_manifest = {
+            'generation': time.time_ns(),
+            'rows': 0,
+            # The hand continues just after the last victim
+            'hand': int(np.searchsorted(survivors, last_victim)) % max(len(survivors), 1),
+        }
+        # Copy survivors in blocks so compaction never holds the whole cache in memory
+        for start in range(0, len(survivors), COMPACT_BLOCK_ROWS):
+            block = survivors[start:start + COMPACT_BLOCK_ROWS]
+            self._append(new_manifest, self.keys[block], np.asarray(self.vectors[block]), refs[block])
+            new_manifest['rows'] += len(block)
+        self._write_manifest(new_manifest)
+        logger.info(f"🗜️  Embeddings cache compacted: evicted {rows - len(survivors):,}, kept {len(survivors):,}")
+
+        self._attach(new_manifest)
+        self._remove_other_generations(new_manifest['generation'])
+        return new_manifest
+
+    def _remove_other_generations(self, generation):
+        # Processes still attached to an old generation keep their open maps
+        suffix = f".{generation}.bin"
+        for name in os.listdir(self.directory):
+            if name.endswith(".bin") and not name.endswith(suffix):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
@@ -12,23 +12,19 @@ from functools import lru_cache
 
 from .config import (
     LLAMA_SERVER_URL, VECTOR_DIM, USE_FP16_EMBEDDINGS,
-    MAX_EMBEDDING_SIZE_CHARS, MAX_EMBEDDING_TOKENS, EMBEDDINGS_CACHE_PATH,
-    CACHE_SAVE_THRESHOLD, CACHE_SAVE_INTERVAL
+    MAX_EMBEDDING_SIZE_CHARS, MAX_EMBEDDING_TOKENS,
+    CACHE_SAVE_THRESHOLD, CACHE_SAVE_INTERVAL, EMBEDDING_BATCH_TOKEN_BUDGET,
+    EMBEDDING_BATCH_MAX_ITEMS, EMBEDDING_COALESCING_ENABLED, EMBEDDING_COALESCE_WINDOW_MS
 )
 from .state import state
+from .embedding_cache import EmbeddingCache
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
-# Import token counter
-import tiktoken
-_encoding = None
+from .token_counter import count_tokens, truncate_tokens
 
-def get_token_count(text: str) -> int:
-    """Count actual tokens using tiktoken."""
-    global _encoding
-    if _encoding is None:
-        _encoding = tiktoken.get_encoding("cl100k_base")
-    return len(_encoding.encode(text))
+# Tokens cut below MAX_EMBEDDING_TOKENS when truncating (the server's tokenizer differs)
+EMBEDDING_TRUNCATION_MARGIN = 10
 
 # Cache tracking
 _cache_last_save_time = 0
@@ -43,8 +39,6 @@ def _embedding_cache_key(text):
 
 async def get_http_session():
     """Get or create the HTTP session with optimized settings."""
-    import os
-    
     current_pid = os.getpid()
     
     # Check if session needs to be created/recreated
@@ -117,7 +111,6 @@ async def get_http_session():
 
 async def close_http_session():
     """Close the HTTP session."""
-    import os
     current_pid = os.getpid()
     
     # Only try to close if this session belongs to current process
@@ -156,182 +149,426 @@ async def _reset_http_session(reason: str):
         state.http_session_pid = None
 
 
-async def create_embeddings(input_text, is_query=False):
-    """Create embeddings using async HTTP request with performance optimizations."""
-    start_time = time.perf_counter()
+def _zero_embedding():
+    """Return the empty vector used to signal a failed/empty embedding."""
+    return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
+
+
+def _prepare_embedding_text(input_text):
+    """Truncate text to the embedding token limit.
     
-    if not input_text or not input_text.strip():
-        return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
+    The text is encoded once and, if too long, cut at a token boundary.
     
-    # Ensure semaphores are valid for current process
-    state.ensure_locks()
+    Returns:
+        (text, token_count) tuple
+    """
+    token_count = count_tokens(input_text)
+    if token_count <= MAX_EMBEDDING_TOKENS:
+        return input_text, token_count
     
-    # Use different semaphores based on context
-    semaphore = state.query_semaphore if is_query else state.embedding_semaphore
+    input_text, new_count = truncate_tokens(input_text, MAX_EMBEDDING_TOKENS - EMBEDDING_TRUNCATION_MARGIN)
+    logger.debug(f"Pre-truncation: {token_count} -> {new_count} tokens (limit {MAX_EMBEDDING_TOKENS})")
+    return input_text, new_count
+
+
+def _vector_from_embedding_data(embedding_data):
+    """Convert a llama-server embedding payload into a normalized vector (or None)."""
+    if not isinstance(embedding_data, list) or len(embedding_data) == 0:
+        logger.error(f"Unexpected embedding format: {type(embedding_data)}")
+        return None
     
-    async with semaphore:
-        # Token-based truncation with retry
-        token_count = get_token_count(input_text)
-        
-        # Truncate if needed (with retries for edge cases)
-        # Server limit tested at 418 tokens, config uses 410 for safety
-        max_attempts = 3
-        for truncate_attempt in range(max_attempts):
-            if token_count <= MAX_EMBEDDING_TOKENS:
-                break
+    if isinstance(embedding_data[0], list):
+        embedding = np.array(embedding_data[0], dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
+    else:
+        embedding = np.array(embedding_data, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
+    
+    # Verify dimension
+    if len(embedding) != VECTOR_DIM:
+        logger.warning(f"Embedding dimension mismatch: expected {VECTOR_DIM}, got {len(embedding)}")
+        if len(embedding) > VECTOR_DIM:
+            embedding = embedding[:VECTOR_DIM]
+        else:
+            embedding = np.pad(embedding, (0, VECTOR_DIM - len(embedding)), 'constant')
+    
+    # Normalize for cosine similarity
+    norm = np.linalg.norm(embedding)
+    if norm > 0:
+        embedding = embedding / norm
+    
+    return embedding
+
+
+async def _fetch_single_embedding(input_text, token_count):
+    """Request one embedding from llama-server with retries.
+    
+    Caller must hold the appropriate semaphore. Returns a zero vector on failure.
+    """
+    # Retry mechanism for server errors
+    max_retries = 2
+    retry_delay = 0.25
+    
+    for attempt in range(max_retries + 1):
+        try:
+            session = await get_http_session()
             
-            # Calculate truncation ratio with safety margin
-            truncate_ratio = (MAX_EMBEDDING_TOKENS - 10) / token_count  # -10 for safety margin
-            new_length = int(len(input_text) * truncate_ratio)
-            input_text = input_text[:new_length]
-            token_count = get_token_count(input_text)
+            logger.debug(f"Sending {len(input_text)} chars (~{token_count} tokens) to embedding server")
             
-            if truncate_attempt == 0:
-                logger.debug(f"Pre-truncation: {token_count} -> target {MAX_EMBEDDING_TOKENS} tokens")
-        
-        if token_count > MAX_EMBEDDING_TOKENS:
-            logger.warning(f"⚠️  Failed to truncate to {MAX_EMBEDDING_TOKENS} tokens after {max_attempts} attempts, attempting with {token_count} tokens")
-        
-        # Check cache first
-        cache_key = _embedding_cache_key(input_text)
-        if cache_key in state.embeddings_cache:
-            elapsed = (time.perf_counter() - start_time) * 1000
-            logger.debug(f"Embedding cache hit: {elapsed:.2f}ms")
-            return state.embeddings_cache[cache_key]
-        
-        # Retry mechanism for server errors
-        max_retries = 2
-        retry_delay = 0.25
-        
-        for attempt in range(max_retries + 1):
-            try:
-                session = await get_http_session()
-                
-                logger.debug(f"Sending {len(input_text)} chars (~{token_count} tokens) to embedding server")
-                
-                async with session.post(
-                    LLAMA_SERVER_URL,
-                    json={"content": input_text, "embedding": True},
-                    timeout=10.0
-                ) as response:
-                    if response.status != 200:
-                        text = await response.text()
-                        if "input is too large" in text.lower() or "input is larger" in text.lower():
-                            # Server rejected - truncate more aggressively and retry
-                            if attempt < max_retries:
-                                old_count = token_count
-                                input_text = input_text[:int(len(input_text) * 0.85)]
-                                token_count = get_token_count(input_text)
-                                logger.warning(f"❌ Server rejected {old_count} tokens - retrying with {token_count} tokens (attempt {attempt+2}/{max_retries+1})")
-                                await asyncio.sleep(retry_delay)
-                                continue
-                            else:
-                                logger.error(f"❌ EMBEDDING FAILED: Server rejected input after {max_retries+1} attempts (final: {token_count} tokens, {len(input_text)} chars)")
-                                logger.error(f"   Text preview: {input_text[:100]}...")
-                                return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
-                        logger.error(f"Error from llama-server: {response.status} - {text}")
+            async with session.post(
+                LLAMA_SERVER_URL,
+                json={"content": input_text, "embedding": True},
+                timeout=10.0
+            ) as response:
+                if response.status != 200:
+                    text = await response.text()
+                    if "input is too large" in text.lower() or "input is larger" in text.lower():
+                        # Server rejected - truncate more aggressively and retry
                         if attempt < max_retries:
+                            old_count = token_count
+                            input_text, token_count = truncate_tokens(input_text, int(token_count * 0.85))
+                            logger.warning(f"❌ Server rejected {old_count} tokens - retrying with {token_count} tokens (attempt {attempt+2}/{max_retries+1})")
                             await asyncio.sleep(retry_delay)
                             continue
-                        return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
-                    
-                    data = await response.json()
-                    
-                    # Parse the response
-                    if isinstance(data, list) and len(data) > 0:
-                        embedding_data = data[0].get("embedding", [])
-                        
-                        if isinstance(embedding_data, list) and len(embedding_data) > 0:
-                            if isinstance(embedding_data[0], list):
-                                embedding = np.array(embedding_data[0], dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
-                            else:
-                                embedding = np.array(embedding_data, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
-                        else:
-                            logger.error(f"Unexpected embedding format: {type(embedding_data)}")
-                            return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
-                    else:
-                        logger.error(f"Unexpected response format: {type(data)}")
-                        return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
-                    
-                    # Verify dimension
-                    if len(embedding) != VECTOR_DIM:
-                        logger.warning(f"Embedding dimension mismatch: expected {VECTOR_DIM}, got {len(embedding)}")
-                        if len(embedding) > VECTOR_DIM:
-                            embedding = embedding[:VECTOR_DIM]
                         else:
-                            embedding = np.pad(embedding, (0, VECTOR_DIM - len(embedding)), 'constant')
-                    
-                    # Normalize for cosine similarity
-                    norm = np.linalg.norm(embedding)
-                    if norm > 0:
-                        embedding = embedding / norm
-                    
-                    # Cache the result
-                    state.embeddings_cache[cache_key] = embedding
-                    
-                    # Save cache periodically
-                    await maybe_save_embeddings_cache()
-                    
-                    elapsed = (time.perf_counter() - start_time) * 1000
-                    logger.debug(f"Embedding server request: {elapsed:.2f}ms, text length: {len(input_text)} chars")
-                    
-                    return embedding
-                
-            except asyncio.TimeoutError:
-                logger.warning(f"Timeout while getting embeddings (attempt {attempt+1}/{max_retries+1})")
-                await _reset_http_session("embedding timeout")
-                if attempt < max_retries:
-                    await asyncio.sleep(retry_delay * (2 ** attempt))
-                else:
-                    return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
-            except RuntimeError as e:
-                if "Event loop is closed" in str(e) or "closed event loop" in str(e).lower():
-                    logger.warning(f"Event loop error detected - forcing HTTP session reset")
-                    await _reset_http_session("event loop closed")
+                            logger.error(f"❌ EMBEDDING FAILED: Server rejected input after {max_retries+1} attempts (final: {token_count} tokens, {len(input_text)} chars)")
+                            logger.error(f"   Text preview: {input_text[:100]}...")
+                            return _zero_embedding()
+                    logger.error(f"Error from llama-server: {response.status} - {text}")
                     if attempt < max_retries:
                         await asyncio.sleep(retry_delay)
                         continue
-                    else:
-                        return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
+                    return _zero_embedding()
+                
+                data = await response.json()
+                
+                # Parse the response
+                if isinstance(data, list) and len(data) > 0:
+                    embedding = _vector_from_embedding_data(data[0].get("embedding", []))
+                    if embedding is None:
+                        return _zero_embedding()
                 else:
-                    logger.error(f"Runtime error creating embeddings: {e}")
-                    await _reset_http_session("runtime error")
-                    return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
-            except Exception as e:
-                logger.error(f"Error creating embeddings from llama-server: {e}")
+                    logger.error(f"Unexpected response format: {type(data)}")
+                    return _zero_embedding()
+                
+                return embedding
+            
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout while getting embeddings (attempt {attempt+1}/{max_retries+1})")
+            await _reset_http_session("embedding timeout")
+            if attempt < max_retries:
+                await asyncio.sleep(retry_delay * (2 ** attempt))
+            else:
+                return _zero_embedding()
+        except RuntimeError as e:
+            if "Event loop is closed" in str(e) or "closed event loop" in str(e).lower():
+                logger.warning(f"Event loop error detected - forcing HTTP session reset")
+                await _reset_http_session("event loop closed")
                 if attempt < max_retries:
-                    await asyncio.sleep(retry_delay * (2 ** attempt))
+                    await asyncio.sleep(retry_delay)
+                    continue
                 else:
-                    return np.zeros(VECTOR_DIM, dtype=np.float16 if USE_FP16_EMBEDDINGS else np.float32)
+                    return _zero_embedding()
+            else:
+                logger.error(f"Runtime error creating embeddings: {e}")
+                await _reset_http_session("runtime error")
+                return _zero_embedding()
+        except Exception as e:
+            logger.error(f"Error creating embeddings from llama-server: {e}")
+            if attempt < max_retries:
+                await asyncio.sleep(retry_delay * (2 ** attempt))
+            else:
+                return _zero_embedding()
 
 
-async def save_embeddings_cache():
-    """Save embeddings cache to disk for faster loading."""
-    try:
-        if state.embeddings_cache:
-            cache_data = {
-                'keys': list(state.embeddings_cache.keys()),
-                'values': np.array(list(state.embeddings_cache.values()))
-            }
+async def _fetch_single_embeddings(texts, token_counts):
+    """Fallback: embed a list of texts one request at a time."""
+    return [await _fetch_single_embedding(text, count) for text, count in zip(texts, token_counts)]
+
+
+async def _fetch_embedding_batch(texts, token_counts):
+    """Request embeddings for several texts in ONE multi-input llama-server call.
+    
+    Caller must hold the appropriate semaphore and keep the batch within
+    EMBEDDING_BATCH_TOKEN_BUDGET. Falls back to single requests when the server
+    rejects the batch, so callers always get one vector per input text.
+    """
+    if len(texts) == 1:
+        return [await _fetch_single_embedding(texts[0], token_counts[0])]
+    
+    max_retries = 2
+    retry_delay = 0.25
+    
+    for attempt in range(max_retries + 1):
+        try:
+            session = await get_http_session()
+            
+            logger.debug(f"Sending batch of {len(texts)} texts (~{sum(token_counts)} tokens) to embedding server")
+            
+            async with session.post(
+                LLAMA_SERVER_URL,
+                json={"content": texts, "embedding": True},
+                timeout=10.0
+            ) as response:
+                if response.status != 200:
+                    text = await response.text()
+                    logger.warning(f"Batch embedding rejected ({response.status}): {text[:200]} - falling back to single requests")
+                    return await _fetch_single_embeddings(texts, token_counts)
+                
+                data = await response.json()
+            
+            if not isinstance(data, list) or len(data) != len(texts):
+                logger.warning(f"Unexpected batch response ({type(data)}), falling back to single requests")
+                return await _fetch_single_embeddings(texts, token_counts)
+            
+            # Results carry an "index" field; don't rely on response ordering
+            vectors = [None] * len(texts)
+            for position, item in enumerate(data):
+                idx = item.get("index", position) if isinstance(item, dict) else position
+                if isinstance(item, dict) and 0 <= idx < len(texts):
+                    vectors[idx] = _vector_from_embedding_data(item.get("embedding", []))
+            
+            return [v if v is not None else _zero_embedding() for v in vectors]
+        
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout while getting batch embeddings (attempt {attempt+1}/{max_retries+1})")
+            await _reset_http_session("batch embedding timeout")
+            if attempt < max_retries:
+                await asyncio.sleep(retry_delay * (2 ** attempt))
+        except RuntimeError as e:
+            logger.warning(f"Runtime error during batch embedding: {e}")
+            await _reset_http_session("runtime error")
+            if attempt < max_retries:
+                await asyncio.sleep(retry_delay)
+        except Exception as e:
+            logger.error(f"Error creating batch embeddings from llama-server: {e}")
+            if attempt < max_retries:
+                await asyncio.sleep(retry_delay * (2 ** attempt))
+    
+    return [_zero_embedding() for _ in texts]
+
+
+def _pack_embedding_batches(items):
+    """Split (text, token_count) items into batches within the server token budget."""
+    batches = []
+    current = []
+    current_tokens = 0
+    
+    for text, token_count in items:
+        if current and (current_tokens + token_count > EMBEDDING_BATCH_TOKEN_BUDGET or
+                        len(current) >= EMBEDDING_BATCH_MAX_ITEMS):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append((text, token_count))
+        current_tokens += token_count
+    
+    if current:
+        batches.append(current)
+    
+    return batches
+
+
+class EmbeddingCoalescer:
+    """Micro-batcher that merges concurrent embedding requests into multi-input calls.
+    
+    Callers submit a single (already truncated) text and await its vector. The
+    first submission opens a short collection window; everything that arrives in
+    that window (and while a batch is in flight) is packed against the server's
+    token budget and sent under the ingestion semaphore.
+    """
+    
+    def __init__(self, window_ms=EMBEDDING_COALESCE_WINDOW_MS):
+        self.window = window_ms / 1000
+        self._pending = []  # (text, token_count, future)
+        self._flush_task = None
+    
+    async def submit(self, text, token_count):
+        """Queue a text for the next batch and wait for its embedding."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, token_count, future))
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+        
+        return await future
+    
+    def _take_batch(self):
+        """Pop the next token-budgeted batch from the pending queue."""
+        batch = []
+        batch_tokens = 0
+        while self._pending and len(batch) < EMBEDDING_BATCH_MAX_ITEMS:
+            token_count = self._pending[0][1]
+            if batch and batch_tokens + token_count > EMBEDDING_BATCH_TOKEN_BUDGET:
+                break
+            batch.append(self._pending.pop(0))
+            batch_tokens += token_count
+        return batch
+    
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        while self._pending:
+            batch = [entry for entry in self._take_batch() if not entry[2].done()]
+            if not batch:
+                continue
             
-            def _save_cache():
-                temp_path = EMBEDDINGS_CACHE_PATH + '.temp.npy'
-                np.save(temp_path, cache_data)
-                os.replace(temp_path, EMBEDDINGS_CACHE_PATH + '.npy')
+            try:
+                state.ensure_locks()
+                async with state.embedding_semaphore:
+                    vectors = await _fetch_embedding_batch(
+                        [text for text, _, _ in batch],
+                        [count for _, count, _ in batch]
+                    )
+            except Exception as e:
+                logger.error(f"Coalesced embedding batch failed: {e}")
+                vectors = [_zero_embedding() for _ in batch]
+            
+            for (_, _, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+
+def _get_coalescer():
+    """Get the embedding coalescer for the current process."""
+    state.ensure_locks()
+    if state.embedding_coalescer is None:
+        state.embedding_coalescer = EmbeddingCoalescer()
+    return state.embedding_coalescer
+
+
+async def create_embeddings(input_text, is_query=False, use_cache=True):
+    """Create embeddings using async HTTP request with performance optimizations.
+    
+    Query embeddings are sent immediately on the query semaphore. Ingestion
+    embeddings go through the EmbeddingCoalescer so concurrent callers share
+    multi-input requests. With use_cache=False the persistent embeddings cache
+    is neither read nor written (queries have their own cache, see query_cache.py).
+    """
+    start_time = time.perf_counter()
+    
+    if not input_text or not input_text.strip():
+        return _zero_embedding()
+    
+    # Ensure semaphores are valid for current process
+    state.ensure_locks()
+    
+    input_text, token_count = _prepare_embedding_text(input_text)
+    
+    # Check cache first
+    cache_key = _embedding_cache_key(input_text)
+    if use_cache and cache_key in state.embeddings_cache:
+        elapsed = (time.perf_counter() - start_time) * 1000
+        logger.debug(f"Embedding cache hit: {elapsed:.2f}ms")
+        return state.embeddings_cache[cache_key]
+    
+    if not is_query and EMBEDDING_COALESCING_ENABLED:
+        embedding = await _get_coalescer().submit(input_text, token_count)
+    else:
+        # Use different semaphores based on context
+        semaphore = state.query_semaphore if is_query else state.embedding_semaphore
+        async with semaphore:
+            embedding = await _fetch_single_embedding(input_text, token_count)
+    
+    if not np.any(embedding):
+        return embedding
+    
+    if use_cache:
+        # Cache the result
+        state.embeddings_cache[cache_key] = embedding
+        
+        # Save cache periodically
+        await maybe_save_embeddings_cache()
+    
+    elapsed = (time.perf_counter() - start_time) * 1000
+    logger.debug(f"Embedding server request: {elapsed:.2f}ms, text length: {len(input_text)} chars")
+    
+    return embedding
+
+
+async def create_embeddings_batch(texts, is_query=False, use_cache=True):
+    """Create embeddings for many texts using multi-input requests.
+    
+    Texts are truncated and looked up in the cache like create_embeddings; the
+    misses are de-duplicated and packed into batches of at most
+    EMBEDDING_BATCH_TOKEN_BUDGET tokens, one request per batch.
+    
+    Args:
+        texts: List of input texts
+        is_query: Use the query semaphore instead of the ingestion one
+        use_cache: Read and write the persistent embeddings cache (off for queries)
+    
+    Returns:
+        List of normalized vectors aligned with `texts` (zero vector on failure)
+    """
+    start_time = time.perf_counter()
+    
+    state.ensure_locks()
+    
+    results = [None] * len(texts)
+    misses = {}  # cache_key -> (text, token_count, [positions])
+    
+    for i, text in enumerate(texts):
+        if not text or not text.strip():
+            results[i] = _zero_embedding()
+            continue
+        
+        prepared_text, token_count = _prepare_embedding_text(text)
+        cache_key = _embedding_cache_key(prepared_text)
+        cached = state.embeddings_cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            results[i] = cached
+        elif cache_key in misses:
+            misses[cache_key][2].append(i)
+        else:
+            misses[cache_key] = (prepared_text, token_count, [i])
+    
+    if misses:
+        keys = list(misses.keys())
+        batches = _pack_embedding_batches([(misses[k][0], misses[k][1]) for k in keys])
+        semaphore = state.query_semaphore if is_query else state.embedding_semaphore
+        
+        offset = 0
+        new_entries = 0
+        for batch in batches:
+            async with semaphore:
+                vectors = await _fetch_embedding_batch(
+                    [text for text, _ in batch],
+                    [count for _, count in batch]
+                )
             
+            for key, vector in zip(keys[offset:offset + len(batch)], vectors):
+                for position in misses[key][2]:
+                    results[position] = vector
+                if use_cache and np.any(vector):
+                    state.embeddings_cache[key] = vector
+                    new_entries += 1
+            offset += len(batch)
+        
+        if new_entries:
+            await maybe_save_embeddings_cache(new_entries)
+        
+        elapsed = (time.perf_counter() - start_time) * 1000
+        logger.debug(f"Batch embedding: {len(texts)} texts, {len(misses)} misses in {len(batches)} requests, {elapsed:.2f}ms")
+    
+    return results
+
+
+async def save_embeddings_cache():
+    """Append new cache entries to the memory-mapped cache (evicting if over capacity)."""
+    try:
+        if isinstance(state.embeddings_cache, EmbeddingCache):
             loop = asyncio.get_running_loop()
-            await loop.run_in_executor(state.executor, _save_cache)
-            logger.debug(f"Saved {len(state.embeddings_cache)} embeddings to cache")
+            appended = await loop.run_in_executor(state.executor, state.embeddings_cache.flush)
+            if appended:
+                logger.debug(f"Appended {appended} embeddings to cache ({len(state.embeddings_cache)} total)")
     except Exception as e:
         logger.error(f"Error saving embeddings cache: {e}")
 
 
-async def maybe_save_embeddings_cache():
+async def maybe_save_embeddings_cache(new_entries=1):
     """Save embeddings cache if enough changes or time has passed."""
     global _cache_last_save_time, _cache_changes_since_save
     
     current_time = time.time()
-    _cache_changes_since_save += 1
+    _cache_changes_since_save += new_entries
     
     if (_cache_changes_since_save >= CACHE_SAVE_THRESHOLD or 
             current_time - _cache_last_save_time > CACHE_SAVE_INTERVAL):
@@ -341,43 +578,22 @@ async def maybe_save_embeddings_cache():
 
 
 async def load_embeddings_cache():
-    """Load embeddings cache from disk asynchronously."""
+    """Attach to the memory-mapped embeddings cache (no vectors are read up front)."""
     global _cache_last_save_time
     
     try:
-        cache_file = EMBEDDINGS_CACHE_PATH + '.npy'
-        if os.path.exists(cache_file):
-            def _load_cache():
-                try:
-                    return np.load(cache_file, allow_pickle=True).item()
-                except Exception as e:
-                    logger.error(f"Error loading cache file: {e}")
-                    backup_file = EMBEDDINGS_CACHE_PATH + '.backup.npy'
-                    if os.path.exists(backup_file):
-                        logger.info("Trying to load backup cache file")
-                        return np.load(backup_file, allow_pickle=True).item()
-                    return {'keys': [], 'values': np.array([])}
-            
-            loop = asyncio.get_running_loop()
-            cache_data = await loop.run_in_executor(state.executor, _load_cache)
-            
-            if 'keys' in cache_data and 'values' in cache_data and len(cache_data['keys']) > 0:
-                state.embeddings_cache = dict(zip(cache_data['keys'], cache_data['values']))
-                logger.info(f"Loaded {len(state.embeddings_cache)} embeddings from cache")
-                
-                # Create backup
-                def _backup_cache():
-                    import shutil
-                    shutil.copy2(cache_file, EMBEDDINGS_CACHE_PATH + '.backup.npy')
-                
-                await loop.run_in_executor(state.executor, _backup_cache)
-            else:
-                logger.warning("Cache file exists but contains no valid data")
-                state.embeddings_cache = {}
-            
-            _cache_last_save_time = time.time()
-        else:
-            state.embeddings_cache = {}
+        loop = asyncio.get_running_loop()
+        state.embeddings_cache = await loop.run_in_executor(state.executor, EmbeddingCache.open)
+        logger.info(f"Attached embeddings cache with {len(state.embeddings_cache)} entries")
+        _cache_last_save_time = time.time()
     except Exception as e:
         logger.error(f"Error loading embeddings cache: {e}")
         state.embeddings_cache = {}
+
+
+def embeddings_cache_nbytes():
+    """Bytes of cached vectors (mapped rows plus unsaved entries)."""
+    cache = state.embeddings_cache
+    if isinstance(cache, EmbeddingCache):
+        return cache.nbytes
+    return sum(arr.nbytes for arr in cache.values())
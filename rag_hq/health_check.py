@@ -271,7 +271,8 @@ class RAGHealthChecker:
         # Check embeddings cache
         num_cached = len(state.embeddings_cache)
         if num_cached > 0:
-            cache_size_mb = sum(arr.nbytes for arr in state.embeddings_cache.values()) / (1024*1024)
+            from .embeddings import embeddings_cache_nbytes
+            cache_size_mb = embeddings_cache_nbytes() / (1024*1024)
             self._log_check(
                 "Embeddings Cache (Memory)",
                 "pass",
@@ -0,0 +1,483 @@
+"""
+Staged, streaming ingestion pipeline.
+
+process_file used to run every step of a document inline (text extraction and
+spaCy segmentation in the 4-thread executor, where the GIL serialised them,
+then embedding in pairs of chunks with fixed sleeps in between), two files at a
+time. Documents now stream through stages connected by bounded queues:
+
+    prepare  (INGESTION_PROCESS_WORKERS processes)  extract text + sentence-split into chunks
+       |     queue (INGESTION_QUEUE_SIZE documents)
+    embed    (INGESTION_EMBED_WORKERS tasks)         one batched embedding call per document, dedup
+       |     queue (INGESTION_QUEUE_SIZE documents)
+    index    (one task)                              add vectors, metadata and BM25 entries
+
+Each chunk is embedded once: the vectors used for near-duplicate detection
+(within the document, and against chunks of other indexed documents) are the
+ones written to the index. Duplicates of other documents are still indexed,
+marked with metadata['duplicate_of'] so retrieval shows one of the pair.
+
+Summaries are generated concurrently, one task per document started as soon as
+its text is available (paced by the LLM pool), and the summary chunk is added
+when a document is finalised. A full queue blocks the stage feeding it, so a
+slow embedding server throttles extraction instead of fixed delays.
+
+Modified documents are diffed against their indexed version: chunks whose text
+hash (embedding_hash) matches a previous chunk keep that chunk's id and vector
+(only their metadata record is updated when positions moved), only new or
+changed chunks are embedded, and the previous chunks left unmatched are
+reported to on_file_done to be tombstoned. Chunks are sentence-aligned, so
+the chunks after an edited page fall back onto the same boundaries within a
+few chunks and an edit costs a few embeddings, not a full reprocess.
+
+A document that fails after its chunks were indexed (e.g. its summary) is
+rolled back: the chunks this run added are tombstoned and rewritten records
+and its summary restored, so its indexed version stays the only one.
+"""
+import time
+import uuid
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from .config import (
+    INGESTION_PROCESS_WORKERS, INGESTION_QUEUE_SIZE, INGESTION_EMBED_WORKERS,
+    INGESTION_CROSS_DOC_DEDUP, DEDUP_THRESHOLD
+)
+from .state import state, save_document_text
+from .text_processing import (
+    load_spacy_model, extract_text_sync, chunk_document_text,
+    embed_and_deduplicate_chunks, clean_text_for_embedding
+)
+from .tts_text import sanitize_tts_chars
+from .token_counter import count_tokens
+from .embeddings import create_embeddings, save_embeddings_cache, _embedding_cache_key
+from .document_management import (
+    generate_document_summary, save_document_summaries, update_ingestion_rapport
+)
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+# spaCy pipeline of a prepare worker process (loaded once per process)
+_worker_nlp = None
+
+
+def _init_prepare_worker():
+    global _worker_nlp
+    _worker_nlp = load_spacy_model()
+
+
+def prepare_document(file_path, filename, nlp=None):
+    """Extract a document's text and split it into chunks (blocking; runs in a worker process).
+
+    The text is sanitized for TTS before chunking, so stored chunks and
+    document texts need no character filtering at query time.
+
+    Returns:
+        (text, [(chunk_text, metadata), ...])
+    """
+    text = extract_text_sync(file_path)
+    if text:
+        text = sanitize_tts_chars(text)
+    if not text:
+        return "", []
+    return text, chunk_document_text(text, filename, nlp if nlp is not None else _worker_nlp)
+
+
+class IngestionPipeline:
+    """Streams documents through extract -> embed -> index into a (forked) index."""
+
+    def __init__(self, annoy_index, chunks_metadata, rapport, bm25_index=None, on_file_done=None,
+                 previous_chunks=None):
+        """
+        Args:
+            annoy_index: Index receiving the chunk vectors
+            chunks_metadata: Chunk store receiving the chunk records
+            rapport: Ingestion rapport, updated per document
+            bm25_index: Optional BM25 index receiving the chunk texts
+            on_file_done: Optional callback(filename, obsolete_chunk_ids) once a document is
+                completely indexed; the ids are previous chunks its new version no longer contains
+            previous_chunks: Optional {filename: [chunk ids]} of the indexed versions of the
+                documents, which new versions are diffed against
+        """
+        self.annoy_index = annoy_index
+        self.chunks_metadata = chunks_metadata
+        self.bm25_index = bm25_index
+        self.rapport = rapport
+        self.on_file_done = on_file_done
+        self.previous_chunks = previous_chunks or {}
+        self.succeeded = 0
+        self._filenames = set()
+        self._added_ids = set()  # Chunks indexed or kept by this run (not pending replacement)
+        self._pool = None
+        self._finalizers = []
+        self._save_lock = asyncio.Lock()
+
+    async def run(self, files):
+        """Ingest (file_path, filename) pairs. Returns the number of documents indexed."""
+        files = list(files)
+        if not files:
+            return 0
+        self._filenames = {filename for _, filename in files}
+
+        prepare_workers = max(1, min(INGESTION_PROCESS_WORKERS, len(files)))
+        if INGESTION_PROCESS_WORKERS > 0:
+            try:
+                self._pool = ProcessPoolExecutor(max_workers=prepare_workers, initializer=_init_prepare_worker)
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️  Could not start extraction processes, extracting in threads: {e}")
+
+        inbox = asyncio.Queue()
+        for item in files:
+            inbox.put_nowait(item)
+        to_embed = asyncio.Queue(maxsize=INGESTION_QUEUE_SIZE)
+        to_index = asyncio.Queue(maxsize=INGESTION_QUEUE_SIZE)
+
+        stages = [
+            asyncio.create_task(self._stage(self._prepare, prepare_workers, inbox, to_embed, INGESTION_EMBED_WORKERS)),
+            asyncio.create_task(self._stage(self._embed, INGESTION_EMBED_WORKERS, to_embed, to_index, 1)),
+            asyncio.create_task(self._stage(self._index, 1, to_index, None, 0)),
+        ]
+        for _ in range(prepare_workers):
+            inbox.put_nowait(None)
+
+        try:
+            await asyncio.gather(*stages)
+            await asyncio.gather(*self._finalizers)
+        finally:
+            for task in stages + self._finalizers:
+                if not task.done():
+                    task.cancel()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+        return self.succeeded
+
+    async def _stage(self, worker, count, inbox, outbox, consumers):
+        """Run `count` workers until their input is exhausted, then close the next stage."""
+
+        async def loop():
+            while True:
+                doc = await inbox.get()
+                if doc is None:
+                    return
+                try:
+                    doc = await worker(doc)
+                except Exception as e:
+                    filename = doc['filename'] if isinstance(doc, dict) else doc[1]
+                    await self._fail(doc, filename, e)
+                    continue
+                if doc is not None and outbox is not None:
+                    await outbox.put(doc)  # Blocks while the next stage is behind
+
+        await asyncio.gather(*(loop() for _ in range(count)))
+        for _ in range(consumers):
+            await outbox.put(None)
+
+    def _file_num(self):
+        rapport = self.rapport
+        return rapport.get('files_processed', 0) + rapport.get('files_failed', 0) + rapport.get('files_skipped', 0) + 1
+
+    # --- Stages ---
+
+    async def _prepare(self, item):
+        from .database import get_file_info, log_progress
+
+        file_path, filename = item
+        total_files = self.rapport.get('total_files', '?')
+
+        file_info = await get_file_info(file_path)
+        if file_info is None:
+            raise Exception("Failed to get file info")
+
+        # Skip if file was already processed and hasn't changed
+        old_info = state.processed_files.get(filename)
+        if old_info is not None and (old_info['size'], old_info['mtime'], old_info['hash']) == \
+                (file_info['size'], file_info['mtime'], file_info['hash']):
+            log_progress(f"[{self._file_num()}/{total_files}] Skipping {filename} (unchanged)", "info")
+            self.rapport['files'][filename] = {'status': 'skipped', 'reason': 'unchanged'}
+            self.rapport['files_skipped'] = self.rapport.get('files_skipped', 0) + 1
+            await update_ingestion_rapport(self.rapport)
+            return None
+
+        log_progress(f"[{self._file_num()}/{total_files}] Processing: {filename}", "file")
+        text, chunks = await self._extract_and_chunk(file_path, filename)
+        if not text:
+            raise Exception("No text extracted from file")
+
+        # Store document text to disk for lazy loading
+        await save_document_text(filename, text)
+        state.document_texts[filename] = text
+
+        # Chunks identical to ones of the indexed version keep their ids and vectors
+        doc = {
+            'filename': filename, 'file_info': file_info, 'previous': self._previous_by_hash(filename),
+            'previous_summary': state.document_summaries.get(filename),  # Restored if the document fails
+            'added_ids': [],  # Chunks this run added for the document (tombstoned if it fails)
+            'replaced_records': {},  # Kept chunks' records before they were rewritten
+        }
+        doc['chunks'], doc['kept'] = self._match_previous(doc['previous'], chunks)
+        if filename in self.previous_chunks:
+            log_progress(f"[{self._file_num()}/{total_files}] {filename}: {len(doc['kept'])} unchanged chunks kept, "
+                         f"{len(doc['chunks'])} new or changed", "chunk")
+
+        # Summaries run alongside embedding; the summary chunk is added when the document is finalised
+        doc['summary_task'] = asyncio.create_task(self._summary_chunk(filename, text, doc['previous']))
+
+        log_progress(f"[{self._file_num()}/{total_files}] Generated {len(chunks)} chunks from {filename}", "chunk")
+        self.rapport['files'][filename] = {
+            'status': 'processing',
+            'total_chunks': len(chunks),
+            'chunks_processed': 0,
+            'start_time': time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if doc['kept']:
+            self.rapport['files'][filename]['chunks_unchanged'] = len(doc['kept'])
+        await update_ingestion_rapport(self.rapport)
+        return doc
+
+    def _previous_by_hash(self, filename):
+        """Chunks of the indexed version of a document: text hash -> [(chunk id, record), ...]."""
+        by_hash = {}
+        for chunk_id in self.previous_chunks.get(filename, ()):
+            try:
+                record = self.chunks_metadata[chunk_id]
+            except KeyError:
+                continue
+            key = record.get('embedding_hash') or _embedding_cache_key(record['text'])
+            by_hash.setdefault(key, []).append((chunk_id, record))
+        return by_hash
+
+    def _match_previous(self, previous, chunks):
+        """Split chunks into ones to embed and (chunk id, text, metadata) of unchanged ones.
+
+        Matched previous chunks are taken out of `previous`; what remains there is obsolete.
+        """
+        new_chunks = []
+        kept = []
+        for chunk_text, metadata in chunks:
+            matches = previous.get(_embedding_cache_key(chunk_text))
+            if not matches:
+                new_chunks.append((chunk_text, metadata))
+                continue
+            chunk_id, record = matches.pop()
+            if not matches:
+                del previous[_embedding_cache_key(chunk_text)]
+            # Only records whose position or counts moved are rewritten
+            kept.append((chunk_id, chunk_text, metadata if record.get('metadata') != metadata else None))
+        self._added_ids.update(chunk_id for chunk_id, _, _ in kept)
+        return new_chunks, kept
+
+    async def _update_kept(self, doc, kept):
+        """Rewrite the metadata records of kept chunks that moved (vectors and BM25 entries stay)."""
+        async with state.lock:
+            for chunk_id, chunk_text, metadata in kept:
+                if metadata is not None:
+                    doc['replaced_records'].setdefault(chunk_id, self.chunks_metadata[chunk_id])
+                    self.chunks_metadata[chunk_id] = {
+                        'text': chunk_text,
+                        'metadata': metadata,
+                        'embedding_hash': _embedding_cache_key(chunk_text)
+                    }
+
+    async def _extract_and_chunk(self, file_path, filename):
+        loop = asyncio.get_running_loop()
+        if self._pool is not None:
+            try:
+                return await loop.run_in_executor(self._pool, prepare_document, file_path, filename)
+            except BrokenProcessPool as e:
+                logger.warning(f"⚠️  Extraction process pool failed, extracting in threads: {e}")
+                self._pool = None
+        return await loop.run_in_executor(state.executor, prepare_document, file_path, filename, state.nlp)
+
+    async def _embed(self, doc):
+        chunks, embeddings = await embed_and_deduplicate_chunks(doc['chunks'], DEDUP_THRESHOLD)
+        if INGESTION_CROSS_DOC_DEDUP and chunks:
+            chunks = await self._mark_corpus_duplicates(doc['filename'], chunks, embeddings)
+        doc['chunks'] = chunks
+        doc['embeddings'] = embeddings
+        return doc
+
+    async def _mark_corpus_duplicates(self, filename, chunks, embeddings):
+        """Mark chunks whose nearest indexed chunk belongs to another document and is a near-duplicate.
+
+        The chunks are still indexed for their own document (so they outlive an edit or
+        deletion of the other one); metadata['duplicate_of'] lets retrieval collapse the pair.
+        """
+        # The writer adds to the index under the same lock; only the snapshot is taken under it
+        async with state.lock:
+            if self.annoy_index.num_live_items() == 0:
+                return chunks
+            snapshot = self.annoy_index.snapshot()
+        nearest = await snapshot.query_batch_async(embeddings, 1, state.executor)
+
+        marked = []
+        duplicates = 0
+        for i, hits in enumerate(nearest):
+            chunk_text, chunk_metadata = chunks[i]
+            match = hits[0] if hits else None
+            if match is not None and match.cosine_similarity > DEDUP_THRESHOLD and np.any(embeddings[i]):
+                metadata = self.chunks_metadata.get(match.userdata, {}).get('metadata', {})
+                other = metadata.get('filename')
+                # Previous versions of documents in this run are about to be replaced, so they do not count
+                replaced = other in self._filenames and match.userdata not in self._added_ids
+                if other not in (None, filename) and not replaced and metadata.get('chunk_type') != 'summary':
+                    chunk_metadata = {**chunk_metadata, 'duplicate_of': match.userdata}
+                    duplicates += 1
+            marked.append((chunk_text, chunk_metadata))
+
+        if duplicates:
+            logger.info(f"🔁 Marked {duplicates} chunks of {filename} that duplicate other documents")
+            self.rapport['files'][filename]['cross_document_duplicates'] = duplicates
+        return marked
+
+    async def _index(self, doc):
+        from .database import add_embedded_chunks
+
+        filename = doc['filename']
+        items = []
+        failed = 0
+        for (chunk_text, metadata), embedding in zip(doc['chunks'], doc['embeddings']):
+            if not np.any(embedding):
+                failed += 1
+                logger.error(f"❌ CHUNK EMBEDDING FAILED: Chunk {metadata.get('chunk_index', '?')} from {filename} - got empty vector")
+                logger.error(f"   Chunk length: {len(chunk_text)} chars, ~{len(chunk_text)//4} tokens")
+                continue
+            items.append((str(uuid.uuid4()), chunk_text, metadata, embedding))
+
+        doc['added_ids'].extend(item[0] for item in items)
+        await add_embedded_chunks(items, self.annoy_index, self.chunks_metadata, self.bm25_index)
+        await self._update_kept(doc, doc['kept'])
+        self._added_ids.update(item[0] for item in items)
+        doc['chunks_processed'] = len(items) + len(doc['kept'])
+        doc['chunks_failed'] = failed
+        self.rapport['files'][filename]['chunks_processed'] = len(items)
+        if failed:
+            self.rapport['files'][filename]['chunks_failed'] = failed
+
+        # Waiting for the summary must not hold up indexing of the next documents
+        self._finalizers.append(asyncio.create_task(self._finalize(doc)))
+        return None
+
+    async def _summary_chunk(self, filename, text, previous):
+        """Generate the document summaries and embed the searchable summary chunk.
+
+        Returns (chunk id, text, metadata, embedding); the embedding is None when the
+        indexed version has the same summary chunk, which is kept.
+        """
+        await generate_document_summary(filename, text)
+        summary_data = state.document_summaries.get(filename)
+        if summary_data is None:
+            return None
+
+        # Summary text WITHOUT keywords (keywords will be in metadata)
+        summary_text = f"Document: {filename}\n\n"
+        summary_text += f"Summary: {summary_data.get('summary', '')}"
+        summary_metadata = {
+            'filename': filename,
+            'chunk_index': -1,  # Special marker for summary chunks
+            'chunk_type': 'summary',
+            'start_sentence': 0,
+            'estimated_tokens': len(summary_text) // 4,
+            'token_count': count_tokens(summary_text),
+            'keywords': summary_data.get('keywords', []),
+            'extended_keywords': summary_data.get('extended_keywords', [])
+        }
+        _, kept = self._match_previous(previous, [(summary_text, summary_metadata)])
+        if kept:
+            chunk_id, _, metadata = kept[0]
+            return chunk_id, summary_text, metadata, None
+        embedding = await create_embeddings(clean_text_for_embedding(summary_text))
+        if not np.any(embedding):
+            return None
+        return str(uuid.uuid4()), summary_text, summary_metadata, embedding
+
+    async def _finalize(self, doc):
+        from .database import add_embedded_chunks, save_processed_files, log_progress
+
+        filename = doc['filename']
+        try:
+            summary_item = await doc['summary_task']
+            chunks_processed, chunks_failed = doc['chunks_processed'], doc['chunks_failed']
+            if summary_item is not None and summary_item[3] is None:
+                await self._update_kept(doc, [summary_item[:3]])
+                chunks_processed += 1
+            elif summary_item is not None:
+                doc['added_ids'].append(summary_item[0])
+                await add_embedded_chunks([summary_item], self.annoy_index, self.chunks_metadata, self.bm25_index)
+                chunks_processed += 1
+                logger.info(f"✓ Added document summary chunk for {filename} (keywords in metadata)")
+
+            # Mark file as processed only if majority of chunks succeeded
+            if chunks_processed <= chunks_failed:
+                raise Exception(f"Too many chunk failures: {chunks_failed}/{len(doc['chunks'])}")
+
+            if self.on_file_done is not None:
+                # Previous chunks not matched by the new version (incl. its summary chunk)
+                obsolete = [chunk_id for matches in doc['previous'].values() for chunk_id, _ in matches]
+                async with state.lock:
+                    self.on_file_done(filename, obsolete)
+            doc['committed'] = True  # The new version replaced the old one; no rollback from here on
+
+            state.processed_files[filename] = doc['file_info']
+            entry = self.rapport['files'][filename]
+            entry['status'] = 'completed'
+            entry['end_time'] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self.rapport['files_processed'] = self.rapport.get('files_processed', 0) + 1
+            self.succeeded += 1
+            log_progress(f"[{self._file_num() - 1}/{self.rapport.get('total_files', '?')}] ✓ Completed {filename}: "
+                         f"{chunks_processed} chunks ({chunks_failed} failed)", "success")
+
+            # The index itself is built and saved once, after all documents
+            async with self._save_lock:
+                await save_processed_files()
+                await save_embeddings_cache()
+                await save_document_summaries()
+                await update_ingestion_rapport(self.rapport)
+        except Exception as e:
+            await self._fail(doc, filename, e)
+
+    async def _rollback(self, doc):
+        """Undo what a failed document changed in the index; its indexed version stays live."""
+        filename = doc['filename']
+        added = doc['added_ids']
+        async with state.lock:
+            for chunk_id in added:
+                self.chunks_metadata.pop(chunk_id, None)
+                if self.bm25_index is not None:
+                    self.bm25_index.remove_document(chunk_id)
+            self.annoy_index.remove_uuids(added)
+            for chunk_id, record in doc['replaced_records'].items():
+                self.chunks_metadata[chunk_id] = record
+        self._added_ids.difference_update(added)
+        # Its indexed chunks are no longer pending replacement (they count for duplicate checks)
+        self._filenames.discard(filename)
+
+        if doc['previous_summary'] is not None:
+            state.document_summaries[filename] = doc['previous_summary']
+        else:
+            state.document_summaries.pop(filename, None)
+        if added or doc['replaced_records']:
+            logger.info(f"↩️  Rolled back {len(added)} added and {len(doc['replaced_records'])} rewritten chunks of {filename}")
+
+    async def _fail(self, doc, filename, error):
+        from .database import log_progress
+
+        summary_task = doc.get('summary_task') if isinstance(doc, dict) else None
+        if summary_task is not None and not summary_task.done():
+            summary_task.cancel()
+            await asyncio.gather(summary_task, return_exceptions=True)
+        if isinstance(doc, dict) and not doc.get('committed'):
+            await self._rollback(doc)
+
+        self.rapport['files'][filename] = {
+            'status': 'failed',
+            'error': str(error),
+            'error_type': type(error).__name__,
+            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        log_progress(f"[{self._file_num()}/{self.rapport.get('total_files', '?')}] ✗ Failed to process {filename}: {error}", "error")
+        self.rapport['files_failed'] = self.rapport.get('files_failed', 0) + 1
+        await update_ingestion_rapport(self.rapport)
@@ -9,9 +9,8 @@ import psutil
 from .state import state
 from .embeddings import (
     get_http_session, close_http_session,
-    load_embeddings_cache
+    load_embeddings_cache, embeddings_cache_nbytes
 )
-from .text_processing import initialize_spacy
 from .document_management import load_document_summaries
 from .database import load_processed_files, cleanup_temp_files
 from .database_operations import (
@@ -19,6 +18,7 @@ from .database_operations import (
     update_database_periodically
 )
 from .config import LLAMA_SERVER_URL, DOCUMENT_TEXTS_DIR, VECTOR_DIM
+from .chunk_store import ChunkStore
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
@@ -73,19 +73,13 @@ async def initialize_rag():
     except Exception as e:
         logger.error(f"Llama-server is not accessible: {e}. RAG functionality may be limited.")
     
-    # Initialize spaCy
-    await initialize_spacy()
-    print_memory_usage("after spaCy initialization")
+    # spaCy is only needed for chunking: build_vector_database() initializes it
+    # itself, so query-only job processes skip the multi-second model load.
     
     # Load caches
     await load_processed_files()
     print_memory_usage("after loading processed files")
     
-    await load_embeddings_cache()
-    print_memory_usage("after loading embeddings cache")
-    logger.info(f"Embeddings cache contains {len(state.embeddings_cache)} entries")
-    logger.info(f"Embeddings cache size in memory: {sum(arr.nbytes for arr in state.embeddings_cache.values()) / (1024*1024):.2f} MB")
-    
     await load_document_summaries()
     print_memory_usage("after loading document summaries")
     
@@ -100,6 +94,12 @@ async def initialize_rag():
     
     print_memory_usage("after loading vector database")
     
+    # Memory-mapped: attaching is cheap, so every process shares the cache for query embeddings too
+    await load_embeddings_cache()
+    print_memory_usage("after loading embeddings cache")
+    logger.info(f"Embeddings cache contains {len(state.embeddings_cache)} entries")
+    logger.info(f"Embeddings cache size (mapped): {embeddings_cache_nbytes() / (1024*1024):.2f} MB")
+    
     # Preload all documents into memory for instant extensive search (if enabled)
     try:
         from config import EXTENSIVE_SEARCH_PRELOAD_DOCUMENTS
@@ -130,7 +130,12 @@ async def initialize_rag():
     logger.info(f"📦 Chunks Metadata:")
     logger.info(f"   - Total chunks: {num_chunks:,}")
     
-    num_docs = len(set(meta['metadata']['filename'] for meta in state.chunks_metadata.values() if 'metadata' in meta))
+    if state.shared_store is not None:
+        num_docs = state.shared_store.num_documents  # Avoid decoding every mapped record
+    elif isinstance(state.chunks_metadata, ChunkStore):
+        num_docs = state.chunks_metadata.num_documents()  # Filename column only
+    else:
+        num_docs = len(set(meta['metadata']['filename'] for meta in state.chunks_metadata.values() if 'metadata' in meta))
     logger.info(f"📄 Documents:")
     logger.info(f"   - Unique documents: {num_docs}")
     logger.info(f"   - Processed files tracked: {len(state.processed_files)}")
@@ -139,7 +144,7 @@ async def initialize_rag():
     logger.info(f"📝 Document Summaries: {num_summaries}")
     
     num_cached_embeddings = len(state.embeddings_cache)
-    cache_size_mb = sum(arr.nbytes for arr in state.embeddings_cache.values()) / (1024*1024) if num_cached_embeddings > 0 else 0
+    cache_size_mb = embeddings_cache_nbytes() / (1024*1024)
     logger.info(f"💾 Embeddings Cache:")
     logger.info(f"   - Cached embeddings: {num_cached_embeddings:,}")
     logger.info(f"   - Cache size: {cache_size_mb:.2f} MB")
@@ -0,0 +1,169 @@
+"""
+Async, pooled LLM client for the ingestion side (summaries, Q&A generation, dedup)
+and the query analysis and rewrites of advanced search.
+
+The ingestion code used to build a synchronous Groq client per call and run
+`chat.completions.create` inside `async def`s, blocking the event loop that
+also drives embedding. LLMPool instead shares one AsyncGroq client (one HTTP
+connection pool) per API key and event loop, and schedules requests with:
+
+- a semaphore bounding in-flight requests (LLM_MAX_CONCURRENCY)
+- a token bucket pacing request starts; every 429 halves its rate (honouring
+  Retry-After) and each success recovers it additively up to LLM_RATE_LIMIT_RPS
+- retries with backoff for rate limits, connection errors and 5xx responses
+
+`as_completed` runs a batch of requests and yields their results in completion
+order, so callers can handle each response as soon as it arrives.
+"""
+import time
+import random
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from groq import AsyncGroq, RateLimitError, APIConnectionError, InternalServerError
+
+from .config import (
+    GROQ_API_KEY, LLM_MAX_CONCURRENCY, LLM_RATE_LIMIT_RPS, LLM_RATE_BURST,
+    LLM_MIN_RATE_RPS, LLM_MAX_RETRIES, LLM_REQUEST_TIMEOUT
+)
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+def _retry_after(error) -> Optional[float]:
+    """Seconds from a 429's Retry-After header, if present."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Request pacing whose rate adapts to rate-limit responses (AIMD)."""
+
+    def __init__(self, rate: float, burst: int, min_rate: float):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()  # FIFO: waiters are served in arrival order
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        """Halve the rate, drain the bucket and pause until the server allows requests again."""
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self._paused_until = max(self._paused_until, now + pause)
+        logger.warning(f"⚠️  LLM rate limited: pausing {pause:.1f}s, rate now {self.rate * 60:.1f} req/min")
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class LLMPool:
+    """Shared AsyncGroq client with bounded concurrency and adaptive rate limiting."""
+
+    def __init__(self, api_key: str = GROQ_API_KEY, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 rate: float = LLM_RATE_LIMIT_RPS, burst: int = LLM_RATE_BURST):
+        # Retries are ours (they must feed the token bucket), not the SDK's
+        self.client = AsyncGroq(api_key=api_key, max_retries=0, timeout=LLM_REQUEST_TIMEOUT)
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(rate, burst, LLM_MIN_RATE_RPS)
+
+    async def _complete(self, **params) -> str:
+        completion = await self.client.chat.completions.create(**params)
+        return completion.choices[0].message.content if completion.choices else ""
+
+    async def chat(self, messages: List[Dict[str, str]], model: str,
+                   max_retries: int = LLM_MAX_RETRIES, **params) -> str:
+        """
+        Run one chat completion and return its text.
+
+        Args:
+            messages: Chat messages
+            model: Groq model name
+            max_retries: Retries for rate limits, connection errors and 5xx responses
+            **params: Further completion parameters (temperature, max_tokens, response_format, ...)
+
+        Raises:
+            The last error once retries are exhausted, or any non-retryable API error
+        """
+        for attempt in range(max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                async with self.semaphore:
+                    text = await self._complete(messages=messages, model=model, **params)
+                self.bucket.on_success()
+                return text
+            except RETRYABLE_ERRORS as e:
+                if attempt == max_retries:
+                    raise
+                if isinstance(e, RateLimitError):
+                    self.bucket.on_rate_limited(_retry_after(e))
+                else:
+                    wait_time = (2 ** attempt) * (0.5 + random.random())
+                    logger.warning(f"⚠️  LLM request failed (retryable), retry {attempt + 1}/{max_retries} in {wait_time:.1f}s: {e}")
+                    await asyncio.sleep(wait_time)
+
+    async def as_completed(self, requests: Iterable[Tuple[Any, Dict[str, Any]]]) -> AsyncIterator[Tuple[Any, Any]]:
+        """
+        Run many chat() calls and yield (key, text or exception) as each one finishes.
+
+        Args:
+            requests: (key, chat() keyword arguments) pairs
+        """
+        async def run(key, kwargs):
+            try:
+                return key, await self.chat(**kwargs)
+            except Exception as e:
+                return key, e
+
+        tasks = [asyncio.ensure_future(run(key, kwargs)) for key, kwargs in requests]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+_pools: Dict[str, LLMPool] = {}
+
+
+def get_llm_pool(api_key: Optional[str] = None) -> LLMPool:
+    """The LLMPool for this API key on the running event loop (created on first use)."""
+    api_key = api_key or GROQ_API_KEY
+    pool = _pools.get(api_key)
+    # Semaphores, locks and the HTTP pool are bound to one event loop
+    if pool is None or pool.loop is not asyncio.get_running_loop():
+        pool = _pools[api_key] = LLMPool(api_key)
+    return pool
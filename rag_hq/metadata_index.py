@@ -0,0 +1,164 @@
+"""
+Metadata filter index for filtered vector search.
+
+Filters used to be applied after retrieval (advanced_search checked
+filename.endswith on the fused results), so a search restricted to one
+document could come back empty while that document had matching chunks. A
+ChunkFilter is instead resolved, per index segment, to the item rows that
+match it, and the segment backends score only those rows:
+
+    filenames    exact document names ("only this document")
+    doc_types    file extensions ("pdf", "docx", ...)
+    chunk_types  "chunk" or "summary" (document summary chunks, chunk_index -1)
+    years        four-digit year in the document name (e.g. "jaarverslag_2023.pdf")
+
+MetadataIndex keeps two columns per segment (filename id, summary flag), read
+from the chunk store's fixed-width records (or the shared store's columns in
+job processes), and caches the matching rows of
+recent filters. Base segments are immutable, so their columns are built once;
+the delta segment's are rebuilt when it grows.
+"""
+import re
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from .config import METADATA_FILTER_CACHE_SIZE
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+CHUNK_TYPES = ("chunk", "summary")
+_YEAR = re.compile(r'(?<!\d)(?:19|20)\d{2}(?!\d)')
+
+
+def filename_year(filename):
+    """First four-digit year (1900-2099) in a document name, or None."""
+    match = _YEAR.search(filename or "")
+    return int(match.group()) if match else None
+
+
+class ChunkFilter:
+    """Restriction on the chunks a search may return (None: attribute not restricted)."""
+
+    def __init__(self, filenames=None, doc_types=None, chunk_types=None, years=None):
+        self.filenames = frozenset(filenames) if filenames else None
+        self.doc_types = frozenset(dt.lower().lstrip('.') for dt in doc_types) if doc_types else None
+        self.chunk_types = frozenset(chunk_types) if chunk_types else None
+        self.years = frozenset(int(year) for year in years) if years else None
+        if self.chunk_types and not self.chunk_types <= set(CHUNK_TYPES):
+            raise ValueError(f"Unknown chunk types {sorted(self.chunk_types)} (choose from {', '.join(CHUNK_TYPES)})")
+
+    def __bool__(self):
+        return any(value is not None for value in (self.filenames, self.doc_types, self.chunk_types, self.years))
+
+    def __repr__(self):
+        return f"ChunkFilter({', '.join(f'{name}={sorted(values)}' for name, values in self.key())})"
+
+    def key(self):
+        """Hashable description, for caches."""
+        return tuple((name, tuple(sorted(values))) for name, values in (
+            ('filenames', self.filenames), ('doc_types', self.doc_types),
+            ('chunk_types', self.chunk_types), ('years', self.years)) if values is not None)
+
+    def matches_filename(self, filename):
+        if self.filenames is not None and filename not in self.filenames:
+            return False
+        if self.doc_types is not None and filename.rsplit('.', 1)[-1].lower() not in self.doc_types:
+            return False
+        if self.years is not None and filename_year(filename) not in self.years:
+            return False
+        return True
+
+    def matches(self, metadata):
+        """Whether one chunk's metadata passes the filter."""
+        filename = metadata.get('filename')
+        if filename is None or not self.matches_filename(filename):
+            return False
+        if self.chunk_types is not None:
+            is_summary = metadata.get('chunk_type') == 'summary' or metadata.get('chunk_index') == -1
+            return ("summary" if is_summary else "chunk") in self.chunk_types
+        return True
+
+
+def _metadata_columns(chunks_metadata, uuid_strs):
+    """(filename table, filename ids (-1: unknown), summary flags) of chunk ids."""
+    if hasattr(chunks_metadata, 'metadata_columns'):
+        filenames, filename_ids, chunk_indexes = chunks_metadata.metadata_columns(uuid_strs)
+        return filenames, filename_ids, chunk_indexes == -1
+
+    # Any other mapping (e.g. a plain dict): decode the records
+    filenames = []
+    ids = {}
+    filename_ids = np.full(len(uuid_strs), -1, dtype=np.int32)
+    is_summary = np.zeros(len(uuid_strs), dtype=bool)
+    for i, uuid_str in enumerate(uuid_strs):
+        record = chunks_metadata.get(uuid_str) if uuid_str else None
+        if record is None:
+            continue
+        metadata = record.get('metadata', {})
+        filename = metadata.get('filename')
+        if filename is not None:
+            if filename not in ids:
+                ids[filename] = len(filenames)
+                filenames.append(filename)
+            filename_ids[i] = ids[filename]
+        is_summary[i] = metadata.get('chunk_type') == 'summary' or metadata.get('chunk_index') == -1
+    return filenames, filename_ids, is_summary
+
+
+class _SegmentColumns:
+    def __init__(self, count, filenames, filename_ids, is_summary):
+        self.count = count
+        self.filenames = filenames
+        self.filename_ids = filename_ids
+        self.is_summary = is_summary
+        self.rows = OrderedDict()  # filter key -> matching item rows (LRU)
+
+
+class MetadataIndex:
+    """Per-segment metadata columns and cached row subsets of recent filters."""
+
+    def __init__(self, cache_size=METADATA_FILTER_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._segments = weakref.WeakKeyDictionary()  # segment -> _SegmentColumns
+        self._lock = threading.Lock()  # Searches run in the executor
+
+    def _columns(self, segment, chunks_metadata):
+        count = segment.index.get_n_items()
+        with self._lock:
+            columns = self._segments.get(segment)
+        if columns is not None and columns.count == count:
+            return columns
+
+        uuid_strs = [segment.uuid_map.get(i) for i in range(count)]
+        columns = _SegmentColumns(count, *_metadata_columns(chunks_metadata, uuid_strs))
+        with self._lock:
+            self._segments[segment] = columns
+        return columns
+
+    def rows(self, segment, chunks_metadata, chunk_filter):
+        """Sorted item ids of a segment whose chunks pass the filter (blocking)."""
+        columns = self._columns(segment, chunks_metadata)
+        key = chunk_filter.key()
+        with self._lock:
+            rows = columns.rows.get(key)
+            if rows is not None:
+                columns.rows.move_to_end(key)
+                return rows
+
+        # Filename-based conditions are evaluated once per distinct document;
+        # the extra False at the end is what unknown (-1) filename ids pick up
+        allowed = np.array([chunk_filter.matches_filename(name) for name in columns.filenames] + [False], dtype=bool)
+        mask = allowed[columns.filename_ids]
+        if chunk_filter.chunk_types is not None and len(chunk_filter.chunk_types) < len(CHUNK_TYPES):
+            mask &= columns.is_summary if "summary" in chunk_filter.chunk_types else ~columns.is_summary
+        rows = np.flatnonzero(mask)
+
+        with self._lock:
+            columns.rows[key] = rows
+            while len(columns.rows) > self.cache_size:
+                columns.rows.popitem(last=False)
+        return rows
@@ -3,6 +3,7 @@ RAG query functions for context enrichment and search.
 """
 import time
 import json
+import asyncio
 import logging
 import numpy as np
 # LiveKit 1.0 - Agent class is used instead of VoicePipelineAgent
@@ -12,109 +13,27 @@ from .config import (
     MAX_EMBEDDING_SIZE_CHARS, RELEVANCE_THRESHOLD, HIGH_RELEVANCE_THRESHOLD,
     CONTEXT_EXPANSION_ENABLED, CONTEXT_EXPANSION_TOKENS, SAFE_EMBEDDING_SIZE_CHARS,
     K_RESULTS,     MAX_CONTEXT_TOKENS, ENABLE_CITATIONS, HYBRID_SEARCH_ENABLED,
-    HYBRID_SEMANTIC_WEIGHT, HYBRID_KEYWORD_WEIGHT, VERBOSE_RAG_LOGGING
+    HYBRID_SEMANTIC_WEIGHT, HYBRID_KEYWORD_WEIGHT, VERBOSE_RAG_LOGGING, QUERY_CACHE_ENABLED
 )
 from .state import state, get_document_text
-from .embeddings import create_embeddings
-from .token_counter import select_chunks_within_budget, count_tokens
+from .embeddings import create_embeddings, create_embeddings_batch
+from .token_counter import select_chunks_within_budget, count_tokens, chunk_token_count
 from .bm25_index import merge_hybrid_results
+from .vector_index import make_query_result
+from .query_cache import query_cache
+from .document_index import DocumentIndex, get_document_index
+from .tts_text import filter_safe_text
+from .metadata_index import ChunkFilter
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
 
-def filter_safe_text(text: str) -> str:
-    """
-    Filter and normalize Unicode for TTS compatibility.
-    Strategy: Replace problematic Unicode with ASCII equivalents.
-    Keep only: ASCII + Latin Extended + essential symbols (€, •)
-    """
-    import re
-    safe_chars = []
-    unsafe_found = False
-    
-    # Unicode replacement mapping - convert to TTS-safe equivalents
-    unicode_replacements = {
-        # Dashes -> hyphen
-        0x2013: '-',   # – En dash
-        0x2014: '-',   # — Em dash
-        0x2015: '-',   # ― Horizontal bar
-        
-        # Spaces -> regular space
-        0x00A0: ' ',   # Non-breaking space
-        0x202F: ' ',   # Narrow no-break space
-        0x2009: ' ',   # Thin space
-        
-        # Ligatures -> letter equivalents
-        0xFB00: 'ff',  # ﬀ -> ff
-        0xFB01: 'fi',  # ﬁ -> fi
-        0xFB02: 'fl',  # ﬂ -> fl
-        0xFB03: 'ffi', # ﬃ -> ffi
-        0xFB04: 'ffl', # ﬄ -> ffl
-        
-        # Other symbols
-        0x2026: '...',  # … -> ...
-        0x00AD: '',     # Soft hyphen -> remove
-    }
-    
-    # Keep these useful symbols as-is (TTS-safe)
-    keep_unicode = {
-        0x20AC,  # € Euro sign
-        0x2022,  # • Bullet point
-        0x2018,  # ' Left single quote
-        0x2019,  # ' Right single quote
-        0x201C,  # " Left double quote
-        0x201D,  # " Right double quote
-    }
-    
-    for char in text:
-        char_code = ord(char)
-        
-        # Replace with mapping if exists
-        if char_code in unicode_replacements:
-            replacement = unicode_replacements[char_code]
-            safe_chars.append(replacement)
-            continue
-        
-        # Keep all ASCII printable (32-126)
-        if 32 <= char_code <= 126:
-            safe_chars.append(char)
-        # Keep common whitespace
-        elif char in '\n\t\r':
-            safe_chars.append(char)
-        # Keep Latin letters with diacritics (À-ÿ and extended up to 591)
-        elif char.isalpha() and char_code < 591:
-            safe_chars.append(char)
-        # Keep essential Unicode symbols
-        elif char_code in keep_unicode:
-            safe_chars.append(char)
-        # Block CJK Unified Ideographs (Chinese/Japanese/Korean)
-        elif 0x4E00 <= char_code <= 0x9FFF:
-            safe_chars.append(' ')
-            unsafe_found = True
-        # Block Emoji ranges
-        elif 0x1F300 <= char_code <= 0x1F9FF:
-            safe_chars.append(' ')
-            unsafe_found = True
-        # Block other high Unicode (>0x3000)
-        elif char_code >= 0x3000:
-            safe_chars.append(' ')
-            unsafe_found = True
-        # Replace other low Unicode with space for safety
-        else:
-            safe_chars.append(' ')
-    
-    # Log if we filtered anything problematic
-    if unsafe_found:
-        logger.warning("⚠️ Filtered problematic Unicode (CJK/emoji) from RAG chunk text")
-    
-    # Clean up multiple spaces
-    result = ''.join(safe_chars)
-    result = re.sub(r'\s+', ' ', result)
-    return result.strip()
-
-
 async def expand_chunk_context(chunk_text: str, metadata: dict) -> str:
-    """Expand a chunk with surrounding context from the original document."""
+    """Expand a chunk with surrounding context from the original document.
+    
+    Sentence boundaries come from the document's precomputed index (see
+    document_index.py): a few bisects plus two slices of the memory-mapped text.
+    """
     if not CONTEXT_EXPANSION_ENABLED:
         return chunk_text
     
@@ -123,25 +42,6 @@ async def expand_chunk_context(chunk_text: str, metadata: dict) -> str:
         logger.debug(f"Cannot expand context: document not registered for {filename}")
         return chunk_text
     
-    # Lazy-load the document text
-    full_text = await get_document_text(filename)
-    if not full_text:
-        logger.debug(f"Cannot expand context: failed to load document text for {filename}")
-        return chunk_text
-    
-    # Use character positions if available
-    if 'char_start' in metadata and 'char_end' in metadata:
-        char_start = metadata['char_start']
-        char_end = metadata['char_end']
-    else:
-        # Fallback: find the chunk in the full text
-        chunk_pos = full_text.find(chunk_text)
-        if chunk_pos == -1:
-            logger.debug(f"Cannot expand context: chunk not found in document")
-            return chunk_text
-        char_start = chunk_pos
-        char_end = chunk_pos + len(chunk_text)
-    
     # Calculate expansion boundaries
     chars_per_token = 4
     
@@ -160,35 +60,43 @@ async def expand_chunk_context(chunk_text: str, metadata: dict) -> str:
     expansion_tokens = min(CONTEXT_EXPANSION_TOKENS, max_expansion_size // chars_per_token)
     expansion_chars = expansion_tokens * chars_per_token
     
-    # Expand boundaries
-    expanded_start = max(0, char_start - expansion_chars)
-    expanded_end = min(len(full_text), char_end + expansion_chars)
+    # Use character positions if available
+    document = None
+    if 'char_start' in metadata and 'char_end' in metadata:
+        char_start = metadata['char_start']
+        char_end = metadata['char_end']
+        try:
+            document = await asyncio.get_running_loop().run_in_executor(
+                state.executor, get_document_index, filename
+            )
+        except Exception as e:
+            logger.debug(f"Cannot open sentence index for {filename}: {e}")
     
-    # Try to find sentence boundaries for cleaner expansion
-    if expanded_start > 0:
-        for punct in ['. ', '? ', '! ', '\n\n', '\n']:
-            pos = full_text.rfind(punct, expanded_start, char_start)
-            if pos != -1:
-                expanded_start = pos + len(punct)
-                break
+    if document is None:
+        # Fallback: find the chunk in the full text
+        full_text = await get_document_text(filename)
+        if not full_text:
+            logger.debug(f"Cannot expand context: failed to load document text for {filename}")
+            return chunk_text
+        chunk_pos = full_text.find(chunk_text)
+        if chunk_pos == -1:
+            logger.debug(f"Cannot expand context: chunk not found in document")
+            return chunk_text
+        char_start = chunk_pos
+        char_end = chunk_pos + len(chunk_text)
+        document = DocumentIndex.from_text(full_text)
     
-    if expanded_end < len(full_text):
-        for punct in ['. ', '? ', '! ', '\n\n', '\n']:
-            pos = full_text.find(punct, char_end, expanded_end)
-            if pos != -1:
-                expanded_end = pos + len(punct.rstrip())
-                break
+    # Expand to the enclosing sentence boundaries within the window
+    expanded_start, expanded_end = document.expansion_bounds(char_start, char_end, expansion_chars)
     
     # Extract expanded text
-    expanded_text = full_text[expanded_start:expanded_end].strip()
+    pre_context = document.slice(expanded_start, char_start).strip()
+    post_context = document.slice(char_end, expanded_end).strip()
+    expanded_text = chunk_text
     
     # Add markers to show original chunk boundaries
-    if expanded_start < char_start or expanded_end > char_end:
-        pre_context = full_text[expanded_start:char_start].strip()
-        post_context = full_text[char_end:expanded_end].strip()
-        
-        if pre_context or post_context:
-            expanded_text = f"[...{pre_context}] {chunk_text} [{post_context}...]"
+    if pre_context or post_context:
+        expanded_text = f"[...{pre_context}] {chunk_text} [{post_context}...]"
     
     # Final check to ensure text is not too large
     if len(expanded_text) > SAFE_EMBEDDING_SIZE_CHARS:
@@ -222,6 +130,46 @@ async def expand_chunk_context(chunk_text: str, metadata: dict) -> str:
     return expanded_text
 
 
+def collapse_duplicates(hits):
+    """Drop hits marked at ingestion as near-duplicates of another hit in the same list.
+
+    hits: [(chunk id, chunk data, score)] in rank order; a duplicate whose original
+    did not make the list is kept, so its content is still found.
+    """
+    hit_ids = {chunk_id for chunk_id, _, _ in hits}
+    return [hit for hit in hits if hit[1]['metadata'].get('duplicate_of') not in hit_ids]
+
+
+async def embed_query(text: str):
+    """Query embedding; repeats of a (normalized) query never reach the embedding server."""
+    if not QUERY_CACHE_ENABLED:
+        return await create_embeddings(text, is_query=True)
+    
+    embedding = query_cache.get_embedding(text)
+    if embedding is not None:
+        return embedding
+    embedding = await create_embeddings(text, is_query=True, use_cache=False)
+    if np.any(embedding):
+        query_cache.put_embedding(text, embedding)
+    return embedding
+
+
+async def embed_queries(texts):
+    """embed_query() for several texts; the misses go to the embedding server in one batched call."""
+    if not QUERY_CACHE_ENABLED:
+        return await create_embeddings_batch(texts, is_query=True)
+    
+    embeddings = [query_cache.get_embedding(text) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        fetched = await create_embeddings_batch([texts[i] for i in missing], is_query=True, use_cache=False)
+        for i, embedding in zip(missing, fetched):
+            embeddings[i] = embedding
+            if np.any(embedding):
+                query_cache.put_embedding(texts[i], embedding)
+    return embeddings
+
+
 async def enrich_with_rag(agent: Agent, chat_ctx: llm.ChatContext):
     """Enrich the chat context with RAG results for the user's message."""
     try:
@@ -241,98 +189,113 @@ async def enrich_with_rag(agent: Agent, chat_ctx: llm.ChatContext):
             
         user_msg = messages[-1]
         
-        # Create embeddings for the user's message
-        start_time = time.perf_counter()
-        
-        # Limit user message size for embedding
-        if len(user_msg.content) > MAX_EMBEDDING_SIZE_CHARS:
-            logger.info(f"Truncating user message from {len(user_msg.content)} to {MAX_EMBEDDING_SIZE_CHARS} chars")
-            user_content_for_embedding = user_msg.content[:MAX_EMBEDDING_SIZE_CHARS]
-        else:
-            user_content_for_embedding = user_msg.content
-            
-        user_embedding = await create_embeddings(user_content_for_embedding, is_query=True)
-        embedding_time = (time.perf_counter() - start_time) * 1000
-        if VERBOSE_RAG_LOGGING:
-            logger.info(f"Time to create embeddings: {embedding_time:.2f} ms")
-        
-        # If embedding is empty, skip RAG enrichment
-        if not np.any(user_embedding):
-            logger.info("Empty user embedding; skipping RAG enrichment")
-            return
-        
-        # Query the vector database
-        start_time = time.perf_counter()
+        # Repeat queries reuse the ranked chunk ids of this database generation
         k = K_RESULTS
-        
-        # Semantic search
-        if VERBOSE_RAG_LOGGING:
-            logger.info(f"Starting semantic search (k={k})...")
-        semantic_results = await state.annoy_index.query_async(user_embedding, n=k * 2, executor=state.executor)
-        
-        # Convert to (uuid, score) format for hybrid merging
-        semantic_scores = [(r.userdata, r.cosine_similarity) for r in semantic_results]
-        
-        # Hybrid search: combine with BM25 if enabled
-        if HYBRID_SEARCH_ENABLED and state.bm25_index and state.bm25_index.get_num_docs() > 0:
+        cached_ranking = query_cache.get_results("enrich", user_msg.content, k) if QUERY_CACHE_ENABLED else None
+        if cached_ranking is not None:
+            results = [make_query_result(uuid, score) for uuid, score in cached_ranking]
+            embedding_time = search_time = 0.0
             if VERBOSE_RAG_LOGGING:
-                logger.info("Performing hybrid search (semantic + keyword)...")
+                logger.info(f"Query result cache hit ({len(results)} ranked chunks)")
+        else:
+            # Create embeddings for the user's message
+            start_time = time.perf_counter()
             
-            # BM25 search
-            bm25_results = state.bm25_index.search(user_msg.content, n=k * 2)
+            # Limit user message size for embedding
+            if len(user_msg.content) > MAX_EMBEDDING_SIZE_CHARS:
+                logger.info(f"Truncating user message from {len(user_msg.content)} to {MAX_EMBEDDING_SIZE_CHARS} chars")
+                user_content_for_embedding = user_msg.content[:MAX_EMBEDDING_SIZE_CHARS]
+            else:
+                user_content_for_embedding = user_msg.content
+                
+            user_embedding = await embed_query(user_content_for_embedding)
+            embedding_time = (time.perf_counter() - start_time) * 1000
+            if VERBOSE_RAG_LOGGING:
+                logger.info(f"Time to create embeddings: {embedding_time:.2f} ms")
             
-            # Merge results
-            merged_results = merge_hybrid_results(
-                semantic_scores,
-                bm25_results,
-                semantic_weight=HYBRID_SEMANTIC_WEIGHT,
-                bm25_weight=HYBRID_KEYWORD_WEIGHT
-            )
+            # If embedding is empty, skip RAG enrichment
+            if not np.any(user_embedding):
+                logger.info("Empty user embedding; skipping RAG enrichment")
+                return
             
-            # Convert back to result objects with combined scores
-            results = []
-            for uuid, combined_score in merged_results:
-                result = type('QueryResult', (), {
-                    'userdata': uuid,
-                    'cosine_similarity': combined_score  # Using combined score as similarity
-                })
-                results.append(result)
+            # Query the vector database
+            start_time = time.perf_counter()
             
+            # Semantic search
             if VERBOSE_RAG_LOGGING:
-                logger.info(f"Hybrid search completed (weights: semantic={HYBRID_SEMANTIC_WEIGHT}, keyword={HYBRID_KEYWORD_WEIGHT})")
-        else:
-            results = semantic_results
+                logger.info(f"Starting semantic search (k={k})...")
+            semantic_results = await state.annoy_index.query_async(user_embedding, n=k * 2, executor=state.executor)
+            
+            # Convert to (uuid, score) format for hybrid merging
+            semantic_scores = [(r.userdata, r.cosine_similarity) for r in semantic_results]
+            
+            # Hybrid search: combine with BM25 if enabled
+            if HYBRID_SEARCH_ENABLED and state.bm25_index and state.bm25_index.get_num_docs() > 0:
+                if VERBOSE_RAG_LOGGING:
+                    logger.info("Performing hybrid search (semantic + keyword)...")
+                
+                # BM25 search
+                bm25_results = state.bm25_index.search(user_msg.content, n=k * 2)
+                
+                # Merge results
+                merged_results = merge_hybrid_results(
+                    semantic_scores,
+                    bm25_results,
+                    semantic_weight=HYBRID_SEMANTIC_WEIGHT,
+                    bm25_weight=HYBRID_KEYWORD_WEIGHT
+                )
+                
+                # Convert back to result objects with combined scores
+                results = []
+                for uuid, combined_score in merged_results:
+                    result = type('QueryResult', (), {
+                        'userdata': uuid,
+                        'cosine_similarity': combined_score  # Using combined score as similarity
+                    })
+                    results.append(result)
+                
+                if VERBOSE_RAG_LOGGING:
+                    logger.info(f"Hybrid search completed (weights: semantic={HYBRID_SEMANTIC_WEIGHT}, keyword={HYBRID_KEYWORD_WEIGHT})")
+            else:
+                results = semantic_results
+                if VERBOSE_RAG_LOGGING:
+                    logger.info("Semantic search completed.")
+            
+            search_time = (time.perf_counter() - start_time) * 1000
             if VERBOSE_RAG_LOGGING:
-                logger.info("Semantic search completed.")
-        
-        search_time = (time.perf_counter() - start_time) * 1000
-        if VERBOSE_RAG_LOGGING:
-            logger.info(f"Time to search: {search_time:.2f} ms")
+                logger.info(f"Time to search: {search_time:.2f} ms")
+            
+            if QUERY_CACHE_ENABLED:
+                query_cache.put_results("enrich", user_msg.content, k, [(r.userdata, r.cosine_similarity) for r in results])
         
-        # Collect candidate chunks above threshold
-        candidate_chunks = []
+        # Collect candidate chunks above threshold (one of each cross-document duplicate pair)
+        hits = []
         for result in results:
             chunk_data = state.chunks_metadata.get(result.userdata)
             if chunk_data and result.cosine_similarity > RELEVANCE_THRESHOLD:
-                chunk_text = chunk_data['text']
-                metadata = chunk_data['metadata']
-                
-                # Expand chunk with surrounding context
-                expanded_text = await expand_chunk_context(chunk_text, metadata)
-                
-                # Filter out unsafe characters (Chinese, emojis, etc.) that can crash TTS
-                expanded_text = filter_safe_text(expanded_text)
-                
-                candidate_chunks.append((expanded_text, result.cosine_similarity, metadata))
-                
-                if len(candidate_chunks) >= k:
-                    break
+                hits.append((result.userdata, chunk_data, result.cosine_similarity))
+        hits = [(chunk_data, similarity) for _, chunk_data, similarity in collapse_duplicates(hits)[:k]]
+        
+        # Expand all candidates with surrounding context concurrently
+        expanded_texts = await asyncio.gather(*(
+            expand_chunk_context(chunk_data['text'], chunk_data['metadata']) for chunk_data, _ in hits
+        ))
+        
+        candidate_chunks = []
+        token_counts = []
+        for (chunk_data, similarity), expanded_text in zip(hits, expanded_texts):
+            # Filter out unsafe characters (Chinese, emojis, etc.) that can crash TTS
+            safe_text = filter_safe_text(expanded_text)
+            candidate_chunks.append((safe_text, similarity, chunk_data['metadata']))
+            # Counted at ingestion; no tokenizer on the query path
+            token_counts.append(chunk_token_count(safe_text, chunk_data['metadata'], chunk_data['text']))
         
         # Apply context window budget
         selected_chunks = select_chunks_within_budget(
             candidate_chunks,
             max_tokens=MAX_CONTEXT_TOKENS,
-            reserve_tokens=100
+            reserve_tokens=100,
+            token_counts=token_counts
         )
         
         # Add selected chunks to chat context
@@ -408,8 +371,13 @@ async def enrich_with_rag(agent: Agent, chat_ctx: llm.ChatContext):
         return
 
 
-async def query_rag(search_string: str, num_results: int = 5) -> str:
-    """Query the RAG database with a search string and return results as formatted JSON."""
+async def query_rag(search_string: str, num_results: int = 5, chunk_filter: ChunkFilter = None) -> str:
+    """
+    Query the RAG database with a search string and return results as formatted JSON.
+    
+    chunk_filter (e.g. ChunkFilter(filenames=[...])) restricts the search to
+    matching chunks; only those are scored.
+    """
     try:
         if not state.rag_enabled:
             logger.info("RAG mechanism is disabled. Skipping query.")
@@ -450,37 +418,52 @@ async def query_rag(search_string: str, num_results: int = 5) -> str:
                 }
             }, indent=2)
         
-        # Create embeddings for the search string
-        start_time = time.perf_counter()
-        
-        # Limit search string size for embedding
-        if len(search_string) > MAX_EMBEDDING_SIZE_CHARS:
-            logger.info(f"Truncating search query from {len(search_string)} to {MAX_EMBEDDING_SIZE_CHARS} chars")
-            search_string_for_embedding = search_string[:MAX_EMBEDDING_SIZE_CHARS]
+        # Repeat queries reuse the ranked chunk ids of this database generation
+        cache_kind = ("query", chunk_filter.key()) if chunk_filter else "query"
+        cached_ranking = query_cache.get_results(cache_kind, search_string, num_results) if QUERY_CACHE_ENABLED else None
+        if cached_ranking is not None:
+            results = [make_query_result(uuid, score) for uuid, score in cached_ranking]
+            embedding_time = search_time = 0.0
+            if VERBOSE_RAG_LOGGING:
+                logger.info(f"Query result cache hit ({len(results)} ranked chunks)")
         else:
-            search_string_for_embedding = search_string
+            # Create embeddings for the search string
+            start_time = time.perf_counter()
             
-        # Mark this as a query to use priority semaphore
-        search_embedding = await create_embeddings(search_string_for_embedding, is_query=True)
-        embedding_time = (time.perf_counter() - start_time) * 1000
-        if VERBOSE_RAG_LOGGING:
-            logger.info(f"Time to create embeddings: {embedding_time:.2f} ms")
-        
-        # If embedding is empty, return empty results
-        if not np.any(search_embedding):
-            return json.dumps({"query": search_string, "retrieved_docs": [], "search_time_ms": embedding_time, "num_results": 0}, indent=2)
-        
-        # Query the vector database
-        start_time = time.perf_counter()
-        if VERBOSE_RAG_LOGGING:
-            logger.info(f"Starting search query for: {search_string}")
-        # Request more results to see what we're getting (even below threshold)
-        results = await state.annoy_index.query_async(search_embedding, n=num_results * 3, executor=state.executor)
-        if VERBOSE_RAG_LOGGING:
-            logger.info("Search query completed.")
-        search_time = (time.perf_counter() - start_time) * 1000
-        if VERBOSE_RAG_LOGGING:
-            logger.info(f"Time to search: {search_time:.2f} ms")
+            # Limit search string size for embedding
+            if len(search_string) > MAX_EMBEDDING_SIZE_CHARS:
+                logger.info(f"Truncating search query from {len(search_string)} to {MAX_EMBEDDING_SIZE_CHARS} chars")
+                search_string_for_embedding = search_string[:MAX_EMBEDDING_SIZE_CHARS]
+            else:
+                search_string_for_embedding = search_string
+                
+            # Query embeddings use the priority semaphore (and the query cache)
+            search_embedding = await embed_query(search_string_for_embedding)
+            embedding_time = (time.perf_counter() - start_time) * 1000
+            if VERBOSE_RAG_LOGGING:
+                logger.info(f"Time to create embeddings: {embedding_time:.2f} ms")
+            
+            # If embedding is empty, return empty results
+            if not np.any(search_embedding):
+                return json.dumps({"query": search_string, "retrieved_docs": [], "search_time_ms": embedding_time, "num_results": 0}, indent=2)
+            
+            # Query the vector database
+            start_time = time.perf_counter()
+            if VERBOSE_RAG_LOGGING:
+                logger.info(f"Starting search query for: {search_string}")
+            # Request more results to see what we're getting (even below threshold)
+            results = await state.annoy_index.query_async(
+                search_embedding, n=num_results * 3, executor=state.executor,
+                chunk_filter=chunk_filter, chunks_metadata=state.chunks_metadata
+            )
+            if VERBOSE_RAG_LOGGING:
+                logger.info("Search query completed.")
+            search_time = (time.perf_counter() - start_time) * 1000
+            if VERBOSE_RAG_LOGGING:
+                logger.info(f"Time to search: {search_time:.2f} ms")
+            
+            if QUERY_CACHE_ENABLED:
+                query_cache.put_results(cache_kind, search_string, num_results, [(r.userdata, r.cosine_similarity) for r in results])
         
         # DEBUG: Log top similarity scores (even if below threshold)
         if results:
@@ -493,46 +476,53 @@ async def query_rag(search_string: str, num_results: int = 5) -> str:
         results_above_threshold = 0
         results_below_threshold = 0
         
+        hits = []
         for result in results:
             chunk_data = state.chunks_metadata.get(result.userdata)
             if chunk_data:
                 if result.cosine_similarity > RELEVANCE_THRESHOLD:
-                    results_above_threshold += 1
-                    metadata = chunk_data['metadata']
-                    filename = metadata['filename']
-                    
-                    # Initialize document entry if not exists
-                    if filename not in documents_data:
-                        summary_data = state.document_summaries.get(filename, {})
-                        # Use extended summary (350 tokens) instead of short one-liner
-                        extended_summary = summary_data.get("extended_summary", summary_data.get("summary", "No summary available"))
-                        documents_data[filename] = {
-                            "source": filename,
-                            "summary": extended_summary,
-                            "keywords": ", ".join(summary_data.get("extended_keywords", summary_data.get("keywords", []))),
-                            "snippets": [],
-                            "max_similarity": result.cosine_similarity
-                        }
-                    
-                    # Expand chunk with surrounding context
-                    expanded_text = await expand_chunk_context(chunk_data['text'], metadata)
-                    
-                    # Filter out unsafe characters (Chinese, emojis, etc.) that can crash TTS
-                    expanded_text = filter_safe_text(expanded_text)
-                    
-                    # Add snippet
-                    snippet_data = {
-                        "text": expanded_text,
-                        "similarity": result.cosine_similarity,
-                        "chunk_index": metadata['chunk_index']
-                    }
-                    documents_data[filename]["snippets"].append(snippet_data)
-                    
-                    # Update max similarity
-                    if result.cosine_similarity > documents_data[filename]["max_similarity"]:
-                        documents_data[filename]["max_similarity"] = result.cosine_similarity
+                    hits.append((result.userdata, chunk_data, result.cosine_similarity))
                 else:
                     results_below_threshold += 1
+        results_above_threshold = len(hits)
+        hits = [(chunk_data, similarity) for _, chunk_data, similarity in collapse_duplicates(hits)]
+        
+        # Expand all chunks with surrounding context concurrently
+        expanded_texts = await asyncio.gather(*(
+            expand_chunk_context(chunk_data['text'], chunk_data['metadata']) for chunk_data, _ in hits
+        ))
+        
+        for (chunk_data, similarity), expanded_text in zip(hits, expanded_texts):
+            metadata = chunk_data['metadata']
+            filename = metadata['filename']
+            
+            # Initialize document entry if not exists
+            if filename not in documents_data:
+                summary_data = state.document_summaries.get(filename, {})
+                # Use extended summary (350 tokens) instead of short one-liner
+                extended_summary = summary_data.get("extended_summary", summary_data.get("summary", "No summary available"))
+                documents_data[filename] = {
+                    "source": filename,
+                    "summary": extended_summary,
+                    "keywords": ", ".join(summary_data.get("extended_keywords", summary_data.get("keywords", []))),
+                    "snippets": [],
+                    "max_similarity": similarity
+                }
+            
+            # Filter out unsafe characters (Chinese, emojis, etc.) that can crash TTS
+            expanded_text = filter_safe_text(expanded_text)
+            
+            # Add snippet
+            snippet_data = {
+                "text": expanded_text,
+                "similarity": similarity,
+                "chunk_index": metadata['chunk_index']
+            }
+            documents_data[filename]["snippets"].append(snippet_data)
+            
+            # Update max similarity
+            if similarity > documents_data[filename]["max_similarity"]:
+                documents_data[filename]["max_similarity"] = similarity
         
         # Log filtering results
         if results_above_threshold == 0 and results_below_threshold > 0:
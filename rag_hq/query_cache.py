@@ -0,0 +1,116 @@
+"""
+Per-process query cache for repeated and near-identical user utterances.
+
+Voice conversations repeat themselves ("ja", "wat is ...", follow-ups). Two
+bounded TTL caches keyed on normalized query text let repeats skip work:
+
+- query embeddings: a repeat never reaches the embedding server. Kept apart
+  from the ingestion embeddings cache so queries neither evict nor grow it.
+- ranked results: the (chunk uuid, score) list per query and result count,
+  valid for one index generation. It is dropped as soon as
+  state.last_db_modified_time changes (hot reload) or the index is swapped
+  in this process (invalidate()).
+"""
+import re
+import time
+import logging
+import unicodedata
+from collections import OrderedDict
+
+from .config import (
+    QUERY_CACHE_TTL_SECONDS, QUERY_EMBEDDING_CACHE_MAX_ENTRIES, QUERY_RESULT_CACHE_MAX_ENTRIES
+)
+from .state import state
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_query(text):
+    """Cache key for a query: NFKC, case-folded, punctuation and extra whitespace removed."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire after `ttl` seconds."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class QueryCache:
+    """Query embeddings and ranked results, keyed on normalized query text."""
+
+    def __init__(self):
+        self.embeddings = TTLCache(QUERY_EMBEDDING_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS)
+        self.results = TTLCache(QUERY_RESULT_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS)
+        self._generation = None
+
+    def get_embedding(self, text):
+        return self.embeddings.get(normalize_query(text))
+
+    def put_embedding(self, text, embedding):
+        self.embeddings.put(normalize_query(text), embedding)
+
+    def _check_generation(self):
+        if self._generation != state.last_db_modified_time:
+            if self._generation is not None and len(self.results):
+                logger.debug(f"Query result cache invalidated ({len(self.results)} entries, new database generation)")
+            self.results.clear()
+            self._generation = state.last_db_modified_time
+
+    def get_results(self, kind, text, n):
+        """Cached [(uuid, score), ...] for this query, or None."""
+        self._check_generation()
+        return self.results.get((kind, normalize_query(text), n))
+
+    def put_results(self, kind, text, n, ranked):
+        self._check_generation()
+        self.results.put((kind, normalize_query(text), n), list(ranked))
+
+    def invalidate(self):
+        """Drop cached results (the index was swapped in this process)."""
+        self.results.clear()
+
+    def stats(self):
+        return {
+            "embeddings": len(self.embeddings),
+            "embedding_hits": self.embeddings.hits,
+            "embedding_misses": self.embeddings.misses,
+            "results": len(self.results),
+            "result_hits": self.results.hits,
+            "result_misses": self.results.misses,
+        }
+
+
+# Per-process instance (job processes each keep their own)
+query_cache = QueryCache()
@@ -0,0 +1,442 @@
+"""
+Segment-based vector index: immutable base segments plus a small delta segment.
+
+Adding a document only appends its vectors to the delta (exact matrix backend,
+nothing to build). Deleting or replacing a document only records tombstones for
+its chunk ids. When the delta grows past SEGMENT_DELTA_MAX_ITEMS it is sealed
+into a new base segment (trees are built over the delta only); when there are
+too many base segments or too many tombstones, compaction merges all live
+vectors into a single base segment, off the event loop.
+
+Files next to VECTOR_DB_PATH ("vdb_data"):
+    vdb_data, vdb_data.map              base segment 0 (the classic single index)
+    vdb_data.seg<k>, vdb_data.seg<k>.map further base segments
+    vdb_data.delta, vdb_data.delta.map  delta segment
+    vdb_data.segments.json              segment list + tombstoned chunk ids (written last)
+
+A database without segments.json is a single base segment, so existing
+databases load unchanged.
+
+Searches can be restricted with a ChunkFilter (metadata_index.py): each
+segment then scores only its matching rows.
+"""
+import os
+import json
+import heapq
+import pickle
+import asyncio
+import logging
+import functools
+from collections.abc import Mapping
+
+import numpy as np
+import aiofiles.os
+
+from .config import (
+    VECTOR_DIM, VECTOR_INDEX_BACKEND, ANNOY_N_TREES, SEGMENT_DELTA_MAX_ITEMS,
+    SEGMENT_MAX_BASE_SEGMENTS, SEGMENT_TOMBSTONE_RATIO, SEGMENT_QUERY_OVERFETCH
+)
+from .vector_index import (
+    EnhancedAnnoyIndex, ExactBackend, INDEX_BACKENDS, make_query_result, stored_backend
+)
+from .metadata_index import MetadataIndex
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+MANIFEST_SUFFIX = ".segments.json"
+DELTA_SUFFIX = ".delta"
+DELTA_KEY = "delta"
+
+
+def _remove_files(path, suffixes):
+    for suffix in ('',) + tuple(suffixes):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _save_segment(segment, path):
+    """Write one segment next to its final path, then swap it in (sidecars first)."""
+    tmp_path = path + ".tmp"
+    segment.index.save(tmp_path)
+    with open(tmp_path + '.map', 'wb') as f:
+        pickle.dump(dict(segment.uuid_map), f)
+    for suffix in segment.file_suffixes():
+        os.replace(tmp_path + suffix, path + suffix)
+    os.replace(tmp_path, path)
+
+
+class _OffsetUuidMap(Mapping):
+    """Segment-local item id -> UUID, backed by a global (shared store) map."""
+
+    def __init__(self, global_map, offset, count):
+        self._global_map = global_map
+        self._offset = offset
+        self._count = count
+
+    def __getitem__(self, item_id):
+        if not 0 <= item_id < self._count:
+            raise KeyError(item_id)
+        return self._global_map[self._offset + item_id]
+
+    def __contains__(self, item_id):
+        return isinstance(item_id, (int, np.integer)) and 0 <= item_id < self._count
+
+    def __iter__(self):
+        return iter(range(self._count))
+
+    def __len__(self):
+        return self._count
+
+
+class _SegmentedUuidMap(Mapping):
+    """Global item id -> UUID across all segments (base segments in order, then delta)."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, item_id):
+        segment, local_id = self._index._locate(item_id)
+        return segment.uuid_map[local_id]
+
+    def __contains__(self, item_id):
+        try:
+            segment, local_id = self._index._locate(item_id)
+        except KeyError:
+            return False
+        return local_id in segment.uuid_map
+
+    def __iter__(self):
+        return iter(range(self._index.get_n_items()))
+
+    def __len__(self):
+        return self._index.get_n_items()
+
+
+class SegmentedIndex:
+    """Drop-in for EnhancedAnnoyIndex made of base segments, a delta and tombstones."""
+
+    def __init__(self, dim, backend=None):
+        self.dim = dim
+        self.backend = backend or VECTOR_INDEX_BACKEND
+        self.segments = []  # [(suffix, EnhancedAnnoyIndex)], immutable once built
+        self.delta = EnhancedAnnoyIndex(dim, backend=ExactBackend.name)
+        self.tombstones = set()  # chunk UUIDs deleted since the last compaction
+        self.uuid_map = _SegmentedUuidMap(self)
+        self._dirty = set()  # segment suffixes / DELTA_KEY that must be written
+        self._obsolete = set()  # segment suffixes whose files must be removed
+        self.metadata_index = MetadataIndex()  # Filter columns per segment (shared by forks)
+
+    # --- EnhancedAnnoyIndex-compatible surface ---
+
+    @property
+    def index(self):
+        # Callers use index.index.get_n_items() / get_item_vector() like an AnnoyIndex
+        return self
+
+    @property
+    def next_id(self):
+        return self.get_n_items()
+
+    @property
+    def backend_name(self):
+        return self.backend
+
+    def _all_segments(self):
+        return [segment for _, segment in self.segments] + [self.delta]
+
+    def get_n_items(self):
+        """Physical items, including tombstoned ones (item ids stay stable until compaction)."""
+        return sum(segment.index.get_n_items() for segment in self._all_segments())
+
+    def num_live_items(self):
+        return self.get_n_items() - len(self.tombstones)
+
+    def _locate(self, item_id):
+        offset = 0
+        for segment in self._all_segments():
+            count = segment.index.get_n_items()
+            if item_id < offset + count:
+                if item_id < 0:
+                    break
+                return segment, item_id - offset
+            offset += count
+        raise KeyError(item_id)
+
+    def get_item_vector(self, item_id):
+        segment, local_id = self._locate(item_id)
+        return segment.index.get_item_vector(local_id)
+
+    def get_vectors(self):
+        """All vectors in global item order."""
+        blocks = [segment.get_vectors() for segment in self._all_segments() if segment.index.get_n_items()]
+        if not blocks:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.concatenate([np.asarray(block, dtype=np.float32) for block in blocks])
+
+    def add_item(self, uuid_str, vector):
+        """New chunks always go to the delta segment."""
+        self.delta.add_item(uuid_str, vector)
+        self._dirty.add(DELTA_KEY)
+
+    def add_items(self, uuid_strs, vectors):
+        self.delta.add_items(uuid_strs, vectors)
+        self._dirty.add(DELTA_KEY)
+
+    def remove_uuids(self, uuid_strs):
+        """Tombstone chunks; they disappear from results immediately and physically at compaction."""
+        before = len(self.tombstones)
+        self.tombstones.update(uuid_strs)
+        if len(self.tombstones) != before:
+            self._dirty.add(MANIFEST_SUFFIX)
+
+    def build(self, n_trees=ANNOY_N_TREES):
+        """Finish an ingestion batch: seal the delta into a base segment once it is large.
+
+        The first build always seals, so VECTOR_DB_PATH (base segment 0) exists.
+        """
+        self.delta.build()
+        if not self.segments or self.delta.index.get_n_items() >= SEGMENT_DELTA_MAX_ITEMS:
+            self.seal_delta(n_trees)
+
+    def seal_delta(self, n_trees=ANNOY_N_TREES):
+        """Turn the delta into a new immutable base segment (blocking)."""
+        count = self.delta.index.get_n_items()
+        if count == 0:
+            return
+        segment = EnhancedAnnoyIndex(self.dim, backend=self.backend)
+        segment.add_items([self.delta.uuid_map[i] for i in range(count)], self.delta.get_vectors())
+        segment.build(n_trees)
+
+        used = {suffix for suffix, _ in self.segments}
+        suffix = '' if '' not in used else next(
+            f".seg{k}" for k in range(1, len(used) + 2) if f".seg{k}" not in used
+        )
+        self.segments.append((suffix, segment))
+        self._obsolete.discard(suffix)
+        self.delta = EnhancedAnnoyIndex(self.dim, backend=ExactBackend.name)
+        self._dirty.update({suffix, DELTA_KEY, MANIFEST_SUFFIX})
+        logger.info(f"✓ Sealed delta into base segment '{suffix or 'base'}' ({count:,} items)")
+
+    def needs_compaction(self):
+        return (len(self.segments) > SEGMENT_MAX_BASE_SEGMENTS or
+                len(self.tombstones) > SEGMENT_TOMBSTONE_RATIO * max(self.get_n_items(), 1))
+
+    def compacted(self, n_trees=ANNOY_N_TREES):
+        """Return a new index with all live vectors in one base segment (blocking)."""
+        uuids = []
+        blocks = []
+        for segment in self._all_segments():
+            count = segment.index.get_n_items()
+            if count == 0:
+                continue
+            segment_uuids = [segment.uuid_map.get(i) for i in range(count)]
+            keep = [i for i, u in enumerate(segment_uuids) if u and u not in self.tombstones]
+            uuids.extend(segment_uuids[i] for i in keep)
+            blocks.append(np.asarray(segment.get_vectors(), dtype=np.float32)[keep])
+
+        base = EnhancedAnnoyIndex(self.dim, backend=self.backend)
+        if blocks:
+            base.add_items(uuids, np.concatenate(blocks))
+        base.build(n_trees)
+
+        compacted = SegmentedIndex(self.dim, self.backend)
+        compacted.segments = [('', base)]
+        compacted._dirty = {'', DELTA_KEY, MANIFEST_SUFFIX}
+        compacted._obsolete = {suffix for suffix, _ in self.segments if suffix} | self._obsolete
+        return compacted
+
+    def fork(self):
+        """Copy for an ingestion run: base segments are shared, delta and tombstones copied."""
+        clone = SegmentedIndex(self.dim, self.backend)
+        clone.segments = list(self.segments)
+        count = self.delta.index.get_n_items()
+        if count:
+            clone.delta.add_items([self.delta.uuid_map[i] for i in range(count)], self.delta.get_vectors())
+        clone.tombstones = set(self.tombstones)
+        clone._dirty = set(self._dirty)
+        clone._obsolete = set(self._obsolete)
+        clone.metadata_index = self.metadata_index
+        return clone
+
+    def snapshot(self):
+        """Read-only view for searching while the index keeps changing (e.g. outside a writer's lock).
+
+        Base segments are immutable and the delta's matrix is replaced, never written
+        in place, on every append, so both are shared; only the delta's item map and
+        the tombstones are copied.
+        """
+        view = SegmentedIndex(self.dim, self.backend)
+        view.segments = list(self.segments)
+        count = self.delta.index.get_n_items()
+        view.delta.index.matrix = self.delta.get_vectors()[:count]
+        view.delta.uuid_map = {i: self.delta.uuid_map[i] for i in range(count)}
+        view.delta.next_id = count
+        view.tombstones = set(self.tombstones)
+        view.metadata_index = self.metadata_index
+        return view
+
+    def unload(self):
+        for segment in self._all_segments():
+            segment.index.unload()
+
+    # --- Search ---
+
+    def _live_hits(self, segment, vector, n, fetch, fetched, rows=None):
+        """Live (similarity, uuid) hits of one segment, starting from the (ids, similarities) of a fetch."""
+        count = segment.index.get_n_items() if rows is None else len(rows)
+        ids, similarities = fetched
+        while True:
+            live = []
+            for item_id, similarity in zip(ids, similarities):
+                uuid_str = segment.uuid_map.get(item_id)
+                if uuid_str and uuid_str not in self.tombstones:
+                    live.append((similarity, uuid_str))
+            # Tombstones may have eaten the top hits: widen the search until n are live
+            if len(live) >= n or fetch >= count:
+                return live[:n]
+            fetch = min(count, fetch * 2)
+            ids, similarities = segment.index.search(vector, fetch, rows)
+
+    def search(self, vector, n, chunk_filter=None, chunks_metadata=None):
+        """Top-n (cosine similarity, uuid) over all segments, skipping tombstones (blocking)."""
+        return self.search_batch(np.asarray([vector]), n, chunk_filter, chunks_metadata)[0]
+
+    def search_batch(self, vectors, n, chunk_filter=None, chunks_metadata=None):
+        """search() for several query vectors, one scan per segment for all of them (blocking).
+
+        Args:
+            chunk_filter: Optional ChunkFilter; only matching chunks are scored
+            chunks_metadata: Chunk records the filter is evaluated on (required with a filter)
+        """
+        candidates = [[] for _ in range(len(vectors))]
+        for segment in self._all_segments():
+            count = segment.index.get_n_items()
+            rows = None
+            if chunk_filter:
+                rows = self.metadata_index.rows(segment, chunks_metadata, chunk_filter)
+                count = len(rows)
+            if count == 0:
+                continue
+            fetch = min(count, n + SEGMENT_QUERY_OVERFETCH)
+            batch = segment.index.search_batch(vectors, fetch, rows)
+            for hits, vector, fetched in zip(candidates, vectors, batch):
+                hits.extend(self._live_hits(segment, vector, n, fetch, fetched, rows))
+        return [heapq.nlargest(n, hits, key=lambda candidate: candidate[0]) for hits in candidates]
+
+    async def query_async(self, vector, n, executor, chunk_filter=None, chunks_metadata=None):
+        """Query all segments for the closest matches using cosine similarity."""
+        return (await self.query_batch_async([vector], n, executor, chunk_filter, chunks_metadata))[0]
+
+    async def query_batch_async(self, vectors, n, executor, chunk_filter=None, chunks_metadata=None):
+        """query_async() for several vectors in one executor call and one scan per segment."""
+        # Normalize query vectors
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1)
+
+        loop = asyncio.get_running_loop()
+        batches = await loop.run_in_executor(
+            executor, functools.partial(self.search_batch, vectors, n, chunk_filter, chunks_metadata)
+        )
+        return [[make_query_result(uuid_str, similarity) for similarity, uuid_str in hits] for hits in batches]
+
+    # --- Persistence ---
+
+    def file_suffixes(self):
+        return ('.map', MANIFEST_SUFFIX)
+
+    def save(self, file_path):
+        """Write only what changed: new segments, the delta and the manifest (blocking)."""
+        for suffix, segment in self.segments:
+            if suffix in self._dirty:
+                _save_segment(segment, file_path + suffix)
+
+        delta_path = file_path + DELTA_SUFFIX
+        if DELTA_KEY in self._dirty:
+            if self.delta.index.get_n_items():
+                _save_segment(self.delta, delta_path)
+            else:
+                _remove_files(delta_path, self.delta.file_suffixes())
+
+        manifest = {
+            'format_version': 1,
+            'backend': self.backend,
+            'segments': [suffix for suffix, _ in self.segments],
+            'tombstones': sorted(self.tombstones),
+        }
+        tmp_manifest = file_path + MANIFEST_SUFFIX + ".tmp"
+        with open(tmp_manifest, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest, file_path + MANIFEST_SUFFIX)
+
+        sidecars = {'.map'}.union(*(backend.sidecar_suffixes for backend in INDEX_BACKENDS.values()))
+        for suffix in self._obsolete:
+            _remove_files(file_path + suffix, sidecars)
+        self._dirty.clear()
+        self._obsolete.clear()
+
+    async def save_async(self, file_path, executor):
+        """Save changed segments asynchronously (each file is swapped in atomically)."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self.save, file_path)
+
+    @classmethod
+    def load(cls, file_path, uuid_map=None, convert=True):
+        """Load all segments (blocking).
+
+        Args:
+            uuid_map: Global item id -> UUID map (shared store); replaces the .map pickles
+            convert: Convert segments to VECTOR_INDEX_BACKEND if stored differently
+        """
+        manifest_path = file_path + MANIFEST_SUFFIX
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        else:
+            manifest = {'segments': [''], 'tombstones': []}
+
+        index = cls(VECTOR_DIM)
+        offset = 0
+
+        def load_segment(path, backend=None):
+            nonlocal offset
+            if backend is None and not convert:
+                backend = stored_backend(path)
+            segment = EnhancedAnnoyIndex.load(path, uuid_map={} if uuid_map is not None else None, backend=backend)
+            count = segment.index.get_n_items()
+            if uuid_map is not None:
+                segment.uuid_map = _OffsetUuidMap(uuid_map, offset, count)
+                segment.next_id = count
+            offset += count
+            return segment
+
+        for suffix in manifest['segments']:
+            index.segments.append((suffix, load_segment(file_path + suffix)))
+        if os.path.exists(file_path + DELTA_SUFFIX):
+            index.delta = load_segment(file_path + DELTA_SUFFIX, backend=ExactBackend.name)
+        index.tombstones = set(manifest.get('tombstones', []))
+        return index
+
+    @classmethod
+    async def load_async(cls, file_path, executor):
+        """Load all segments asynchronously."""
+        if not await aiofiles.os.path.exists(file_path):
+            raise FileNotFoundError(f"Index file not found: {file_path}")
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, lambda: cls.load(file_path))
+
+    @classmethod
+    async def attach_shared(cls, file_path, store, executor):
+        """Load all segments with UUIDs served from a shared-store generation."""
+        if not await aiofiles.os.path.exists(file_path):
+            raise FileNotFoundError(f"Index file not found: {file_path}")
+
+        loop = asyncio.get_running_loop()
+        index = await loop.run_in_executor(executor, lambda: cls.load(file_path, uuid_map=store.uuid_map))
+
+        if index.get_n_items() != store.num_items:
+            raise ValueError(f"Shared store has {store.num_items} items, index has {index.get_n_items()}")
+        return index
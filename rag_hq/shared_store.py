@@ -0,0 +1,484 @@
+"""
+Read-only, memory-mapped snapshot of the vector database for job processes.
+
+Every LiveKit job process used to unpickle metadata.pkl and bm25_index.pkl (and
+load the embeddings cache) into its own heap. Instead, the process that builds
+the database exports ONE generation of flat NumPy arrays + a record blob, and
+job processes attach with np.load(mmap_mode='r'). All processes then share the
+same page-cache pages, so an extra idle process costs almost no RSS and attaching
+takes milliseconds.
+
+Layout (SHARED_STORE_DIR/gen-<n>/):
+    manifest.json            counts, generation, source mtime (written last)
+    ids.npy                  chunk UUIDs (bytes) in Annoy item order
+    ids_sorted.npy           same UUIDs sorted (binary-search lookup)
+    ids_sorted_rows.npy      item row of each sorted UUID
+    vectors.npy              float16 [n, VECTOR_DIM] normalized vectors, item order
+    records.bin              JSON chunk records ({'text', 'metadata', ...}), utf-8
+    record_offsets.npy       int64 [n + 1] byte offsets into records.bin
+    filenames.npy            document names (utf-8 bytes), referenced by filename_ids
+    filename_ids.npy         int32 [n] document of each row (-1: no filename / tombstoned)
+    chunk_indexes.npy        int64 [n] chunk index of each row (-1: summary chunk)
+    bm25_terms.npy           sorted vocabulary (utf-8 bytes)
+    bm25_term_offsets.npy    int64 [n_terms + 1] posting list boundaries
+    bm25_postings_rows.npy   int32 item rows, grouped per term
+    bm25_postings_tf.npy     float32 term frequencies, aligned with rows
+    bm25_idf.npy             float64 IDF per term
+    bm25_doc_norms.npy       float64 k1 * (1 - b + b * len / avg_len) per row
+
+SHARED_STORE_DIR/CURRENT holds the name of the active generation and is swapped
+atomically, so readers never see a half-written generation.
+"""
+import os
+import json
+import time
+import fcntl
+import pickle
+import shutil
+import logging
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import numpy as np
+
+from .bm25_index import tokenize, bm25_top_k
+from .chunk_store import ChunkStore, chunk_store_exists
+from .config import (
+    VECTOR_DB_PATH, VECTOR_DIM,
+    SHARED_STORE_DIR, SHARED_STORE_KEEP_GENERATIONS
+)
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+STORE_FORMAT_VERSION = 3
+CURRENT_POINTER_PATH = os.path.join(SHARED_STORE_DIR, "CURRENT")
+LOCK_PATH = os.path.join(SHARED_STORE_DIR, ".lock")
+MANIFEST_NAME = "manifest.json"
+
+
+# ===========================
+# Helpers
+# ===========================
+
+@contextmanager
+def _store_lock():
+    """Inter-process lock so only one process exports a generation at a time."""
+    os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+    with open(LOCK_PATH, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _source_mtime():
+    """Integer mtime of the Annoy file (same value used for hot-reload checks)."""
+    try:
+        return int(os.stat(VECTOR_DB_PATH).st_mtime)
+    except OSError:
+        return None
+
+
+def _load_array(path):
+    """Memory-map a .npy file; zero-length arrays cannot be mapped and are loaded."""
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)
+
+
+def _bytes_array(values):
+    """Fixed-width bytes array (numpy 'S' dtype) for a list of str."""
+    encoded = [v.encode('utf-8') for v in values]
+    width = max((len(v) for v in encoded), default=1) or 1
+    return np.array(encoded, dtype=f'S{width}')
+
+
+def read_current_manifest():
+    """Return (generation_dir, manifest) of the active generation, or (None, None)."""
+    try:
+        with open(CURRENT_POINTER_PATH, "r") as f:
+            gen_name = f.read().strip()
+        gen_dir = os.path.join(SHARED_STORE_DIR, gen_name)
+        with open(os.path.join(gen_dir, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != STORE_FORMAT_VERSION:
+            return None, None
+        return gen_dir, manifest
+    except (OSError, ValueError):
+        return None, None
+
+
+def is_store_current(manifest):
+    """True if the manifest was exported from the database currently on disk."""
+    return manifest is not None and manifest.get('source_mtime') == _source_mtime()
+
+
+# ===========================
+# Writer (runs once per database generation)
+# ===========================
+
+def _write_bm25(gen_dir, bm25_index, ids):
+    """Write the frozen BM25 posting lists with documents renumbered to item rows."""
+    frozen = bm25_index.freeze()
+    row_of = {uuid_str: row for row, uuid_str in enumerate(ids)}
+    doc_rows = np.array([row_of.get(u, -1) for u in bm25_index.doc_uuids], dtype=np.int64)
+
+    rows = doc_rows[frozen['postings_docs']] if len(doc_rows) else np.zeros(0, dtype=np.int64)
+    keep = rows >= 0
+    # Postings of documents missing from the index are dropped; shift offsets to match
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    term_offsets = kept_before[frozen['term_offsets']].astype(np.int64)
+
+    doc_norms = np.zeros(len(ids), dtype=np.float64)
+    present = doc_rows >= 0
+    doc_norms[doc_rows[present]] = frozen['doc_norms'][present]
+
+    np.save(os.path.join(gen_dir, "bm25_terms.npy"), _bytes_array(frozen['terms']))
+    np.save(os.path.join(gen_dir, "bm25_term_offsets.npy"), term_offsets)
+    np.save(os.path.join(gen_dir, "bm25_postings_rows.npy"), rows[keep].astype(np.int32))
+    np.save(os.path.join(gen_dir, "bm25_postings_tf.npy"), frozen['postings_tf'][keep])
+    np.save(os.path.join(gen_dir, "bm25_idf.npy"), frozen['idf'])
+    np.save(os.path.join(gen_dir, "bm25_doc_norms.npy"), doc_norms)
+
+    return {
+        'k1': bm25_index.k1,
+        'b': bm25_index.b,
+        'num_docs': bm25_index.get_num_docs(),
+        'num_terms': len(frozen['terms']),
+    }
+
+
+def write_shared_store(annoy_index, chunks_metadata, bm25_index=None, source_mtime=None):
+    """Export the in-memory database as a new shared-store generation (blocking).
+
+    Call from a thread pool. Returns the generation directory.
+    """
+    with _store_lock():
+        return _write_generation(annoy_index, chunks_metadata, bm25_index, source_mtime)
+
+
+def _write_generation(annoy_index, chunks_metadata, bm25_index, source_mtime):
+    start_time = time.time()
+    generation = time.time_ns()
+    gen_name = f"gen-{generation}"
+    gen_dir = os.path.join(SHARED_STORE_DIR, gen_name)
+    tmp_dir = gen_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # Item order == index item order, so a hit's item id IS the row.
+    # Tombstoned items (no metadata) keep their row with an empty id.
+    num_items = annoy_index.index.get_n_items()
+    ids = [annoy_index.uuid_map.get(i, "") for i in range(num_items)]
+    ids = [u if u in chunks_metadata else "" for u in ids]
+
+    ids_array = _bytes_array(ids)
+    sort_rows = np.argsort(ids_array, kind='stable').astype(np.int32)
+    np.save(os.path.join(tmp_dir, "ids.npy"), ids_array)
+    np.save(os.path.join(tmp_dir, "ids_sorted.npy"), ids_array[sort_rows])
+    np.save(os.path.join(tmp_dir, "ids_sorted_rows.npy"), sort_rows)
+
+    vectors_path = os.path.join(tmp_dir, "vectors.npy")
+    if num_items == 0:
+        np.save(vectors_path, np.zeros((0, VECTOR_DIM), dtype=np.float16))
+    else:
+        vectors = np.lib.format.open_memmap(
+            vectors_path, mode='w+', dtype=np.float16, shape=(num_items, VECTOR_DIM)
+        )
+        vectors[:] = annoy_index.get_vectors()[:num_items]
+        vectors.flush()
+        del vectors
+
+    # Metadata filter columns, so filtered searches never decode records
+    offsets = np.zeros(num_items + 1, dtype=np.int64)
+    filenames = {}
+    filename_ids = np.full(num_items, -1, dtype=np.int32)
+    chunk_indexes = np.zeros(num_items, dtype=np.int64)
+    with open(os.path.join(tmp_dir, "records.bin"), "wb") as f:
+        for i, uuid_str in enumerate(ids):
+            record = chunks_metadata.get(uuid_str) or {}
+            metadata = record.get('metadata', {})
+            filename = metadata.get('filename')
+            if filename:
+                filename_ids[i] = filenames.setdefault(filename, len(filenames))
+            chunk_index = metadata.get('chunk_index')
+            if metadata.get('chunk_type') == 'summary' or chunk_index == -1:
+                chunk_indexes[i] = -1
+            elif isinstance(chunk_index, int):
+                chunk_indexes[i] = chunk_index
+            blob = json.dumps(record, ensure_ascii=False, default=str).encode('utf-8')
+            f.write(blob)
+            offsets[i + 1] = offsets[i] + len(blob)
+    np.save(os.path.join(tmp_dir, "record_offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "filenames.npy"), _bytes_array(list(filenames)))
+    np.save(os.path.join(tmp_dir, "filename_ids.npy"), filename_ids)
+    np.save(os.path.join(tmp_dir, "chunk_indexes.npy"), chunk_indexes)
+
+    bm25_info = _write_bm25(tmp_dir, bm25_index, ids) if bm25_index is not None else None
+
+    manifest = {
+        'format_version': STORE_FORMAT_VERSION,
+        'generation': generation,
+        'source_mtime': source_mtime if source_mtime is not None else _source_mtime(),
+        'num_items': num_items,
+        'num_chunks': sum(1 for u in ids if u),
+        'num_documents': len(filenames),
+        'vector_dim': VECTOR_DIM,
+        'bm25': bm25_info,
+        'created_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(tmp_dir, gen_dir)
+
+    tmp_pointer = CURRENT_POINTER_PATH + ".tmp"
+    with open(tmp_pointer, "w") as f:
+        f.write(gen_name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, CURRENT_POINTER_PATH)
+
+    _cleanup_old_generations(keep=gen_name)
+
+    logger.info(f"✓ Shared store generation {gen_name} written: {num_items:,} items "
+                f"in {(time.time() - start_time) * 1000:.0f} ms")
+    return gen_dir
+
+
+def _cleanup_old_generations(keep):
+    """Remove old generations; recent ones stay for processes still attached to them.
+
+    Unlinking a mapped file is safe on POSIX (pages live until the last unmap),
+    the grace generations just keep CURRENT readers from racing the delete.
+    """
+    generations = sorted(
+        (name for name in os.listdir(SHARED_STORE_DIR)
+         if name.startswith("gen-") and not name.endswith(".tmp") and name != keep),
+        key=lambda name: int(name.split("-", 1)[1])
+    )
+    stale = generations[:max(0, len(generations) - (SHARED_STORE_KEEP_GENERATIONS - 1))]
+    for name in stale:
+        shutil.rmtree(os.path.join(SHARED_STORE_DIR, name), ignore_errors=True)
+        logger.debug(f"Removed old shared store generation {name}")
+
+
+def _export_from_disk():
+    """Export a generation from the database files on disk (blocking)."""
+    from .segments import SegmentedIndex
+    from .database_operations import BM25_INDEX_PATH
+
+    source_mtime = _source_mtime()
+
+    # Stored backend as-is: only the vectors and ids are exported
+    annoy_index = SegmentedIndex.load(VECTOR_DB_PATH, convert=False)
+
+    chunks_metadata = ChunkStore.open()
+
+    bm25_index = None
+    if os.path.exists(BM25_INDEX_PATH):
+        with open(BM25_INDEX_PATH, 'rb') as f:
+            bm25_index = pickle.load(f)
+
+    try:
+        return _write_generation(annoy_index, chunks_metadata, bm25_index, source_mtime)
+    finally:
+        annoy_index.unload()
+
+
+def ensure_shared_store():
+    """Make sure the active generation matches the database on disk (blocking).
+
+    The first process to find the store missing or stale exports it from the
+    database files; every other process waits on the lock and then just attaches.
+    Returns the manifest of the active generation, or None if there is no database.
+    """
+    if _source_mtime() is None or not chunk_store_exists():
+        return None
+
+    _, manifest = read_current_manifest()
+    if is_store_current(manifest):
+        return manifest
+
+    with _store_lock():
+        _, manifest = read_current_manifest()
+        if is_store_current(manifest):
+            return manifest
+
+        logger.info("🔄 Shared store missing or stale - exporting from database files...")
+        _export_from_disk()
+        _, manifest = read_current_manifest()
+        return manifest
+
+
+# ===========================
+# Reader (zero-copy attach)
+# ===========================
+
+class SharedStore:
+    """One attached generation; all arrays are read-only memory maps."""
+
+    def __init__(self, gen_dir, manifest):
+        self.gen_dir = gen_dir
+        self.manifest = manifest
+        self.generation = manifest['generation']
+        self.num_items = manifest['num_items']
+        self.num_chunks = manifest.get('num_chunks', self.num_items)  # Excludes tombstoned rows
+        self.num_documents = manifest.get('num_documents', 0)
+
+        path = lambda name: os.path.join(gen_dir, name)
+        self.ids = _load_array(path("ids.npy"))
+        self.ids_sorted = _load_array(path("ids_sorted.npy"))
+        self.ids_sorted_rows = _load_array(path("ids_sorted_rows.npy"))
+        self.vectors = _load_array(path("vectors.npy"))
+        self.record_offsets = _load_array(path("record_offsets.npy"))
+        self.records = (np.memmap(path("records.bin"), dtype=np.uint8, mode='r')
+                        if self.record_offsets[-1] > 0 else np.zeros(0, dtype=np.uint8))
+        self.filenames = [name.decode('utf-8') for name in np.load(path("filenames.npy"))]
+        self.filename_ids = _load_array(path("filename_ids.npy"))
+        self.chunk_indexes = _load_array(path("chunk_indexes.npy"))
+
+        self.uuid_map = MappedUuidMap(self)
+        self.chunks_metadata = MappedChunksMetadata(self)
+        self.bm25_index = MappedBM25Index(self) if manifest.get('bm25') else None
+
+    @classmethod
+    def open_current(cls):
+        """Attach to the active generation, or return None if there is none."""
+        gen_dir, manifest = read_current_manifest()
+        if manifest is None:
+            return None
+        return cls(gen_dir, manifest)
+
+    def uuid_for_row(self, row):
+        return self.ids[row].decode('utf-8')
+
+    def row_for_uuid(self, uuid_str):
+        """Binary search over the sorted id array; returns None if absent."""
+        if not uuid_str:
+            return None  # Tombstoned rows have an empty id
+        key = uuid_str.encode('utf-8')
+        pos = int(np.searchsorted(self.ids_sorted, key))
+        if pos < self.num_items and self.ids_sorted[pos] == key:
+            return int(self.ids_sorted_rows[pos])
+        return None
+
+    def rows_for_uuids(self, uuid_strs):
+        """Vectorised row_for_uuid; returns int64 rows with -1 for absent ids."""
+        rows = np.full(len(uuid_strs), -1, dtype=np.int64)
+        if not self.num_items or not len(uuid_strs):
+            return rows
+        keys = np.array([(u or '').encode('utf-8') for u in uuid_strs], dtype=self.ids_sorted.dtype)
+        pos = np.minimum(np.searchsorted(self.ids_sorted, keys), self.num_items - 1)
+        found = (np.asarray(self.ids_sorted[pos]) == keys) & (keys != b'')
+        rows[found] = np.asarray(self.ids_sorted_rows[pos[found]])
+        return rows
+
+    def record(self, row):
+        """Decode one chunk record; only the touched pages are read."""
+        start, end = self.record_offsets[row], self.record_offsets[row + 1]
+        return json.loads(self.records[start:end].tobytes().decode('utf-8'))
+
+
+class MappedUuidMap(Mapping):
+    """Annoy item id -> chunk UUID, backed by the shared id array."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, item_id):
+        if not isinstance(item_id, (int, np.integer)) or not 0 <= item_id < self._store.num_items:
+            raise KeyError(item_id)
+        return self._store.uuid_for_row(item_id)
+
+    def __contains__(self, item_id):
+        return isinstance(item_id, (int, np.integer)) and 0 <= item_id < self._store.num_items
+
+    def __iter__(self):
+        return iter(range(self._store.num_items))
+
+    def __len__(self):
+        return self._store.num_items
+
+
+class MappedChunksMetadata(Mapping):
+    """Read-only drop-in for state.chunks_metadata (uuid -> record dict)."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, uuid_str):
+        row = self._store.row_for_uuid(uuid_str) if isinstance(uuid_str, str) else None
+        if row is None:
+            raise KeyError(uuid_str)
+        return self._store.record(row)
+
+    def __contains__(self, uuid_str):
+        return isinstance(uuid_str, str) and self._store.row_for_uuid(uuid_str) is not None
+
+    def __iter__(self):
+        for row in range(self._store.num_items):
+            uuid_str = self._store.uuid_for_row(row)
+            if uuid_str:
+                yield uuid_str
+
+    def __len__(self):
+        return self._store.num_chunks
+
+    def metadata_columns(self, uuid_strs):
+        """Filename ids and chunk indexes of chunk ids, read from the shared columns.
+
+        Returns:
+            (filename table, filename ids into it (-1: unknown chunk or no filename),
+            chunk indexes (-1 marks summary chunks))
+        """
+        store = self._store
+        rows = store.rows_for_uuids(uuid_strs)
+        found = rows >= 0
+        filename_ids = np.full(len(uuid_strs), -1, dtype=np.int32)
+        chunk_indexes = np.zeros(len(uuid_strs), dtype=np.int64)
+        filename_ids[found] = store.filename_ids[rows[found]]
+        chunk_indexes[found] = store.chunk_indexes[rows[found]]
+        return store.filenames, filename_ids, chunk_indexes
+
+
+class MappedBM25Index:
+    """BM25 search over the shared posting lists (same ranking as BM25Index)."""
+
+    def __init__(self, store):
+        path = lambda name: os.path.join(store.gen_dir, name)
+        info = store.manifest['bm25']
+        self._store = store
+        self.k1 = info['k1']
+        self.b = info['b']
+        self.num_docs = info['num_docs']
+        self.terms = _load_array(path("bm25_terms.npy"))
+        self.term_offsets = _load_array(path("bm25_term_offsets.npy"))
+        self.postings_rows = _load_array(path("bm25_postings_rows.npy"))
+        self.postings_tf = _load_array(path("bm25_postings_tf.npy"))
+        self.idf = _load_array(path("bm25_idf.npy"))
+        self.doc_norms = _load_array(path("bm25_doc_norms.npy"))
+
+    def tokenize(self, text):
+        return tokenize(text)
+
+    def _term_id(self, term):
+        key = term.encode('utf-8')
+        pos = int(np.searchsorted(self.terms, key))
+        if pos < len(self.terms) and self.terms[pos] == key:
+            return pos
+        return None
+
+    def search(self, query, n=10):
+        """Return the top-n (uuid, score) tuples sorted by score descending."""
+        term_ids = [t for t in map(self._term_id, self.tokenize(query)) if t is not None]
+        top = bm25_top_k(
+            term_ids, self.term_offsets, self.postings_rows, self.postings_tf,
+            self.idf, self.doc_norms, self.k1, n
+        )
+        return [(self._store.uuid_for_row(row), score) for row, score in top]
+
+    def get_num_docs(self):
+        return self.num_docs
@@ -7,6 +7,7 @@ from concurrent.futures import ThreadPoolExecutor
 import aiofiles
 import aiofiles.os
 import logging
+from collections import OrderedDict
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
@@ -44,6 +45,7 @@ class RAGState:
         self.document_texts = LazyDocumentTexts()
         self.annoy_index = None
         self.bm25_index = None  # Keyword-based search index
+        self.shared_store = None  # Attached mmap generation (see shared_store.py)
         self.rag_enabled = False
         self.update_task = None
         self.nlp = None
@@ -56,6 +58,7 @@ class RAGState:
         self._lock_pid = None
         self.embedding_semaphore = None
         self.query_semaphore = None
+        self.embedding_coalescer = None  # Per-process micro-batcher (see embeddings.py)
         self._semaphores_pid = None
         self.is_ingesting = False
         self.last_db_modified_time = 0  # Track when the database file was last loaded
@@ -74,9 +77,12 @@ class RAGState:
         if self._semaphores_pid != current_pid:
             # CRITICAL: Server has --batch-size 512 (total across all concurrent requests)
             # With 410 token chunks: 2 concurrent × 410 = 820 tokens > 512 (exceeds batch!)
-            # Must use 1 concurrent request during ingestion to avoid batch size overflow
+            # Must use 1 concurrent request during ingestion to avoid batch size overflow.
+            # Throughput comes from multi-input requests instead: each request is packed
+            # up to EMBEDDING_BATCH_TOKEN_BUDGET tokens (see embeddings.EmbeddingCoalescer).
             self.embedding_semaphore = asyncio.Semaphore(1)  # Changed from 2 to 1
             self.query_semaphore = asyncio.Semaphore(1)
+            self.embedding_coalescer = None  # Bound to the old process' event loop
             self._semaphores_pid = current_pid
     
     @property
@@ -89,21 +95,24 @@ class RAGState:
 # Global state instance
 state = RAGState()
 
-# Document text cache for LRU
-_document_text_cache = {}
-_document_text_cache_order = []
+# Document text cache for LRU (OrderedDict: most recently used last)
+_document_text_cache = OrderedDict()
 
 
 async def save_document_text(filename, text):
-    """Save document text to disk for lazy loading."""
+    """Save document text to disk for lazy loading, plus its sentence-boundary index."""
     from .config import DOCUMENT_TEXTS_DIR
+    from .document_index import save_document_index
     
     safe_filename = filename.replace('/', '_').replace('\\', '_')
     file_path = os.path.join(DOCUMENT_TEXTS_DIR, safe_filename)
     
     try:
-        async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
+        # newline='' keeps the file's character offsets equal to the chunks' char_start/char_end
+        async with aiofiles.open(file_path, 'w', encoding='utf-8', newline='') as f:
             await f.write(text)
+        await asyncio.get_running_loop().run_in_executor(state.executor, save_document_index, filename, text)
+        _document_text_cache.pop(filename, None)
         logger.debug(f"Saved document text for {filename} to disk")
         return True
     except Exception as e:
@@ -114,12 +123,9 @@ async def save_document_text(filename, text):
 async def get_document_text(filename):
     """Get document text with lazy loading from disk."""
     from .config import DOCUMENT_TEXTS_DIR, DOCUMENT_TEXT_CACHE_MAX_SIZE
-    global _document_text_cache, _document_text_cache_order
-    
     # Check cache first
     if filename in _document_text_cache:
-        _document_text_cache_order.remove(filename)
-        _document_text_cache_order.append(filename)
+        _document_text_cache.move_to_end(filename)
         return _document_text_cache[filename]
     
     # Load from disk
@@ -132,12 +138,10 @@ async def get_document_text(filename):
                 text = await f.read()
             
             _document_text_cache[filename] = text
-            _document_text_cache_order.append(filename)
             
             # Enforce cache size limit
             if len(_document_text_cache) > DOCUMENT_TEXT_CACHE_MAX_SIZE:
-                oldest = _document_text_cache_order.pop(0)
-                _document_text_cache.pop(oldest)
+                oldest, _ = _document_text_cache.popitem(last=False)
                 logger.debug(f"Removed {oldest} from document text cache (LRU)")
             
             return text
@@ -156,7 +160,6 @@ async def preload_all_documents():
     Call this during RAG initialization if EXTENSIVE_SEARCH_PRELOAD_DOCUMENTS is enabled.
     """
     from .config import DOCUMENT_TEXTS_DIR
-    global _document_text_cache, _document_text_cache_order
     
     if not state.document_summaries:
         logger.warning("No document summaries available for preloading")
@@ -182,7 +185,6 @@ async def preload_all_documents():
                     text = await f.read()
                 
                 _document_text_cache[filename] = text
-                _document_text_cache_order.append(filename)
                 
                 preloaded_count += 1
                 total_size_mb += len(text) / 1024 / 1024
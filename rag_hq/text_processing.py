@@ -14,10 +14,11 @@ import numpy as np
 
 from .config import (
     CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_RATIO, MAX_CHUNK_SIZE_CHARS,
-    SAFE_EMBEDDING_SIZE_CHARS
+    DEDUP_BLOCK_ROWS
 )
 from .state import state
-from .embeddings import create_embeddings, _embedding_cache_key
+from .embeddings import create_embeddings_batch, _embedding_cache_key
+from .token_counter import count_tokens
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
@@ -105,74 +106,104 @@ def is_valid_chunk(text: str) -> bool:
     return True
 
 
+def load_spacy_model():
+    """Load the spaCy sentence segmentation model (blocking). Returns None if unavailable."""
+    try:
+        # Force spaCy to use CPU only (disable GPU)
+        spacy.require_cpu()
+        
+        import importlib.util
+        if importlib.util.find_spec("en_core_web_sm") is not None:
+            nlp = spacy.load("en_core_web_sm")
+            logger.info("spaCy model loaded successfully (CPU-only mode)")
+            return nlp
+        else:
+            try:
+                nlp = spacy.load("en")
+                logger.info("spaCy model 'en' loaded successfully (CPU-only mode)")
+                return nlp
+            except:
+                logger.warning("No spaCy model found, falling back to simple segmentation")
+                return None
+    except:
+        logger.warning("spaCy initialization failed, falling back to simple segmentation")
+        return None
+
+
 async def initialize_spacy():
     """Initialize spaCy model for sentence segmentation asynchronously."""
-    def _load_spacy():
-        try:
-            # Force spaCy to use CPU only (disable GPU)
-            spacy.require_cpu()
-            
-            import importlib.util
-            if importlib.util.find_spec("en_core_web_sm") is not None:
-                nlp = spacy.load("en_core_web_sm")
-                logger.info("spaCy model loaded successfully (CPU-only mode)")
-                return nlp
-            else:
-                try:
-                    nlp = spacy.load("en")
-                    logger.info("spaCy model 'en' loaded successfully (CPU-only mode)")
-                    return nlp
-                except:
-                    logger.warning("No spaCy model found, falling back to simple segmentation")
-                    return None
-        except:
-            logger.warning("spaCy initialization failed, falling back to simple segmentation")
-            return None
-    
     loop = asyncio.get_running_loop()
-    state.nlp = await loop.run_in_executor(state.executor, _load_spacy)
+    state.nlp = await loop.run_in_executor(state.executor, load_spacy_model)
 
 
-async def extract_text_from_pdf(file_path):
-    """Extract text from a PDF file asynchronously."""
-    logger.info(f"Extracting text from PDF: {file_path}")
+def extract_text_from_pdf_sync(file_path):
+    """Extract text from a PDF file (blocking)."""
+    text = ""
+    try:
+        with open(file_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            for i, page in enumerate(reader.pages):
+                page_text = page.extract_text()
+                if page_text:
+                    text += f"\n[Page {i+1}]\n{page_text}\n\n"
+        return text
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF {file_path}: {e}")
+        return ""
+
+
+def extract_text_from_docx_sync(file_path):
+    """Extract text from a DOCX file (blocking)."""
+    text = ""
+    try:
+        doc = docx.Document(file_path)
+        for para in doc.paragraphs:
+            if para.text.strip():
+                text += para.text + "\n\n"
+        return text
+    except Exception as e:
+        logger.error(f"Error extracting text from DOCX {file_path}: {e}")
+        return ""
+
+
+def extract_text_sync(file_path):
+    """Extract text from a document based on its file extension (blocking).
+    
+    Used directly by the ingestion pipeline's worker processes.
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
     
-    def _extract_pdf():
-        text = ""
+    if file_ext == '.pdf':
+        logger.info(f"Extracting text from PDF: {file_path}")
+        return extract_text_from_pdf_sync(file_path)
+    elif file_ext in ['.docx', '.doc']:
+        logger.info(f"Extracting text from DOCX: {file_path}")
+        return extract_text_from_docx_sync(file_path)
+    elif file_ext in ['.txt', '.md', '.csv', '.json']:
+        logger.info(f"Extracting text from TXT: {file_path}")
         try:
-            with open(file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                for i, page in enumerate(reader.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += f"\n[Page {i+1}]\n{page_text}\n\n"
-            return text
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+                return file.read()
         except Exception as e:
-            logger.error(f"Error extracting text from PDF {file_path}: {e}")
+            logger.error(f"Error extracting text from TXT {file_path}: {e}")
             return ""
-    
+    else:
+        logger.warning(f"Unsupported file format: {file_ext} for file {file_path}")
+        return ""
+
+
+async def extract_text_from_pdf(file_path):
+    """Extract text from a PDF file asynchronously."""
+    logger.info(f"Extracting text from PDF: {file_path}")
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(state.executor, _extract_pdf)
+    return await loop.run_in_executor(state.executor, extract_text_from_pdf_sync, file_path)
 
 
 async def extract_text_from_docx(file_path):
     """Extract text from a DOCX file asynchronously."""
     logger.info(f"Extracting text from DOCX: {file_path}")
-    
-    def _extract_docx():
-        text = ""
-        try:
-            doc = docx.Document(file_path)
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    text += para.text + "\n\n"
-            return text
-        except Exception as e:
-            logger.error(f"Error extracting text from DOCX {file_path}: {e}")
-            return ""
-    
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(state.executor, _extract_docx)
+    return await loop.run_in_executor(state.executor, extract_text_from_docx_sync, file_path)
 
 
 async def extract_text_from_txt(file_path):
@@ -201,96 +232,65 @@ async def extract_text(file_path):
         return ""
 
 
-async def smart_chunk_text(text: str, filename: str) -> List[Tuple[str, Dict]]:
-    """Enhanced text chunking with character-based sizing and metadata."""
+def chunk_document_text(text: str, filename: str, nlp=None) -> List[Tuple[str, Dict]]:
+    """Split a document into sentence-aligned chunks with metadata (blocking).
+    
+    Chunks end at sentence boundaries, so after an edit the chunks fall back
+    onto the same sentences within a few chunks; re-ingestion diffs chunks by
+    text hash and only embeds the ones that changed (see ingestion_pipeline.py).
+    
+    Args:
+        text: Document text
+        filename: Document name stored in the chunk metadata
+        nlp: spaCy pipeline for sentence segmentation (None: regex split)
+    """
     if not text or not text.strip():
         return []
     
-    def _chunk_text():
-        chunks_with_metadata = []
-        
-        # Use spaCy for sentence segmentation if available
-        if state.nlp:
-            doc = state.nlp(text)
-            sentences = [sent.text.strip() for sent in doc.sents if sent.text.strip()]
+    chunks_with_metadata = []
+    
+    # Use spaCy for sentence segmentation if available
+    if nlp:
+        doc = nlp(text)
+        sentences = [sent.text.strip() for sent in doc.sents if sent.text.strip()]
+    else:
+        sentences = re.split(r'(?<=[.!?])\s+', text)
+        sentences = [s.strip() for s in sentences if s.strip()]
+    
+    if not sentences:
+        return []
+    
+    # Use configured chunk size (now supports up to 1250 tokens with 2048 context)
+    from .config import CHUNK_SIZE_TOKENS
+    adjusted_chunk_size_tokens = CHUNK_SIZE_TOKENS
+    
+    current_chunk = []
+    current_chars = 0
+    estimated_tokens = 0
+    chunk_index = 0
+    
+    chars_per_token = 4
+    target_tokens = adjusted_chunk_size_tokens
+    target_chars = target_tokens * chars_per_token
+    
+    # Track character positions for context expansion
+    char_position = 0
+    sentence_positions = []
+    
+    for sentence in sentences:
+        start_pos = text.find(sentence, char_position)
+        if start_pos != -1:
+            sentence_positions.append((start_pos, start_pos + len(sentence)))
+            char_position = start_pos + len(sentence)
         else:
-            sentences = re.split(r'(?<=[.!?])\s+', text)
-            sentences = [s.strip() for s in sentences if s.strip()]
-        
-        if not sentences:
-            return []
-        
-        # Use configured chunk size (now supports up to 1250 tokens with 2048 context)
-        from .config import CHUNK_SIZE_TOKENS
-        adjusted_chunk_size_tokens = CHUNK_SIZE_TOKENS
-        
-        current_chunk = []
-        current_chars = 0
-        estimated_tokens = 0
-        chunk_index = 0
-        
-        chars_per_token = 4
-        target_tokens = adjusted_chunk_size_tokens
-        target_chars = target_tokens * chars_per_token
-        
-        # Track character positions for context expansion
-        char_position = 0
-        sentence_positions = []
-        
-        for sentence in sentences:
-            start_pos = text.find(sentence, char_position)
-            if start_pos != -1:
-                sentence_positions.append((start_pos, start_pos + len(sentence)))
-                char_position = start_pos + len(sentence)
-            else:
-                sentence_positions.append((char_position, char_position + len(sentence)))
-                char_position += len(sentence)
-        
-        for i, sentence in enumerate(sentences):
-            sentence_chars = len(sentence)
-            sentence_tokens = sentence_chars / chars_per_token
-            
-            if estimated_tokens + sentence_tokens > target_tokens and current_chunk:
-                chunk_text = ' '.join(current_chunk)
-                
-                # Enforce hard character limit (normal behavior when breaking at sentence boundaries)
-                if len(chunk_text) > MAX_CHUNK_SIZE_CHARS:
-                    logger.debug(f"Chunk exceeds MAX_CHUNK_SIZE_CHARS ({len(chunk_text)} > {MAX_CHUNK_SIZE_CHARS}), truncating")
-                    chunk_text = chunk_text[:MAX_CHUNK_SIZE_CHARS]
-                
-                chunk_start_idx = i - len(current_chunk)
-                chunk_end_idx = i - 1
-                
-                if chunk_start_idx >= 0 and chunk_end_idx < len(sentence_positions):
-                    char_start = sentence_positions[chunk_start_idx][0]
-                    char_end = sentence_positions[chunk_end_idx][1]
-                else:
-                    char_start = 0
-                    char_end = len(chunk_text)
-                
-                metadata = {
-                    'filename': filename,
-                    'chunk_index': chunk_index,
-                    'start_sentence': chunk_index * (1 - CHUNK_OVERLAP_RATIO),
-                    'estimated_tokens': estimated_tokens,
-                    'char_start': char_start,
-                    'char_end': char_end
-                }
-                chunks_with_metadata.append((chunk_text, metadata))
-                
-                # Start new chunk with overlap
-                overlap_sentences = int(len(current_chunk) * CHUNK_OVERLAP_RATIO)
-                current_chunk = current_chunk[-overlap_sentences:] if overlap_sentences > 0 else []
-                current_chars = sum(len(s) for s in current_chunk)
-                estimated_tokens = current_chars / chars_per_token
-                chunk_index += 1
-            
-            current_chunk.append(sentence)
-            current_chars += sentence_chars
-            estimated_tokens = current_chars / chars_per_token
+            sentence_positions.append((char_position, char_position + len(sentence)))
+            char_position += len(sentence)
+    
+    for i, sentence in enumerate(sentences):
+        sentence_chars = len(sentence)
+        sentence_tokens = sentence_chars / chars_per_token
         
-        # Add the last chunk
-        if current_chunk:
+        if estimated_tokens + sentence_tokens > target_tokens and current_chunk:
             chunk_text = ' '.join(current_chunk)
             
             # Enforce hard character limit (normal behavior when breaking at sentence boundaries)
@@ -298,8 +298,8 @@ async def smart_chunk_text(text: str, filename: str) -> List[Tuple[str, Dict]]:
                 logger.debug(f"Chunk exceeds MAX_CHUNK_SIZE_CHARS ({len(chunk_text)} > {MAX_CHUNK_SIZE_CHARS}), truncating")
                 chunk_text = chunk_text[:MAX_CHUNK_SIZE_CHARS]
             
-            chunk_start_idx = len(sentences) - len(current_chunk)
-            chunk_end_idx = len(sentences) - 1
+            chunk_start_idx = i - len(current_chunk)
+            chunk_end_idx = i - 1
             
             if chunk_start_idx >= 0 and chunk_end_idx < len(sentence_positions):
                 char_start = sentence_positions[chunk_start_idx][0]
@@ -313,26 +313,74 @@ async def smart_chunk_text(text: str, filename: str) -> List[Tuple[str, Dict]]:
                 'chunk_index': chunk_index,
                 'start_sentence': chunk_index * (1 - CHUNK_OVERLAP_RATIO),
                 'estimated_tokens': estimated_tokens,
+                'token_count': count_tokens(chunk_text),
                 'char_start': char_start,
                 'char_end': char_end
             }
             chunks_with_metadata.append((chunk_text, metadata))
+            
+            # Start new chunk with overlap
+            overlap_sentences = int(len(current_chunk) * CHUNK_OVERLAP_RATIO)
+            current_chunk = current_chunk[-overlap_sentences:] if overlap_sentences > 0 else []
+            current_chars = sum(len(s) for s in current_chunk)
+            estimated_tokens = current_chars / chars_per_token
+            chunk_index += 1
         
-        # Filter out invalid chunks (TOC, page numbers, etc.)
-        valid_chunks = []
-        for chunk_text, metadata in chunks_with_metadata:
-            if is_valid_chunk(chunk_text):
-                valid_chunks.append((chunk_text, metadata))
-            else:
-                logger.debug(f"Skipping invalid chunk {metadata['chunk_index']} from {filename}: {chunk_text[:100]}...")
+        current_chunk.append(sentence)
+        current_chars += sentence_chars
+        estimated_tokens = current_chars / chars_per_token
+    
+    # Add the last chunk
+    if current_chunk:
+        chunk_text = ' '.join(current_chunk)
+        
+        # Enforce hard character limit (normal behavior when breaking at sentence boundaries)
+        if len(chunk_text) > MAX_CHUNK_SIZE_CHARS:
+            logger.debug(f"Chunk exceeds MAX_CHUNK_SIZE_CHARS ({len(chunk_text)} > {MAX_CHUNK_SIZE_CHARS}), truncating")
+            chunk_text = chunk_text[:MAX_CHUNK_SIZE_CHARS]
+        
+        chunk_start_idx = len(sentences) - len(current_chunk)
+        chunk_end_idx = len(sentences) - 1
         
-        if len(valid_chunks) < len(chunks_with_metadata):
-            logger.info(f"Filtered out {len(chunks_with_metadata) - len(valid_chunks)} invalid chunks from {filename}")
+        if chunk_start_idx >= 0 and chunk_end_idx < len(sentence_positions):
+            char_start = sentence_positions[chunk_start_idx][0]
+            char_end = sentence_positions[chunk_end_idx][1]
+        else:
+            char_start = 0
+            char_end = len(chunk_text)
         
-        return valid_chunks
+        metadata = {
+            'filename': filename,
+            'chunk_index': chunk_index,
+            'start_sentence': chunk_index * (1 - CHUNK_OVERLAP_RATIO),
+            'estimated_tokens': estimated_tokens,
+            'token_count': count_tokens(chunk_text),
+            'char_start': char_start,
+            'char_end': char_end
+        }
+        chunks_with_metadata.append((chunk_text, metadata))
+    
+    # Filter out invalid chunks (TOC, page numbers, etc.)
+    valid_chunks = []
+    for chunk_text, metadata in chunks_with_metadata:
+        if is_valid_chunk(chunk_text):
+            valid_chunks.append((chunk_text, metadata))
+        else:
+            logger.debug(f"Skipping invalid chunk {metadata['chunk_index']} from {filename}: {chunk_text[:100]}...")
+    
+    if len(valid_chunks) < len(chunks_with_metadata):
+        logger.info(f"Filtered out {len(chunks_with_metadata) - len(valid_chunks)} invalid chunks from {filename}")
+    
+    return valid_chunks
+
+
+async def smart_chunk_text(text: str, filename: str) -> List[Tuple[str, Dict]]:
+    """Enhanced text chunking with character-based sizing and metadata."""
+    if not text or not text.strip():
+        return []
     
     loop = asyncio.get_running_loop()
-    chunks_with_metadata = await loop.run_in_executor(state.executor, _chunk_text)
+    chunks_with_metadata = await loop.run_in_executor(state.executor, chunk_document_text, text, filename, state.nlp)
     
     # Deduplicate nearly identical chunks
     deduplicated_chunks = await deduplicate_chunks(chunks_with_metadata)
@@ -340,40 +388,60 @@ async def smart_chunk_text(text: str, filename: str) -> List[Tuple[str, Dict]]:
     return deduplicated_chunks
 
 
+def near_duplicate_mask(embeddings, similarity_threshold: float = 0.95, block_rows: int = DEDUP_BLOCK_ROWS) -> np.ndarray:
+    """
+    Boolean mask of the rows to keep: a row is dropped if its cosine similarity
+    with an earlier kept row exceeds the threshold (same result as comparing
+    every pair in order). Similarities are computed as one matrix multiply per
+    block of rows, so memory stays at block_rows x n.
+    
+    Args:
+        embeddings: Normalized vectors, one row per chunk
+        similarity_threshold: Cosine similarity above which a row is a duplicate
+        block_rows: Rows compared against all earlier rows at a time
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    n = len(matrix)
+    keep = np.ones(n, dtype=bool)
+    for start in range(0, n, block_rows):
+        end = min(n, start + block_rows)
+        similar = (matrix[start:end] @ matrix[:end].T) > similarity_threshold
+        # Only compare with earlier rows
+        similar &= np.arange(end)[None, :] < np.arange(start, end)[:, None]
+        # Rows without any similar earlier row are kept; the rest depend on which earlier rows survived
+        for offset in np.flatnonzero(similar.any(axis=1)):
+            i = start + offset
+            keep[i] = not np.any(similar[offset, :i] & keep[:i])
+    return keep
+
+
+async def embed_and_deduplicate_chunks(chunks_with_metadata: List[Tuple[str, Dict]],
+                                       similarity_threshold: float = 0.95) -> Tuple[List[Tuple[str, Dict]], List[np.ndarray]]:
+    """
+    Embed chunks (cleaned text, as they are indexed) and drop near-duplicates.
+    
+    Returns:
+        (unique chunks, their embeddings) - the vectors are carried on to indexing
+    """
+    if not chunks_with_metadata:
+        return [], []
+    
+    # One multi-input request per token-budgeted batch instead of one per chunk
+    texts_for_embedding = [clean_text_for_embedding(chunk_text) for chunk_text, _ in chunks_with_metadata]
+    chunk_embeddings = await create_embeddings_batch(texts_for_embedding)
+    if len(chunks_with_metadata) == 1:
+        return chunks_with_metadata, chunk_embeddings
+    
+    loop = asyncio.get_running_loop()
+    keep = await loop.run_in_executor(state.executor, near_duplicate_mask, chunk_embeddings, similarity_threshold)
+    unique_indices = np.flatnonzero(keep)
+    if len(unique_indices) < len(chunks_with_metadata):
+        logger.debug(f"Dropped {len(chunks_with_metadata) - len(unique_indices)} near-duplicate chunks")
+    return [chunks_with_metadata[i] for i in unique_indices], [chunk_embeddings[i] for i in unique_indices]
+
+
 async def deduplicate_chunks(chunks_with_metadata: List[Tuple[str, Dict]], 
                       similarity_threshold: float = 0.95) -> List[Tuple[str, Dict]]:
     """Remove nearly identical chunks based on cosine similarity."""
-    if len(chunks_with_metadata) <= 1:
-        return chunks_with_metadata
-    
-    # Create embeddings for all chunks
-    chunk_embeddings = []
-    for i, (chunk_text, metadata) in enumerate(chunks_with_metadata):
-        # Clean text before embedding
-        chunk_text_cleaned = clean_text_for_embedding(chunk_text)
-        
-        chunk_size = len(chunk_text_cleaned)
-        if chunk_size > SAFE_EMBEDDING_SIZE_CHARS:
-            logger.warning(f"Chunk {i} too large ({chunk_size} chars), truncating to {SAFE_EMBEDDING_SIZE_CHARS}")
-            chunk_text_for_embedding = chunk_text_cleaned[:SAFE_EMBEDDING_SIZE_CHARS]
-        else:
-            chunk_text_for_embedding = chunk_text_cleaned
-        
-        logger.debug(f"Chunk {i}: {len(chunk_text_for_embedding)} chars (original: {chunk_size})")
-        embedding = await create_embeddings(chunk_text_for_embedding)
-        chunk_embeddings.append(embedding)
-    
-    # Find duplicates
-    unique_indices = []
-    for i in range(len(chunks_with_metadata)):
-        is_duplicate = False
-        for j in unique_indices:
-            sim = np.dot(chunk_embeddings[i], chunk_embeddings[j])
-            if sim > similarity_threshold:
-                is_duplicate = True
-                break
-        
-        if not is_duplicate:
-            unique_indices.append(i)
-    
-    return [chunks_with_metadata[i] for i in unique_indices]
+    unique_chunks, _ = await embed_and_deduplicate_chunks(chunks_with_metadata, similarity_threshold)
+    return unique_chunks
@@ -1,118 +1,225 @@
 """
-Token counting utilities for context window management.
+Token accounting for context budgets and embedding limits.
+
+Counts come from the tiktoken cl100k_base encoding (the one the embedding
+path already used) instead of a 4-characters-per-token estimate:
+
+- chunk_document_text stores every chunk's exact count in its metadata
+  ('token_count'), so query-time counts of (expanded) chunks are derived from
+  it with chunk_token_count instead of running the tokenizer
+- truncation encodes a text once and cuts it at a token boundary; token
+  counts of shorter prefixes are a bisect over the token offsets
+- select_chunks_within_budget packs candidates by their counts with a 0/1
+  knapsack over the budget, then fills what is left with a truncated chunk
 """
+import math
+import bisect
 import logging
-from typing import List, Tuple
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+import tiktoken
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
-# Approximate token counting (4 chars per token is typical for English)
-CHARS_PER_TOKEN = 4
+TOKEN_ENCODING = "cl100k_base"
+TOKEN_COUNT_CACHE_SIZE = 4096  # Exact counts kept for repeated texts (queries, summaries)
+MIN_TRUNCATED_CHUNK_TOKENS = 100  # Smallest useful truncated chunk when filling leftover budget
+
+_encoding = None
+
+
+def get_encoding():
+    """The shared tiktoken encoding (loaded on first use)."""
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    return _encoding
+
 
+def encode(text: str) -> List[int]:
+    # Text such as "<|endoftext|>" in a document is ordinary text here
+    return get_encoding().encode(text, disallowed_special=())
 
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
 def count_tokens(text: str) -> int:
     """
-    Estimate token count from text length.
-    This is approximate but fast. For production, consider using tiktoken.
-    
+    Exact token count of a text (cached).
+
     Args:
         text: Input text
-        
+
     Returns:
-        Estimated token count
+        Token count
     """
-    return len(text) // CHARS_PER_TOKEN
+    return len(encode(text))
 
 
 def count_tokens_batch(texts: List[str]) -> List[int]:
     """
     Count tokens for multiple texts.
-    
+
     Args:
         texts: List of input texts
-        
+
     Returns:
         List of token counts
     """
     return [count_tokens(text) for text in texts]
 
 
+def chunk_token_count(text: str, metadata: Optional[dict] = None, chunk_text: Optional[str] = None) -> int:
+    """
+    Token count of a retrieved chunk, possibly expanded with surrounding context.
+
+    Uses the count stored at ingestion (metadata['token_count']) and scales it
+    by the chunk's own characters-per-token ratio for text added around it;
+    chunks ingested without a stored count are counted exactly.
+
+    Args:
+        text: Text to count (the chunk itself or its expanded context)
+        metadata: Chunk metadata
+        chunk_text: The stored chunk text the count belongs to (default: `text`)
+    """
+    stored = metadata.get('token_count') if metadata else None
+    if stored is None:
+        return count_tokens(text)
+    base_length = len(chunk_text) if chunk_text is not None else len(text)
+    if base_length == 0 or len(text) == base_length:
+        return stored
+    return math.ceil(len(text) * stored / base_length)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> Tuple[str, int]:
+    """
+    Cut text to at most max_tokens tokens at a token boundary (encodes once).
+
+    Returns:
+        (text, token_count) tuple
+    """
+    max_tokens = max(0, max_tokens)
+    tokens = encode(text)
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    _, offsets = get_encoding().decode_with_offsets(tokens)
+    return text[:offsets[max_tokens]], max_tokens
+
+
+def truncate_with_count(text: str, max_tokens: int) -> Tuple[str, int]:
+    """
+    Truncate text to fit within a token limit, preferring a sentence end.
+
+    Returns:
+        (truncated text, token count) tuple
+    """
+    tokens = encode(text)
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    if max_tokens <= 1:
+        return "", 0
+    _, offsets = get_encoding().decode_with_offsets(tokens)
+
+    # Try to find the last complete sentence in the final 20% of the allowed tokens
+    cut = offsets[max_tokens]
+    truncated = text[:cut]
+    for punct in ['. ', '? ', '! ', '\n\n']:
+        last_punct = truncated.rfind(punct)
+        if last_punct > cut * 0.8:
+            end = last_punct + len(punct)
+            # Tokens starting before the cut (the trailing space may share a token)
+            return text[:end], min(max_tokens, bisect.bisect_left(offsets, end))
+
+    # Otherwise truncate one token earlier and add an ellipsis
+    return text[:offsets[max_tokens - 1]].rstrip() + "...", max_tokens
+
+
 def truncate_to_token_limit(text: str, max_tokens: int) -> str:
     """
     Truncate text to fit within token limit.
-    
+
     Args:
         text: Input text
         max_tokens: Maximum number of tokens
-        
+
     Returns:
         Truncated text
     """
-    max_chars = max_tokens * CHARS_PER_TOKEN
-    if len(text) <= max_chars:
-        return text
-    
-    # Truncate at last sentence boundary if possible
-    truncated = text[:max_chars]
-    
-    # Try to find last complete sentence
-    for punct in ['. ', '? ', '! ', '\n\n']:
-        last_punct = truncated.rfind(punct)
-        if last_punct > max_chars * 0.8:  # At least 80% of target
-            return truncated[:last_punct + len(punct)]
-    
-    # Otherwise just truncate with ellipsis
-    return truncated.rstrip() + "..."
+    return truncate_with_count(text, max_tokens)[0]
+
+
+def _knapsack(weights: List[int], values: List[float], capacity: int) -> List[int]:
+    """Indices of the items with the highest total value whose weights fit in capacity (0/1)."""
+    best = np.zeros(capacity + 1)  # best[c]: highest value within c tokens
+    take = np.zeros((len(weights), capacity + 1), dtype=bool)
+    for i, (weight, value) in enumerate(zip(weights, values)):
+        if weight > capacity:
+            continue
+        candidate = best[:capacity + 1 - weight] + value
+        improved = candidate > best[weight:]
+        take[i, weight:] = improved
+        best[weight:] = np.where(improved, candidate, best[weight:])
+
+    chosen = []
+    remaining = capacity
+    for i in range(len(weights) - 1, -1, -1):
+        if take[i, remaining]:
+            chosen.append(i)
+            remaining -= weights[i]
+    return sorted(chosen)
 
 
 def select_chunks_within_budget(
     chunks: List[Tuple[str, float, dict]],
     max_tokens: int,
-    reserve_tokens: int = 100
+    reserve_tokens: int = 100,
+    token_counts: Optional[List[int]] = None
 ) -> List[Tuple[str, float, dict]]:
     """
     Select chunks that fit within token budget while prioritizing by similarity.
-    
+
+    When not everything fits, the chunks with the highest total similarity that
+    fit are chosen (0/1 knapsack on token counts); leftover budget is filled
+    with the best excluded chunk, truncated.
+
     Args:
         chunks: List of (text, similarity, metadata) tuples, sorted by similarity
         max_tokens: Maximum total tokens allowed
         reserve_tokens: Tokens to reserve for formatting/overhead
-        
+        token_counts: Token count per chunk (default: counted with the tokenizer)
+
     Returns:
-        List of selected chunks that fit within budget
+        List of selected chunks that fit within budget, in their original order
     """
-    available_tokens = max_tokens - reserve_tokens
-    selected = []
-    total_tokens = 0
-    
-    for chunk_text, similarity, metadata in chunks:
-        chunk_tokens = count_tokens(chunk_text)
-        
-        if total_tokens + chunk_tokens <= available_tokens:
-            selected.append((chunk_text, similarity, metadata))
-            total_tokens += chunk_tokens
+    available_tokens = max(0, max_tokens - reserve_tokens)
+    if token_counts is None:
+        token_counts = [count_tokens(chunk_text) for chunk_text, _, _ in chunks]
+
+    if sum(token_counts) <= available_tokens:
+        return list(chunks)
+
+    chosen = _knapsack(token_counts, [similarity for _, similarity, _ in chunks], available_tokens)
+    selected = {i: chunks[i] for i in chosen}
+    total_tokens = sum(token_counts[i] for i in chosen)
+
+    # Fill the rest with a truncated version of the best chunk left out
+    remaining_tokens = available_tokens - total_tokens
+    excluded = [i for i in range(len(chunks)) if i not in selected]
+    if excluded and remaining_tokens > 200:  # Only if meaningful amount left
+        i = excluded[0]
+        chunk_text, similarity, metadata = chunks[i]
+        truncated, truncated_tokens = truncate_with_count(chunk_text, remaining_tokens)
+        if truncated_tokens > MIN_TRUNCATED_CHUNK_TOKENS:
+            selected[i] = (truncated, similarity, metadata)
+            total_tokens += truncated_tokens
             logger.debug(
-                f"Added chunk from {metadata.get('filename', 'unknown')} "
-                f"({chunk_tokens} tokens, total: {total_tokens}/{available_tokens})"
-            )
-        else:
-            # Check if we can fit a truncated version
-            remaining_tokens = available_tokens - total_tokens
-            if remaining_tokens > 200:  # Only if meaningful amount left
-                truncated = truncate_to_token_limit(chunk_text, remaining_tokens)
-                if count_tokens(truncated) > 100:  # At least 100 tokens useful
-                    selected.append((truncated, similarity, metadata))
-                    total_tokens += count_tokens(truncated)
-                    logger.debug(
-                        f"Added truncated chunk from {metadata.get('filename', 'unknown')} "
-                        f"({count_tokens(truncated)} tokens, total: {total_tokens}/{available_tokens})"
-                    )
-            
-            logger.info(
-                f"Context budget reached: {total_tokens}/{available_tokens} tokens used, "
-                f"{len(chunks) - len(selected)} chunks excluded"
+                f"Added truncated chunk from {metadata.get('filename', 'unknown')} "
+                f"({truncated_tokens} tokens, total: {total_tokens}/{available_tokens})"
             )
-            break
-    
-    return selected
 
+    logger.info(
+        f"Context budget reached: {total_tokens}/{available_tokens} tokens used, "
+        f"{len(chunks) - len(selected)} chunks excluded"
+    )
+    return [selected[i] for i in sorted(selected)]
@@ -0,0 +1,77 @@
+"""
+TTS-safe text normalization shared by the chunk RAG (rag_hq) and the Q&A RAG (rag_qa).
+
+Both query modules had their own copy of filter_safe_text, walking every
+character in Python on each retrieved text. The same rules are now compiled
+once into a str.translate table (replacements) and precompiled regexes
+(allowed characters, whitespace):
+
+- dashes, special spaces, ligatures and the ellipsis are replaced by ASCII
+- kept: printable ASCII, tab/newline/carriage return, Latin letters below
+  U+024F, and a few useful symbols (€ • ‘ ’ “ ”)
+- everything else becomes a space (CJK/emoji/other text >= U+3000 is logged)
+- whitespace runs collapse to one space
+
+Ingestion applies sanitize_tts_chars to document texts before chunking, so
+stored chunks and texts already hold only allowed characters; filter_safe_text
+at query time then verifies that with one regex search and only collapses
+whitespace.
+"""
+import re
+import logging
+
+logger = logging.getLogger("rag-assistant-enhanced")
+
+# Unicode replacement mapping - convert to TTS-safe equivalents
+TTS_REPLACEMENTS = str.maketrans({
+    # Dashes -> hyphen
+    '\u2013': '-',    # – En dash
+    '\u2014': '-',    # — Em dash
+    '\u2015': '-',    # ― Horizontal bar
+    # Spaces -> regular space
+    '\u00a0': ' ',    # Non-breaking space
+    '\u202f': ' ',    # Narrow no-break space
+    '\u2009': ' ',    # Thin space
+    # Ligatures -> letter equivalents
+    '\ufb00': 'ff',   # ﬀ -> ff
+    '\ufb01': 'fi',   # ﬁ -> fi
+    '\ufb02': 'fl',   # ﬂ -> fl
+    '\ufb03': 'ffi',  # ﬃ -> ffi
+    '\ufb04': 'ffl',  # ﬄ -> ffl
+    # Other symbols
+    '\u2026': '...',  # … -> ...
+    '\u00ad': '',     # Soft hyphen -> remove
+})
+
+# Useful symbols kept as-is: € • ‘ ’ “ ”
+KEEP_SYMBOLS = '\u20ac\u2022\u2018\u2019\u201c\u201d'
+
+_LATIN_LETTERS = ''.join(chr(code) for code in range(127, 591) if chr(code).isalpha())
+
+# Characters not kept as-is (replaced and blanked ones)
+_DISALLOWED = re.compile('[^\\x20-\\x7e' + re.escape('\t\n\r' + _LATIN_LETTERS + KEEP_SYMBOLS) + ']')
+_HIGH_UNICODE = re.compile('[\u3000-\U0010ffff]')  # CJK, emoji, ...
+_WHITESPACE = re.compile(r'\s+')
+
+
+def sanitize_tts_chars(text: str) -> str:
+    """
+    Replace or blank out every character TTS cannot handle, keeping the layout
+    (newlines and runs of spaces are left for filter_safe_text).
+    """
+    text = text.translate(TTS_REPLACEMENTS)
+    if _HIGH_UNICODE.search(text):
+        logger.warning("⚠️ Filtered problematic Unicode (CJK/emoji) from RAG text")
+    return _DISALLOWED.sub(' ', text)
+
+
+def filter_safe_text(text: str) -> str:
+    """
+    Filter and normalize Unicode for TTS compatibility.
+    Strategy: Replace problematic Unicode with ASCII equivalents.
+    Keep only: ASCII + Latin Extended + essential symbols (€, •)
+    """
+    # Texts sanitized at ingestion pass this check and skip the character pass
+    if _DISALLOWED.search(text):
+        text = sanitize_tts_chars(text)
+    return _WHITESPACE.sub(' ', text).strip()
@@ -1,6 +1,19 @@
 """
-Enhanced Annoy index wrapper for vector similarity search.
+Enhanced vector index wrapper for vector similarity search.
+
+EnhancedAnnoyIndex keeps one public API (UUID mapping, async save/load/query)
+on top of a pluggable search backend, selected by VECTOR_INDEX_BACKEND:
+
+- "annoy": Annoy forest (approximate, the original behaviour)
+- "exact": contiguous normalized matrix, brute-force dot products + argpartition
+- "int8":  scalar-quantized matrix for the scan, fp32 rescoring of the best hits
+
+Every backend exposes get_n_items() / get_item_vector() like an AnnoyIndex, so
+callers that use `index.index` keep working. search()/search_batch() take an
+optional sorted array of item rows (a metadata filter, see metadata_index.py)
+to search only that subset.
 """
+import os
 import asyncio
 import numpy as np
 from annoy import AnnoyIndex
@@ -9,19 +22,331 @@ import aiofiles
 import aiofiles.os
 import logging
 
-from .config import VECTOR_DIM, USE_FP16_EMBEDDINGS
+from .config import (
+    VECTOR_DIM, USE_FP16_EMBEDDINGS, VECTOR_INDEX_BACKEND, ANNOY_N_TREES,
+    EXACT_INDEX_DTYPE, INDEX_SCAN_BLOCK_ROWS, INT8_RESCORE_FACTOR, FILTER_EXACT_SCAN_MAX_ITEMS
+)
 
 logger = logging.getLogger("rag-assistant-enhanced")
 
+_NPY_MAGIC = b'\x93NUMPY'
 
-class EnhancedAnnoyIndex:
-    """Enhanced Annoy index with UUID mapping and async operations."""
+
+def _is_npy_file(file_path):
+    """True if the file was written by np.save (matrix backends)."""
+    with open(file_path, 'rb') as f:
+        return f.read(len(_NPY_MAGIC)) == _NPY_MAGIC
+
+
+def _save_npy(file_path, array):
+    # np.save appends '.npy' to plain paths; writing through a handle keeps the name
+    with open(file_path, 'wb') as f:
+        np.save(f, array)
+
+
+def _load_npy(file_path):
+    try:
+        return np.load(file_path, mmap_mode='r')
+    except ValueError:
+        # Zero-length arrays cannot be memory-mapped
+        return np.load(file_path)
+
+
+def _top_k(scores, n):
+    """Indices of the n highest scores, best first."""
+    if n >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    top = np.argpartition(-scores, n - 1)[:n]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+def _scan_scores(matrix, query, block_rows=INDEX_SCAN_BLOCK_ROWS, rows=None):
+    """Dot products of every row with the query, upcasting to fp32 block by block.
+
+    NumPy has no fast fp16/int8 matmul, and upcasting the whole matrix would
+    allocate a full fp32 copy per query; blocks keep the temporary small.
+    A [dim, q] query matrix scores q queries in the same pass ([rows, q] result).
+    With `rows`, only those rows are gathered and scored (in that order).
+    """
+    total = len(matrix) if rows is None else len(rows)
+    scores = np.empty((total,) + query.shape[1:], dtype=np.float32)
+    for start in range(0, total, block_rows):
+        if rows is None:
+            block = matrix[start:start + block_rows]
+        else:
+            block = matrix[rows[start:start + block_rows]]
+        scores[start:start + block_rows] = block.astype(np.float32, copy=False) @ query
+    return scores
+
+
+class AnnoyBackend:
+    """Annoy forest (approximate nearest neighbours)."""
+
+    name = "annoy"
+    sidecar_suffixes = ()
     
     def __init__(self, dim):
+        self.dim = dim
         self.index = AnnoyIndex(dim, 'angular')
+    
+    def add_item(self, item_id, vector):
+        self.index.add_item(item_id, vector)
+    
+    def build(self, n_trees=ANNOY_N_TREES):
+        self.index.build(n_trees)
+    
+    def get_n_items(self):
+        return self.index.get_n_items()
+    
+    def get_item_vector(self, item_id):
+        return self.index.get_item_vector(item_id)
+    
+    def get_vectors(self):
+        """All vectors in item order (Annoy only hands them out one at a time)."""
+        vectors = np.empty((self.get_n_items(), self.dim), dtype=np.float32)
+        for i in range(len(vectors)):
+            vectors[i] = self.index.get_item_vector(i)
+        return vectors
+    
+    def save(self, file_path):
+        self.index.save(file_path)
+    
+    def load(self, file_path):
+        self.index.load(file_path, prefault=False)
+    
+    def unload(self):
+        self.index.unload()
+    
+    def search(self, vector, n, rows=None):
+        """Return (item ids, cosine similarities) of the n nearest items (among `rows`)."""
+        if rows is not None:
+            return self._search_rows(vector, n, rows)
+        indices, distances = self.index.get_nns_by_vector(vector, n, include_distances=True)
+        # Convert angular distance to cosine similarity
+        return indices, [1 - (dist ** 2) / 2 for dist in distances]
+    
+    def _search_rows(self, vector, n, rows):
+        if len(rows) <= FILTER_EXACT_SCAN_MAX_ITEMS:
+            # Small subsets: exact scores over the subset's vectors
+            vectors = np.array([self.index.get_item_vector(int(row)) for row in rows], dtype=np.float32).reshape(-1, self.dim)
+            scores = vectors @ np.asarray(vector, dtype=np.float32)
+            top = _top_k(scores, n)
+            return rows[top].tolist(), scores[top].tolist()
+        
+        # Large subsets: widen the approximate search until n hits fall inside it
+        allowed = np.zeros(self.get_n_items(), dtype=bool)
+        allowed[rows] = True
+        fetch = min(self.get_n_items(), n * max(2, self.get_n_items() // len(rows)))
+        while True:
+            indices, similarities = self.search(vector, fetch)
+            hits = [(i, s) for i, s in zip(indices, similarities) if allowed[i]][:n]
+            if len(hits) >= n or fetch >= self.get_n_items():
+                return [i for i, _ in hits], [s for _, s in hits]
+            fetch = min(self.get_n_items(), fetch * 2)
+    
+    def search_batch(self, vectors, n, rows=None):
+        """search() for each query vector (Annoy has no batched lookup)."""
+        return [self.search(vector, n, rows) for vector in vectors]
+
+
+class ExactBackend:
+    """Brute-force search over a contiguous matrix of normalized vectors."""
+
+    name = "exact"
+    sidecar_suffixes = ()
+    
+    def __init__(self, dim, dtype=EXACT_INDEX_DTYPE):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._pending = []
+        self.matrix = np.zeros((0, dim), dtype=self.dtype)
+    
+    def add_item(self, item_id, vector):
+        expected = len(self.matrix) + len(self._pending)
+        if item_id != expected:
+            raise ValueError(f"Items must be added in order (expected id {expected}, got {item_id})")
+        self._pending.append(np.asarray(vector, dtype=self.dtype))
+    
+    def add_items(self, vectors):
+        """Append a block of already-normalized vectors."""
+        self._flush_pending()
+        self.matrix = np.concatenate([self.matrix, np.asarray(vectors, dtype=self.dtype)])
+    
+    def _flush_pending(self):
+        if self._pending:
+            self.matrix = np.concatenate([self.matrix, np.stack(self._pending)])
+            self._pending = []
+    
+    def build(self, n_trees=None):
+        # Nothing to build beyond making the matrix contiguous
+        self._flush_pending()
+        self.matrix = np.ascontiguousarray(self.matrix)
+    
+    def get_n_items(self):
+        return len(self.matrix) + len(self._pending)
+    
+    def get_item_vector(self, item_id):
+        self._flush_pending()
+        return self.matrix[item_id].astype(np.float32).tolist()
+    
+    def get_vectors(self):
+        self._flush_pending()
+        return self.matrix
+    
+    def save(self, file_path):
+        self._flush_pending()
+        _save_npy(file_path, self.matrix)
+    
+    def load(self, file_path):
+        self.matrix = _load_npy(file_path)
+        self.dtype = self.matrix.dtype
+    
+    def unload(self):
+        self.matrix = np.zeros((0, self.dim), dtype=self.dtype)
+    
+    def search(self, vector, n, rows=None):
+        """Return (item ids, cosine similarities) of the n nearest items (among `rows`)."""
+        self._flush_pending()
+        if len(self.matrix) == 0 or (rows is not None and len(rows) == 0):
+            return [], []
+        scores = _scan_scores(self.matrix, np.asarray(vector, dtype=np.float32), rows=rows)
+        top = _top_k(scores, n)
+        ids = top if rows is None else rows[top]
+        return ids.tolist(), scores[top].tolist()
+    
+    def search_batch(self, vectors, n, rows=None):
+        """search() for several query vectors with a single scan of the matrix."""
+        self._flush_pending()
+        if len(self.matrix) == 0 or (rows is not None and len(rows) == 0):
+            return [([], []) for _ in vectors]
+        scores = _scan_scores(self.matrix, np.asarray(vectors, dtype=np.float32).T, rows=rows)
+        results = []
+        for column in scores.T:
+            top = _top_k(column, n)
+            ids = top if rows is None else rows[top]
+            results.append((ids.tolist(), column[top].tolist()))
+        return results
+
+
+class Int8Backend(ExactBackend):
+    """Int8 scalar-quantized scan with fp32 rescoring of the top candidates.
+
+    Codes use one symmetric scale per dimension. The scan keeps
+    n * INT8_RESCORE_FACTOR candidates, which are rescored against the fp16
+    vectors (upcast to fp32), so the final ranking matches the exact backend
+    whenever the true top n is among the candidates.
+    """
+
+    name = "int8"
+    sidecar_suffixes = ('.scales.npy', '.rescore.npy')
+    
+    def __init__(self, dim):
+        super().__init__(dim, dtype=np.float16)
+        self.codes = np.zeros((0, dim), dtype=np.int8)
+        self.scales = np.ones(dim, dtype=np.float32)
+    
+    def build(self, n_trees=None):
+        super().build()
+        self._quantize()
+    
+    def add_items(self, vectors):
+        super().add_items(vectors)
+        self._quantize()
+    
+    def _quantize(self):
+        if len(self.matrix) == 0:
+            self.codes = np.zeros((0, self.dim), dtype=np.int8)
+            return
+        max_abs = np.abs(self.matrix).max(axis=0).astype(np.float32)
+        self.scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        self.codes = np.clip(np.rint(self.matrix / self.scales), -127, 127).astype(np.int8)
+    
+    def save(self, file_path):
+        self._flush_pending()
+        if len(self.codes) != len(self.matrix):
+            self._quantize()
+        _save_npy(file_path, self.codes)
+        _save_npy(file_path + '.scales.npy', self.scales)
+        _save_npy(file_path + '.rescore.npy', self.matrix)
+    
+    def load(self, file_path):
+        self.codes = _load_npy(file_path)
+        self.scales = np.load(file_path + '.scales.npy')
+        self.matrix = _load_npy(file_path + '.rescore.npy')
+    
+    def unload(self):
+        super().unload()
+        self.codes = np.zeros((0, self.dim), dtype=np.int8)
+    
+    def search(self, vector, n, rows=None):
+        """Return (item ids, cosine similarities) of the n nearest items (among `rows`)."""
+        return self.search_batch(np.asarray([vector]), n, rows)[0]
+    
+    def search_batch(self, vectors, n, rows=None):
+        """search() for several query vectors with a single scan of the codes."""
+        self._flush_pending()
+        if len(self.matrix) == 0 or (rows is not None and len(rows) == 0):
+            return [([], []) for _ in vectors]
+        if len(self.codes) != len(self.matrix):
+            self._quantize()
+        
+        queries = np.asarray(vectors, dtype=np.float32)
+        approx = _scan_scores(self.codes, (queries * self.scales).T, rows=rows)
+        results = []
+        for query, column in zip(queries, approx.T):
+            # Sorted candidate rows keep the rescoring gather sequential
+            candidates = _top_k(column, max(n, n * INT8_RESCORE_FACTOR))
+            candidates = np.sort(candidates if rows is None else rows[candidates])
+            exact = self.matrix[candidates].astype(np.float32) @ query
+            order = _top_k(exact, n)
+            results.append((candidates[order].tolist(), exact[order].tolist()))
+        return results
+
+
+INDEX_BACKENDS = {
+    AnnoyBackend.name: AnnoyBackend,
+    ExactBackend.name: ExactBackend,
+    Int8Backend.name: Int8Backend,
+}
+
+
+def stored_backend(file_path):
+    """Name of the backend that wrote the index file at file_path."""
+    if not _is_npy_file(file_path):
+        return AnnoyBackend.name
+    if os.path.exists(file_path + '.rescore.npy'):
+        return Int8Backend.name
+    return ExactBackend.name
+
+
+def _create_backend(name, dim):
+    if name not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown VECTOR_INDEX_BACKEND '{name}' (choose from {', '.join(INDEX_BACKENDS)})")
+    return INDEX_BACKENDS[name](dim)
+
+
+def make_query_result(uuid_str, cosine_sim):
+    """Result object with the attributes callers expect from an Annoy query."""
+    return type('QueryResult', (), {
+        'userdata': uuid_str,
+        'distance': float(np.sqrt(max(0.0, 2 - 2 * cosine_sim))),  # Angular distance
+        'cosine_similarity': cosine_sim
+    })
+
+
+class EnhancedAnnoyIndex:
+    """Enhanced vector index with UUID mapping, pluggable backends and async operations."""
+
+    def __init__(self, dim, backend=None):
+        self.dim = dim
+        self.index = _create_backend(backend or VECTOR_INDEX_BACKEND, dim)
         self.uuid_map = {}
         self.next_id = 0
-        
+    
+    @property
+    def backend_name(self):
+        return self.index.name
+    
     def add_item(self, uuid_str, vector):
         """Add an item to the index with a UUID as userdata."""
         # Normalize vector for cosine similarity
@@ -32,11 +357,30 @@ class EnhancedAnnoyIndex:
         self.uuid_map[self.next_id] = uuid_str
         self.index.add_item(self.next_id, vector)
         self.next_id += 1
-        
-    def build(self, n_trees):
-        """Build the index with the specified number of trees."""
+    
+    def add_items(self, uuid_strs, vectors):
+        """Add a block of already-normalized vectors (e.g. carried forward from another index)."""
+        if isinstance(self.index, ExactBackend):
+            for uuid_str in uuid_strs:
+                self.uuid_map[self.next_id] = uuid_str
+                self.next_id += 1
+            self.index.add_items(vectors)
+        else:
+            for uuid_str, vector in zip(uuid_strs, vectors):
+                self.add_item(uuid_str, vector)
+    
+    def get_vectors(self):
+        """All normalized vectors in item order."""
+        return self.index.get_vectors()
+    
+    def build(self, n_trees=ANNOY_N_TREES):
+        """Build the index (n_trees only applies to the Annoy backend)."""
         self.index.build(n_trees)
-        
+    
+    def file_suffixes(self):
+        """Files written next to the index file, besides the index file itself."""
+        return ('.map',) + self.index.sidecar_suffixes
+    
     async def save_async(self, file_path, executor):
         """Save the index to a file asynchronously."""
         loop = asyncio.get_running_loop()
@@ -48,33 +392,54 @@ class EnhancedAnnoyIndex:
         map_path = file_path + '.map'
         async with aiofiles.open(map_path, 'wb') as f:
             await f.write(pickle.dumps(self.uuid_map))
-            
+    
     @classmethod
-    async def load_async(cls, file_path, executor):
-        """Load the index from a file asynchronously."""
-        if not await aiofiles.os.path.exists(file_path):
+    def load(cls, file_path, uuid_map=None, backend=None):
+        """Load the index from a file (blocking).
+
+        The on-disk format is detected; if it differs from the configured backend,
+        the vectors are converted in memory (rebuild the database to persist it).
+        """
+        if not os.path.exists(file_path):
             raise FileNotFoundError(f"Index file not found: {file_path}")
-            
-        map_path = file_path + '.map'
-        if not await aiofiles.os.path.exists(map_path):
-            raise FileNotFoundError(f"UUID map file not found: {map_path}")
-            
-        async with aiofiles.open(map_path, 'rb') as f:
-            uuid_map = pickle.loads(await f.read())
-            
-        index = cls(VECTOR_DIM)
         
-        # Load index with memory mapping
-        index.index = AnnoyIndex(VECTOR_DIM, 'angular')
+        if uuid_map is None:
+            map_path = file_path + '.map'
+            if not os.path.exists(map_path):
+                raise FileNotFoundError(f"UUID map file not found: {map_path}")
+            with open(map_path, 'rb') as f:
+                uuid_map = pickle.load(f)
         
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(executor, 
-                                 lambda: index.index.load(file_path, prefault=False))
+        target = backend or VECTOR_INDEX_BACKEND
+        stored = stored_backend(file_path)
         
+        # Load index with memory mapping
+        index = cls(VECTOR_DIM, backend=stored)
+        index.index.load(file_path)
         index.uuid_map = uuid_map
         index.next_id = max(uuid_map.keys()) + 1 if uuid_map else 0
+        
+        if stored != target:
+            logger.warning(f"⚠️  Index on disk uses the '{stored}' backend, converting to '{target}' in memory")
+            converted = cls(VECTOR_DIM, backend=target)
+            vectors = index.get_vectors()
+            converted.add_items([uuid_map.get(i, "") for i in range(len(vectors))], vectors)
+            converted.uuid_map = uuid_map
+            converted.next_id = index.next_id
+            converted.build()
+            index.index.unload()
+            index = converted
         return index
+    
+    @classmethod
+    async def load_async(cls, file_path, executor):
+        """Load the index from a file asynchronously."""
+        if not await aiofiles.os.path.exists(file_path):
+            raise FileNotFoundError(f"Index file not found: {file_path}")
         
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, lambda: cls.load(file_path))
+    
     async def query_async(self, vector, n, executor):
         """Query the index for the closest matches using cosine similarity."""
         # Normalize query vector
@@ -83,31 +448,10 @@ class EnhancedAnnoyIndex:
             vector = vector / norm
         
         loop = asyncio.get_running_loop()
+        indices, similarities = await loop.run_in_executor(executor, self.index.search, vector, n)
         
-        def _query_index():
-            return self.index.get_nns_by_vector(vector, n, include_distances=True)
-        
-        result = await loop.run_in_executor(executor, _query_index)
-        
-        # Handle different return formats
-        if isinstance(result, tuple) and len(result) == 2:
-            indices, distances = result
-        else:
-            indices = self.index.get_nns_by_vector(vector, n)
-            distances = [0.5] * len(indices)
-        
-        results = []
-        for idx, dist in zip(indices, distances):
-            if idx in self.uuid_map:
-                # Convert angular distance to cosine similarity
-                cosine_sim = 1 - (dist ** 2) / 2
-                result = type('QueryResult', (), {
-                    'userdata': self.uuid_map[idx], 
-                    'distance': dist,
-                    'cosine_similarity': cosine_sim
-                })
-                results.append(result)
-        return results
+        return [make_query_result(self.uuid_map[idx], cosine_sim)
+                for idx, cosine_sim in zip(indices, similarities) if idx in self.uuid_map]
 
 
 async def validate_index(index, metadata):
@@ -150,20 +494,18 @@ async def copy_index_efficiently(old_index, new_index, batch_size=500):
     logger.info(f"Copying {total_items:,} items from existing index in batches of {batch_size:,}...")
     copied = 0
     errors = 0
+    vectors = old_index.get_vectors()
     
     for i in range(0, total_items, batch_size):
         end = min(i + batch_size, total_items)
         
-        for j in range(i, end):
-            try:
-                vector = old_index.index.get_item_vector(j)
-                uuid_str = old_index.uuid_map.get(j)
-                if uuid_str:
-                    new_index.add_item(uuid_str, vector)
-                    copied += 1
-            except Exception as e:
-                logger.error(f"Error copying item {j}: {e}")
-                errors += 1
+        try:
+            rows = [j for j in range(i, end) if old_index.uuid_map.get(j)]
+            new_index.add_items([old_index.uuid_map[j] for j in rows], vectors[rows])
+            copied += len(rows)
+        except Exception as e:
+            logger.error(f"Error copying items {i}-{end}: {e}")
+            errors += end - i
         
         progress = (end / total_items) * 100
         logger.info(f"Copy progress: {progress:.1f}% ({end:,}/{total_items:,})")
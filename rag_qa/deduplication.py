@@ -3,15 +3,26 @@ Q&A deduplication utilities.
 
 Remove semantically duplicate questions while keeping valuable variety.
 Uses LLM to intelligently detect truly redundant questions.
+
+Questions are embedded in multi-input batches and compared as one normalized
+matrix, block by block, so tens of thousands of Q&As take seconds. The LLM
+judge only sees clusters of questions that are similar enough to possibly be
+redundant; everything else is kept without an LLM call.
 """
 import asyncio
 import aiohttp
 import json
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 import numpy as np
-from groq import Groq
+from rag_hq.llm_client import get_llm_pool
 from . import config
 
+# Tuning (can be overridden in rag_qa/config.py)
+EMBED_BATCH_SIZE = getattr(config, 'QA_DEDUP_EMBED_BATCH_SIZE', 16)  # Questions per embedding request
+EMBED_CONCURRENCY = getattr(config, 'QA_DEDUP_EMBED_CONCURRENCY', 4)  # Embedding requests in flight
+SIMILARITY_BLOCK_ROWS = getattr(config, 'QA_DEDUP_BLOCK_ROWS', 1024)  # Rows per similarity block
+LLM_CANDIDATE_THRESHOLD = getattr(config, 'QA_DEDUP_LLM_CANDIDATE_THRESHOLD', 0.85)  # Similarity to send a pair to the LLM
+
 
 async def get_embedding(text: str, session: aiohttp.ClientSession) -> np.ndarray:
     """Get embedding for text from llama server."""
@@ -43,6 +54,98 @@ async def get_embedding(text: str, session: aiohttp.ClientSession) -> np.ndarray
         return None
 
 
+async def get_embeddings(texts: List[str], session: aiohttp.ClientSession) -> List[Optional[np.ndarray]]:
+    """
+    Get embeddings for many texts with multi-input requests (EMBED_BATCH_SIZE
+    texts each, EMBED_CONCURRENCY requests in flight).
+    
+    Returns one vector per text (None where embedding failed).
+    """
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    
+    async def embed_batch(batch: List[str]) -> List[Optional[np.ndarray]]:
+        async with semaphore:
+            try:
+                async with session.post(
+                    config.LLAMA_SERVER_URL,
+                    json={"content": batch}
+                ) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        if isinstance(result, list) and len(result) == len(batch):
+                            vectors = [None] * len(batch)
+                            for position, item in enumerate(result):
+                                if not isinstance(item, dict):
+                                    continue
+                                idx = item.get('index', position)
+                                embedding = item.get('embedding')
+                                # Embedding is nested [[...]], flatten to [...]
+                                if isinstance(embedding, list) and embedding and isinstance(embedding[0], list):
+                                    embedding = embedding[0]
+                                if embedding and 0 <= idx < len(batch):
+                                    vectors[idx] = np.array(embedding, dtype=np.float32)
+                            return vectors
+            except Exception as e:
+                print(f"⚠️  Batch embedding error: {e}")
+            
+            # Server rejected the batch: one request per text
+            return [await get_embedding(text, session) for text in batch]
+    
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    return [vector for batch in results for vector in batch]
+
+
+def normalized_matrix(embeddings: List[Optional[np.ndarray]]) -> np.ndarray:
+    """Stack embeddings into a row-normalized float32 matrix (zero rows for missing embeddings)."""
+    dim = next((len(v) for v in embeddings if v is not None), 0)
+    matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+    for i, vector in enumerate(embeddings):
+        if vector is not None and len(vector) == dim:
+            matrix[i] = vector
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def similar_pairs(matrix: np.ndarray, threshold: float, block_rows: int = SIMILARITY_BLOCK_ROWS):
+    """
+    Yield (i, j, similarity) for every pair j < i with similarity >= threshold.
+    
+    Similarities are computed one block of rows at a time against all earlier
+    rows, so memory stays at block_rows x n.
+    """
+    n = len(matrix)
+    for start in range(0, n, block_rows):
+        end = min(n, start + block_rows)
+        similarities = matrix[start:end] @ matrix[:end].T
+        # Only pairs with an earlier row
+        similarities[np.arange(end)[None, :] >= np.arange(start, end)[:, None]] = -1.0
+        rows, cols = np.nonzero(similarities >= threshold)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            yield start + row, col, float(similarities[row, col])
+
+
+def similarity_clusters(matrix: np.ndarray, threshold: float) -> List[List[int]]:
+    """Connected components of the 'similarity >= threshold' graph (each sorted, in order of first member)."""
+    parent = list(range(len(matrix)))
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    for i, j, _ in similar_pairs(matrix, threshold):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    
+    clusters = {}
+    for i in range(len(matrix)):
+        clusters.setdefault(find(i), []).append(i)
+    return list(clusters.values())
+
+
 def cosine_similarity(v1: np.ndarray, v2: np.ndarray) -> float:
     """Calculate cosine similarity between two vectors."""
     if v1 is None or v2 is None:
@@ -62,7 +165,11 @@ async def deduplicate_qa_pairs_llm(qa_pairs: List[Dict], batch_size: int = 30) -
     (count vs timing vs location) are VALUABLE, while questions asking the 
     exact same thing in different words are REDUNDANT.
     
-    For large lists, processes in batches to avoid token limits.
+    Questions are first clustered by embedding similarity (LLM_CANDIDATE_THRESHOLD);
+    only clusters with more than one question are judged, packed into batches of
+    at most batch_size questions that run concurrently. Identical questions are
+    removed without asking. Without embeddings, all questions are judged in
+    fixed batches.
     
     Returns:
         (unique_qa_pairs, duplicate_qa_pairs)
@@ -73,31 +180,59 @@ async def deduplicate_qa_pairs_llm(qa_pairs: List[Dict], batch_size: int = 30) -
     
     print(f"\n🤖 LLM-based deduplication of {len(qa_pairs)} Q&A pairs...")
     
-    # If too many Q&As, process in batches
-    if len(qa_pairs) > batch_size:
-        print(f"   Processing in batches of {batch_size}...")
-        all_duplicates = []
-        remaining_qa_pairs = qa_pairs.copy()
-        
-        while len(remaining_qa_pairs) > 0:
-            batch = remaining_qa_pairs[:batch_size]
-            unique_batch, dup_batch = await _deduplicate_batch_llm(batch)
-            
-            # Keep unique ones, track duplicates
-            all_duplicates.extend(dup_batch)
-            remaining_qa_pairs = remaining_qa_pairs[batch_size:]
-        
-        # Now all batches are internally deduplicated
-        # Re-index and build final result
-        all_unique_questions = {qa['question'] for qa in qa_pairs if qa not in all_duplicates}
-        final_unique = [qa for qa in qa_pairs if qa['question'] in all_unique_questions]
-        
-        print(f"\n   ✓ Kept {len(final_unique)} unique Q&As")
-        print(f"   ✗ Removed {len(all_duplicates)} redundant Q&As")
-        
-        return final_unique, all_duplicates
+    # Exact repeats (ignoring case and surrounding whitespace) need no judge
+    first_by_question = {}
+    exact_duplicates = set()
+    for i, qa in enumerate(qa_pairs):
+        key = qa['question'].strip().casefold()
+        if key in first_by_question:
+            exact_duplicates.add(i)
+        else:
+            first_by_question[key] = i
+    candidates = [i for i in range(len(qa_pairs)) if i not in exact_duplicates]
+    
+    async with aiohttp.ClientSession() as session:
+        embeddings = await get_embeddings([qa_pairs[i]['question'] for i in candidates], session)
+    
+    if all(e is None for e in embeddings):
+        print(f"   ⚠️  No embeddings available, judging all questions in batches of {batch_size}")
+        batches = [candidates[i:i + batch_size] for i in range(0, len(candidates), batch_size)]
     else:
-        return await _deduplicate_batch_llm(qa_pairs)
+        # Pack multi-question clusters into LLM batches; singletons are kept as-is
+        loop = asyncio.get_running_loop()
+        clusters = await loop.run_in_executor(
+            None, similarity_clusters, normalized_matrix(embeddings), LLM_CANDIDATE_THRESHOLD
+        )
+        batches = []
+        current = []
+        for cluster in clusters:
+            if len(cluster) < 2:
+                continue
+            members = [candidates[i] for i in cluster]
+            # Oversized clusters are judged in consecutive slices
+            for piece in (members[k:k + batch_size] for k in range(0, len(members), batch_size)):
+                if current and len(current) + len(piece) > batch_size:
+                    batches.append(current)
+                    current = []
+                current.extend(piece)
+        if current:
+            batches.append(current)
+        print(f"   {sum(len(b) for b in batches)} questions in similar clusters -> {len(batches)} LLM batches")
+    
+    # Batches are independent: run them concurrently on the LLM pool
+    duplicate_indices = set(exact_duplicates)
+    batch_pairs = [[qa_pairs[i] for i in sorted(batch)] for batch in batches]
+    position = {id(qa): i for i, qa in enumerate(qa_pairs)}
+    for _, dup_batch in await asyncio.gather(*(_deduplicate_batch_llm(batch) for batch in batch_pairs)):
+        duplicate_indices.update(position[id(qa)] for qa in dup_batch)
+    
+    final_unique = [qa for i, qa in enumerate(qa_pairs) if i not in duplicate_indices]
+    all_duplicates = [qa for i, qa in enumerate(qa_pairs) if i in duplicate_indices]
+    
+    print(f"\n   ✓ Kept {len(final_unique)} unique Q&As")
+    print(f"   ✗ Removed {len(all_duplicates)} redundant Q&As ({len(exact_duplicates)} exact repeats)")
+    
+    return final_unique, all_duplicates
 
 
 async def _deduplicate_batch_llm(qa_pairs: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
@@ -145,10 +280,8 @@ Wees CONSERVATIEF - behoud vragen tenzij ze ECHT hetzelfde vragen.
 """
 
     try:
-        # Use Groq with small model for deduplication
-        client = Groq(api_key=config.GROQ_API_KEY)
-        
-        response = client.chat.completions.create(
+        # Use Groq with small model for deduplication (async pool: rate limited, non-blocking)
+        result_text = await get_llm_pool(config.GROQ_API_KEY).chat(
             model="openai/gpt-oss-20b",  # Fast, cheap model for deduplication
             messages=[
                 {"role": "system", "content": "Je bent een expert in het identificeren van redundante vragen. Answer in JSON mode. Output alleen geldige JSON."},
@@ -157,10 +290,8 @@ Wees CONSERVATIEF - behoud vragen tenzij ze ECHT hetzelfde vragen.
             temperature=0.1,
             max_completion_tokens=4096,  # Groq requires max_completion_tokens, not max_tokens
             response_format={"type": "json_object"},
-            stream=False
         )
         
-        result_text = response.choices[0].message.content
         result = json.loads(result_text)
         
         redundant_indices = set(result.get('redundant_indices', []))
@@ -214,60 +345,42 @@ async def deduplicate_qa_pairs(qa_pairs: List[Dict], similarity_threshold: float
     # Extract questions for embedding
     questions = [qa['question'] for qa in qa_pairs]
     
-    # Get embeddings for all questions
-    embeddings = []
+    # Get embeddings for all questions (multi-input requests)
     async with aiohttp.ClientSession() as session:
-        # Batch process with small delays
-        for i, question in enumerate(questions):
-            if i > 0 and i % 10 == 0:
-                await asyncio.sleep(0.1)  # Small delay every 10 requests
-            
-            embedding = await get_embedding(question, session)
-            embeddings.append(embedding)
-            
-            if i % 20 == 0:
-                print(f"   Embedded {i}/{len(questions)} questions...")
+        embeddings = await get_embeddings(questions, session)
     
-    print(f"   ✓ Embedded {len(embeddings)} questions")
+    print(f"   ✓ Embedded {sum(e is not None for e in embeddings)}/{len(questions)} questions")
     
-    # Find duplicates using cosine similarity
-    unique_indices = []
-    duplicate_indices = []
+    # A question is a duplicate if it is similar to an EARLIER KEPT question
+    loop = asyncio.get_running_loop()
+    pairs = await loop.run_in_executor(
+        None, lambda: list(similar_pairs(normalized_matrix(embeddings), similarity_threshold))
+    )
+    similar_earlier = {}
+    for i, j, similarity in pairs:
+        similar_earlier.setdefault(i, []).append((j, similarity))
     
-    for i in range(len(qa_pairs)):
-        if embeddings[i] is None:
-            unique_indices.append(i)
+    is_unique = [True] * len(qa_pairs)
+    duplicate_indices = []
+    for i in sorted(similar_earlier):
+        match = next(((j, sim) for j, sim in sorted(similar_earlier[i]) if is_unique[j]), None)
+        if match is None:
             continue
+        is_unique[i] = False
+        duplicate_indices.append(i)
         
-        is_duplicate = False
-        
-        # Compare with all previous unique questions
-        for j in unique_indices:
-            if embeddings[j] is None:
-                continue
-            
-            similarity = cosine_similarity(embeddings[i], embeddings[j])
-            
-            if similarity >= similarity_threshold:
-                # This is a duplicate
-                is_duplicate = True
-                duplicate_indices.append(i)
-                
-                # Show duplicate info in dev mode
-                print(f"\n   ⚠️  Duplicate found (similarity: {similarity:.3f}):")
-                print(f"      Original [{j+1}]: {questions[j][:80]}...")
-                print(f"      Duplicate [{i+1}]: {questions[i][:80]}...")
-                break
-        
-        if not is_duplicate:
-            unique_indices.append(i)
+        # Show duplicate info in dev mode
+        if len(duplicate_indices) <= 10:
+            j, similarity = match
+            print(f"\n   ⚠️  Duplicate found (similarity: {similarity:.3f}):")
+            print(f"      Original [{j+1}]: {questions[j][:80]}...")
+            print(f"      Duplicate [{i+1}]: {questions[i][:80]}...")
     
     # Build result lists
-    unique_qa_pairs = [qa_pairs[i] for i in unique_indices]
+    unique_qa_pairs = [qa for i, qa in enumerate(qa_pairs) if is_unique[i]]
     duplicate_qa_pairs = [qa_pairs[i] for i in duplicate_indices]
     
     print(f"\n   ✓ Kept {len(unique_qa_pairs)} unique Q&As")
     print(f"   ✗ Removed {len(duplicate_qa_pairs)} duplicates")
     
     return unique_qa_pairs, duplicate_qa_pairs
-
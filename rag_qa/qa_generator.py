@@ -8,7 +8,7 @@ import time
 import re
 import tiktoken
 from typing import List, Dict, Tuple, Optional
-from groq import Groq
+from rag_hq.llm_client import get_llm_pool
 from . import config
 from .state import state
 
@@ -340,12 +340,9 @@ async def generate_qa_pairs(document_text: str, document_title: str, document_ye
         print(f"📝 Prompt tokens: {prompt_tokens:,}")
         print(f"🔄 Sending request to Groq ({config.GROQ_MODEL})...\n")
     
-    # Initialize Groq client
-    client = Groq(api_key=config.GROQ_API_KEY)
-    
     try:
-        # Make API call
-        response = client.chat.completions.create(
+        # Make API call on the shared async pool (non-blocking, rate limited)
+        response_text = await get_llm_pool(config.GROQ_API_KEY).chat(
             model=config.GROQ_MODEL,
             messages=[
                 {"role": "system", "content": "Je bent een precisie vraag-antwoord generator voor een Nederlandse dorpscoöperatie. Answer in JSON mode. Genereer alleen geldige JSON in het Nederlands."},
@@ -354,11 +351,9 @@ async def generate_qa_pairs(document_text: str, document_title: str, document_ye
             temperature=config.GROQ_TEMPERATURE,
             max_completion_tokens=16000,  # Groq requires max_completion_tokens, not max_tokens
             response_format={"type": "json_object"},
-            stream=False
         )
         
         # Extract response
-        response_text = response.choices[0].message.content
         response_tokens = count_tokens(response_text)
         
         # Parse JSON
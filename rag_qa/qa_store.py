@@ -0,0 +1,126 @@
+"""
+On-disk Q&A store: pre-normalized embedding matrix plus compact records.
+
+precompute_qa_embeddings.py used to pickle a list of dicts with every vector
+as a Python list; workers unpickled it and rebuilt a normalized matrix at
+startup. The store instead keeps (in QA_STORE_DIR):
+
+    qa_embeddings.npy       float16 [n, dim], rows L2-normalized
+    qa_records.bin          UTF-8 JSON records (question, answer, context, source, page), concatenated
+    qa_records.offsets.npy  int64 [n + 1] byte offsets of the records
+    qa_manifest.json        count, dim and per-source-file content hash + row range (written last)
+
+Opening the store memory-maps the matrix and the records; a record is decoded
+only when it is accessed. The per-file hashes let the precompute script reuse
+the rows of unchanged Q&A files.
+"""
+import os
+import json
+import mmap
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("rag_qa")
+
+QA_STORE_DIR = Path(__file__).parent.parent / "qa_vector_db"
+EMBEDDINGS_NAME = "qa_embeddings.npy"
+RECORDS_NAME = "qa_records.bin"
+OFFSETS_NAME = "qa_records.offsets.npy"
+MANIFEST_NAME = "qa_manifest.json"
+
+
+def qa_store_exists(directory=QA_STORE_DIR):
+    return (Path(directory) / MANIFEST_NAME).exists()
+
+
+def normalize_rows(vectors):
+    """Float16 matrix with L2-normalized rows (zero rows stay zero)."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms > 0, norms, 1)).astype(np.float16)
+
+
+def write_qa_store(records, matrix, files, directory=QA_STORE_DIR):
+    """
+    Write a complete store, replacing the previous one (manifest last).
+
+    Args:
+        records: Record dicts, aligned with the matrix rows
+        matrix: float16 [n, dim] normalized embeddings
+        files: Source file name -> {'hash', 'start', 'count'}
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    blobs = [json.dumps(record, ensure_ascii=False).encode('utf-8') for record in records]
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+
+    def replace(name, write):
+        tmp_path = directory / (name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, directory / name)
+
+    replace(EMBEDDINGS_NAME, lambda f: np.save(f, np.ascontiguousarray(matrix, dtype=np.float16)))
+    replace(RECORDS_NAME, lambda f: f.write(b"".join(blobs)))
+    replace(OFFSETS_NAME, lambda f: np.save(f, offsets))
+    manifest = {
+        'count': len(records),
+        'dim': int(matrix.shape[1]) if len(matrix) else 0,
+        'files': files,
+    }
+    replace(MANIFEST_NAME, lambda f: f.write(json.dumps(manifest, indent=2).encode('utf-8')))
+
+
+class QARecords:
+    """Read-only sequence of Q&A record dicts decoded from a memory-mapped blob."""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return json.loads(self._blob[start:end].decode('utf-8'))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class QAStore:
+    """A committed store: `matrix` (memory-mapped float16) and `records`."""
+
+    def __init__(self, manifest, matrix, records):
+        self.manifest = manifest
+        self.matrix = matrix
+        self.records = records
+
+    @classmethod
+    def open(cls, directory=QA_STORE_DIR):
+        """Memory-map the store (blocking). Raises ValueError if its files disagree."""
+        directory = Path(directory)
+        with open(directory / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        matrix = np.load(directory / EMBEDDINGS_NAME, mmap_mode='r')
+        offsets = np.load(directory / OFFSETS_NAME, mmap_mode='r')
+        with open(directory / RECORDS_NAME, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        count = manifest['count']
+        if len(matrix) != count or len(offsets) != count + 1 or int(offsets[-1]) != size:
+            raise ValueError(f"Q&A store in {directory} is inconsistent "
+                             f"({len(matrix)} vectors, {len(offsets) - 1} records, manifest {count})")
+        return cls(manifest, matrix, QARecords(blob, offsets))
@@ -11,109 +11,23 @@ import aiohttp
 import numpy as np
 from typing import List, Dict, Optional
 
+from rag_hq.tts_text import filter_safe_text
+from .qa_store import QAStore, qa_store_exists
+
 logger = logging.getLogger("rag_qa")
 logger.setLevel(logging.ERROR) # Disabled INFO logs as requested
 
-
-def filter_safe_text(text: str) -> str:
-    """
-    Filter and normalize Unicode for TTS compatibility.
-    Strategy: Replace problematic Unicode with ASCII equivalents.
-    Keep only: ASCII + Latin Extended + essential symbols (€, •)
-    """
-    import re
-    safe_chars = []
-    unsafe_found = False
-    
-    # Unicode replacement mapping - convert to TTS-safe equivalents
-    unicode_replacements = {
-        # Dashes -> hyphen
-        0x2013: '-',   # – En dash
-        0x2014: '-',   # — Em dash
-        0x2015: '-',   # ― Horizontal bar
-        
-        # Spaces -> regular space
-        0x00A0: ' ',   # Non-breaking space
-        0x202F: ' ',   # Narrow no-break space
-        0x2009: ' ',   # Thin space
-        
-        # Ligatures -> letter equivalents
-        0xFB00: 'ff',  # ﬀ -> ff
-        0xFB01: 'fi',  # ﬁ -> fi
-        0xFB02: 'fl',  # ﬂ -> fl
-        0xFB03: 'ffi', # ﬃ -> ffi
-        0xFB04: 'ffl', # ﬄ -> ffl
-        
-        # Other symbols
-        0x2026: '...',  # … -> ...
-        0x00AD: '',     # Soft hyphen -> remove
-    }
-    
-    # Keep these useful symbols as-is (TTS-safe)
-    keep_unicode = {
-        0x20AC,  # € Euro sign
-        0x2022,  # • Bullet point
-        0x2018,  # ' Left single quote
-        0x2019,  # ' Right single quote
-        0x201C,  # " Left double quote
-        0x201D,  # " Right double quote
-    }
-    
-    for char in text:
-        char_code = ord(char)
-        
-        # Replace with mapping if exists
-        if char_code in unicode_replacements:
-            replacement = unicode_replacements[char_code]
-            safe_chars.append(replacement)
-            continue
-        
-        # Keep all ASCII printable (32-126)
-        if 32 <= char_code <= 126:
-            safe_chars.append(char)
-        # Keep common whitespace
-        elif char in '\n\t\r':
-            safe_chars.append(char)
-        # Keep Latin letters with diacritics (À-ÿ and extended up to 591)
-        elif char.isalpha() and char_code < 591:
-            safe_chars.append(char)
-        # Keep essential Unicode symbols
-        elif char_code in keep_unicode:
-            safe_chars.append(char)
-        # Block CJK Unified Ideographs (Chinese/Japanese/Korean)
-        elif 0x4E00 <= char_code <= 0x9FFF:
-            safe_chars.append(' ')
-            unsafe_found = True
-        # Block Emoji ranges
-        elif 0x1F300 <= char_code <= 0x1F9FF:
-            safe_chars.append(' ')
-            unsafe_found = True
-        # Block other high Unicode (>0x3000)
-        elif char_code >= 0x3000:
-            safe_chars.append(' ')
-            unsafe_found = True
-        # Replace other low Unicode with space for safety
-        else:
-            safe_chars.append(' ')
-    
-    # Log if we filtered anything problematic
-    if unsafe_found:
-        logger.warning("⚠️ Filtered problematic Unicode (CJK/emoji) from Q&A RAG text")
-    
-    # Clean up multiple spaces
-    result = ''.join(safe_chars)
-    result = re.sub(r'\s+', ' ', result)
-    return result.strip()
-
 # Configuration
 QA_DATA_DIR = Path(__file__).parent / "data"
-EMBEDDINGS_FILE = Path(__file__).parent.parent / "qa_vector_db" / "qa_embeddings.pkl"
+EMBEDDINGS_FILE = Path(__file__).parent.parent / "qa_vector_db" / "qa_embeddings.pkl"  # Legacy pickle (before qa_store)
+SCAN_BLOCK_ROWS = 8192  # float16 rows upcast to float32 at a time when scoring
 EMBEDDING_SERVER_URL = "http://localhost:7777/embedding"
 TOP_K = 5  # Number of questions to retrieve
 
 # Cache for Q&A pairs
 _qa_cache = None
 _qa_embeddings_matrix = None  # NumPy matrix for fast similarity
+_qa_results = {}  # Row -> result dict with TTS-safe text (built on a pair's first hit)
 _qa_initialized = False
 
 # Shared aiohttp session
@@ -163,30 +77,80 @@ def cosine_similarity_batch(query_vec: np.ndarray, embeddings_matrix: np.ndarray
         Array of similarity scores
     """
     # Normalize query vector
-    query_norm = query_vec / np.linalg.norm(query_vec)
+    query_norm = (query_vec / np.linalg.norm(query_vec)).astype(np.float32)
     
     # Embeddings should already be normalized during load
     # Compute dot product (cosine similarity with normalized vectors)
-    similarities = np.dot(embeddings_matrix, query_norm)
+    if embeddings_matrix.dtype == np.float32:
+        return np.dot(embeddings_matrix, query_norm)
     
+    # Memory-mapped float16 store: upcast block by block instead of the whole matrix
+    similarities = np.empty(len(embeddings_matrix), dtype=np.float32)
+    for start in range(0, len(embeddings_matrix), SCAN_BLOCK_ROWS):
+        block = embeddings_matrix[start:start + SCAN_BLOCK_ROWS]
+        similarities[start:start + len(block)] = block.astype(np.float32) @ query_norm
     return similarities
 
 
+def safe_result(idx: int) -> Dict:
+    """
+    Result dict of one Q&A pair with TTS-safe text. Only hits are decoded and
+    filtered, each pair once (memoised), so loading the store stays instant.
+    """
+    result = _qa_results.get(idx)
+    if result is None:
+        qa = _qa_cache[idx]
+        result = _qa_results[idx] = {
+            'question': filter_safe_text(qa['question']),
+            'answer': filter_safe_text(qa['answer']),
+            'context': filter_safe_text(qa['context']),
+            'source': qa['source'],
+            'page': qa['page'],
+        }
+    return result
+
+
+def top_k_indices(similarities: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (partial selection, not a full sort)."""
+    k = min(k, len(similarities))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    if k < len(similarities):
+        candidates = np.argpartition(similarities, len(similarities) - k)[-k:]
+    else:
+        candidates = np.arange(len(similarities))
+    return candidates[np.argsort(similarities[candidates])[::-1]]
+
+
 def load_qa_cache():
     """Load pre-computed Q&A embeddings from disk (instant loading)"""
-    global _qa_cache, _qa_embeddings_matrix, _qa_initialized
+    global _qa_cache, _qa_embeddings_matrix, _qa_results, _qa_initialized
     
     if _qa_initialized:
         return _qa_cache
     
     logger.info("Loading Q&A pairs from pre-computed embeddings...")
     
+    # Q&A store: memory-mapped, already normalized (no unpickling, no matrix rebuild)
+    if qa_store_exists():
+        try:
+            store = QAStore.open()
+            _qa_cache = store.records
+            _qa_embeddings_matrix = store.matrix
+            _qa_results = {}
+            _qa_initialized = True
+            logger.info(f"✓ Mapped {len(_qa_cache)} Q&A pairs, embeddings matrix shape: {_qa_embeddings_matrix.shape}")
+            return _qa_cache
+        except Exception as e:
+            logger.error(f"Error opening Q&A store, trying legacy embeddings file: {e}")
+    
     # Check if embeddings file exists
     if not EMBEDDINGS_FILE.exists():
         logger.error(f"Embeddings file not found: {EMBEDDINGS_FILE}")
         logger.error("Please run: python precompute_qa_embeddings.py")
         _qa_cache = []
         _qa_embeddings_matrix = np.array([])
+        _qa_results = {}
         _qa_initialized = True
         return _qa_cache
     
@@ -203,6 +167,7 @@ def load_qa_cache():
         # Pre-normalize all embeddings (for cosine similarity)
         norms = np.linalg.norm(embeddings_matrix, axis=1, keepdims=True)
         _qa_embeddings_matrix = embeddings_matrix / norms
+        _qa_results = {}
         
         _qa_initialized = True
         
@@ -215,6 +180,7 @@ def load_qa_cache():
         logger.error(f"Error loading embeddings: {e}")
         _qa_cache = []
         _qa_embeddings_matrix = np.array([])
+        _qa_results = {}
         _qa_initialized = True
         return _qa_cache
 
@@ -229,7 +195,7 @@ def ensure_qa_initialized():
     return _qa_initialized
 
 
-async def query_qa_rag(query: str, num_results: int = TOP_K) -> str:
+async def query_qa_rag_results(query: str, num_results: int = TOP_K) -> Dict:
     """
     Query the Q&A RAG system (fully async, non-blocking)
     
@@ -238,14 +204,15 @@ async def query_qa_rag(query: str, num_results: int = TOP_K) -> str:
         num_results: Number of results to return
     
     Returns:
-        JSON string with retrieved Q&A pairs and timing info
+        Dict with retrieved Q&A pairs ("retrieved_qa") and timing info, plus
+        "message" when nothing relevant was found or "error" on failure
     """
     import time
     total_start = time.perf_counter()
     
     # Ensure cache is loaded
     if not ensure_qa_initialized():
-        return json.dumps({"error": "Q&A RAG not initialized", "retrieved_qa": []})
+        return {"error": "Q&A RAG not initialized", "retrieved_qa": []}
     
     # Get embedding for query (async, non-blocking)
     embed_start = time.perf_counter()
@@ -253,7 +220,7 @@ async def query_qa_rag(query: str, num_results: int = TOP_K) -> str:
     embed_time_ms = (time.perf_counter() - embed_start) * 1000
     
     if not query_embedding:
-        return json.dumps({"error": "Failed to get query embedding", "retrieved_qa": []})
+        return {"error": "Failed to get query embedding", "retrieved_qa": []}
     
     # Calculate similarities (vectorized with NumPy - super fast!)
     similarity_start = time.perf_counter()
@@ -261,55 +228,50 @@ async def query_qa_rag(query: str, num_results: int = TOP_K) -> str:
     similarities = cosine_similarity_batch(query_vec, _qa_embeddings_matrix)
     similarity_time_ms = (time.perf_counter() - similarity_start) * 1000
     
-    # Sort by similarity and take top K
+    # Select top K (argpartition) and copy their TTS-safe results
     sort_start = time.perf_counter()
-    # Use argsort for efficient top-k selection
-    top_indices = np.argsort(similarities)[::-1][:num_results]
-    
-    # Build results for top K
     filtered_results = []
-    for idx in top_indices:
+    for idx in top_k_indices(similarities, num_results):
         sim_score = float(similarities[idx])
         # Filter out low similarity results (< 0.5)
-        if sim_score >= 0.5:
-            qa = _qa_cache[idx]
-            # Filter unsafe characters from Q&A text
-            filtered_results.append({
-                'question': filter_safe_text(qa['question']),
-                'answer': filter_safe_text(qa['answer']),
-                'context': filter_safe_text(qa['context']),
-                'source': qa['source'],
-                'page': qa['page'],
-                'similarity': sim_score
-            })
+        if sim_score < 0.5:
+            break
+        filtered_results.append(dict(safe_result(int(idx)), similarity=sim_score))
     
     sort_time_ms = (time.perf_counter() - sort_start) * 1000
     
     total_time_ms = (time.perf_counter() - total_start) * 1000
     
+    timing = {
+        "embedding_ms": round(embed_time_ms, 2),
+        "similarity_calc_ms": round(similarity_time_ms, 2),
+        "sort_filter_ms": round(sort_time_ms, 2),
+        "total_ms": round(total_time_ms, 2)
+    }
+    
     if not filtered_results:
-        return json.dumps({
+        return {
             "message": "No relevant Q&A pairs found", 
             "retrieved_qa": [],
-            "timing": {
-                "embedding_ms": round(embed_time_ms, 2),
-                "similarity_calc_ms": round(similarity_time_ms, 2),
-                "sort_filter_ms": round(sort_time_ms, 2),
-                "total_ms": round(total_time_ms, 2)
-            }
-        })
+            "timing": timing
+        }
     
-    return json.dumps({
+    timing["qa_pairs_searched"] = len(_qa_cache)
+    return {
         "retrieved_qa": filtered_results,
         "total_results": len(filtered_results),
-        "timing": {
-            "embedding_ms": round(embed_time_ms, 2),
-            "similarity_calc_ms": round(similarity_time_ms, 2),
-            "sort_filter_ms": round(sort_time_ms, 2),
-            "total_ms": round(total_time_ms, 2),
-            "qa_pairs_searched": len(_qa_cache)
-        }
-    }, ensure_ascii=False)
+        "timing": timing
+    }
+
+
+async def query_qa_rag(query: str, num_results: int = TOP_K) -> str:
+    """
+    Query the Q&A RAG system; JSON-encoded form of query_qa_rag_results().
+    
+    Returns:
+        JSON string with retrieved Q&A pairs and timing info
+    """
+    return json.dumps(await query_qa_rag_results(query, num_results), ensure_ascii=False)
 
 
 # Initialize on module import for faster queries